@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Literal
 import json
 import sys
 import os
@@ -10,6 +10,10 @@ import time
 import asyncio
 from server.services.vector_db_service import VectorDBService
 from server.services.embedding_manager import EmbeddingManager
+from server.services.embedding_migration import collection_embedding_service
+from server.services.readiness import readiness
+from server.services.kb_catalog import is_draft_metadata
+from server.services.search_cache import search_collection
 #from server.mcp.manager import mcp_manager, ToolCall
 
 
@@ -40,7 +44,8 @@ class ChatRequest(BaseModel):
     session_id: Optional[str] = Field(default=None, description="Session ID for Codespace management")
 
 def get_ollama_service(request: Request) -> OllamaService:
-    """从 FastAPI 应用状态获取 OllamaService"""
+    """从 FastAPI 应用状态获取 OllamaService（后台初始化完成前返回 503）"""
+    readiness.require("chat")
     return request.app.state.services.ollama_service
 
 '''def get_tool_chat_service(request: Request) -> ToolEnhancedChatService:
@@ -270,12 +275,16 @@ async def refresh_models(
 class RAGChatRequest(BaseModel):
     model: Optional[str] = Field(default=None, description="Model name or 'auto' for automatic selection")
     messages: List[ChatMessage]
-    knowledge_base_id: str = Field(..., description="Knowledge base to search")
+    knowledge_base_id: Optional[str] = Field(default=None, description="Knowledge base to search (required unless federated)")
     stream: bool = False
     temperature: float = 0.7
     max_tokens: Optional[int] = None
     search_limit: int = Field(default=5, ge=1, le=20, description="Number of documents to retrieve")
     use_rerank: bool = Field(default=False, description="Whether to use reranking")
+    federated: bool = Field(default=False, description="Search across several knowledge bases instead of one")
+    knowledge_base_ids: Optional[List[str]] = Field(default=None, description="Knowledge bases for federated search (default: all published)")
+    federated_top_m: Optional[int] = Field(default=None, ge=1, le=100, description="Only search the M best-matching knowledge bases")
+    search_mode: Literal["dense", "hybrid", "lexical"] = Field(default="dense", description="Dense, BM25 + dense fused with RRF, or BM25 only")
 
 # 添加 RAG 聊天端点
 @router.post("/rag/completions")
@@ -285,11 +294,20 @@ async def rag_chat_completions(
     ollama: OllamaService = Depends(get_ollama_service)
 ):
     """使用知识库进行 RAG 聊天"""
+    readiness.require("knowledge")
     services = request.app.state.services
     
     if not services.vector_db_service or not services.embedding_manager:
         raise HTTPException(status_code=503, detail="RAG services not available")
     
+    if not chat_request.federated:
+        if not chat_request.knowledge_base_id:
+            raise HTTPException(status_code=400, detail="knowledge_base_id is required unless federated is set")
+        service_name = collection_embedding_service(
+            services.vector_db_service, services.embedding_manager,
+            chat_request.knowledge_base_id, services.embedding_migrator
+        )
+    
     try:
         # 获取最后一条用户消息作为查询
         user_messages = [msg for msg in chat_request.messages if msg.role == "user"]
@@ -299,14 +317,27 @@ async def rag_chat_completions(
         query = user_messages[-1].content
         
         # 搜索知识库
-        logger.info(f"Searching knowledge base {chat_request.knowledge_base_id} for: {query}")
-        query_embedding = services.embedding_manager.embed_text(query)
-        
-        search_results = services.vector_db_service.search(
-            collection_name=chat_request.knowledge_base_id,
-            query_embedding=query_embedding,
-            n_results=chat_request.search_limit
-        )
+        if chat_request.federated:
+            kb_ids = chat_request.knowledge_base_ids or [
+                collection["id"] for collection in services.vector_db_service.list_collections()
+                if collection["document_count"] > 0 and not is_draft_metadata(collection["metadata"])
+            ]
+            logger.info(f"Federated search over {len(kb_ids)} knowledge bases for: {query}")
+            search_results = await services.federated_searcher.search(
+                services, query, kb_ids,
+                n_results=chat_request.search_limit,
+                top_m=chat_request.federated_top_m
+            )
+        else:
+            logger.info(f"Searching knowledge base {chat_request.knowledge_base_id} ({chat_request.search_mode}) for: {query}")
+            search_results = await search_collection(
+                services,
+                chat_request.knowledge_base_id,
+                query,
+                n_results=chat_request.search_limit,
+                mode=chat_request.search_mode,
+                service_name=service_name
+            )
         
         # 构建上下文
         context_parts = []
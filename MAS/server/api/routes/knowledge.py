@@ -1,20 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, UploadFile, File, Form
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
+import json
 import logging
 import os
 import tempfile
 import shutil
+import time
 from pathlib import Path
 from datetime import datetime, timedelta
 
 try:
     from server.utils.metadata_handler import metadata_handler
-    from server.utils.kb_transactions import TransactionalKBOperations
 except ImportError:
     try:
         from utils.metadata_handler import metadata_handler
-        from utils.kb_transactions import TransactionalKBOperations
     except ImportError:
         # 如果还是找不到，创建一个简单的备用实现
         class MetadataHandler:
@@ -25,12 +25,11 @@ except ImportError:
             def restore_metadata(metadata):
                 return metadata
         metadata_handler = MetadataHandler()
-        
-        class TransactionalKBOperations:
-            def __init__(self, vector_db_service):
-                self.vector_db = vector_db_service
-            def execute_with_rollback(self, kb_id, operation_func):
-                return operation_func()
+
+from server.services.embedding_dispatcher import embed_query
+from server.services.embedding_migration import collection_embedding_service
+from server.services.readiness import readiness
+from server.services.search_cache import search_collection
 
 logger = logging.getLogger(__name__)
 
@@ -68,6 +67,7 @@ class SearchRequest(BaseModel):
     query: str = Field(..., min_length=1)
     limit: int = Field(default=10, ge=1, le=100)
     filter: Optional[Dict[str, Any]] = None
+    mode: Literal["dense", "hybrid", "lexical"] = Field(default="dense", description="向量检索、BM25+向量融合或只用关键词")
 
 class SearchResult(BaseModel):
     id: str
@@ -75,6 +75,33 @@ class SearchResult(BaseModel):
     metadata: Dict[str, Any]
     score: float
 
+# 批量搜索一次最多的查询数
+MAX_BATCH_QUERIES = 32
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchRequest] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES)
+
+class BatchSearchResult(BaseModel):
+    query: str
+    results: List[SearchResult]
+
+class BatchSearchResponse(BaseModel):
+    results: List[BatchSearchResult]
+    timing_ms: Dict[str, float]  # 各阶段耗时：embed / search / format / total
+
+class FederatedSearchRequest(BaseModel):
+    query: str = Field(..., min_length=1)
+    limit: int = Field(default=10, ge=1, le=100)
+    filter: Optional[Dict[str, Any]] = None
+    kb_ids: Optional[List[str]] = Field(default=None, description="要搜索的知识库，不指定时为该设备可见的所有知识库")
+    device_id: Optional[str] = Field(default=None, description="设备ID，用于包含该设备的草稿")
+    synced_only: bool = Field(default=False, description="只搜索从其他设备同步的知识库")
+    top_m: Optional[int] = Field(default=None, ge=1, le=100, description="只搜索路由分数最高的 M 个知识库")
+
+class FederatedSearchResult(SearchResult):
+    kb_id: str
+    kb_name: str
+
 class DeleteDocumentsRequest(BaseModel):
     document_ids: Optional[List[str]] = Field(None, description="Specific document IDs to delete")
     filter_conditions: Optional[Dict[str, Any]] = Field(None, description="Filter conditions for deletion")
@@ -88,7 +115,8 @@ class CleanupRequest(BaseModel):
 # ========== 依赖注入 ==========
 
 def get_services(request: Request):
-    """获取所需的服务"""
+    """获取所需的服务（后台初始化完成前返回 503）"""
+    readiness.require("knowledge")
     services = request.app.state.services
     
     logger.info(f"Vector DB Service: {services.vector_db_service is not None}")
@@ -128,17 +156,77 @@ def get_services(request: Request):
     
     return services
 
-def get_kb_operations(request: Request) -> TransactionalKBOperations:
-    """获取知识库事务操作管理器"""
-    services = get_services(request)
-    
-    # 创建或获取事务管理器
-    if not hasattr(request.app.state, 'kb_operations'):
-        request.app.state.kb_operations = TransactionalKBOperations(services.vector_db_service)
-    
-    return request.app.state.kb_operations
+def get_kb_metadata(services, kb_id: str) -> Dict[str, Any]:
+    """从知识库目录读取元数据（不打开集合），不存在时返回 404"""
+    try:
+        raw_metadata = services.vector_db_service.get_kb_metadata(kb_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    return metadata_handler.restore_metadata(raw_metadata)
+
+# 知识库列表缓存：目录版本不变时直接返回上次序列化的列表
+_list_cache: Dict[str, Any] = {"etag": None, "lists": {}}
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """请求的 If-None-Match 是否包含当前 ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+def collection_service(services, kb_id: str) -> str:
+    """该知识库的查询和新文档使用的嵌入服务（与集合标记的模型一致）"""
+    return collection_embedding_service(
+        services.vector_db_service, services.embedding_manager, kb_id, services.embedding_migrator
+    )
 # ========== API 端点 ==========
 
+def visible_to_device(metadata: Dict[str, Any], device_id: Optional[str]) -> bool:
+    """有设备ID：该设备的草稿 + 所有公开的；没有设备ID：只有公开的"""
+    if not metadata.get("is_draft", False):
+        return True
+    return bool(device_id) and metadata.get("device_id") == device_id  # 草稿只能看到自己的
+
+def build_knowledge_base_list(services, device_id: Optional[str], show_mode: str) -> List[Dict[str, Any]]:
+    """按设备和显示模式过滤知识库列表"""
+    knowledge_bases = []
+    for collection in services.vector_db_service.list_collections():
+        # 使用统一的元数据处理器（元数据来自目录，不逐个打开集合）
+        metadata = metadata_handler.restore_metadata(collection["metadata"])
+        
+        is_draft = metadata.get("is_draft", False)
+        kb_device_id = metadata.get("device_id")
+        
+        # 根据规则过滤
+        if not visible_to_device(metadata, device_id):
+            continue
+        
+        # 根据show_mode过滤
+        if show_mode == "drafts" and not is_draft:
+            continue
+        elif show_mode == "published" and is_draft:
+            continue
+        
+        # 使用元数据中的display_name，如果没有则使用collection的name
+        display_name = metadata.get("display_name", collection.get("name", collection["id"]))
+        
+        kb = KnowledgeBase(
+            id=collection["id"],
+            name=display_name,  # 使用显示名称而不是ID
+            description=collection.get("description", ""),
+            created_at=collection.get("created_at", ""),
+            document_count=collection.get("document_count", 0),
+            device_id=kb_device_id,
+            device_name=metadata.get("device_name"),
+            is_synced=metadata.get("is_synced", False)
+        )
+        # 添加元数据信息以便客户端使用
+        kb_dict = kb.dict()
+        kb_dict["metadata"] = metadata
+        kb_dict["is_draft"] = is_draft
+        knowledge_bases.append(kb_dict)
+    return knowledge_bases
+
 @router.get("/")  # 移除 response_model 以返回完整数据
 async def list_knowledge_bases(
     request: Request,
@@ -150,66 +238,25 @@ async def list_knowledge_bases(
     列出知识库
     - 如果提供device_id：显示该设备的所有草稿 + 所有公开的知识库
     - 如果不提供device_id：只显示公开的知识库
+    - 支持 ETag / If-None-Match，列表未变化时返回 304
     """
     try:
-        collections = services.vector_db_service.list_collections()
-        
-        knowledge_bases = []
-        for collection in collections:
-            # 获取集合的元数据
-            collection_obj = services.vector_db_service.client.get_collection(name=collection["id"])
-            raw_metadata = collection_obj.metadata or {}
-            
-            # 使用统一的元数据处理器
-            metadata = metadata_handler.restore_metadata(raw_metadata)
-            
-            is_draft = metadata.get("is_draft", False)
-            kb_device_id = metadata.get("device_id")
-            
-            # 根据规则过滤
-            if device_id:
-                # 有设备ID：显示该设备的草稿 + 所有公开的
-                if is_draft and kb_device_id != device_id:
-                    continue  # 草稿只能看到自己的
-            else:
-                # 没有设备ID：只显示公开的
-                if is_draft:
-                    continue
-            
-            # 根据show_mode过滤
-            if show_mode == "drafts" and not is_draft:
-                continue
-            elif show_mode == "published" and is_draft:
-                continue
-            
-            # 使用元数据中的display_name，如果没有则使用collection的name
-            display_name = metadata.get("display_name", collection.get("name", collection["id"]))
-            
-            kb = KnowledgeBase(
-                id=collection["id"],
-                name=display_name,  # 使用显示名称而不是ID
-                description=collection.get("description", ""),
-                created_at=collection.get("created_at", ""),
-                document_count=collection.get("document_count", 0),
-                device_id=kb_device_id,
-                device_name=metadata.get("device_name"),
-                is_synced=metadata.get("is_synced", False)
-            )
-            # 添加元数据信息以便客户端使用
-            kb_dict = kb.dict()
-            kb_dict["metadata"] = metadata
-            kb_dict["is_draft"] = is_draft
-            
-            # 确保 is_draft 始终存在且正确
-            if "is_draft" not in kb_dict:
-                kb_dict["is_draft"] = is_draft
-                
-            # 调试输出
-            logger.info(f"KB: {kb_dict['name']}, is_draft: {kb_dict.get('is_draft')}, metadata: {kb_dict.get('metadata')}")
-            knowledge_bases.append(kb_dict)
-        
-        logger.info(f"Listed {len(knowledge_bases)} knowledge bases for device: {device_id}")
-        return knowledge_bases
+        etag = f'W/"{services.vector_db_service.catalog_etag}"'
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        if _list_cache["etag"] != etag:
+            _list_cache["etag"] = etag
+            _list_cache["lists"] = {}
+        # 缓存序列化后的响应体，命中时不再逐项编码
+        cache_key = (device_id, show_mode)
+        body = _list_cache["lists"].get(cache_key)
+        if body is None:
+            knowledge_bases = build_knowledge_base_list(services, device_id, show_mode)
+            body = json.dumps(knowledge_bases, ensure_ascii=False).encode("utf-8")
+            _list_cache["lists"][cache_key] = body
+            logger.info(f"Listed {len(knowledge_bases)} knowledge bases for device: {device_id}")
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
         
     except Exception as e:
         logger.error(f"Failed to list knowledge bases: {e}")
@@ -236,16 +283,11 @@ async def create_knowledge_base(
         full_name = f"{kb_request.name} ({kb_request.device_name})"
         
         # 检查是否已存在同名知识库（只检查公开的）
-        if not kb_request.is_draft:
-            existing_collections = services.vector_db_service.list_collections()
-            for collection in existing_collections:
-                collection_obj = services.vector_db_service.client.get_collection(name=collection["id"])
-                metadata = collection_obj.metadata or {}
-                if collection["name"] == full_name and not metadata.get("is_draft", False):
-                    raise HTTPException(
-                        status_code=400, 
-                        detail=f"A published knowledge base with name '{full_name}' already exists"
-                    )
+        if not kb_request.is_draft and services.vector_db_service.check_name_exists(full_name):
+            raise HTTPException(
+                status_code=400, 
+                detail=f"A published knowledge base with name '{full_name}' already exists"
+            )
         
         # 创建元数据
         raw_metadata = {
@@ -259,6 +301,10 @@ async def create_knowledge_base(
             "display_name": full_name  # 保存显示名称
         }
         
+        # 记录当前默认嵌入模型，模型变化后据此重新嵌入
+        if services.embedding_manager and services.embedding_manager.default_service:
+            raw_metadata.update(services.embedding_manager.model_signature())
+        
         # 使用元数据处理器清理
         metadata = metadata_handler.clean_metadata(raw_metadata)
         
@@ -314,41 +360,41 @@ async def create_knowledge_base(
 async def get_knowledge_base(
     kb_id: str,
     request: Request,
+    response: Response,
     services = Depends(get_services)
 ):
     """获取特定知识库的信息"""
     try:
-        collections = services.vector_db_service.list_collections()
+        collection = services.vector_db_service.get_collection_info(kb_id)
+        if collection is None:
+            raise HTTPException(status_code=404, detail="Knowledge base not found")
         
-        for collection in collections:
-            if collection["id"] == kb_id:
-                # 获取集合的元数据
-                collection_obj = services.vector_db_service.client.get_collection(name=collection["id"])
-                raw_metadata = collection_obj.metadata or {}
-                
-                # 使用元数据处理器恢复数据
-                restored_metadata = metadata_handler.restore_metadata(raw_metadata)
-                is_draft = restored_metadata.get("is_draft", False)
-                
-                kb = KnowledgeBase(
-                    id=collection["id"],
-                    name=collection["name"],
-                    description=collection.get("description", ""),
-                    created_at=collection.get("created_at", ""),
-                    document_count=collection.get("document_count", 0),
-                    device_id=restored_metadata.get("device_id"),
-                    device_name=restored_metadata.get("device_name"),
-                    is_synced=restored_metadata.get("is_synced", False)
-                )
-                
-                # 返回完整数据
-                kb_dict = kb.dict()
-                kb_dict["is_draft"] = is_draft
-                kb_dict["metadata"] = restored_metadata
-                
-                return kb_dict
+        etag = f'W/"{services.vector_db_service.catalog_etag}"'
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
         
-        raise HTTPException(status_code=404, detail="Knowledge base not found")
+        # 使用元数据处理器恢复数据
+        restored_metadata = metadata_handler.restore_metadata(collection["metadata"])
+        is_draft = restored_metadata.get("is_draft", False)
+        
+        kb = KnowledgeBase(
+            id=collection["id"],
+            name=collection["name"],
+            description=collection.get("description", ""),
+            created_at=collection.get("created_at", ""),
+            document_count=collection.get("document_count", 0),
+            device_id=restored_metadata.get("device_id"),
+            device_name=restored_metadata.get("device_name"),
+            is_synced=restored_metadata.get("is_synced", False)
+        )
+        
+        # 返回完整数据
+        kb_dict = kb.dict()
+        kb_dict["is_draft"] = is_draft
+        kb_dict["metadata"] = restored_metadata
+        
+        return kb_dict
         
     except HTTPException:
         raise
@@ -366,11 +412,7 @@ async def delete_knowledge_base(
     """删除知识库"""
     try:
         # 获取知识库元数据以检查状态
-        try:
-            collection = services.vector_db_service.client.get_collection(name=kb_id)
-            metadata = collection.metadata or {}
-        except Exception:
-            raise HTTPException(status_code=404, detail="Knowledge base not found")
+        metadata = get_kb_metadata(services, kb_id)
         
         # 检查是否是草稿
         is_draft_value = metadata.get("is_draft", False)
@@ -410,6 +452,7 @@ async def add_document(
     services = Depends(get_services)
 ):
     """向知识库添加文档（文本）"""
+    service_name = collection_service(services, kb_id)
     try:
         # 处理文档
         chunks = services.document_processor.split_text(
@@ -422,7 +465,7 @@ async def add_document(
         
         # 生成嵌入
         texts = [chunk["text"] for chunk in chunks]
-        embeddings = services.embedding_manager.embed_texts(texts)
+        embeddings = await services.embedding_manager.aembed_texts_array(texts, service_name, same_model=True)
         
         # 准备元数据
         metadatas = []
@@ -439,7 +482,8 @@ async def add_document(
             collection_name=kb_id,
             documents=texts,
             embeddings=embeddings,
-            metadatas=metadatas
+            metadatas=metadatas,
+            embedding_stamp=services.embedding_manager.model_signature(service_name)
         )
         
         logger.info(f"Added document with {len(chunks)} chunks to {kb_id}")
@@ -463,6 +507,7 @@ async def upload_document(
 ):
     """上传文件到知识库"""
     temp_file_path = None
+    service_name = collection_service(services, kb_id)
     
     try:
         # 验证文件类型
@@ -502,7 +547,7 @@ async def upload_document(
         
         # 生成嵌入
         texts = [chunk["text"] for chunk in chunks]
-        embeddings = services.embedding_manager.embed_texts(texts)
+        embeddings = await services.embedding_manager.aembed_texts_array(texts, service_name, same_model=True)
         
         # 准备元数据
         metadatas = []
@@ -519,7 +564,8 @@ async def upload_document(
             collection_name=kb_id,
             documents=texts,
             embeddings=embeddings,
-            metadatas=metadatas
+            metadatas=metadatas,
+            embedding_stamp=services.embedding_manager.model_signature(service_name)
         )
         
         logger.info(f"Uploaded file {file.filename} with {len(chunks)} chunks to {kb_id}")
@@ -549,23 +595,27 @@ async def search_knowledge_base(
     services = Depends(get_services)
 ):
     """在知识库中搜索"""
+    service_name = collection_service(services, kb_id)
     try:
-        # 生成查询向量
-        query_embedding = services.embedding_manager.embed_text(search_request.query)
-        
-        # 执行搜索
-        results = services.vector_db_service.search(
-            collection_name=kb_id,
-            query_embedding=query_embedding,
+        # 嵌入查询（使用生成集合向量的同一模型）并执行搜索；知识库没有写入时重复的查询直接返回缓存的结果
+        results = await search_collection(
+            services,
+            kb_id,
+            search_request.query,
             n_results=search_request.limit,
-            filter=search_request.filter
+            filter=search_request.filter,
+            mode=search_request.mode,
+            service_name=service_name
         )
         
         # 格式化结果
         search_results = []
         for result in results["results"]:
-            # 计算相似度分数（距离越小，相似度越高）
-            similarity_score = 1.0 / (1.0 + result["distance"])
+            # 计算相似度分数（距离越小，相似度越高）；融合检索使用 RRF 分数
+            if "rrf_score" in result:
+                similarity_score = result["rrf_score"]
+            else:
+                similarity_score = 1.0 / (1.0 + result["distance"])
             
             search_results.append(SearchResult(
                 id=result["id"],
@@ -581,6 +631,138 @@ async def search_knowledge_base(
         logger.error(f"Failed to search knowledge base: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def federated_candidates(services, search_request: FederatedSearchRequest) -> List[str]:
+    """联合搜索的候选知识库：指定的知识库，或该设备可见的所有非空知识库"""
+    if search_request.kb_ids:
+        missing = [kb_id for kb_id in search_request.kb_ids if services.vector_db_service.get_collection_info(kb_id) is None]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Knowledge bases not found: {missing}")
+        return list(dict.fromkeys(search_request.kb_ids))
+    
+    candidates = []
+    for collection in services.vector_db_service.list_collections():
+        metadata = metadata_handler.restore_metadata(collection["metadata"])
+        if collection["document_count"] == 0 or not visible_to_device(metadata, search_request.device_id):
+            continue
+        if search_request.synced_only and not metadata.get("is_synced", False):
+            continue
+        candidates.append(collection["id"])
+    return candidates
+
+@router.post("/search/federated")
+async def federated_search(
+    request: Request,
+    search_request: FederatedSearchRequest,
+    services = Depends(get_services)
+):
+    """跨知识库联合搜索：按路由画像选出最相关的知识库并发搜索，结果按相似度合并"""
+    try:
+        kb_ids = federated_candidates(services, search_request)
+        outcome = await services.federated_searcher.search(
+            services,
+            search_request.query,
+            kb_ids,
+            n_results=search_request.limit,
+            top_m=search_request.top_m,
+            filter=search_request.filter
+        )
+        
+        results = []
+        for result in outcome["results"]:
+            collection = services.vector_db_service.get_collection_info(result["kb_id"])
+            results.append(FederatedSearchResult(
+                id=result["id"],
+                content=result["document"],
+                metadata=result["metadata"],
+                score=result["similarity"],
+                kb_id=result["kb_id"],
+                kb_name=collection["name"] if collection else result["kb_id"]
+            ))
+        
+        logger.info(
+            f"Federated search over {len(kb_ids)} knowledge bases searched "
+            f"{len(outcome['routing'])}, returned {len(results)} results"
+        )
+        return {**outcome, "results": results}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to run federated search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/search/cache")
+async def search_cache_stats(request: Request):
+    """搜索结果缓存的条目数、估计内存占用和命中率"""
+    cache = getattr(request.app.state.services, "search_cache", None)
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.get_stats()}
+
+@router.post("/{kb_id}/search/batch", response_model=BatchSearchResponse)
+async def search_knowledge_base_batch(
+    kb_id: str,
+    request: Request,
+    batch_request: BatchSearchRequest,
+    services = Depends(get_services)
+):
+    """在知识库中批量搜索：所有查询一次嵌入、一次向量查询，结果按查询分组返回"""
+    service_name = collection_service(services, kb_id)
+    try:
+        started = time.perf_counter()
+        queries = batch_request.queries
+        if any(item.mode != "dense" for item in queries):
+            raise HTTPException(status_code=400, detail="Batch search only supports dense mode")
+        
+        # 相同的查询文本只嵌入一次
+        texts = list(dict.fromkeys(item.query for item in queries))
+        embeddings = await services.embedding_manager.aembed_texts_array(
+            texts, service_name, same_model=service_name is not None
+        )
+        positions = {text: i for i, text in enumerate(texts)}
+        query_embeddings = embeddings[[positions[item.query] for item in queries]]
+        embedded = time.perf_counter()
+        
+        batch_results = services.vector_db_service.search_batch(
+            collection_name=kb_id,
+            query_embeddings=query_embeddings,
+            n_results=[item.limit for item in queries],
+            filters=[item.filter for item in queries]
+        )
+        searched = time.perf_counter()
+        
+        grouped = [
+            BatchSearchResult(
+                query=item.query,
+                results=[
+                    SearchResult(
+                        id=result["id"],
+                        content=result["document"],
+                        metadata=result["metadata"],
+                        score=1.0 / (1.0 + result["distance"])
+                    )
+                    for result in results["results"]
+                ]
+            )
+            for item, results in zip(queries, batch_results)
+        ]
+        finished = time.perf_counter()
+        
+        timing_ms = {
+            "embed": round((embedded - started) * 1000, 3),
+            "search": round((searched - embedded) * 1000, 3),
+            "format": round((finished - searched) * 1000, 3),
+            "total": round((finished - started) * 1000, 3)
+        }
+        logger.info(f"Batch search in {kb_id}: {len(queries)} queries, timing {timing_ms}")
+        return BatchSearchResponse(results=grouped, timing_ms=timing_ms)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to batch search knowledge base: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{kb_id}/documents/{doc_id}")
 async def get_document(
     kb_id: str,
@@ -628,22 +810,21 @@ async def get_knowledge_base_stats(
 ):
     """获取知识库统计信息"""
     try:
-        collections = services.vector_db_service.list_collections()
-        
-        for collection in collections:
-            if collection["id"] == kb_id:
-                # 获取更详细的统计信息
-                stats = {
-                    "id": kb_id,
-                    "name": collection["name"],
-                    "document_count": collection["document_count"],
-                    "created_at": collection.get("created_at", ""),
-                    "embedding_service": services.embedding_manager.default_service,
-                    "embedding_dimension": len(services.embedding_manager.embed_text("test"))
-                }
-                return stats
+        collection = services.vector_db_service.get_collection_info(kb_id)
+        if collection is None:
+            raise HTTPException(status_code=404, detail="Knowledge base not found")
         
-        raise HTTPException(status_code=404, detail="Knowledge base not found")
+        # 获取更详细的统计信息
+        stats = {
+            "id": kb_id,
+            "name": collection["name"],
+            "document_count": collection["document_count"],
+            "created_at": collection.get("created_at", ""),
+            "embedding_service": services.embedding_manager.default_service,
+            # 集合记录了嵌入维度时不再为此调用一次嵌入服务
+            "embedding_dimension": collection.get("embedding_dimension") or len(await services.embedding_manager.aembed_text("test"))
+        }
+        return stats
         
     except HTTPException:
         raise
@@ -662,7 +843,7 @@ async def list_documents(
     """列出知识库中的文档"""
     try:
         # 直接使用ChromaDB的get方法获取所有文档
-        collection = services.vector_db_service.client.get_collection(name=kb_id)
+        collection = services.vector_db_service.get_collection(kb_id)
         
         # 获取所有文档（ChromaDB支持不指定IDs获取所有）
         results = collection.get(
@@ -718,7 +899,7 @@ async def delete_documents_batch(
             cutoff_date_str = cutoff_date.isoformat()
             
             # 获取所有文档并筛选
-            collection = services.vector_db_service.client.get_collection(name=kb_id)
+            collection = services.vector_db_service.get_collection(kb_id)
             results = collection.get(include=["metadatas"])
             
             all_docs = {
@@ -744,7 +925,7 @@ async def delete_documents_batch(
         if delete_request.source_pattern:
             # 重新获取所有文档（如果之前没有获取过）
             if 'collection' not in locals():
-                collection = services.vector_db_service.client.get_collection(name=kb_id)
+                collection = services.vector_db_service.get_collection(kb_id)
                 results = collection.get(include=["metadatas"])
                 
                 all_docs = {
@@ -819,7 +1000,7 @@ async def cleanup_knowledge_base(
             )
         
         # 获取所有文档
-        collection = services.vector_db_service.client.get_collection(name=kb_id)
+        collection = services.vector_db_service.get_collection(kb_id)
         results = collection.get(include=["metadatas"])  # 只需要IDs
         
         all_docs = {
@@ -871,7 +1052,7 @@ async def get_documents_stats(
     try:
         # 获取所有文档信息
         # 直接使用ChromaDB获取所有文档
-        collection = services.vector_db_service.client.get_collection(name=kb_id)
+        collection = services.vector_db_service.get_collection(kb_id)
         results = collection.get(include=["metadatas"])
         
         all_docs = {
@@ -974,9 +1155,10 @@ async def search_and_delete(
     services = Depends(get_services)
 ):
     """搜索并删除匹配的文档"""
+    service_name = collection_service(services, kb_id)
     try:
         # 先搜索
-        query_embedding = services.embedding_manager.embed_text(query)
+        query_embedding = await embed_query(services, query, service_name)
         
         results = services.vector_db_service.search(
             collection_name=kb_id,
@@ -1025,18 +1207,12 @@ async def publish_knowledge_base(
     kb_id: str,
     request: Request,
     device_id: str,  # 必须提供设备ID以验证权限
-    services = Depends(get_services),
-    kb_ops = Depends(get_kb_operations)
+    services = Depends(get_services)
 ):
     """发布草稿知识库为公开状态"""
     try:
         # 获取知识库元数据
-        try:
-            collection = services.vector_db_service.client.get_collection(name=kb_id)
-            raw_metadata = collection.metadata or {}
-            metadata = metadata_handler.restore_metadata(raw_metadata)
-        except Exception:
-            raise HTTPException(status_code=404, detail="Knowledge base not found")
+        metadata = get_kb_metadata(services, kb_id)
         
         # 验证权限：只有创建者可以发布
         if metadata.get("creator_device_id") != device_id:
@@ -1047,71 +1223,28 @@ async def publish_knowledge_base(
             raise HTTPException(status_code=400, detail="Knowledge base is already published")
         
         # 获取原始的显示名称
-        kb_display_name = metadata.get("display_name", collection.name)
+        kb_display_name = metadata.get("display_name", kb_id)
         
         # 检查是否存在同名的公开知识库
-        existing_collections = services.vector_db_service.list_collections()
-        for existing in existing_collections:
-            if existing["id"] == kb_id:
-                continue  # 跳过自己
-            
-            existing_collection = services.vector_db_service.client.get_collection(name=existing["id"])
-            existing_raw_metadata = existing_collection.metadata or {}
-            existing_metadata = metadata_handler.restore_metadata(existing_raw_metadata)
-            
-            # 检查名称冲突（只检查公开的）
-            existing_display_name = existing_metadata.get("display_name", existing_collection.name)
-            if (existing_display_name == kb_display_name and 
-                not existing_metadata.get("is_draft", False)):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Cannot publish: A public knowledge base with name '{kb_display_name}' already exists. Please rename before publishing."
-                )
-        
-        # 定义发布操作
-        def publish_operation():
-            # 更新元数据为公开状态
-            new_metadata = metadata.copy()
-            new_metadata["is_draft"] = False
-            new_metadata["published_at"] = datetime.now().isoformat()
-            new_metadata["published_by_device"] = device_id
-            
-            # 使用元数据处理器清理
-            clean_metadata = metadata_handler.clean_metadata(new_metadata)
-            
-            # 由于ChromaDB不支持直接更新元数据，需要重新创建
-            # 获取所有文档
-            results = collection.get(include=["embeddings", "documents", "metadatas"])
-            
-            # 删除旧集合
-            services.vector_db_service.delete_collection(kb_id)
-            
-            # 创建新集合（公开状态），使用原始的显示名称
-            services.vector_db_service.create_collection(
-                name=kb_display_name,  # 使用显示名称而不是collection.name
-                description=metadata.get("description", ""),
-                metadata=clean_metadata,
-                collection_id=kb_id  # 保持相同ID
+        if services.vector_db_service.check_name_exists(kb_display_name, exclude_id=kb_id):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot publish: A public knowledge base with name '{kb_display_name}' already exists. Please rename before publishing."
             )
-            
-            # 恢复文档
-            if results['ids']:
-                services.vector_db_service.add_documents(
-                    collection_name=kb_id,
-                    documents=results['documents'],
-                    embeddings=results['embeddings'],
-                    metadatas=results['metadatas'],
-                    ids=results['ids']
-                )
-            
-            return {
-                "kb_id": kb_id,
-                "name": kb_display_name,
-                "published_at": new_metadata["published_at"]
-            }
         
-        # 使用事务性操作执行发布
-        result = kb_ops.execute_with_rollback(kb_id, publish_operation)
+        # 发布只修改目录中的元数据，集合中的向量不变
+        published_at = datetime.now().isoformat()
+        services.vector_db_service.update_kb_metadata(kb_id, metadata_handler.clean_metadata({
+            "is_draft": False,
+            "status": "published",
+            "published_at": published_at,
+            "published_by_device": device_id
+        }))
+        result = {
+            "kb_id": kb_id,
+            "name": kb_display_name,
+            "published_at": published_at
+        }
         
         logger.info(f"Published knowledge base {kb_id} by device {device_id}")
         
@@ -1131,18 +1264,12 @@ async def rename_knowledge_base(
     kb_id: str,
     new_name: str,
     device_id: str,
-    services = Depends(get_services),
-    kb_ops = Depends(get_kb_operations)
+    services = Depends(get_services)
 ):
     """重命名知识库（只能重命名草稿）"""
     try:
         # 获取知识库
-        try:
-            collection = services.vector_db_service.client.get_collection(name=kb_id)
-            raw_metadata = collection.metadata or {}
-            metadata = metadata_handler.restore_metadata(raw_metadata)
-        except Exception:
-            raise HTTPException(status_code=404, detail="Knowledge base not found")
+        metadata = get_kb_metadata(services, kb_id)
         
         # 验证权限
         if metadata.get("creator_device_id") != device_id:
@@ -1156,49 +1283,16 @@ async def rename_knowledge_base(
         device_name = metadata.get("device_name", "Unknown")
         full_new_name = f"{new_name} ({device_name})"
         
-        # 定义重命名操作
-        def rename_operation():
-            # 由于ChromaDB不支持重命名，需要重新创建
-            # 获取所有数据
-            results = collection.get(include=["embeddings", "documents", "metadatas"])
-            
-            # 更新元数据
-            new_metadata = metadata.copy()
-            new_metadata["original_name"] = new_name
-            new_metadata["display_name"] = full_new_name
-            new_metadata["renamed_at"] = datetime.now().isoformat()
-            
-            # 使用元数据处理器清理
-            clean_metadata = metadata_handler.clean_metadata(new_metadata)
-            
-            # 删除旧集合
-            services.vector_db_service.delete_collection(kb_id)
-            
-            # 创建新集合
-            services.vector_db_service.create_collection(
-                name=full_new_name,
-                description=metadata.get("description", ""),
-                metadata=clean_metadata,
-                collection_id=kb_id
-            )
-            
-            # 恢复文档
-            if results['ids']:
-                services.vector_db_service.add_documents(
-                    collection_name=kb_id,
-                    documents=results['documents'],
-                    embeddings=results['embeddings'],
-                    metadatas=results['metadatas'],
-                    ids=results['ids']
-                )
-            
-            return {
-                "kb_id": kb_id,
-                "new_name": full_new_name
-            }
-        
-        # 使用事务性操作执行重命名
-        result = kb_ops.execute_with_rollback(kb_id, rename_operation)
+        # 重命名只修改目录中的元数据，集合中的向量不变
+        services.vector_db_service.update_kb_metadata(kb_id, {
+            "original_name": new_name,
+            "display_name": full_new_name,
+            "renamed_at": datetime.now().isoformat()
+        })
+        result = {
+            "kb_id": kb_id,
+            "new_name": full_new_name
+        }
         
         logger.info(f"Renamed knowledge base {kb_id} to {full_new_name}")
         
@@ -11,6 +11,7 @@ import asyncio
 
 from server.services.device_discovery_service import discovery_service
 from server.services.knowledge_sync_service import sync_service
+from server.services.embedding_migration import collection_embedding_service
 
 logger = logging.getLogger(__name__)
 
@@ -324,18 +325,21 @@ async def receive_pushed_documents(
         vector_db = services.vector_db_service
         embedding_manager = services.embedding_manager
         
+        service_name = collection_embedding_service(vector_db, embedding_manager, kb_id, services.embedding_migrator)
+        
         # 处理接收到的文档
         for doc in push_request.documents:
-            # 生成嵌入
-            embedding = embedding_manager.embed_text(doc['content'])
+            # 生成嵌入（与集合标记的模型一致）
+            embeddings = await embedding_manager.aembed_texts_array([doc['content']], service_name, same_model=True)
             
             # 添加或更新文档
             vector_db.add_documents(
                 collection_name=kb_id,
                 documents=[doc['content']],
-                embeddings=[embedding],
+                embeddings=embeddings,
                 metadatas=[doc['metadata']],
-                ids=[doc['id']]
+                ids=[doc['id']],
+                embedding_stamp=embedding_manager.model_signature(service_name)
             )
         
         return {
@@ -426,8 +430,7 @@ async def list_synced_knowledge_bases(
         synced_kbs = []
         for collection in collections:
             try:
-                collection_obj = services.vector_db_service.client.get_collection(name=collection["id"])
-                metadata = collection_obj.metadata or {}
+                metadata = collection["metadata"]
                 
                 if metadata.get("is_synced", False):
                     synced_kbs.append({
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import JSONResponse
 import platform
 import psutil
 import sys
@@ -14,6 +15,7 @@ sys.path.insert(0, server_dir)
 
 from server.services.ollama_service import OllamaService
 from server.services.device_discovery_service import discovery_service
+from server.services.readiness import readiness
 
 # 创建 logger 实例
 logger = logging.getLogger(__name__)
@@ -24,6 +26,12 @@ def get_ollama_service(request: Request) -> OllamaService:
     """从 FastAPI 应用状态获取 OllamaService"""
     return request.app.state.services.ollama_service
 
+@router.get("/ready")
+async def readiness_check():
+    """就绪检查：各组件的加载状态和耗时，仍在加载时返回 503"""
+    snapshot = readiness.snapshot()
+    return JSONResponse(status_code=503 if snapshot["loading"] else 200, content=snapshot)
+
 @router.get("/health")
 async def health_check(
     request: Request,
@@ -171,10 +179,13 @@ async def embedding_status(request: Request):
     # 获取健康状态
     health_status = embedding_manager.get_health_status()
     
+    dispatcher = getattr(request.app.state.services, "embedding_dispatcher", None)
+    
     return {
         "status": "active" if health_status["has_healthy_service"] else "degraded",
         "health": health_status,
-        "default_service": embedding_manager.default_service
+        "default_service": embedding_manager.default_service,
+        "dispatcher": dispatcher.get_stats() if dispatcher else None
     }
 
 @router.post("/embeddings/check")
@@ -201,6 +212,14 @@ async def check_embedding_services(request: Request):
         logger.error(f"Failed to check embedding services: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/embeddings/migrations")
+async def get_embedding_migrations(request: Request):
+    """获取知识库重新嵌入迁移的进度"""
+    migrator = request.app.state.services.embedding_migrator
+    if migrator is None:
+        return {"enabled": False, "jobs": {}}
+    return {"enabled": True, **migrator.status()}
+
 @router.post("/embeddings/test")
 async def test_embeddings(
     request: Request,
@@ -216,7 +235,7 @@ async def test_embeddings(
     try:
         if service_name:
             # 测试特定服务
-            embedding = embedding_manager.embed_text(text, service_name)
+            embedding = (await embedding_manager.aembed_text(text, service_name)).tolist()
             service, actual_service_name = embedding_manager.get_service(service_name)
             return {
                 "requested_service": service_name,
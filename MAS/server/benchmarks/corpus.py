@@ -0,0 +1,50 @@
+"""
+基准测试使用的固定语料
+覆盖中英文、短查询和长文本块，保证不同版本之间的结果可比较
+"""
+from typing import List
+
+QUERIES: List[str] = [
+    "How do I reset my password?",
+    "What is the refund policy?",
+    "Error code E1024 when syncing knowledge base",
+    "如何把知识库同步到另一台设备？",
+    "设备发现服务无法找到局域网内的服务器",
+    "Which embedding model does the server use by default?",
+    "上传 PDF 文件失败怎么办",
+    "Explain retrieval augmented generation in one sentence.",
+]
+
+PASSAGES: List[str] = [
+    "To reset your password, open Settings, choose Account and tap 'Forgot password'. "
+    "A verification link is sent to the registered email address and expires after 30 minutes.",
+    "Refunds are available within 14 days of purchase for unused licences. "
+    "Contact support with your order number; refunds are issued to the original payment method.",
+    "E1024 indicates that the remote device rejected the sync request because the knowledge base "
+    "version is older than the one stored on the peer. Pull the latest version before pushing.",
+    "知识库同步会先比较两台设备上的版本号，只传输新增或修改过的文档块。"
+    "同步完成后，接收端会重新计算文档数量并更新元数据。",
+    "设备发现服务通过 UDP 广播在局域网内寻找服务器，如果路由器隔离了客户端，"
+    "请在设置中手动填写服务器地址和端口。",
+    "The server loads all-MiniLM-L6-v2 through sentence-transformers by default and falls back to "
+    "the Ollama nomic-embed-text model when the local model cannot be loaded.",
+    "上传的 PDF 会被逐页提取文本。扫描版 PDF 没有文本层，需要先进行 OCR，否则提取结果为空。",
+    "Retrieval augmented generation retrieves relevant passages from a knowledge base and passes "
+    "them to the language model as context so that answers are grounded in the stored documents.",
+    "The vector database persists collections on disk. Each collection stores document chunks, "
+    "their embeddings and metadata such as the source file name and the time it was added.",
+    "Long paragraphs are split at sentence boundaries so that each chunk stays below the configured "
+    "token budget, with a small overlap between neighbouring chunks to preserve context.",
+    "移动端可以在没有网络的情况下使用本地知识库，但嵌入模型需要事先下载到设备上。",
+    "Draft knowledge bases are only visible to the device that created them until they are published.",
+    "Published knowledge bases can only be deleted through the server admin interface.",
+    "每个知识库都可以设置描述信息，描述会显示在客户端的知识库列表中。",
+    "Chunk overlap keeps sentences that straddle a boundary retrievable from either neighbouring chunk, "
+    "at the cost of storing a few duplicated tokens per chunk.",
+    "The admin dashboard lists connected devices, their platform, IP address and the last time they were seen.",
+]
+
+
+def fixed_corpus() -> List[str]:
+    """返回查询和文本块组成的固定语料"""
+    return QUERIES + PASSAGES
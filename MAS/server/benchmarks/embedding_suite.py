@@ -0,0 +1,468 @@
+"""
+嵌入后端吞吐量基准测试套件
+对每个 BaseEmbeddingService 实现（sentence-transformers、工作进程池、ONNX、Ollama 桩服务、特征哈希）
+按批大小和文本长度分布扫描，报告吞吐量、p50/p99 延迟、峰值 RSS 和后端之间的余弦一致性矩阵，
+结果写成 JSON 基线，不同版本之间可以直接比较
+
+文本长度分布来自 DocumentProcessor.split_text 的真实切分结果；每个后端默认在独立的子进程中运行，
+保证峰值 RSS 只包含该后端自身
+
+用法:
+    python -m server.benchmarks.embedding_suite --output baseline.json
+    python -m server.benchmarks.embedding_suite --backends simple,onnx-int8 --compare baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+import numpy as np
+
+from server.benchmarks.corpus import QUERIES, PASSAGES, fixed_corpus
+
+SCHEMA_VERSION = 1
+DEFAULT_BATCH_SIZES = [1, 8, 32, 128]
+DEFAULT_CHUNK_SIZES = [128, 500]
+
+
+# ---------------------------------------------------------------------------
+# 后端
+# ---------------------------------------------------------------------------
+
+def _simple(options: Dict[str, Any]):
+    from server.services.simple_embedding_service import SimpleEmbeddingService
+    return SimpleEmbeddingService(), None
+
+
+def _sentence_transformers(options: Dict[str, Any]):
+    from server.services.embedding_service import EmbeddingService
+    return EmbeddingService(options["model"]), None
+
+
+def _worker_pool(options: Dict[str, Any]):
+    from server.services.embedding_worker_pool import PooledEmbeddingService
+    service = PooledEmbeddingService(options["model"], num_workers=options["workers"])
+    return service, service.close
+
+
+def _onnx(quantize: bool):
+    def factory(options: Dict[str, Any]):
+        from server.services.onnx_embedding_service import OnnxEmbeddingService
+        return OnnxEmbeddingService(options["model"], quantize=quantize), None
+    return factory
+
+
+def _ollama_stub(options: Dict[str, Any]):
+    from server.benchmarks.ollama_stub import OllamaStubServer
+    from server.services.ollama_embedding_service import OllamaEmbeddingService
+    stub = OllamaStubServer().start()
+    service = OllamaEmbeddingService(stub.base_url, options["ollama_model"])
+
+    def cleanup():
+        service.close()
+        stub.stop()
+    return service, cleanup
+
+
+def _ollama(options: Dict[str, Any]):
+    from server.services.ollama_embedding_service import OllamaEmbeddingService
+    service = OllamaEmbeddingService(options["ollama_url"], options["ollama_model"])
+    return service, service.close
+
+
+# 名称 -> 工厂函数（返回 (服务, 清理函数)）；新增后端时在这里注册
+BACKENDS: Dict[str, Callable[[Dict[str, Any]], Tuple[Any, Optional[Callable[[], None]]]]] = {
+    "simple": _simple,
+    "sentence-transformers": _sentence_transformers,
+    "sentence-transformers-pool": _worker_pool,
+    "onnx-fp32": _onnx(False),
+    "onnx-int8": _onnx(True),
+    "ollama-stub": _ollama_stub,
+    "ollama": _ollama,
+}
+
+# 默认运行的后端（真实 Ollama 需要本地服务，需显式指定）
+DEFAULT_BACKENDS = [name for name in BACKENDS if name != "ollama"]
+
+
+# ---------------------------------------------------------------------------
+# 工作负载
+# ---------------------------------------------------------------------------
+
+def synthetic_documents(count: int = 4, seed: int = 0) -> List[str]:
+    """用固定文本块拼出若干篇长文档（段落以空行分隔），供 split_text 切分"""
+    rng = random.Random(seed)
+    documents = []
+    for _ in range(count):
+        paragraphs = [rng.choice(PASSAGES) * rng.randint(1, 4) for _ in range(40)]
+        documents.append("\n\n".join(paragraphs))
+    return documents
+
+
+def load_documents(directory: str) -> List[str]:
+    """用 DocumentProcessor 读取目录中的真实文档"""
+    from server.services.document_processor import DocumentProcessor
+    processor = DocumentProcessor()
+    documents = []
+    for root, _, files in os.walk(directory):
+        for filename in sorted(files):
+            try:
+                text, _ = processor.process_file(os.path.join(root, filename))
+            except Exception:
+                continue
+            if text:
+                documents.append(text)
+    return documents
+
+
+def build_workloads(
+    chunk_sizes: List[int] = DEFAULT_CHUNK_SIZES,
+    documents: Optional[List[str]] = None,
+    seed: int = 0
+) -> Dict[str, List[str]]:
+    """
+    构造文本长度分布：
+    queries: 短查询；chunks-<n>: split_text(chunk_size=n) 的切分结果；mixed: 两者按固定种子混合
+    """
+    from server.services.document_processor import DocumentProcessor
+
+    documents = documents or synthetic_documents(seed=seed)
+    workloads = {"queries": list(QUERIES)}
+    for chunk_size in chunk_sizes:
+        processor = DocumentProcessor(chunk_size=chunk_size, chunk_overlap=min(50, chunk_size // 4))
+        workloads[f"chunks-{chunk_size}"] = [
+            chunk["text"] for document in documents for chunk in processor.split_text(document)
+        ]
+
+    mixed = [text for texts in workloads.values() for text in texts]
+    random.Random(seed).shuffle(mixed)
+    workloads["mixed"] = mixed
+    return workloads
+
+
+def describe_workload(texts: List[str]) -> Dict[str, Any]:
+    """工作负载的文本长度分布（字符数）"""
+    lengths = np.array([len(text) for text in texts])
+    return {
+        "texts": len(texts),
+        "chars_p50": int(np.percentile(lengths, 50)),
+        "chars_p90": int(np.percentile(lengths, 90)),
+        "chars_max": int(lengths.max())
+    }
+
+
+def _sized(texts: List[str], count: int) -> List[str]:
+    """循环取样到指定条数，保证不同机器上每个组合的工作量相同"""
+    return [texts[i % len(texts)] for i in range(count)]
+
+
+# ---------------------------------------------------------------------------
+# 测量
+# ---------------------------------------------------------------------------
+
+def rss_mb() -> float:
+    """当前进程的 RSS（MB）"""
+    import psutil
+    return psutil.Process().memory_info().rss / 2 ** 20
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值 RSS（MB）"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def measure_throughput(service, texts: List[str], batch_size: int, repeat: int = 1) -> Dict[str, Any]:
+    """按批嵌入 texts，返回吞吐量和每批延迟的分位数"""
+    service.embed_texts_array(texts[:batch_size], batch_size)  # 预热
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for offset in range(0, len(texts), batch_size):
+            batch = texts[offset:offset + batch_size]
+            batch_start = time.perf_counter()
+            service.embed_texts_array(batch, batch_size)
+            latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "batch_size": batch_size,
+        "texts": len(texts) * repeat,
+        "texts_per_sec": round(len(texts) * repeat / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3)
+    }
+
+
+def run_backend(
+    name: str,
+    workloads: Dict[str, List[str]],
+    batch_sizes: List[int],
+    texts_per_run: int,
+    repeat: int,
+    options: Dict[str, Any]
+) -> Dict[str, Any]:
+    """加载一个后端并跑完所有 (工作负载, 批大小) 组合；后端不可用时返回 skipped"""
+    rss_before = rss_mb()
+    load_start = time.perf_counter()
+    try:
+        service, cleanup = BACKENDS[name](options)
+    except Exception as e:
+        return {"status": "skipped", "reason": f"{type(e).__name__}: {e}"}
+    load_seconds = time.perf_counter() - load_start
+
+    try:
+        results = []
+        for workload, texts in workloads.items():
+            texts = _sized(texts, texts_per_run)
+            for batch_size in batch_sizes:
+                results.append({"workload": workload, **measure_throughput(service, texts, batch_size, repeat)})
+        agreement_vectors = np.asarray(service.embed_texts_array(fixed_corpus()), dtype=np.float32)
+        model_info = service.get_model_info()
+    except Exception as e:
+        return {"status": "failed", "reason": f"{type(e).__name__}: {e}"}
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+    return {
+        "status": "ok",
+        "model_info": model_info,
+        "load_seconds": round(load_seconds, 3),
+        "load_rss_mb": round(rss_mb() - rss_before, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "results": results,
+        "agreement_vectors": agreement_vectors.tolist()
+    }
+
+
+def agreement_matrix(vectors: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """
+    后端之间的一致性矩阵
+    similarity_correlation: 两个后端在同一组文本上的两两余弦相似度矩阵的皮尔逊相关系数（维度不同也可以比较）
+    direct_cosine: 维度相同时逐条向量余弦的平均值（同一模型的不同实现应接近 1）
+    """
+    names = list(vectors)
+    normalized = {
+        name: matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        for name, matrix in vectors.items()
+    }
+    upper = np.triu_indices(len(fixed_corpus()), k=1)
+    similarities = {name: (matrix @ matrix.T)[upper] for name, matrix in normalized.items()}
+
+    correlation = []
+    direct = []
+    for a in names:
+        correlation_row, direct_row = [], []
+        for b in names:
+            correlation_row.append(round(float(np.corrcoef(similarities[a], similarities[b])[0, 1]), 4))
+            if normalized[a].shape == normalized[b].shape:
+                direct_row.append(round(float(np.mean(np.sum(normalized[a] * normalized[b], axis=1))), 4))
+            else:
+                direct_row.append(None)
+        correlation.append(correlation_row)
+        direct.append(direct_row)
+    return {"backends": names, "similarity_correlation": correlation, "direct_cosine": direct}
+
+
+def run_suite(
+    backends: List[str] = DEFAULT_BACKENDS,
+    batch_sizes: List[int] = DEFAULT_BATCH_SIZES,
+    chunk_sizes: List[int] = DEFAULT_CHUNK_SIZES,
+    texts_per_run: int = 256,
+    repeat: int = 1,
+    documents: Optional[List[str]] = None,
+    isolate: bool = True,
+    workloads: Optional[Dict[str, List[str]]] = None,
+    **options
+) -> Dict[str, Any]:
+    """
+    运行整个套件并返回可序列化的基线
+    isolate: 每个后端在独立子进程中运行（峰值 RSS 才有意义）
+    workloads: 直接指定工作负载，默认由 build_workloads 生成
+    """
+    options = {
+        "model": "all-MiniLM-L6-v2",
+        "workers": 2,
+        "ollama_url": "http://localhost:11434",
+        "ollama_model": "nomic-embed-text:latest",
+        **options
+    }
+    workloads = workloads or build_workloads(chunk_sizes, documents)
+    args = (workloads, batch_sizes, texts_per_run, repeat, options)
+
+    results = {}
+    for name in backends:
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results[name] = pool.submit(run_backend, name, *args).result()
+        else:
+            results[name] = run_backend(name, *args)
+
+    vectors = {
+        name: np.asarray(result.pop("agreement_vectors"), dtype=np.float32)
+        for name, result in results.items() if result["status"] == "ok"
+    }
+
+    return {
+        "schema": SCHEMA_VERSION,
+        "created_at": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": {
+            "batch_sizes": batch_sizes,
+            "texts_per_run": texts_per_run,
+            "repeat": repeat,
+            "isolated": isolate,
+            **options
+        },
+        "workloads": {name: describe_workload(texts) for name, texts in workloads.items()},
+        "backends": results,
+        "agreement": agreement_matrix(vectors) if vectors else None
+    }
+
+
+# ---------------------------------------------------------------------------
+# 基线比较
+# ---------------------------------------------------------------------------
+
+def compare_baselines(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.1) -> List[Dict[str, Any]]:
+    """
+    比较两份基线，返回超出容差的回归：吞吐量下降、p99 延迟或峰值 RSS 上升超过 tolerance（比例）
+    只比较两边都成功运行的后端和组合
+    """
+    regressions = []
+
+    def check(backend: str, key: str, metric: str, old: float, new: float, higher_is_better: bool):
+        if not old:
+            return
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append({
+                "backend": backend,
+                "case": key,
+                "metric": metric,
+                "baseline": old,
+                "current": new,
+                "change": round(change, 3)
+            })
+
+    for backend, new_result in current.get("backends", {}).items():
+        old_result = baseline.get("backends", {}).get(backend)
+        if not old_result or old_result.get("status") != "ok" or new_result.get("status") != "ok":
+            continue
+        check(backend, "load", "peak_rss_mb", old_result["peak_rss_mb"], new_result["peak_rss_mb"], False)
+        old_cases = {(case["workload"], case["batch_size"]): case for case in old_result["results"]}
+        for case in new_result["results"]:
+            old_case = old_cases.get((case["workload"], case["batch_size"]))
+            if old_case is None:
+                continue
+            key = f"{case['workload']}@{case['batch_size']}"
+            check(backend, key, "texts_per_sec", old_case["texts_per_sec"], case["texts_per_sec"], True)
+            check(backend, key, "p99_ms", old_case["p99_ms"], case["p99_ms"], False)
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    """以表格形式打印结果"""
+    print(f"{'backend':<28}{'workload':<14}{'batch':>6}{'texts/s':>11}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, result in report["backends"].items():
+        if result["status"] != "ok":
+            print(f"{name:<28}{result['status']}: {result['reason']}")
+            continue
+        for case in result["results"]:
+            print(
+                f"{name:<28}{case['workload']:<14}{case['batch_size']:>6}{case['texts_per_sec']:>11}"
+                f"{case['p50_ms']:>10}{case['p99_ms']:>10}"
+            )
+        print(f"{'':<28}load {result['load_seconds']} s, peak RSS {result['peak_rss_mb']} MB")
+
+    agreement = report["agreement"]
+    if agreement:
+        names = agreement["backends"]
+        print("\nsimilarity correlation")
+        print(" " * 28 + "".join(f"{name[:12]:>13}" for name in names))
+        for name, row in zip(names, agreement["similarity_correlation"]):
+            print(f"{name:<28}" + "".join(f"{value:>13}" for value in row))
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every registered embedding backend")
+    parser.add_argument("--backends", default=",".join(DEFAULT_BACKENDS),
+                        help=f"comma separated, available: {', '.join(BACKENDS)}")
+    parser.add_argument("--batch-sizes", type=_int_list, default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--chunk-sizes", type=_int_list, default=DEFAULT_CHUNK_SIZES,
+                        help="DocumentProcessor chunk sizes used to build the chunk workloads")
+    parser.add_argument("--texts", type=int, default=256, help="texts per (workload, batch size) run")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--documents", help="directory of real documents to split instead of the synthetic corpus")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes for sentence-transformers-pool")
+    parser.add_argument("--ollama-url", default="http://localhost:11434")
+    parser.add_argument("--ollama-model", default="nomic-embed-text:latest")
+    parser.add_argument("--no-isolate", action="store_true", help="run every backend in this process")
+    parser.add_argument("--output", help="write the JSON baseline to this path")
+    parser.add_argument("--compare", help="baseline JSON to compare against; exits with 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = run_suite(
+        backends=[name for name in args.backends.split(",") if name],
+        batch_sizes=args.batch_sizes,
+        chunk_sizes=args.chunk_sizes,
+        texts_per_run=args.texts,
+        repeat=args.repeat,
+        documents=load_documents(args.documents) if args.documents else None,
+        isolate=not args.no_isolate,
+        model=args.model,
+        workers=args.workers,
+        ollama_url=args.ollama_url,
+        ollama_model=args.ollama_model
+    )
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare_baselines(json.load(f), report, args.tolerance)
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['backend']} {regression['case']} {regression['metric']}: "
+                f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})"
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+HNSW 索引的召回率与延迟基准测试
+对每组 (M, ef_construction) 建一次索引，再用不同的 ef_search 查询，
+与精确搜索对比 recall@k 和 p50/p99 延迟，用于选择索引参数
+
+用法:
+    python -m server.benchmarks.hnsw_recall_benchmark --vectors 20000 --dimension 384
+"""
+import argparse
+import json
+import tempfile
+import time
+from typing import List, Dict, Any
+
+import numpy as np
+
+from server.services.simple_vector_db import SimpleVectorDB
+
+
+def clustered_vectors(count: int, dimension: int, clusters: int, seed: int) -> np.ndarray:
+    """围绕若干中心生成的向量，近似真实嵌入的聚簇分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    noise = rng.standard_normal((count, dimension), dtype=np.float32)
+    return centers[rng.integers(0, clusters, count)] + 0.7 * noise
+
+
+def _percentile_ms(samples: List[float], percentile: float) -> float:
+    return round(float(np.percentile(samples, percentile)) * 1000, 3)
+
+
+def _timed_searches(db: SimpleVectorDB, queries: np.ndarray, k: int, **options):
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results = db.search("bench", query, n_results=k, **options)["results"]
+        latencies.append(time.perf_counter() - start)
+        ids.append({result["id"] for result in results})
+    return ids, latencies
+
+
+def run_benchmark(
+    count: int,
+    dimension: int,
+    query_count: int,
+    k: int,
+    m_values: List[int],
+    ef_construction: int,
+    ef_search_values: List[int]
+) -> Dict[str, Any]:
+    vectors = clustered_vectors(count, dimension, clusters=max(count // 200, 1), seed=0)
+    queries = clustered_vectors(query_count, dimension, clusters=max(count // 200, 1), seed=0)
+    queries = queries + np.random.default_rng(1).standard_normal(queries.shape, dtype=np.float32) * 0.1
+    ids = [str(i) for i in range(count)]
+
+    report: Dict[str, Any] = {"vectors": count, "dimension": dimension, "k": k, "results": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SimpleVectorDB(tmp, exact_threshold=0)
+        db.create_collection("bench")
+        db.add_documents("bench", ids, vectors, ids=ids)
+
+        exact_ids, exact_latencies = _timed_searches(db, queries, k, exact=True)
+        report["exact"] = {"p50_ms": _percentile_ms(exact_latencies, 50), "p99_ms": _percentile_ms(exact_latencies, 99)}
+
+        for m in m_values:
+            start = time.perf_counter()
+            db.create_index("bench", M=m, ef_construction=ef_construction)
+            build_seconds = time.perf_counter() - start
+            for ef_search in ef_search_values:
+                found, latencies = _timed_searches(db, queries, k, ef_search=ef_search)
+                recall = np.mean([len(a & b) / k for a, b in zip(found, exact_ids)])
+                report["results"].append({
+                    "M": m,
+                    "ef_construction": ef_construction,
+                    "ef_search": ef_search,
+                    "build_seconds": round(build_seconds, 2),
+                    f"recall@{k}": round(float(recall), 4),
+                    "p50_ms": _percentile_ms(latencies, 50),
+                    "p99_ms": _percentile_ms(latencies, 99)
+                })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs. latency of the HNSW index against exact search")
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16])
+    parser.add_argument("--ef-construction", type=int, default=100)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(
+        args.vectors, args.dimension, args.queries, args.k, args.m, args.ef_construction, args.ef_search
+    ), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+嵌入入库路径的内存与延迟基准测试
+对比旧的列表路径（服务 .tolist() → 管理器传递 List[List[float]] → 向量库保存列表、搜索时再 np.array）
+与新的 float32 数组路径（服务 → 管理器 → SimpleVectorDB 全程为连续数组）
+
+用法:
+    python -m server.benchmarks.ndarray_ingest_benchmark --chunks 10000
+"""
+import argparse
+import gc
+import json
+import tempfile
+import time
+import tracemalloc
+from typing import List, Dict, Any
+
+import numpy as np
+
+from server.services.embedding_manager import BaseEmbeddingService, EmbeddingManager
+from server.services.simple_vector_db import SimpleVectorDB
+
+
+class SyntheticEmbeddingService(BaseEmbeddingService):
+    """生成确定性随机向量的嵌入服务，模拟本地模型输出 float32 数组"""
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        seed = sum(len(text) for text in texts)
+        rng = np.random.default_rng(seed)
+        return rng.standard_normal((len(texts), self.dimension), dtype=np.float32)
+
+    def embed_text(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+    def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        return self._encode(texts).tolist()
+
+    def embed_texts_array(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return self._encode(texts)
+
+    def get_model_info(self) -> Dict[str, Any]:
+        return {"model_name": "synthetic", "embedding_dimension": self.dimension}
+
+
+class LegacyListVectorDB:
+    """旧版 SimpleVectorDB 的存储方式：向量以列表保存，每次搜索都把整个集合转换为数组"""
+
+    def __init__(self):
+        self.vectors: List[List[float]] = []
+        self.ids: List[str] = []
+
+    def add_documents(self, embeddings: List[List[float]], ids: List[str]):
+        self.vectors.extend(embeddings)
+        self.ids.extend(ids)
+
+    def search(self, query_embedding: List[float], n_results: int = 10) -> List[str]:
+        query_vec = np.array(query_embedding)
+        vectors = np.array(self.vectors)
+        query_norm = query_vec / (np.linalg.norm(query_vec) + 1e-10)
+        vectors_norm = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-10)
+        similarities = np.dot(vectors_norm, query_norm)
+        return [self.ids[i] for i in np.argsort(similarities)[::-1][:n_results]]
+
+
+def _measure(ingest, search, queries: int) -> Dict[str, Any]:
+    """测量入库耗时、峰值/常驻内存和搜索延迟"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    ingest()
+    ingest_seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    for i in range(queries):
+        start = time.perf_counter()
+        search(i)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    return {
+        "ingest_seconds": round(ingest_seconds, 3),
+        "peak_mb": round(peak / 2 ** 20, 1),
+        "retained_mb": round(retained / 2 ** 20, 1),
+        "search_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "search_p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2)
+    }
+
+
+def run_benchmark(chunk_count: int = 10000, dimension: int = 384, batch_size: int = 256, queries: int = 50) -> List[Dict[str, Any]]:
+    """对比两条路径，返回结果列表"""
+    texts = [f"chunk {i}: " + "lorem ipsum dolor sit amet " * (1 + i % 8) for i in range(chunk_count)]
+    ids = [f"doc_{i}" for i in range(chunk_count)]
+    manager = EmbeddingManager()
+    manager.register_service("synthetic", SyntheticEmbeddingService(dimension))
+    results = []
+
+    legacy_db = LegacyListVectorDB()
+
+    def legacy_ingest():
+        for start in range(0, chunk_count, batch_size):
+            embeddings = manager.embed_texts(texts[start:start + batch_size])
+            legacy_db.add_documents(embeddings, ids[start:start + batch_size])
+
+    results.append({
+        "path": "legacy: List[List[float]] end to end",
+        **_measure(legacy_ingest, lambda i: legacy_db.search(manager.embed_text(texts[i])), queries)
+    })
+    del legacy_db
+    gc.collect()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SimpleVectorDB(tmp)
+        db.create_collection("bench")
+        # 分段存储每批只追加新行，持久化计入写入耗时
+
+        def array_ingest():
+            for start in range(0, chunk_count, batch_size):
+                embeddings = manager.embed_texts_array(texts[start:start + batch_size])
+                db.add_documents("bench", texts[start:start + batch_size], embeddings, ids=ids[start:start + batch_size])
+
+        results.append({
+            "path": "float32 ndarray end to end",
+            **_measure(array_ingest, lambda i: db.search("bench", manager.embed_texts_array([texts[i]])[0]), queries)
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare list-based and ndarray-based embedding ingest")
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.chunks, args.dimension, args.batch_size, args.queries), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Ollama 嵌入后端吞吐量基准测试
+对比旧实现（每条文本一个新连接、串行请求）与连接池 + 批量接口 + 并发请求的新实现
+
+用法:
+    python -m server.benchmarks.ollama_embedding_benchmark --texts 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List, Dict, Any
+
+import requests
+
+from server.benchmarks.ollama_stub import OllamaStubServer
+from server.services.ollama_embedding_service import OllamaEmbeddingService
+
+
+def legacy_embed_texts(base_url: str, model_name: str, texts: List[str]) -> List[List[float]]:
+    """旧实现：每条文本单独 requests.post 到 /api/embeddings（每次新建连接）"""
+    embeddings = []
+    for text in texts:
+        response = requests.post(
+            f"{base_url}/api/embeddings",
+            json={"model": model_name, "prompt": text},
+            timeout=30
+        )
+        response.raise_for_status()
+        embeddings.append(response.json()["embedding"])
+    return embeddings
+
+
+def _measure(name: str, stub: OllamaStubServer, texts: List[str], func) -> Dict[str, Any]:
+    """执行一次测量并记录吞吐量、请求数和连接数"""
+    stub.reset_counters()
+    start = time.perf_counter()
+    embeddings = func()
+    elapsed = time.perf_counter() - start
+    assert len(embeddings) == len(texts)
+    return {
+        "name": name,
+        "texts": len(texts),
+        "seconds": round(elapsed, 3),
+        "texts_per_sec": round(len(texts) / elapsed, 1),
+        "requests": stub.request_count,
+        "connections": stub.connection_count
+    }
+
+
+def run_benchmark(
+    text_count: int = 2000,
+    request_latency_ms: float = 2.0,
+    per_text_latency_ms: float = 0.2,
+    parallel: int = 4,
+    max_concurrency: int = 4,
+    batch_size: int = 64
+) -> List[Dict[str, Any]]:
+    """运行全部场景，返回结果列表"""
+    texts = [f"chunk {i}: " + "lorem ipsum dolor sit amet " * (1 + i % 8) for i in range(text_count)]
+    model_name = "nomic-embed-text:latest"
+    results = []
+
+    stub_options = dict(
+        request_latency_ms=request_latency_ms,
+        per_text_latency_ms=per_text_latency_ms,
+        parallel=parallel
+    )
+
+    # 旧版 Ollama（只有逐条接口）
+    with OllamaStubServer(batch_endpoint=False, **stub_options) as stub:
+        results.append(_measure(
+            "legacy: sequential, new connection per text", stub, texts,
+            lambda: legacy_embed_texts(stub.base_url, model_name, texts)
+        ))
+
+        service = OllamaEmbeddingService(stub.base_url, model_name, max_concurrency=max_concurrency)
+        results.append(_measure(
+            "pooled: /api/embeddings fallback, concurrent", stub, texts,
+            lambda: service.embed_texts(texts, batch_size)
+        ))
+        service.close()
+
+    # 新版 Ollama（提供批量接口）
+    with OllamaStubServer(batch_endpoint=True, **stub_options) as stub:
+        service = OllamaEmbeddingService(stub.base_url, model_name, max_concurrency=max_concurrency)
+        results.append(_measure(
+            "pooled: /api/embed batches, concurrent", stub, texts,
+            lambda: service.embed_texts(texts, batch_size)
+        ))
+
+        async def run_async():
+            return await service.aembed_texts(texts, batch_size)
+
+        results.append(_measure(
+            "async: /api/embed batches, concurrent", stub, texts,
+            lambda: asyncio.run(run_async())
+        ))
+        service.close()
+
+    baseline = results[0]["texts_per_sec"]
+    for result in results:
+        result["speedup"] = round(result["texts_per_sec"] / baseline, 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Ollama embedding backend against a local stub server")
+    parser.add_argument("--texts", type=int, default=2000, help="number of texts to embed")
+    parser.add_argument("--request-latency-ms", type=float, default=2.0, help="stub fixed cost per request")
+    parser.add_argument("--per-text-latency-ms", type=float, default=0.2, help="stub cost per text")
+    parser.add_argument("--parallel", type=int, default=4, help="stub concurrent request slots")
+    parser.add_argument("--concurrency", type=int, default=4, help="client max in-flight requests")
+    parser.add_argument("--batch-size", type=int, default=64, help="texts per /api/embed request")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        text_count=args.texts,
+        request_latency_ms=args.request_latency_ms,
+        per_text_latency_ms=args.per_text_latency_ms,
+        parallel=args.parallel,
+        max_concurrency=args.concurrency,
+        batch_size=args.batch_size
+    )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'scenario':<48}{'texts/s':>10}{'requests':>10}{'conns':>8}{'speedup':>9}")
+    for result in results:
+        print(
+            f"{result['name']:<48}{result['texts_per_sec']:>10}{result['requests']:>10}"
+            f"{result['connections']:>8}{result['speedup']:>8}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+本地 Ollama 嵌入接口桩服务
+模拟 /api/embed（批量）和 /api/embeddings（逐条）接口，用于基准测试
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import numpy as np
+
+
+def stub_embedding(text: str, dimension: int) -> List[float]:
+    """根据文本生成确定性的伪嵌入向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension)
+    return vector.tolist()
+
+
+class OllamaStubServer:
+    """在后台线程中运行的 Ollama 桩服务"""
+
+    def __init__(
+        self,
+        dimension: int = 768,
+        request_latency_ms: float = 2.0,
+        per_text_latency_ms: float = 0.2,
+        batch_endpoint: bool = True,
+        parallel: int = 4,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ):
+        """
+        request_latency_ms: 每个请求的固定开销（模拟调度、模型调用等）
+        per_text_latency_ms: 每条文本的额外耗时
+        batch_endpoint: 是否提供 /api/embed（False 时模拟旧版 Ollama）
+        parallel: 同时处理的请求数（模拟 OLLAMA_NUM_PARALLEL）
+        port: 为 0 时自动分配端口
+        """
+        self.dimension = dimension
+        self.request_latency = request_latency_ms / 1000.0
+        self.per_text_latency = per_text_latency_ms / 1000.0
+        self.batch_endpoint = batch_endpoint
+        self.request_count = 0
+        self.connection_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0  # 同时处理中的请求数的最大值
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max(1, parallel))
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connection_count += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.request_count += 1
+
+                if self.path == "/api/embed" and stub.batch_endpoint:
+                    texts = payload.get("input", [])
+                    if isinstance(texts, str):
+                        texts = [texts]
+                    stub._work(len(texts))
+                    body = {"model": payload.get("model"), "embeddings": [
+                        stub._normalized(text) for text in texts
+                    ]}
+                    self._send(200, json.dumps(body).encode("utf-8"), "application/json")
+                elif self.path == "/api/embeddings":
+                    stub._work(1)
+                    body = {"embedding": stub_embedding(payload.get("prompt", ""), stub.dimension)}
+                    self._send(200, json.dumps(body).encode("utf-8"), "application/json")
+                else:
+                    self._send(404, b"404 page not found", "text/plain")
+
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _work(self, text_count: int):
+        """模拟模型推理耗时"""
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            with self._slots:
+                time.sleep(self.request_latency + self.per_text_latency * text_count)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _normalized(self, text: str) -> List[float]:
+        """/api/embed 返回归一化后的向量"""
+        vector = np.asarray(stub_embedding(text, self.dimension))
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.connection_count = 0
+            self.max_in_flight = 0
+
+    def start(self) -> "OllamaStubServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "OllamaStubServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
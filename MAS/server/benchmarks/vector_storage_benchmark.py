@@ -0,0 +1,76 @@
+"""
+SimpleVectorDB 存储模式的内存与召回率基准测试
+对同一集合依次切换 float32 / float16 / int8 / pq，报告向量常驻内存、
+相对 float32 精确搜索的 recall@k、编码耗时和查询延迟
+
+用法:
+    python -m server.benchmarks.vector_storage_benchmark --vectors 50000 --dimension 384
+"""
+import argparse
+import json
+import tempfile
+import time
+from typing import List, Dict, Any
+
+import numpy as np
+
+from server.benchmarks.hnsw_recall_benchmark import clustered_vectors
+from server.services.simple_vector_db import SimpleVectorDB
+
+MODES = ["float32", "float16", "int8", "pq"]
+
+
+def run_benchmark(count: int, dimension: int, query_count: int, k: int, rerank_factor: int, modes: List[str]) -> Dict[str, Any]:
+    clusters = max(count // 200, 1)
+    vectors = clustered_vectors(count, dimension, clusters, seed=0)
+    queries = clustered_vectors(query_count, dimension, clusters, seed=0)
+    queries = queries + np.random.default_rng(1).standard_normal(queries.shape, dtype=np.float32) * 0.1
+    ids = [str(i) for i in range(count)]
+
+    report: Dict[str, Any] = {"vectors": count, "dimension": dimension, "k": k, "rerank_factor": rerank_factor, "modes": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SimpleVectorDB(tmp)
+        db.create_collection("bench")
+        db.add_documents("bench", ids, vectors, ids=ids)
+        exact = [{r["id"] for r in db.search("bench", query, k)["results"]} for query in queries]
+
+        for mode in modes:
+            start = time.perf_counter()
+            db.set_storage_mode("bench", mode, rerank_factor=rerank_factor)
+            encode_seconds = time.perf_counter() - start
+
+            latencies, recalls = [], []
+            for query, expected in zip(queries, exact):
+                start = time.perf_counter()
+                found = {r["id"] for r in db.search("bench", query, k)["results"]}
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len(found & expected) / k)
+
+            stats = db.storage_stats("bench")
+            report["modes"].append({
+                "mode": mode,
+                "resident_mb": round(stats["resident_bytes"] / 2 ** 20, 1),
+                "compression": round(stats["float32_bytes"] / stats["resident_bytes"], 1),
+                f"recall@{k}": round(float(np.mean(recalls)), 4),
+                "encode_seconds": round(encode_seconds, 2),
+                "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+                "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 2)
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and recall of SimpleVectorDB storage modes")
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factor", type=int, default=10)
+    parser.add_argument("--modes", nargs="+", default=MODES)
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.vectors, args.dimension, args.queries, args.k, args.rerank_factor, args.modes), indent=2))
+
+
+if __name__ == "__main__":
+    main()
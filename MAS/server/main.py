@@ -2,6 +2,8 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from contextlib import asynccontextmanager
+from typing import Optional, Tuple, Callable, Any
+import asyncio
 import uvicorn
 import logging
 import sys
@@ -11,8 +13,17 @@ import warnings
 # 忽略 FutureWarning
 warnings.filterwarnings("ignore", category=FutureWarning)
 
-from server.services.embedding_manager import EmbeddingManager
-from server.utils.exception_handlers import validation_exception_handler, general_exception_handler
+from server.services.embedding_manager import EmbeddingManager, BaseEmbeddingService
+from server.services.embedding_cache import EmbeddingCache
+from server.services.embedding_dispatcher import EmbeddingDispatcher
+from server.services.embedding_migration import EmbeddingMigrator, CollectionModelUnavailableError
+from server.services.readiness import readiness, ServiceNotReadyError
+from server.services.federated_search import FederatedSearcher
+from server.services.search_cache import SearchResultCache
+from server.utils.exception_handlers import (
+    validation_exception_handler, general_exception_handler, service_not_ready_handler,
+    collection_model_unavailable_handler
+)
 
 
 # 将当前文件的父目录添加到 Python 路径
@@ -24,7 +35,7 @@ sys.path.insert(0, current_dir)  # 添加server目录到路径
 # 现在使用绝对导入
 from server.api.routes import chat, knowledge, system, sync, admin, web_admin, messages, p2p_chat
 from server.services.ollama_service import OllamaService
-from server.services.vector_db_service import VectorDBService
+from server.services.vector_db_service import VectorDBService, DEFAULT_PERSIST_DIRECTORY
 from server.services.document_processor import DocumentProcessor
 from server.services.device_discovery_service import discovery_service
 from server.services.knowledge_sync_service import sync_service
@@ -40,89 +51,220 @@ logger = logging.getLogger(__name__)
 class ServiceContainer:
     ollama_service: OllamaService = None
     embedding_manager: EmbeddingManager = None  
+    embedding_dispatcher: EmbeddingDispatcher = None
     vector_db_service: VectorDBService = None
     document_processor: DocumentProcessor = None
+    embedding_migrator: EmbeddingMigrator = None
+    federated_searcher: FederatedSearcher = None
+    search_cache: SearchResultCache = None
 
 # 全局服务容器实例
 services = ServiceContainer()
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # 启动时初始化
-    logger.info("Initializing services...")
-    
-    # 初始化 Ollama 服务
-    services.ollama_service = OllamaService()
-    logger.info("Ollama service initialized")
-    
-    # 初始化嵌入管理器
-    services.embedding_manager = EmbeddingManager()
+def _load_local_embedding_backend() -> Optional[Tuple[str, BaseEmbeddingService]]:
+    """
+    按优先级加载本地嵌入后端（在线程池中执行）：ONNX → 多进程 sentence-transformers → 进程内 sentence-transformers
+    前一个成功后不再加载后面的，每次尝试都记录在就绪状态中
+    """
+    # 0. 显式启用时优先使用 ONNX Runtime 后端（MAS_ONNX_EMBEDDING=int8 或 fp32）
+    onnx_mode = os.getenv("MAS_ONNX_EMBEDDING", "off").lower()
+    if onnx_mode in ("int8", "fp32"):
+        try:
+            with readiness.track("embedding_backend:onnx"):
+                from server.services.onnx_embedding_service import OnnxEmbeddingService
+                return "onnx", OnnxEmbeddingService(quantize=onnx_mode == "int8")
+        except Exception as e:
+            logger.warning(f"Failed to initialize ONNX embedding service: {e}")
     
-    # 尝试初始化不同的嵌入服务
-    embedding_initialized = False
+    # 1. 尝试 Sentence-Transformers（配置了工作进程数时使用多进程模式）
+    embedding_workers = int(os.getenv("MAS_EMBEDDING_WORKERS", "0"))
+    if embedding_workers > 0:
+        try:
+            with readiness.track("embedding_backend:sentence-transformers-pool"):
+                from server.services.embedding_worker_pool import PooledEmbeddingService
+                return "sentence-transformers-pool", PooledEmbeddingService(
+                    num_workers=embedding_workers,
+                    threads_per_worker=int(os.getenv("MAS_EMBEDDING_THREADS_PER_WORKER", "1"))
+                )
+        except Exception as e:
+            logger.warning(f"Failed to initialize embedding worker pool: {e}")
     
-    # 1. 尝试 Sentence-Transformers
     try:
-        from server.services.embedding_service import EmbeddingService
-        st_service = EmbeddingService()
-        services.embedding_manager.register_service(
-            "sentence-transformers", 
-            st_service,
-            set_as_default=True  # 先设为默认
-        )
-        logger.info("Registered sentence-transformers embedding service")
-        embedding_initialized = True
+        with readiness.track("embedding_backend:sentence-transformers"):
+            from server.services.embedding_service import EmbeddingService
+            return "sentence-transformers", EmbeddingService()
     except Exception as e:
         logger.warning(f"Failed to initialize sentence-transformers: {e}")
     
-    # 2. 尝试 Ollama 嵌入
+    return None
+
+
+def _load_ollama_embedding_backend() -> Optional[BaseEmbeddingService]:
+    """加载 Ollama 嵌入后端（在线程池中执行）"""
     try:
-        from server.services.ollama_embedding_service import OllamaEmbeddingService
-        ollama_service = OllamaEmbeddingService()
-        services.embedding_manager.register_service(
-            "ollama",
-            ollama_service,
-            set_as_default=not embedding_initialized  # 如果是第一个成功的，设为默认
-        )
-        logger.info("Registered Ollama embedding service")
-        embedding_initialized = True
+        with readiness.track("embedding_backend:ollama"):
+            from server.services.ollama_embedding_service import OllamaEmbeddingService
+            return OllamaEmbeddingService()
     except Exception as e:
         logger.warning(f"Failed to initialize Ollama embedding service: {e}")
+        return None
+
 
-    # 3. 如果没有其他嵌入服务可用，使用简单的备用服务
-    if not embedding_initialized:
+def _build_embedding_manager(
+    local_backend: Optional[Tuple[str, BaseEmbeddingService]],
+    ollama_backend: Optional[BaseEmbeddingService]
+) -> Optional[EmbeddingManager]:
+    """按优先级注册已加载的后端（注册时会做健康检查），并预热默认服务（在线程池中执行）"""
+    # 嵌入缓存与知识库放在同一个数据目录下，不随启动时的工作目录分散
+    embedding_manager = EmbeddingManager(
+        cache=EmbeddingCache(persist_directory=os.path.join(DEFAULT_PERSIST_DIRECTORY, "embedding_cache"))
+    )
+    
+    # 本地后端优先作为默认服务
+    if local_backend is not None:
+        name, service = local_backend
+        embedding_manager.register_service(name, service, set_as_default=True)
+        logger.info(f"Registered {name} embedding service")
+    
+    # Ollama 嵌入
+    if ollama_backend is not None:
+        embedding_manager.register_service(
+            "ollama",
+            ollama_backend,
+            set_as_default=embedding_manager.default_service is None  # 如果是第一个成功的，设为默认
+        )
+        logger.info("Registered Ollama embedding service")
+    
+    # 如果没有其他嵌入服务可用，使用简单的备用服务
+    if embedding_manager.default_service is None:
         logger.warning("No standard embedding service available, using simple fallback")
         try:
-            from server.services.simple_embedding_service import SimpleEmbeddingService
-            simple_service = SimpleEmbeddingService()
-            services.embedding_manager.register_service(
-                "simple",
-                simple_service,
-                set_as_default=True
-            )
+            with readiness.track("embedding_backend:simple"):
+                from server.services.simple_embedding_service import SimpleEmbeddingService
+                embedding_manager.register_service("simple", SimpleEmbeddingService(), set_as_default=True)
             logger.info("Registered simple embedding service as fallback")
-            embedding_initialized = True
         except Exception as e:
             logger.error(f"Failed to initialize simple embedding service: {e}")
     
-    if not embedding_initialized:
+    if embedding_manager.default_service is None:
+        embedding_manager.shutdown()
+        return None
+    
+    logger.info(f"Default embedding service: {embedding_manager.default_service}")
+    
+    # 用代表性批次预热，避免第一个真实请求承担初始化开销
+    readiness.start("embedding_warmup")
+    try:
+        warmup = embedding_manager.warm_up(
+            batch_size=int(os.getenv("MAS_EMBEDDING_MAX_BATCH_SIZE", "32"))
+        )
+        readiness.mark_ready("embedding_warmup", **warmup)
+    except Exception as e:
+        # 预热失败不阻止服务就绪，第一个请求会按原有的重试和降级逻辑处理
+        readiness.mark_failed("embedding_warmup", str(e))
+    return embedding_manager
+
+
+async def _initialize_embeddings():
+    """并行加载各嵌入后端，全部完成后按优先级注册并预热"""
+    loop = asyncio.get_running_loop()
+    readiness.start("embeddings")
+    try:
+        local_backend, ollama_backend = await asyncio.gather(
+            loop.run_in_executor(None, _load_local_embedding_backend),
+            loop.run_in_executor(None, _load_ollama_embedding_backend)
+        )
+        embedding_manager = await loop.run_in_executor(
+            None, _build_embedding_manager, local_backend, ollama_backend
+        )
+    except Exception as e:
+        logger.error(f"Embedding initialization failed: {e}")
+        embedding_manager = None
+    
+    if embedding_manager is None:
         logger.error("No embedding service could be initialized!")
         logger.warning("RAG features will be disabled")
-        services.embedding_manager = None
-    else:
-        logger.info(f"Default embedding service: {services.embedding_manager.default_service}")    
+        readiness.mark_failed("embeddings", "No embedding service could be initialized")
+        return
     
-    # 初始化向量数据库
+    services.embedding_manager = embedding_manager
+    
+    # 启动嵌入微批处理调度器，合并并发的单条查询嵌入
+    services.embedding_dispatcher = EmbeddingDispatcher(
+        services.embedding_manager,
+        max_wait_ms=float(os.getenv("MAS_EMBEDDING_BATCH_WINDOW_MS", "3")),
+        max_batch_size=int(os.getenv("MAS_EMBEDDING_MAX_BATCH_SIZE", "32"))
+    )
+    services.embedding_dispatcher.start()
+    readiness.mark_ready("embeddings", default_service=embedding_manager.default_service)
+
+
+async def _initialize_component(component: str, factory: Callable[[], Any], attribute: str):
+    """在线程池中构造一个服务并放入服务容器，记录就绪状态"""
+    loop = asyncio.get_running_loop()
+    readiness.start(component)
     try:
-        services.vector_db_service = VectorDBService()
-        logger.info("Vector database service initialized")
+        setattr(services, attribute, await loop.run_in_executor(None, factory))
+        readiness.mark_ready(component)
     except Exception as e:
-        logger.error(f"Failed to initialize vector database: {e}")
-        logger.warning("Knowledge base features will be disabled")
+        logger.error(f"Failed to initialize {component}: {e}")
+        readiness.mark_failed(component, str(e))
+
+
+async def initialize_services():
+    """后台并行初始化各服务；路由按能力的就绪状态放行请求"""
+    await asyncio.gather(
+        _initialize_component("ollama", OllamaService, "ollama_service"),
+        _initialize_component("vector_db", VectorDBService, "vector_db_service"),
+        _initialize_component("document_processor", DocumentProcessor, "document_processor"),
+        _initialize_embeddings()
+    )
+    logger.info(f"Service initialization finished: {readiness.snapshot()['capabilities']}")
+    
+    if services.vector_db_service and services.embedding_manager:
+        _start_embedding_migration()
+
+
+def _start_embedding_migration():
+    """
+    默认嵌入模型与集合标记的模型不一致时，在后台把集合重新嵌入到新模型（MAS_EMBEDDING_MIGRATION=off 关闭）
+    迁移前的集合仍可以用原模型搜索（如果原模型仍然加载）
+    """
+    services.embedding_migrator = EmbeddingMigrator(
+        services.vector_db_service,
+        services.embedding_manager,
+        state_path=os.path.join(services.vector_db_service.persist_directory, "embedding_migrations.json"),
+        batch_size=int(os.getenv("MAS_MIGRATION_BATCH_SIZE", "32")),
+        max_texts_per_second=float(os.getenv("MAS_MIGRATION_MAX_TEXTS_PER_SEC", "50")),
+        duty_cycle=float(os.getenv("MAS_MIGRATION_DUTY_CYCLE", "0.5"))
+    )
+    if os.getenv("MAS_EMBEDDING_MIGRATION", "on").lower() in ("off", "0", "false"):
+        logger.info("Embedding migration disabled")
+        return
+    services.embedding_migrator.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时初始化：耗时的模型加载和网络检查放到后台，应用立即开始接受请求
+    logger.info("Initializing services in background...")
+    readiness.define_capability("chat", ["ollama"])
+    readiness.define_capability("embeddings", ["embeddings"])
+    readiness.define_capability("knowledge", ["vector_db", "document_processor", "embeddings"])
+    initialization = asyncio.create_task(initialize_services())
     
-    # 初始化文档处理器
-    services.document_processor = DocumentProcessor()
-    logger.info("Document processor initialized")
+    # 跨知识库联合搜索的线程池和路由参数
+    services.federated_searcher = FederatedSearcher(
+        max_workers=int(os.getenv("MAS_FEDERATED_MAX_WORKERS", "8")),
+        kb_timeout=float(os.getenv("MAS_FEDERATED_KB_TIMEOUT", "2.0")),
+        top_m=int(os.getenv("MAS_FEDERATED_TOP_M", "5"))
+    )
+    
+    # 知识库搜索和 RAG 检索的结果缓存（按知识库写入代数失效）
+    services.search_cache = SearchResultCache(
+        max_entries=int(os.getenv("MAS_SEARCH_CACHE_ENTRIES", "2048")),
+        max_bytes=int(float(os.getenv("MAS_SEARCH_CACHE_MB", "64")) * 1024 * 1024)
+    )
     
     # 将服务容器添加到 app.state
     app.state.services = services
@@ -147,6 +289,19 @@ async def lifespan(app: FastAPI):
     # 关闭时清理
     logger.info("Shutting down...")
     
+    # 等待后台初始化结束，避免关闭过程中还有服务在注册
+    if not initialization.done():
+        await initialization
+    
+    # 停止迁移（进度已保存，下次启动时继续），再停止嵌入调度器并释放嵌入服务资源
+    if services.embedding_migrator:
+        await services.embedding_migrator.stop()
+    if services.embedding_dispatcher:
+        await services.embedding_dispatcher.stop()
+    if services.embedding_manager:
+        services.embedding_manager.shutdown()
+    services.federated_searcher.shutdown()
+    
     # 停止设备发现服务
     discovery_service.stop()
     
@@ -172,6 +327,8 @@ app.add_middleware(
 
 # 注册异常处理器
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
+app.add_exception_handler(ServiceNotReadyError, service_not_ready_handler)
+app.add_exception_handler(CollectionModelUnavailableError, collection_model_unavailable_handler)
 app.add_exception_handler(Exception, general_exception_handler)
 
 # 注册路由
@@ -0,0 +1,113 @@
+"""
+熔断器和退避工具
+每个嵌入后端一个熔断器：连续失败达到阈值后打开（快速失败），冷却时间后半开放行一个探测请求，
+探测成功则关闭，失败则重新打开
+"""
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """指数退避加全抖动（full jitter）：在 [0, min(max_delay, base * 2^attempt)] 中均匀取值"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """单个后端的熔断器（线程安全）"""
+
+    def __init__(self, failure_threshold: int = 3, recovery_timeout: float = 30.0, history_size: int = 20):
+        """
+        failure_threshold: 连续失败多少次后打开
+        recovery_timeout: 打开后多少秒进入半开状态
+        history_size: 保留的状态转换记录数
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.transitions = deque(maxlen=history_size)
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """是否放行请求；半开状态同一时间只放行一个探测请求"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self._transition(HALF_OPEN, "recovery timeout elapsed")
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def is_closed(self) -> bool:
+        """是否处于关闭状态（不消耗半开探测名额）"""
+        return self.state == CLOSED
+
+    def record_success(self):
+        """记录一次成功"""
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            if self.state != CLOSED:
+                self._transition(CLOSED, "request succeeded")
+
+    def record_failure(self, error: str):
+        """记录一次失败"""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = error
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN:
+                self._open(f"probe failed: {error}")
+            elif self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self._open(f"{self.consecutive_failures} consecutive failures: {error}")
+
+    def trip(self, reason: str):
+        """直接打开熔断器（例如注册时健康检查失败）"""
+        with self._lock:
+            self.last_error = reason
+            self._open(reason)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """熔断器状态及最近的状态转换"""
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "last_error": self.last_error,
+                "retry_in_seconds": round(retry_in, 1) if retry_in is not None else None,
+                "transitions": list(self.transitions)
+            }
+
+    def _open(self, reason: str):
+        """打开熔断器（调用方持有锁）"""
+        self._opened_at = time.monotonic()
+        if self.state != OPEN:
+            self._transition(OPEN, reason)
+
+    def _transition(self, state: str, reason: str):
+        """记录状态转换（调用方持有锁）"""
+        self.transitions.append({
+            "from": self.state,
+            "to": state,
+            "at": datetime.now().isoformat(),
+            "reason": reason
+        })
+        self.state = state
@@ -0,0 +1,95 @@
+"""
+按长度分桶的批处理规划
+按 token 长度排序后分批，每批的大小由该批最长文本决定（token 预算固定），
+从而减少补齐（padding）带来的无效计算
+"""
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+
+def plan_length_buckets(
+    lengths: Sequence[int],
+    batch_size: int,
+    max_seq_length: int,
+    max_batch_multiplier: int = 8
+) -> List[np.ndarray]:
+    """
+    规划分批
+
+    Args:
+        lengths: 每个文本的 token 数（含特殊 token，未截断）
+        batch_size: 最大长度文本的批大小；token 预算 = batch_size * max_seq_length
+        max_seq_length: 模型最大序列长度，超出部分会被截断
+        max_batch_multiplier: 短文本批大小的上限（batch_size 的倍数）
+
+    Returns:
+        每批文本在原列表中的下标数组，批内按长度降序
+    """
+    if len(lengths) == 0:
+        return []
+
+    effective = np.minimum(np.asarray(lengths, dtype=np.int64), max_seq_length)
+    effective = np.maximum(effective, 1)
+    order = np.argsort(-effective, kind="stable")
+
+    token_budget = max(1, batch_size) * max_seq_length
+    max_batch = max(1, batch_size) * max_batch_multiplier
+
+    batches = []
+    start = 0
+    while start < len(order):
+        # 已按降序排列，本批补齐长度即为第一个文本的长度
+        longest = int(effective[order[start]])
+        size = max(1, min(max_batch, token_budget // longest))
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def padding_stats(lengths: Sequence[int], batches: List[np.ndarray], max_seq_length: int) -> Dict[str, int]:
+    """统计一组分批的有效 token 数和补齐后的 token 数"""
+    effective = np.minimum(np.asarray(lengths, dtype=np.int64), max_seq_length)
+    real_tokens = 0
+    padded_tokens = 0
+    for batch in batches:
+        batch_lengths = effective[batch]
+        real_tokens += int(batch_lengths.sum())
+        padded_tokens += int(batch_lengths.max()) * len(batch)
+    return {"real_tokens": real_tokens, "padded_tokens": padded_tokens}
+
+
+def fixed_size_batches(count: int, batch_size: int) -> List[np.ndarray]:
+    """按原顺序、固定大小分批（用于对比）"""
+    return [np.arange(i, min(i + batch_size, count)) for i in range(0, count, batch_size)]
+
+
+def padding_report(
+    lengths: Sequence[int],
+    batch_size: int,
+    max_seq_length: int,
+    char_lengths: Optional[Sequence[int]] = None
+) -> Dict[str, Any]:
+    """
+    对比几种分批方式的补齐浪费
+
+    Args:
+        char_lengths: 每个文本的字符数；提供时额外统计按字符数排序、固定批大小的方式
+            （即 sentence-transformers 内部的排序方式）
+    """
+    def summarize(batches: List[np.ndarray]) -> Dict[str, Any]:
+        stats = padding_stats(lengths, batches, max_seq_length)
+        waste = 1.0 - stats["real_tokens"] / stats["padded_tokens"] if stats["padded_tokens"] else 0.0
+        return {**stats, "batches": len(batches), "padding_waste": waste}
+
+    report = {
+        "texts": len(lengths),
+        "fixed_batches": summarize(fixed_size_batches(len(lengths), batch_size))
+    }
+    if char_lengths is not None:
+        order = np.argsort(-np.asarray(char_lengths), kind="stable")
+        report["char_sorted_batches"] = summarize(
+            [order[batch] for batch in fixed_size_batches(len(order), batch_size)]
+        )
+    report["length_buckets"] = summarize(plan_length_buckets(lengths, batch_size, max_seq_length))
+    return report
@@ -0,0 +1,250 @@
+"""
+嵌入缓存
+按 (服务名, 模型名, 归一化文本的sha256) 缓存嵌入向量，
+第一层为进程内LRU，第二层为可跨重启保留的SQLite存储
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str]
+
+
+def normalize_text(text: str) -> str:
+    """归一化文本（NFC + 去除首尾空白），用于计算缓存键"""
+    return unicodedata.normalize("NFC", text).strip()
+
+
+def text_digest(text: str) -> str:
+    """计算归一化文本的sha256"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """两级嵌入缓存：内存LRU + SQLite持久化"""
+
+    def __init__(
+        self,
+        max_memory_entries: int = 10000,
+        persist_directory: Optional[str] = None,
+        max_disk_entries: int = 500000
+    ):
+        """
+        max_memory_entries: 内存LRU的最大条目数
+        persist_directory: SQLite文件所在目录，为None时只使用内存缓存（服务中放在向量数据库目录下，见 main.py）
+        max_disk_entries: 磁盘缓存的最大条目数，超出后按最近访问时间淘汰
+        """
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[CacheKey, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_entries = 0
+        self._access_clock = 0
+
+        # 统计信息
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+        if persist_directory:
+            try:
+                os.makedirs(persist_directory, exist_ok=True)
+                db_path = os.path.join(persist_directory, "embeddings.sqlite3")
+                self._conn = sqlite3.connect(db_path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS embeddings (
+                        service TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        digest TEXT NOT NULL,
+                        dim INTEGER NOT NULL,
+                        vector BLOB NOT NULL,
+                        last_access INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (service, model, digest)
+                    )
+                    """
+                )
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)"
+                )
+                self._conn.commit()
+                self._disk_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                self._access_clock = self._conn.execute(
+                    "SELECT COALESCE(MAX(last_access), 0) FROM embeddings"
+                ).fetchone()[0]
+                logger.info(f"Embedding cache opened at {db_path} ({self._disk_entries} entries)")
+            except Exception as e:
+                logger.warning(f"Failed to open embedding disk cache, using memory only: {e}")
+                self._conn = None
+
+    # ========== 读取 ==========
+
+    def get_many(self, service: str, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查找缓存，未命中的位置返回None"""
+        keys = [(service, model, text_digest(text)) for text in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        disk_lookup: Dict[CacheKey, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    results[i] = vector
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            found: Dict[str, np.ndarray] = {}
+            if disk_lookup and self._conn is not None:
+                found = self._read_disk(service, model, [key[2] for key in disk_lookup])
+
+            for key, positions in disk_lookup.items():
+                vector = found.get(key[2])
+                if vector is None:
+                    self.misses += len(positions)
+                    continue
+                self._put_memory(key, vector)
+                for i in positions:
+                    results[i] = vector
+                self.disk_hits += len(positions)
+
+        return results
+
+    def get(self, service: str, model: str, text: str) -> Optional[np.ndarray]:
+        """查找单条缓存"""
+        return self.get_many(service, model, [text])[0]
+
+    # ========== 写入 ==========
+
+    def put_many(self, service: str, model: str, texts: List[str], vectors: List[Any]):
+        """批量写入缓存"""
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                # 总是复制：传入的可能是调用方整块结果数组的一行视图
+                array = np.array(vector, dtype=np.float32)
+                key = (service, model, text_digest(text))
+                self._put_memory(key, array)
+                if self._conn is not None:
+                    self._access_clock += 1
+                    rows.append((service, model, key[2], array.shape[0], array.tobytes(), self._access_clock))
+
+            if rows:
+                try:
+                    # 同一键对应的向量是确定的，已存在的行直接忽略
+                    cursor = self._conn.executemany(
+                        "INSERT OR IGNORE INTO embeddings (service, model, digest, dim, vector, last_access) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        rows
+                    )
+                    self._conn.commit()
+                    self._disk_entries += max(cursor.rowcount, 0)
+                    self._evict_disk()
+                except Exception as e:
+                    logger.warning(f"Failed to write embedding cache: {e}")
+
+    def put(self, service: str, model: str, text: str, vector: Any):
+        """写入单条缓存"""
+        self.put_many(service, model, [text], [vector])
+
+    def clear(self):
+        """清空全部缓存"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM embeddings")
+                self._conn.commit()
+                self._disk_entries = 0
+
+    def close(self):
+        """关闭磁盘缓存"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "max_memory_entries": self.max_memory_entries,
+            "disk_enabled": self._conn is not None,
+            "disk_entries": self._disk_entries,
+            "max_disk_entries": self.max_disk_entries,
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "memory_evictions": self.memory_evictions,
+            "disk_evictions": self.disk_evictions
+        }
+
+    # ========== 内部方法 ==========
+
+    def _put_memory(self, key: CacheKey, vector: np.ndarray):
+        """写入内存LRU（调用方持有锁）"""
+        vector.setflags(write=False)
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.memory_evictions += 1
+
+    def _read_disk(self, service: str, model: str, digests: List[str]) -> Dict[str, np.ndarray]:
+        """从SQLite读取向量（调用方持有锁）"""
+        found: Dict[str, np.ndarray] = {}
+        try:
+            # SQLite 默认最多 999 个参数
+            for i in range(0, len(digests), 500):
+                part = digests[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE service = ? AND model = ? "
+                    f"AND digest IN ({placeholders})",
+                    [service, model, *part]
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = np.frombuffer(blob, dtype=np.float32).copy()
+
+            if found:
+                self._access_clock += 1
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE service = ? AND model = ? AND digest = ?",
+                    [(self._access_clock, service, model, digest) for digest in found]
+                )
+                self._conn.commit()
+        except Exception as e:
+            logger.warning(f"Failed to read embedding cache: {e}")
+        return found
+
+    def _evict_disk(self):
+        """磁盘条目超出上限时淘汰最久未访问的条目（调用方持有锁）"""
+        overflow = self._disk_entries - self.max_disk_entries
+        if overflow <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (overflow,)
+        )
+        self._conn.commit()
+        self._disk_entries -= overflow
+        self.disk_evictions += overflow
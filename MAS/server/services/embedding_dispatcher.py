@@ -0,0 +1,219 @@
+"""
+嵌入请求微批处理调度器
+把短时间窗口内到达的单条嵌入请求合并为一次批量嵌入调用
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from server.services.embedding_manager import EmbeddingManager
+
+logger = logging.getLogger(__name__)
+
+# 批大小直方图的桶上界
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+class _PendingRequest:
+    """等待中的嵌入请求"""
+    __slots__ = ("text", "service_name", "future", "enqueued_at")
+
+    def __init__(self, text: str, service_name: Optional[str], future: asyncio.Future):
+        self.text = text
+        self.service_name = service_name
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class EmbeddingDispatcher:
+    """位于 EmbeddingManager 前面的微批处理调度器"""
+
+    def __init__(
+        self,
+        embedding_manager: EmbeddingManager,
+        max_wait_ms: float = 3.0,
+        max_batch_size: int = 32,
+        stats_window: int = 1000
+    ):
+        """
+        embedding_manager: 实际执行嵌入的管理器
+        max_wait_ms: 第一条请求到达后最多等待多久再发起批量嵌入
+        max_batch_size: 单批最多合并的文本数
+        stats_window: 等待时间统计保留的最近样本数
+        """
+        self.embedding_manager = embedding_manager
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._arrival: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # 统计信息
+        self.total_requests = 0
+        self.total_batches = 0
+        self.max_queue_depth = 0
+        self.batch_size_histogram: Dict[str, int] = {
+            self._bucket_label(size): 0 for size in BATCH_SIZE_BUCKETS + [BATCH_SIZE_BUCKETS[-1] + 1]
+        }
+        self._wait_samples: deque = deque(maxlen=stats_window)
+        self._total_wait = 0.0
+
+    # ========== 生命周期 ==========
+
+    def start(self):
+        """在当前事件循环中启动调度任务"""
+        loop = asyncio.get_running_loop()
+        if self._worker is not None and not self._worker.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._arrival = asyncio.Event()
+        self._worker = loop.create_task(self._run())
+        logger.info(
+            f"Embedding dispatcher started (window={self.max_wait * 1000:.1f}ms, "
+            f"max_batch_size={self.max_batch_size})"
+        )
+
+    async def stop(self):
+        """停止调度任务，未完成的请求以异常结束"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        while self._queue is not None and not self._queue.empty():
+            request = self._queue.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Embedding dispatcher stopped"))
+        logger.info("Embedding dispatcher stopped")
+
+    # ========== 对外接口 ==========
+
+    async def embed_text(self, text: str, service_name: Optional[str] = None) -> np.ndarray:
+        """提交单条文本，等待所在批次完成后返回其嵌入向量（float32）"""
+        if self._worker is None or self._worker.done() or self._loop is not asyncio.get_running_loop():
+            self.start()
+
+        future = self._loop.create_future()
+        self._queue.put_nowait(_PendingRequest(text, service_name, future))
+        self._arrival.set()
+        self.total_requests += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度器统计信息，用于调整时间窗口"""
+        waits = sorted(self._wait_samples)
+        return {
+            "running": self._worker is not None and not self._worker.done(),
+            "window_ms": self.max_wait * 1000,
+            "max_batch_size": self.max_batch_size,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "total_requests": self.total_requests,
+            "total_batches": self.total_batches,
+            "avg_batch_size": self.total_requests / self.total_batches if self.total_batches else 0.0,
+            "batch_size_histogram": dict(self.batch_size_histogram),
+            "added_wait_ms": {
+                "avg": (self._total_wait / self.total_requests * 1000) if self.total_requests else 0.0,
+                "p50": self._percentile(waits, 0.50) * 1000,
+                "p99": self._percentile(waits, 0.99) * 1000,
+                "max": (waits[-1] * 1000) if waits else 0.0
+            }
+        }
+
+    # ========== 内部方法 ==========
+
+    async def _run(self):
+        """调度主循环：收集一个时间窗口内的请求并批量嵌入"""
+        while True:
+            first = await self._queue.get()
+            batch = [first]
+            deadline = first.enqueued_at + self.max_wait
+
+            while True:
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                timeout = deadline - time.perf_counter()
+                if len(batch) >= self.max_batch_size or timeout <= 0:
+                    break
+                # 等待新请求到达或窗口结束（等待 Event 可安全取消，不会丢失队列中的请求）
+                self._arrival.clear()
+                try:
+                    await asyncio.wait_for(self._arrival.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            await self._dispatch(batch)
+
+    async def _dispatch(self, batch: List[_PendingRequest]):
+        """按服务名分组执行批量嵌入，并把结果分发给各个调用方"""
+        dispatched_at = time.perf_counter()
+        for request in batch:
+            wait = dispatched_at - request.enqueued_at
+            self._wait_samples.append(wait)
+            self._total_wait += wait
+
+        groups: Dict[Optional[str], List[_PendingRequest]] = {}
+        for request in batch:
+            groups.setdefault(request.service_name, []).append(request)
+
+        for service_name, requests in groups.items():
+            self.total_batches += 1
+            self.batch_size_histogram[self._bucket_label(len(requests))] += 1
+
+            texts = [request.text for request in requests]
+            try:
+                # 嵌入在线程池中执行，重试退避和对冲都不阻塞事件循环
+                # 显式指定服务的请求（知识库集合标记了模型）只降级到同一模型的服务
+                embeddings = await self.embedding_manager.aembed_texts_array(
+                    texts, service_name=service_name, batch_size=self.max_batch_size,
+                    same_model=service_name is not None
+                )
+            except Exception as e:
+                logger.error(f"Batched embedding failed for {len(texts)} texts: {e}")
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+
+            for request, embedding in zip(requests, embeddings):
+                if not request.future.done():
+                    request.future.set_result(embedding)
+
+    @staticmethod
+    def _bucket_label(size: int) -> str:
+        """获取批大小所属直方图桶的标签"""
+        for bound in BATCH_SIZE_BUCKETS:
+            if size <= bound:
+                return f"<={bound}"
+        return f">{BATCH_SIZE_BUCKETS[-1]}"
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], q: float) -> float:
+        """计算已排序样本的分位数"""
+        if not sorted_values:
+            return 0.0
+        index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+        return sorted_values[index]
+
+
+async def embed_query(services, text: str, service_name: Optional[str] = None) -> np.ndarray:
+    """
+    嵌入查询文本（返回 float32 向量）：有调度器时走微批处理，否则直接调用嵌入管理器的异步接口
+    service_name: 指定服务时只使用同一模型的服务（查询向量必须与集合中的向量来自同一模型）
+    """
+    dispatcher = getattr(services, "embedding_dispatcher", None)
+    if dispatcher is not None:
+        return await dispatcher.embed_text(text, service_name)
+    return await services.embedding_manager.aembed_text(text, service_name, same_model=service_name is not None)
@@ -1,11 +1,31 @@
+import asyncio
 import logging
+from collections import deque
 from typing import List, Dict, Any, Optional, Literal, Tuple
 from abc import ABC, abstractmethod
 import time
 from datetime import datetime, timedelta
 
+import numpy as np
+
+from server.services.embedding_cache import EmbeddingCache, text_digest
+from server.services.circuit_breaker import CircuitBreaker, OPEN, backoff_delay
+
 logger = logging.getLogger(__name__)
 
+# 预热用的代表性文本：短查询和接近最大序列长度的文本块，中英文混合，
+# 让模型在第一个真实请求之前完成内核选择和内存分配
+WARMUP_TEXTS = [
+    "How do I reset my password?",
+    "知识库同步失败怎么办？",
+    "Which embedding model does the server use?",
+    "上传 PDF 文件后搜索不到内容",
+    ("Retrieval augmented generation retrieves relevant passages from a knowledge base and passes "
+     "them to the language model as context so that answers are grounded in the stored documents. ") * 6,
+    ("知识库同步会先比较两台设备上的版本号，只传输新增或修改过的文档块。"
+     "同步完成后，接收端会重新计算文档数量并更新元数据。") * 6,
+]
+
 class BaseEmbeddingService(ABC):
     """嵌入服务基类"""
     
@@ -21,6 +41,12 @@ class BaseEmbeddingService(ABC):
     def get_model_info(self) -> Dict[str, Any]:
         pass
     
+    def embed_texts_array(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """批量嵌入并返回形状为 (n, dim) 的连续 float32 数组，子类可覆盖以省去列表转换"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.ascontiguousarray(self.embed_texts(texts, batch_size), dtype=np.float32)
+    
     def is_healthy(self) -> bool:
         """检查服务是否健康"""
         try:
@@ -30,6 +56,21 @@ class BaseEmbeddingService(ABC):
         except:
             return False
 
+def _in_event_loop() -> bool:
+    """当前线程是否正在运行事件循环"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _discard_result(future: asyncio.Future):
+    """取回被放弃的对冲请求的结果或异常，避免 "exception was never retrieved" 警告"""
+    if not future.cancelled():
+        future.exception()
+
+
 class ServiceHealth:
     """服务健康状态"""
     def __init__(self):
@@ -42,21 +83,47 @@ class ServiceHealth:
 class EmbeddingManager:
     """嵌入服务管理器，支持多种嵌入服务"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[EmbeddingCache] = None):
         self.services: Dict[str, BaseEmbeddingService] = {}
         self.default_service: Optional[str] = None
         self.service_health: Dict[str, ServiceHealth] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}  # 每个服务一个熔断器
         self.fallback_order: List[str] = []  # 服务降级顺序
-        self.max_retries: int = 3
-        self.retry_delay: float = 1.0
+        self.max_retries: int = 3  # 对候选服务列表的完整尝试轮数
+        self.retry_delay: float = 1.0  # 退避基准时间（秒），每轮翻倍并加抖动
+        self.max_retry_delay: float = 5.0
+        self.breaker_failure_threshold: int = 3
+        self.breaker_recovery_timeout: float = 30.0
+        self.hedging_enabled: bool = True  # 存在兼容的第二个健康服务时对慢请求发出对冲请求
+        self.hedge_delay: Optional[float] = None  # 对冲等待时间（秒），None 时使用主服务近期延迟的 p95
+        self.hedge_max_texts: int = 32  # 只对小批量（查询）对冲，避免大批量入库翻倍计算
+        self.hedged_requests: int = 0
+        self.hedge_wins: int = 0
+        self.failovers: int = 0
+        self.cache: Optional[EmbeddingCache] = cache  # 嵌入缓存（可选）
+        self._latencies: Dict[str, deque] = {}
+        self._model_keys: Dict[str, Tuple] = {}
         
     def register_service(self, name: str, service: BaseEmbeddingService, set_as_default: bool = False):
         """注册嵌入服务"""
         self.services[name] = service
         self.service_health[name] = ServiceHealth()
+        self.breakers[name] = CircuitBreaker(self.breaker_failure_threshold, self.breaker_recovery_timeout)
+        self._latencies[name] = deque(maxlen=256)
         
         # 检查服务健康状态
-        if service.is_healthy():
+        healthy = service.is_healthy()
+        
+        # 模型名、维度和量化方式相同的服务结果可以互换，才能互相对冲
+        # （在健康检查之后读取，部分后端第一次嵌入后才知道维度）
+        info = service.get_model_info()
+        self._model_keys[name] = (
+            info.get("model_name"),
+            info.get("embedding_dimension", info.get("dimension")),
+            info.get("quantization")
+        )
+        
+        if healthy:
             self.service_health[name].is_healthy = True
             self.service_health[name].last_check = datetime.now()
             
@@ -71,6 +138,8 @@ class EmbeddingManager:
         else:
             self.service_health[name].is_healthy = False
             self.service_health[name].last_error = "Initial health check failed"
+            # 熔断器直接打开，冷却后由半开探测决定是否恢复
+            self.breakers[name].trip("Initial health check failed")
             logger.warning(f"Registered embedding service: {name} (unhealthy)")
         
     def get_service(self, name: Optional[str] = None) -> Tuple[BaseEmbeddingService, str]:
@@ -82,14 +151,14 @@ class EmbeddingManager:
             raise ValueError(f"Embedding service '{name}' not found")
         
         # 检查指定服务的健康状态
-        if self.service_health[name].is_healthy:
+        if self._is_available(name):
             return self.services[name], name
         
         # 如果不健康，尝试降级到其他服务
         logger.warning(f"Service '{name}' is unhealthy, attempting fallback")
         
         for fallback_name in self.fallback_order:
-            if fallback_name != name and self.service_health[fallback_name].is_healthy:
+            if fallback_name != name and self._is_available(fallback_name):
                 logger.info(f"Falling back to service: {fallback_name}")
                 return self.services[fallback_name], fallback_name
         
@@ -99,81 +168,283 @@ class EmbeddingManager:
     
     def embed_text(self, text: str, service_name: Optional[str] = None) -> List[float]:
         """使用指定服务嵌入文本，支持重试和降级"""
-        last_error = None
+        return self.embed_texts_array([text], service_name)[0].tolist()
+    
+    def embed_texts(self, texts: List[str], service_name: Optional[str] = None, batch_size: int = 32) -> List[List[float]]:
+        """批量嵌入文本，支持重试和降级"""
+        return self.embed_texts_array(texts, service_name, batch_size).tolist()
+    
+    def embed_texts_array(
+        self,
+        texts: List[str],
+        service_name: Optional[str] = None,
+        batch_size: int = 32,
+        same_model: bool = False
+    ) -> np.ndarray:
+        """
+        批量嵌入文本并返回 (n, dim) 的 float32 数组（同步版本，只应在工作线程中调用）
         
+        每轮按候选顺序尝试：熔断器打开的服务直接跳过，失败后立即切换到下一个服务；
+        整轮都失败后退避（带抖动）再开始下一轮
+        same_model: 只降级到模型名和维度相同的服务（写入已标记模型的集合时使用）
+        退避用 time.sleep，在事件循环线程中调用会阻塞所有请求，因此直接报错（应使用 aembed_texts_array）
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        if _in_event_loop():
+            raise RuntimeError("embed_texts_array blocks on retries; use aembed_texts_array in the event loop thread")
+        
+        last_error = None
         for attempt in range(self.max_retries):
-            try:
-                service, actual_service_name = self.get_service(service_name)
-                
-                # 执行嵌入
-                result = service.embed_text(text)
-                
-                # 更新健康状态
-                health = self.service_health[actual_service_name]
-                health.is_healthy = True
-                health.success_count += 1
-                health.last_check = datetime.now()
-                
-                return result
-                
-            except Exception as e:
-                last_error = e
-                service_name_for_log = service_name or self.default_service
-                logger.error(f"Embedding failed (attempt {attempt + 1}/{self.max_retries}): {e}")
-                
-                # 更新健康状态
-                if service_name_for_log in self.service_health:
-                    health = self.service_health[service_name_for_log]
-                    health.is_healthy = False
-                    health.failure_count += 1
-                    health.last_error = str(e)
-                    health.last_check = datetime.now()
-                
-                # 等待后重试
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay * (attempt + 1))
+            attempted = False
+            for name in self._candidates(service_name, same_model):
+                if not self.breakers[name].allow_request():
+                    continue
+                if attempted:
+                    self.failovers += 1
+                attempted = True
+                try:
+                    return self._attempt(name, texts, batch_size)
+                except Exception as e:
+                    last_error = e
+                    logger.error(f"Embedding with {name} failed (attempt {attempt + 1}/{self.max_retries}): {e}")
+            
+            if not attempted:
+                raise RuntimeError(f"All embedding services are unavailable (circuits open). Last error: {last_error}")
+            if attempt < self.max_retries - 1:
+                time.sleep(backoff_delay(attempt, self.retry_delay, self.max_retry_delay))
         
         # 所有重试都失败
         raise RuntimeError(f"All embedding attempts failed. Last error: {last_error}")
     
-    def embed_texts(self, texts: List[str], service_name: Optional[str] = None, batch_size: int = 32) -> List[List[float]]:
-        """批量嵌入文本，支持重试和降级"""
-        last_error = None
+    async def aembed_text(self, text: str, service_name: Optional[str] = None, same_model: bool = False) -> np.ndarray:
+        """异步嵌入单条文本，返回 float32 向量"""
+        return (await self.aembed_texts_array([text], service_name, same_model=same_model))[0]
+    
+    async def aembed_texts_array(
+        self,
+        texts: List[str],
+        service_name: Optional[str] = None,
+        batch_size: int = 32,
+        same_model: bool = False
+    ) -> np.ndarray:
+        """
+        异步批量嵌入：嵌入在线程池中执行，退避使用 asyncio.sleep，不阻塞事件循环；
+        小批量请求在主服务超过对冲等待时间仍未返回时，向兼容的第二个服务发出对冲请求，取先成功的结果
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
         
+        loop = asyncio.get_running_loop()
+        last_error = None
         for attempt in range(self.max_retries):
-            try:
-                service, actual_service_name = self.get_service(service_name)
-                
-                # 执行批量嵌入
-                result = service.embed_texts(texts, batch_size)
-                
-                # 更新健康状态
-                health = self.service_health[actual_service_name]
-                health.is_healthy = True
-                health.success_count += 1
-                health.last_check = datetime.now()
-                
-                return result
-                
-            except Exception as e:
-                last_error = e
-                service_name_for_log = service_name or self.default_service
-                logger.error(f"Batch embedding failed (attempt {attempt + 1}/{self.max_retries}): {e}")
-                
-                # 更新健康状态
-                if service_name_for_log in self.service_health:
-                    health = self.service_health[service_name_for_log]
-                    health.is_healthy = False
-                    health.failure_count += 1
-                    health.last_error = str(e)
-                    health.last_check = datetime.now()
-                
-                # 等待后重试
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay * (attempt + 1))
+            candidates = self._candidates(service_name, same_model)
+            attempted = False
+            for i, name in enumerate(candidates):
+                if not self.breakers[name].allow_request():
+                    continue
+                if attempted:
+                    self.failovers += 1
+                attempted = True
+                hedge = self._hedge_partner(name, candidates[i + 1:], len(texts))
+                try:
+                    return await self._attempt_with_hedge(loop, name, hedge, texts, batch_size)
+                except Exception as e:
+                    last_error = e
+                    logger.error(f"Embedding with {name} failed (attempt {attempt + 1}/{self.max_retries}): {e}")
+            
+            if not attempted:
+                raise RuntimeError(f"All embedding services are unavailable (circuits open). Last error: {last_error}")
+            if attempt < self.max_retries - 1:
+                await asyncio.sleep(backoff_delay(attempt, self.retry_delay, self.max_retry_delay))
         
-        # 所有重试都失败
-        raise RuntimeError(f"All batch embedding attempts failed. Last error: {last_error}")
+        raise RuntimeError(f"All embedding attempts failed. Last error: {last_error}")
+    
+    async def _attempt_with_hedge(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        name: str,
+        hedge: Optional[str],
+        texts: List[str],
+        batch_size: int
+    ) -> np.ndarray:
+        """执行一次尝试，必要时发出对冲请求"""
+        primary = loop.run_in_executor(None, self._attempt, name, texts, batch_size)
+        if hedge is None:
+            return await primary
+        
+        done, _ = await asyncio.wait({primary}, timeout=self._hedge_delay(name))
+        if done or not self.breakers[hedge].allow_request():
+            return await primary
+        
+        self.hedged_requests += 1
+        secondary = loop.run_in_executor(None, self._attempt, hedge, texts, batch_size)
+        pending = {primary, secondary}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is secondary:
+                        self.hedge_wins += 1
+                    # 落后的请求无法在线程中取消，完成后丢弃其结果
+                    for other in pending:
+                        other.add_done_callback(_discard_result)
+                    return future.result()
+        
+        # 两个请求都失败，抛出主服务的错误，由调用方继续降级
+        raise primary.exception()
+    
+    def _attempt(self, name: str, texts: List[str], batch_size: int) -> np.ndarray:
+        """用指定服务嵌入一次，并把结果记到该服务（而不是请求的服务名）的健康状态和熔断器上"""
+        try:
+            result = self._embed_with_cache(self.services[name], name, texts, batch_size)
+        except Exception as e:
+            self._record_failure(name, e)
+            raise
+        self._record_success(name)
+        return result
+    
+    def _record_success(self, name: str):
+        """更新成功的健康状态"""
+        self.breakers[name].record_success()
+        health = self.service_health[name]
+        health.is_healthy = True
+        health.success_count += 1
+        health.last_check = datetime.now()
+    
+    def _record_failure(self, name: str, error: Exception):
+        """更新失败的健康状态"""
+        self.breakers[name].record_failure(str(error))
+        health = self.service_health[name]
+        health.is_healthy = False
+        health.failure_count += 1
+        health.last_error = str(error)
+        health.last_check = datetime.now()
+    
+    def _candidates(self, service_name: Optional[str], same_model: bool = False) -> List[str]:
+        """候选服务：请求的（或默认）服务在前，其余按降级顺序"""
+        name = service_name or self.default_service
+        if name not in self.services:
+            raise ValueError(f"Embedding service '{name}' not found")
+        others = [other for other in self.fallback_order if other != name]
+        if same_model:
+            others = [other for other in others if self._model_keys[other][:2] == self._model_keys[name][:2]]
+        return [name] + others
+    
+    def model_signature(self, service_name: Optional[str] = None) -> Dict[str, Any]:
+        """服务生成的向量的模型标记（模型名和维度），用于标记知识库集合"""
+        model_name, dimension, _ = self._model_keys[service_name or self.default_service]
+        return {"embedding_model": model_name, "embedding_dimension": int(dimension or 0)}
+    
+    def find_service(self, model_name: str, dimension: int) -> Optional[str]:
+        """查找生成指定模型向量的服务：默认服务优先，其次是可用的服务"""
+        matches = [
+            name for name, key in self._model_keys.items()
+            if key[0] == model_name and int(key[1] or 0) == int(dimension)
+        ]
+        if not matches:
+            return None
+        matches.sort(key=lambda name: (name != self.default_service, not self._is_available(name)))
+        return matches[0]
+    
+    def _is_available(self, name: str) -> bool:
+        """服务健康且熔断器未打开"""
+        return self.service_health[name].is_healthy and self.breakers[name].state != OPEN
+    
+    def _hedge_partner(self, name: str, remaining: List[str], text_count: int) -> Optional[str]:
+        """找一个可以对冲的服务：模型相同（结果可互换）、熔断器关闭且健康"""
+        if not self.hedging_enabled or text_count > self.hedge_max_texts:
+            return None
+        for other in remaining:
+            if (self._model_keys.get(other) == self._model_keys.get(name)
+                    and self.breakers[other].is_closed()
+                    and self.service_health[other].is_healthy):
+                return other
+        return None
+    
+    def _hedge_delay(self, name: str) -> float:
+        """对冲等待时间：固定值，或主服务最近延迟的 p95（样本不足时用 0.2 秒）"""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        samples = sorted(self._latencies.get(name, ()))
+        if len(samples) < 20:
+            return 0.2
+        return max(0.01, samples[int(len(samples) * 0.95)])
+    
+    def _embed_with_cache(
+        self,
+        service: BaseEmbeddingService,
+        service_name: str,
+        texts: List[str],
+        batch_size: int = 32
+    ) -> np.ndarray:
+        """嵌入文本，命中缓存的直接返回，未命中的批量嵌入后写回缓存；结果为 (n, dim) 的 float32 数组"""
+        if self.cache is None:
+            return self._embed_array(service, service_name, texts, batch_size)
+        
+        model_name = str(service.get_model_info().get("model_name", ""))
+        cached = self.cache.get_many(service_name, model_name, texts)
+        
+        # 未命中的文本按缓存键（归一化文本的摘要）去重后再嵌入，每组嵌入第一次出现的原文
+        miss_positions: Dict[str, List[int]] = {}
+        for i, vector in enumerate(cached):
+            if vector is None:
+                miss_positions.setdefault(text_digest(texts[i]), []).append(i)
+        
+        embeddings = None
+        if miss_positions:
+            miss_texts = [texts[positions[0]] for positions in miss_positions.values()]
+            embeddings = self._embed_array(service, service_name, miss_texts, batch_size)
+            self.cache.put_many(service_name, model_name, miss_texts, embeddings)
+        
+        dimension = embeddings.shape[1] if embeddings is not None else len(cached[0])
+        results = np.empty((len(texts), dimension), dtype=np.float32)
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                results[i] = vector
+        if embeddings is not None:
+            for row, positions in zip(embeddings, miss_positions.values()):
+                results[positions] = row
+        
+        return results
+    
+    def _embed_array(self, service: BaseEmbeddingService, service_name: str, texts: List[str], batch_size: int) -> np.ndarray:
+        """调用服务嵌入文本并记录后端延迟（缓存命中不计入）；单条文本走 embed_text（部分后端有专门的单条接口）"""
+        start = time.perf_counter()
+        if len(texts) == 1:
+            result = np.asarray([service.embed_text(texts[0])], dtype=np.float32)
+        else:
+            result = service.embed_texts_array(texts, batch_size)
+        latencies = self._latencies.get(service_name)
+        if latencies is not None:
+            latencies.append(time.perf_counter() - start)
+        return result
+    
+    def warm_up(self, service_name: Optional[str] = None, batch_size: int = 32) -> Dict[str, Any]:
+        """
+        用代表性批次预热嵌入服务（绕过缓存，否则重启后缓存命中会跳过模型）
+        
+        Returns:
+            预热的服务名、批大小以及单条和批量嵌入的耗时
+        """
+        service, actual_service_name = self.get_service(service_name)
+        texts = (WARMUP_TEXTS * (batch_size // len(WARMUP_TEXTS) + 1))[:batch_size]
+        
+        start = time.perf_counter()
+        service.embed_text(WARMUP_TEXTS[0])
+        single_ms = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        service.embed_texts_array(texts, batch_size)
+        batch_ms = (time.perf_counter() - start) * 1000
+        
+        logger.info(f"Warmed up embedding service {actual_service_name}: single {single_ms:.1f} ms, batch {batch_ms:.1f} ms")
+        return {
+            "service": actual_service_name,
+            "warmup_batch_size": len(texts),
+            "warmup_single_ms": round(single_ms, 1),
+            "warmup_batch_ms": round(batch_ms, 1)
+        }
     
     def list_services(self) -> Dict[str, Dict[str, Any]]:
         """列出所有可用的嵌入服务及其健康状态"""
@@ -189,7 +460,8 @@ class EmbeddingManager:
                     "last_check": health.last_check.isoformat() if health and health.last_check else None,
                     "failure_count": health.failure_count if health else 0,
                     "success_count": health.success_count if health else 0
-                }
+                },
+                "circuit": self.breakers[name].to_dict() if name in self.breakers else None
             }
         return result
     
@@ -205,7 +477,14 @@ class EmbeddingManager:
             "has_healthy_service": healthy_count > 0,
             "default_service": self.default_service,
             "default_healthy": self.service_health.get(self.default_service, ServiceHealth()).is_healthy if self.default_service else False,
-            "services": self.list_services()
+            "services": self.list_services(),
+            "cache": self.cache.get_stats() if self.cache else None,
+            "resilience": {
+                "failovers": self.failovers,
+                "hedging_enabled": self.hedging_enabled,
+                "hedged_requests": self.hedged_requests,
+                "hedge_wins": self.hedge_wins
+            }
         }
     
     def check_all_services(self) -> Dict[str, bool]:
@@ -222,8 +501,13 @@ class EmbeddingManager:
                 health.is_healthy = is_healthy
                 health.last_check = datetime.now()
                 
-                if not is_healthy:
+                if is_healthy:
+                    self.breakers[name].record_success()
+                    if name not in self.fallback_order:
+                        self.fallback_order.append(name)
+                else:
                     health.last_error = "Health check failed"
+                    self.breakers[name].trip("Health check failed")
                 
                 results[name] = is_healthy
                 
@@ -233,9 +517,22 @@ class EmbeddingManager:
                 health.is_healthy = False
                 health.last_error = str(e)
                 health.last_check = datetime.now()
+                self.breakers[name].trip(str(e))
         
         return results
     
+    def shutdown(self):
+        """释放各嵌入服务持有的资源（工作进程、连接等）以及缓存"""
+        for name, service in self.services.items():
+            close = getattr(service, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception as e:
+                    logger.warning(f"Failed to close embedding service {name}: {e}")
+        if self.cache is not None:
+            self.cache.close()
+    
     def compare_embeddings(self, text: str) -> Dict[str, List[float]]:
         """使用所有服务生成嵌入并比较"""
         results = {}
@@ -0,0 +1,331 @@
+"""
+知识库重新嵌入迁移
+默认嵌入模型变化后（例如 sentence-transformers 加载失败，改用 Ollama 的 nomic-embed-text），
+已有集合中的向量来自旧模型，维度和向量空间都与新模型不同。迁移任务在后台用新模型把集合中保存的文档
+分批重新嵌入到影子集合：限速运行给在线请求留出 CPU，进度持久化以便重启后继续，完成后通过别名原子地切换。
+切换前搜索仍然使用旧集合（查询用集合标记的模型嵌入）
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 与 vector_db_service 中的集合元数据键一致（这里不导入 chromadb）
+EMBEDDING_MODEL_KEY = "embedding_model"
+EMBEDDING_DIMENSION_KEY = "embedding_dimension"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class CollectionModelUnavailableError(Exception):
+    """集合标记的嵌入模型当前没有可用的服务（通常在等待重新嵌入迁移完成）"""
+
+    def __init__(self, collection: str, stamp: Dict[str, Any], migration: Optional[Dict[str, Any]] = None):
+        self.collection = collection
+        self.stamp = stamp
+        self.migration = migration
+        super().__init__(
+            f"Collection '{collection}' was embedded with {stamp.get(EMBEDDING_MODEL_KEY)} "
+            f"({stamp.get(EMBEDDING_DIMENSION_KEY)} dims), which is not loaded"
+        )
+
+
+def collection_embedding_service(vector_db, embedding_manager, collection_name: str, migrator=None) -> str:
+    """
+    嵌入该集合的查询和新文档应使用的服务：集合标记的模型对应的服务，未标记时为默认服务
+    标记的模型没有可用服务时抛出 CollectionModelUnavailableError
+    """
+    try:
+        stamp = vector_db.get_embedding_stamp(collection_name)
+    except Exception:
+        # 集合不存在等错误交给后续的数据库操作按原有方式处理
+        return embedding_manager.default_service
+    if stamp is None:
+        return embedding_manager.default_service
+
+    service_name = embedding_manager.find_service(stamp[EMBEDDING_MODEL_KEY], stamp[EMBEDDING_DIMENSION_KEY])
+    if service_name is None:
+        migration = migrator.job_status(collection_name) if migrator is not None else None
+        raise CollectionModelUnavailableError(collection_name, stamp, migration)
+    return service_name
+
+
+class EmbeddingMigrator:
+    """后台重新嵌入迁移任务"""
+
+    def __init__(
+        self,
+        vector_db,
+        embedding_manager,
+        state_path: str,
+        batch_size: int = 32,
+        max_texts_per_second: float = 50.0,
+        duty_cycle: float = 0.5
+    ):
+        """
+        state_path: 迁移进度文件（JSON），重启后据此继续
+        batch_size: 每批重新嵌入的文档数
+        max_texts_per_second: 重新嵌入速率上限，0 表示不限
+        duty_cycle: 嵌入时间占总时间的最大比例，其余时间让给在线请求
+        """
+        self.vector_db = vector_db
+        self.embedding_manager = embedding_manager
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self.max_texts_per_second = max_texts_per_second
+        self.duty_cycle = min(1.0, max(0.05, duty_cycle))
+        self.jobs: Dict[str, Dict[str, Any]] = self._load_state()
+        self._task: Optional[asyncio.Task] = None
+
+    # ------------------------------------------------------------------
+    # 状态
+    # ------------------------------------------------------------------
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        """读取迁移进度"""
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load migration state: {e}")
+            return {}
+
+    def _save_state(self):
+        """原子地写入迁移进度"""
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.jobs, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _update(self, name: str, **fields):
+        """更新并持久化作业状态"""
+        self.jobs[name].update(fields, updated_at=datetime.now().isoformat())
+        self._save_state()
+
+    def job_status(self, name: str) -> Optional[Dict[str, Any]]:
+        """单个集合的迁移状态"""
+        job = self.jobs.get(name)
+        return dict(job) if job else None
+
+    def status(self) -> Dict[str, Any]:
+        """所有迁移作业的状态"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "target": self.target_stamp(),
+            "batch_size": self.batch_size,
+            "max_texts_per_second": self.max_texts_per_second,
+            "duty_cycle": self.duty_cycle,
+            "jobs": {name: dict(job) for name, job in self.jobs.items()}
+        }
+
+    def target_stamp(self) -> Dict[str, Any]:
+        """迁移目标：当前默认嵌入服务的模型标记"""
+        return self.embedding_manager.model_signature()
+
+    # ------------------------------------------------------------------
+    # 计划
+    # ------------------------------------------------------------------
+
+    def plan(self) -> List[str]:
+        """
+        找出需要迁移的集合；没有标记的旧集合为空或维度与当前模型一致时直接标记为当前模型
+        不再需要的未完成作业（例如默认模型又换回来了）会删除其影子集合
+        """
+        target = self.target_stamp()
+        pending = []
+        for collection in self.vector_db.list_collections():
+            name = collection["id"]
+            stamp = self.vector_db.get_embedding_stamp(name)
+            if stamp is None:
+                dimension = self.vector_db.infer_embedding_dimension(name)
+                if dimension is None or dimension == target[EMBEDDING_DIMENSION_KEY]:
+                    logger.warning(f"Collection {name} has no embedding stamp; assuming {target[EMBEDDING_MODEL_KEY]}")
+                    self.vector_db.stamp_collection(name, target)
+                    continue
+            elif stamp == target:
+                continue
+            pending.append(name)
+
+        for name, job in list(self.jobs.items()):
+            if name not in pending and job["status"] != DONE:
+                self._discard_shadow(job)
+                del self.jobs[name]
+        self._save_state()
+        return pending
+
+    def _discard_shadow(self, job: Dict[str, Any]):
+        """删除作业未切换的影子集合"""
+        shadow = job.get("shadow")
+        if shadow and job["status"] != DONE and self.vector_db.has_physical_collection(shadow):
+            self.vector_db.drop_shadow_collection(shadow)
+
+    # ------------------------------------------------------------------
+    # 运行
+    # ------------------------------------------------------------------
+
+    def start(self) -> asyncio.Task:
+        """在后台开始迁移所有需要迁移的集合"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        """停止迁移（进度已持久化，下次启动时继续）"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def run(self):
+        """依次迁移每个需要迁移的集合，单个集合失败不影响其他集合"""
+        loop = asyncio.get_running_loop()
+        pending = await loop.run_in_executor(None, self.plan)
+        if pending:
+            logger.info(f"Re-embedding {len(pending)} collections with {self.target_stamp()[EMBEDDING_MODEL_KEY]}")
+        for name in pending:
+            try:
+                await self.migrate_collection(name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Migration of collection {name} failed: {e}")
+                if name in self.jobs:
+                    self._update(name, status=FAILED, error=str(e))
+
+    async def migrate_collection(self, name: str):
+        """把一个集合重新嵌入到影子集合并切换"""
+        loop = asyncio.get_running_loop()
+        target = self.target_stamp()
+        service_name = self.embedding_manager.default_service
+
+        job = self.jobs.get(name)
+        if job is not None and job["status"] != DONE:
+            shadow_exists = await loop.run_in_executor(None, self.vector_db.has_physical_collection, job["shadow"])
+            if job["target"] != target or not shadow_exists:
+                await loop.run_in_executor(None, self._discard_shadow, job)
+                job = None
+        if job is None or job["status"] == DONE:
+            shadow = await loop.run_in_executor(None, self.vector_db.create_shadow_collection, name, target)
+            self.jobs[name] = {
+                "shadow": shadow,
+                "source": self.vector_db.get_embedding_stamp(name),
+                "target": target,
+                "status": PENDING,
+                "migrated": 0,
+                "total": 0,
+                "started_at": datetime.now().isoformat(),
+                "error": None
+            }
+        else:
+            logger.info(f"Resuming migration of collection {name} ({job['migrated']}/{job['total']})")
+        self._update(name, status=RUNNING, error=None)
+
+        shadow = self.jobs[name]["shadow"]
+        await self._copy(name, shadow, service_name)
+
+        # 增量追赶迁移期间的写入，直到剩余差异不超过一批，再在写锁内完成最后一批并切换
+        for _ in range(3):
+            changed, removed = await loop.run_in_executor(None, self._diff, name, shadow)
+            if len(changed["ids"]) + len(removed) <= self.batch_size:
+                break
+            await self._apply(shadow, changed, removed, service_name)
+        await loop.run_in_executor(None, self._finish, name, shadow, service_name)
+
+    async def _copy(self, name: str, shadow: str, service_name: str):
+        """分页读取原集合，跳过影子集合中已有的文档（断点续传），限速重新嵌入"""
+        loop = asyncio.get_running_loop()
+        done = set(await loop.run_in_executor(None, self.vector_db.document_ids, shadow))
+        total = len(await loop.run_in_executor(None, self.vector_db.document_ids, name))
+        self._update(name, migrated=len(done), total=total)
+
+        offset = 0
+        while True:
+            page = await loop.run_in_executor(None, self.vector_db.read_documents, name, offset, self.batch_size)
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            batch = _select(page, [i for i, doc_id in enumerate(page["ids"]) if doc_id not in done])
+            if not batch["ids"]:
+                continue
+
+            started = time.perf_counter()
+            await self._apply(shadow, batch, [], service_name)
+            elapsed = time.perf_counter() - started
+            done.update(batch["ids"])
+            self._update(name, migrated=len(done), total=max(total, len(done)))
+            await self._throttle(len(batch["ids"]), elapsed)
+
+    async def _apply(self, shadow: str, batch: Dict[str, List], removed: List[str], service_name: str):
+        """重新嵌入一批文档写入影子集合，并删除原集合中已删除的文档"""
+        loop = asyncio.get_running_loop()
+        if batch["ids"]:
+            embeddings = await self.embedding_manager.aembed_texts_array(
+                batch["documents"], service_name, self.batch_size, same_model=True
+            )
+            await loop.run_in_executor(
+                None, self.vector_db.write_documents,
+                shadow, batch["ids"], batch["documents"], embeddings, batch["metadatas"]
+            )
+        if removed:
+            await loop.run_in_executor(None, self.vector_db.delete_physical_documents, shadow, removed)
+
+    def _diff(self, name: str, shadow: str) -> Tuple[Dict[str, List], List[str]]:
+        """原集合与影子集合的差异：需要（重新）嵌入的文档，以及需要从影子集合删除的 ID"""
+        source = self.vector_db.read_documents(name)
+        target = self.vector_db.read_documents(shadow)
+        copied = {
+            doc_id: (document, metadata)
+            for doc_id, document, metadata in zip(target["ids"], target["documents"], target["metadatas"])
+        }
+        changed = [
+            i for i, doc_id in enumerate(source["ids"])
+            if copied.get(doc_id) != (source["documents"][i], source["metadatas"][i])
+        ]
+        removed = sorted(set(copied) - set(source["ids"]))
+        return _select(source, changed), removed
+
+    def _finish(self, name: str, shadow: str, service_name: str):
+        """在写锁内追赶最后的差异并切换（在工作线程中执行，持锁期间写入请求等待）"""
+        with self.vector_db.collection_lock(name):
+            changed, removed = self._diff(name, shadow)
+            if changed["ids"]:
+                embeddings = self.embedding_manager.embed_texts_array(
+                    changed["documents"], service_name, self.batch_size, same_model=True
+                )
+                self.vector_db.write_documents(shadow, changed["ids"], changed["documents"], embeddings, changed["metadatas"])
+            self.vector_db.delete_physical_documents(shadow, removed)
+            self.vector_db.swap_collection(name, shadow)
+
+        count = len(self.vector_db.document_ids(name))
+        self._update(name, status=DONE, migrated=count, total=count, finished_at=datetime.now().isoformat())
+        logger.info(f"Collection {name} re-embedded with {self.jobs[name]['target'][EMBEDDING_MODEL_KEY]} ({count} documents)")
+
+    async def _throttle(self, texts: int, elapsed: float):
+        """按占空比和速率上限让出时间"""
+        delay = elapsed * (1 - self.duty_cycle) / self.duty_cycle
+        if self.max_texts_per_second:
+            delay = max(delay, texts / self.max_texts_per_second - elapsed)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _select(page: Dict[str, List], indices: List[int]) -> Dict[str, List]:
+    """从 ChromaDB get 的结果中取出指定位置的文档；没有文本的文档无法重新嵌入，跳过"""
+    indices = [i for i in indices if page["documents"][i] is not None]
+    return {
+        "ids": [page["ids"][i] for i in indices],
+        "documents": [page["documents"][i] for i in indices],
+        "metadatas": [page["metadatas"][i] for i in indices]
+    }
@@ -7,6 +7,11 @@ import os
 logger = logging.getLogger(__name__)
 
 from server.services.embedding_manager import BaseEmbeddingService
+from server.services.embedding_batching import plan_length_buckets, padding_stats
+
+# 分词前按字符截断：保留 max_seq_length * 8 个字符，远超模型会读取的 token 数，
+# 超长文本不必整段分词（统计长度和编码各一次）
+MAX_CHARS_PER_TOKEN = 8
 
 class EmbeddingService(BaseEmbeddingService):
     """文本嵌入服务"""
@@ -71,19 +76,23 @@ class EmbeddingService(BaseEmbeddingService):
             else:
                 logger.error("Failed to load any embedding model")
                 raise RuntimeError("No embedding model could be loaded")
+        
+        # 使用模型自身的分词器计算 token 数
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = getattr(self.model, 'max_seq_length', 512)
+        
+        # 批处理统计
+        self.total_texts = 0
+        self.over_length_texts = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
     
     def embed_text(self, text: str) -> List[float]:
         """
         将单个文本转换为向量
         """
         try:
-            # 限制文本长度，避免超出模型限制
-            if len(text) > 5000:
-                text = text[:5000]
-                logger.warning("Text truncated to 5000 characters")
-            
-            embedding = self.model.encode(text, convert_to_numpy=True)
-            return embedding.tolist()
+            return self.embed_texts_array([text])[0].tolist()
         except Exception as e:
             logger.error(f"Failed to embed text: {e}")
             raise
@@ -93,25 +102,73 @@ class EmbeddingService(BaseEmbeddingService):
         批量将文本转换为向量
         """
         try:
-            # 限制每个文本的长度
-            processed_texts = []
-            for text in texts:
-                if len(text) > 5000:
-                    processed_texts.append(text[:5000])
-                else:
-                    processed_texts.append(text)
-            
-            embeddings = self.model.encode(
-                processed_texts, 
-                convert_to_numpy=True,
-                batch_size=batch_size,
-                show_progress_bar=len(texts) > 100
-            )
-            return embeddings.tolist()
+            return self.embed_texts_array(texts, batch_size).tolist()
         except Exception as e:
             logger.error(f"Failed to embed texts: {e}")
             raise
     
+    def embed_texts_array(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        批量编码并返回 float32 数组
+        按 token 长度分桶，每个桶使用与其长度相适应的批大小，最后恢复原顺序
+        """
+        if not texts:
+            return np.zeros((0, self.embedding_dim), dtype=np.float32)
+        
+        char_limit = self.max_seq_length * MAX_CHARS_PER_TOKEN
+        texts = [text[:char_limit] for text in texts]
+        lengths = self._token_lengths(texts)
+        
+        # 超出模型最大长度的文本会被模型截断，这里精确统计并告警
+        over_length = sum(1 for length in lengths if length > self.max_seq_length)
+        if over_length:
+            self.over_length_texts += over_length
+            logger.warning(
+                f"{over_length}/{len(texts)} texts exceed max_seq_length={self.max_seq_length} tokens "
+                f"(longest: {max(lengths)}) and will be truncated"
+            )
+        
+        batches = plan_length_buckets(lengths, batch_size, self.max_seq_length)
+        output = np.empty((len(texts), self.embedding_dim), dtype=np.float32)
+        
+        show_progress = len(texts) > 100 and logger.isEnabledFor(logging.DEBUG)
+        for batch in batches:
+            output[batch] = self.model.encode(
+                [texts[i] for i in batch],
+                convert_to_numpy=True,
+                batch_size=len(batch),
+                show_progress_bar=show_progress
+            )
+        
+        stats = padding_stats(lengths, batches, self.max_seq_length)
+        self.total_texts += len(texts)
+        self.real_tokens += stats["real_tokens"]
+        self.padded_tokens += stats["padded_tokens"]
+        
+        return output
+    
+    def _token_lengths(self, texts: List[str]) -> List[int]:
+        """使用模型分词器计算每个文本的 token 数（含特殊 token，不截断）"""
+        encoded = self.tokenizer(
+            list(texts),
+            add_special_tokens=True,
+            truncation=False,
+            verbose=False,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+    
+    def get_batching_stats(self) -> Dict[str, Any]:
+        """获取批处理统计信息"""
+        return {
+            "total_texts": self.total_texts,
+            "over_length_texts": self.over_length_texts,
+            "real_tokens": self.real_tokens,
+            "padded_tokens": self.padded_tokens,
+            "padding_waste": 1.0 - self.real_tokens / self.padded_tokens if self.padded_tokens else 0.0
+        }
+    
     def compute_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
         """
         计算两个向量的余弦相似度
@@ -140,5 +197,6 @@ class EmbeddingService(BaseEmbeddingService):
         return {
             "model_name": self.model_name,
             "embedding_dimension": self.embedding_dim,
-            "max_sequence_length": getattr(self.model, 'max_seq_length', 512)
+            "max_sequence_length": self.max_seq_length,
+            "batching": self.get_batching_stats()
         }
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""
+多进程嵌入服务
+每个工作进程加载一次 sentence-transformers 模型，大批量文本按分片分发到各进程，
+结果以 float32 数组写入共享内存返回，避免 pickle 大量 Python 浮点列表
+"""
+import logging
+import math
+import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from server.services.embedding_manager import BaseEmbeddingService
+
+logger = logging.getLogger(__name__)
+
+# 工作进程内加载的模型（每个进程一份）
+_worker_model = None
+
+
+def load_sentence_transformer(model_name: str, cache_dir: str, threads_per_worker: int):
+    """默认的模型加载函数：限制 torch 线程数后加载 sentence-transformers 模型"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads_per_worker)
+    return SentenceTransformer(model_name, cache_folder=cache_dir, device='cpu')
+
+
+def _init_worker(
+    model_name: str,
+    cache_dir: str,
+    threads_per_worker: int,
+    model_loader: Callable[[str, str, int], Any] = load_sentence_transformer
+):
+    """工作进程初始化：限制线程数并加载模型"""
+    global _worker_model
+    # 必须在导入 torch 之前设置
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+    os.environ["MKL_NUM_THREADS"] = str(threads_per_worker)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    _worker_model = model_loader(model_name, cache_dir, threads_per_worker)
+
+
+def _worker_model_info() -> Dict[str, Any]:
+    """返回工作进程中模型的信息"""
+    return {
+        "pid": os.getpid(),
+        "embedding_dimension": _worker_model.get_sentence_embedding_dimension(),
+        "max_sequence_length": getattr(_worker_model, 'max_seq_length', 512)
+    }
+
+
+def _encode_into_shared_memory(
+    texts: List[str],
+    shm_name: str,
+    total_rows: int,
+    dim: int,
+    row_offset: int,
+    batch_size: int
+) -> int:
+    """在工作进程中编码一个分片，并把结果写入共享内存的对应行"""
+    embeddings = _worker_model.encode(texts, convert_to_numpy=True, batch_size=batch_size)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        output = np.ndarray((total_rows, dim), dtype=np.float32, buffer=shm.buf)
+        output[row_offset:row_offset + len(texts)] = embeddings
+        del output
+    finally:
+        shm.close()
+    return len(texts)
+
+
+class PooledEmbeddingService(BaseEmbeddingService):
+    """使用进程池的 sentence-transformers 嵌入服务"""
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        num_workers: int = 2,
+        threads_per_worker: int = 1,
+        min_shard_size: int = 16,
+        model_loader: Callable[[str, str, int], Any] = load_sentence_transformer
+    ):
+        """
+        model_name: 使用的嵌入模型名称
+        num_workers: 工作进程数
+        threads_per_worker: 每个工作进程内 torch 使用的线程数
+        min_shard_size: 每个分片的最小文本数，小批量不拆分
+        model_loader: 在工作进程中加载模型的模块级函数 (模型名, 缓存目录, 线程数) -> 模型
+        """
+        self.model_name = model_name
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.min_shard_size = max(1, min_shard_size)
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.join(os.path.dirname(__file__), "..", "..", "models", "embeddings")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        logger.info(
+            f"Starting embedding worker pool: model={model_name}, workers={self.num_workers}, "
+            f"threads_per_worker={self.threads_per_worker}"
+        )
+        # 使用 spawn，避免在已加载 torch 的进程中 fork
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, cache_dir, self.threads_per_worker, model_loader)
+        )
+
+        try:
+            # 每个工作进程都加载一次模型，同时获取模型维度
+            futures = [self._executor.submit(_worker_model_info) for _ in range(self.num_workers)]
+            infos = [future.result() for future in futures]
+        except Exception as e:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            logger.error(f"Failed to start embedding worker pool: {e}")
+            raise RuntimeError(f"Embedding worker pool could not load model {model_name}: {e}")
+
+        self.embedding_dim = infos[0]["embedding_dimension"]
+        self.max_seq_length = infos[0]["max_sequence_length"]
+        logger.info(f"Embedding worker pool ready (dimension: {self.embedding_dim})")
+
+    def embed_text(self, text: str) -> List[float]:
+        """将单个文本转换为向量"""
+        return self.embed_texts([text])[0]
+
+    def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """批量将文本转换为向量，大批量按分片并行编码"""
+        return self.embed_texts_array(texts, batch_size).tolist()
+
+    def embed_texts_array(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """批量编码并返回 float32 数组"""
+        total = len(texts)
+        if total == 0:
+            return np.zeros((0, self.embedding_dim), dtype=np.float32)
+        executor = self._executor
+        if executor is None:
+            raise RuntimeError("Embedding worker pool is closed")
+
+        shard_count = min(self.num_workers, max(1, total // self.min_shard_size))
+        shard_size = math.ceil(total / shard_count)
+
+        shm = shared_memory.SharedMemory(create=True, size=total * self.embedding_dim * 4)
+        try:
+            futures = []
+            for offset in range(0, total, shard_size):
+                futures.append(executor.submit(
+                    _encode_into_shared_memory,
+                    texts[offset:offset + shard_size],
+                    shm.name,
+                    total,
+                    self.embedding_dim,
+                    offset,
+                    batch_size
+                ))
+            for future in futures:
+                future.result()
+
+            shared = np.ndarray((total, self.embedding_dim), dtype=np.float32, buffer=shm.buf)
+            result = shared.copy()
+            del shared
+            return result
+        except Exception as e:
+            logger.error(f"Failed to embed texts in worker pool: {e}")
+            raise
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def get_model_info(self) -> Dict[str, Any]:
+        """获取模型信息"""
+        return {
+            "model_name": self.model_name,
+            "embedding_dimension": self.embedding_dim,
+            "max_sequence_length": self.max_seq_length,
+            "num_workers": self.num_workers,
+            "threads_per_worker": self.threads_per_worker,
+            "provider": "sentence-transformers-pool"
+        }
+
+    def close(self):
+        """关闭工作进程"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+                logger.info("Embedding worker pool stopped")
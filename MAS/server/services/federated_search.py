@@ -0,0 +1,152 @@
+"""
+跨知识库联合搜索
+查询对每种嵌入模型只嵌入一次，按路由画像只选出最相关的 M 个知识库，
+在有界线程池中并发搜索（每个知识库单独超时），结果按余弦相似度合并
+
+超时无法中止已经在线程中运行的搜索，它会继续占用线程池的一个线程直到完成；
+为避免慢知识库占满线程池，每个知识库最多有一个超时后仍在运行的搜索，期间该知识库被跳过（结果中的 busy）
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from server.services.embedding_dispatcher import embed_query
+from server.services.embedding_migration import collection_embedding_service, CollectionModelUnavailableError
+
+logger = logging.getLogger(__name__)
+
+
+class FederatedSearcher:
+    """联合搜索执行器（持有有界线程池）"""
+
+    def __init__(self, max_workers: int = 8, kb_timeout: float = 2.0, top_m: int = 5):
+        """
+        max_workers: 同时搜索的知识库数上限
+        kb_timeout: 单个知识库的搜索超时（秒），超时的知识库不参与合并
+        top_m: 默认只搜索路由分数最高的 M 个知识库
+        """
+        self.kb_timeout = kb_timeout
+        self.top_m = top_m
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="federated-search")
+        # 知识库 ID -> 超时后仍在线程中运行的搜索数
+        self._lingering: Dict[str, int] = defaultdict(int)
+        self._lingering_lock = threading.Lock()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _linger(self, kb_id: str, future):
+        """记录超时后仍在运行的搜索，完成时释放"""
+        def release(_):
+            with self._lingering_lock:
+                self._lingering[kb_id] -= 1
+                if not self._lingering[kb_id]:
+                    del self._lingering[kb_id]
+
+        with self._lingering_lock:
+            self._lingering[kb_id] += 1
+        future.add_done_callback(release)
+
+    async def search(
+        self,
+        services,
+        query: str,
+        kb_ids: List[str],
+        n_results: int = 10,
+        top_m: Optional[int] = None,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """在 kb_ids 中联合搜索，返回合并后的结果、路由和各阶段耗时"""
+        loop = asyncio.get_running_loop()
+        vector_db = services.vector_db_service
+        top_m = top_m or self.top_m
+        started = time.perf_counter()
+
+        # 按嵌入服务分组，每种模型只嵌入一次；模型不可用的知识库跳过
+        groups: Dict[str, List[str]] = {}
+        unavailable = []
+        for kb_id in kb_ids:
+            try:
+                service_name = collection_embedding_service(
+                    vector_db, services.embedding_manager, kb_id, services.embedding_migrator
+                )
+            except CollectionModelUnavailableError:
+                unavailable.append(kb_id)
+                continue
+            groups.setdefault(service_name, []).append(kb_id)
+        query_embeddings = {}
+        for service_name, members in groups.items():
+            embedding = await embed_query(services, query, service_name)
+            for kb_id in members:
+                query_embeddings[kb_id] = embedding
+        embedded = time.perf_counter()
+
+        # 路由：各组分别计算与知识库画像的相似度，全部知识库一起排序；
+        # 画像还在后台重建的知识库分数未知，排在有分数的之后补足 M 个
+        route_scores: Dict[str, float] = {}
+        for members in groups.values():
+            route_scores.update(await loop.run_in_executor(
+                self._executor, vector_db.routing_scores, query_embeddings[members[0]], members
+            ))
+        routed = sorted(route_scores, key=route_scores.get, reverse=True)[:top_m]
+        unscored = [kb_id for members in groups.values() for kb_id in members if kb_id not in route_scores]
+        routed += unscored[:top_m - len(routed)]
+        routed_at = time.perf_counter()
+
+        # 并发搜索，每个知识库单独超时
+        async def search_one(kb_id: str):
+            future = self._executor.submit(
+                vector_db.search,
+                collection_name=kb_id,
+                query_embedding=query_embeddings[kb_id],
+                n_results=n_results,
+                filter=filter,
+                with_similarity=True
+            )
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.kb_timeout)
+            except asyncio.TimeoutError:
+                # 还在排队的搜索直接取消；已经在运行的记下来，完成后才释放
+                if not future.cancel():
+                    self._linger(kb_id, future)
+                raise
+
+        with self._lingering_lock:
+            busy = [kb_id for kb_id in routed if self._lingering.get(kb_id)]
+        searched = [kb_id for kb_id in routed if kb_id not in busy]
+        outcomes = await asyncio.gather(*(search_one(kb_id) for kb_id in searched), return_exceptions=True)
+        merged, timed_out, failed = [], [], []
+        for kb_id, outcome in zip(searched, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                timed_out.append(kb_id)
+            elif isinstance(outcome, Exception):
+                logger.warning(f"Federated search in {kb_id} failed: {outcome}")
+                failed.append(kb_id)
+            else:
+                merged.extend({**result, "kb_id": kb_id} for result in outcome["results"])
+        merged.sort(key=lambda result: result["similarity"], reverse=True)
+        finished = time.perf_counter()
+
+        if timed_out:
+            logger.warning(f"Federated search timed out in {len(timed_out)} knowledge bases: {timed_out}")
+        if busy:
+            logger.warning(f"Federated search skipped {len(busy)} knowledge bases with a timed-out search still running: {busy}")
+        return {
+            "results": merged[:n_results],
+            "routing": [{"kb_id": kb_id, "score": route_scores.get(kb_id)} for kb_id in routed],
+            "candidates": len(kb_ids),
+            "timed_out": timed_out,
+            "busy": busy,
+            "failed": failed,
+            "unavailable": unavailable,
+            "timing_ms": {
+                "embed": round((embedded - started) * 1000, 3),
+                "route": round((routed_at - embedded) * 1000, 3),
+                "search": round((finished - routed_at) * 1000, 3),
+                "total": round((finished - started) * 1000, 3)
+            }
+        }
@@ -0,0 +1,348 @@
+"""
+HNSW 近似最近邻索引（纯 numpy 实现，供 SimpleVectorDB 使用）
+向量本身不保存在索引中，按行号从集合的向量段读取；向量已归一化，相似度为内积
+
+索引文件与向量段放在同一目录：
+    hnsw-l0.i32   第 0 层邻接表，n x 2M 的 int32 矩阵（-1 为空位），只追加，用 np.memmap 原地更新
+    hnsw.pkl      参数、入口点、每个节点的层数和上层邻接表（节点数约为 n/M，整体重写）
+集合压缩时按保留的行重新编号（remapped），不重新建图
+"""
+import heapq
+import math
+import os
+import pickle
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+LAYER0_FILE = "hnsw-l0.i32"
+GRAPH_FILE = "hnsw.pkl"
+
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 200
+DEFAULT_EF_SEARCH = 64
+
+
+class HNSWIndex:
+    """分层可导航小世界图索引"""
+
+    def __init__(
+        self,
+        directory: Path,
+        vectors: Callable[[np.ndarray], np.ndarray],
+        M: int = DEFAULT_M,
+        ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+        ef_search: int = DEFAULT_EF_SEARCH,
+        seed: int = 100
+    ):
+        self.directory = directory
+        self.vectors = vectors  # 行号数组 -> 归一化向量矩阵
+        self.M = M
+        self.max_neighbors0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.level_mult = 1 / math.log(M)
+        self.rng = np.random.default_rng(seed)
+
+        self.levels = np.zeros(0, dtype=np.int8)
+        self.upper: Dict[int, Dict[int, List[int]]] = {}  # 层 -> 节点 -> 邻居
+        self.entry_point = -1
+        self.max_level = -1
+        self.layer0 = np.full((0, self.max_neighbors0), -1, dtype=np.int32)
+        self._layer0_map: Optional[np.memmap] = None
+
+    @property
+    def size(self) -> int:
+        """已加入索引的节点数"""
+        return len(self.levels)
+
+    def params(self) -> Dict[str, int]:
+        return {"M": self.M, "ef_construction": self.ef_construction, "ef_search": self.ef_search}
+
+    # ------------------------------------------------------------------
+    # 持久化
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def open(cls, directory: Path, vectors: Callable[[np.ndarray], np.ndarray], **params) -> "HNSWIndex":
+        """打开已保存的索引；文件不存在或不一致时返回空索引（由调用方补建）"""
+        index = cls(directory, vectors, **params)
+        graph_path = directory / GRAPH_FILE
+        if not graph_path.exists():
+            return index
+        with open(graph_path, "rb") as f:
+            graph = pickle.load(f)
+        if graph["params"]["M"] != index.M:
+            return index
+        index.levels = graph["levels"]
+        index.upper = graph["upper"]
+        index.entry_point = graph["entry_point"]
+        index.max_level = graph["max_level"]
+        layer0_path = directory / LAYER0_FILE
+        if index.size and layer0_path.stat().st_size >= index.size * index.max_neighbors0 * 4:
+            index._map_layer0(index.size)
+            # 第 0 层原地更新先于图结构保存：崩溃后可能留下指向未保存节点的邻接，清空这些位置
+            dangling = index.layer0 >= index.size
+            if dangling.any():
+                index.layer0[dangling] = -1
+        elif index.size:
+            return cls(directory, vectors, **params)
+        return index
+
+    def save(self):
+        """刷新第 0 层并重写上层图结构（先写临时文件再替换）"""
+        if self._layer0_map is not None:
+            self._layer0_map.flush()
+        graph = {
+            "params": self.params(),
+            "levels": self.levels,
+            "upper": self.upper,
+            "entry_point": self.entry_point,
+            "max_level": self.max_level
+        }
+        tmp_path = self.directory / (GRAPH_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(graph, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.directory / GRAPH_FILE)
+
+    def remapped(self, directory: Path, vectors: Callable[[np.ndarray], np.ndarray], keep: np.ndarray) -> "HNSWIndex":
+        """按保留的节点（旧编号，按新编号排列）生成重新编号的索引并保存到 directory（集合压缩时使用）；
+        失去邻居的节点从被删邻居的邻居中重新选邻居，入口点未保留时改用层数最高的保留节点"""
+        index = HNSWIndex(directory, vectors, **self.params())
+        if len(keep):
+            kept = np.zeros(self.size + 1, dtype=bool)  # 末位对应空位 -1
+            kept[keep] = True
+            layer0 = self.layer0[keep].copy()
+            lost = ~kept[layer0] & (layer0 >= 0)
+            for i in np.flatnonzero(lost.any(axis=1)).tolist():
+                neighbors = self._repaired(int(keep[i]), layer0[i], kept, self.max_neighbors0, lambda node: self.layer0[node])
+                layer0[i] = -1
+                layer0[i, :len(neighbors)] = neighbors
+            upper = {}
+            for layer, nodes in self.upper.items():
+                adjacency = lambda node, nodes=nodes: np.asarray(nodes.get(node, []), dtype=np.int64)
+                upper[layer] = {
+                    node: self._repaired(node, adjacency(node), kept, self.M, adjacency)
+                    for node in nodes if kept[node]
+                }
+
+            new_ids = np.full(self.size + 1, -1, dtype=np.int32)
+            new_ids[keep] = np.arange(len(keep), dtype=np.int32)
+            index._grow_layer0(len(keep))
+            index.layer0[:] = new_ids[layer0]
+            index.levels = self.levels[keep].copy()
+            index.max_level = int(index.levels.max())
+            index.entry_point = int(new_ids[self.entry_point])
+            if index.entry_point < 0:
+                index.entry_point = int(np.argmax(index.levels))
+            for layer in range(1, index.max_level + 1):
+                index.upper[layer] = {
+                    int(new_ids[node]): new_ids[neighbors].tolist() for node, neighbors in upper.get(layer, {}).items()
+                }
+        index.save()
+        return index
+
+    def _repaired(
+        self,
+        node: int,
+        neighbors: np.ndarray,
+        kept: np.ndarray,
+        limit: int,
+        adjacency: Callable[[int], np.ndarray]
+    ) -> List[int]:
+        """节点的保留邻居；有邻居被删除时，在保留邻居和被删邻居的保留邻居中重新选邻居"""
+        neighbors = neighbors[neighbors >= 0]
+        removed = neighbors[~kept[neighbors]]
+        if len(removed) == 0:
+            return neighbors.tolist()
+        candidates = set(neighbors[kept[neighbors]].tolist())
+        for neighbor in removed.tolist():
+            second = adjacency(neighbor)
+            second = second[second >= 0]
+            candidates.update(second[kept[second]].tolist())
+        candidates.discard(node)
+        if not candidates:
+            return []
+        nodes = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = self.vectors(nodes) @ self.vectors(np.asarray([node]))[0]
+        return self._select_neighbors(list(zip(similarities.tolist(), nodes.tolist())), limit)
+
+    def remove_files(self):
+        """删除索引文件"""
+        self.layer0 = np.full((0, self.max_neighbors0), -1, dtype=np.int32)
+        self._layer0_map = None
+        for name in (LAYER0_FILE, GRAPH_FILE):
+            path = self.directory / name
+            if path.exists():
+                path.unlink()
+
+    def _grow_layer0(self, count: int):
+        """在第 0 层文件末尾追加 count 个空邻接表"""
+        path = self.directory / LAYER0_FILE
+        size = self.size
+        mode = "r+b" if path.exists() else "w+b"
+        with open(path, mode) as f:
+            f.seek(size * self.max_neighbors0 * 4)
+            f.write(np.full((count, self.max_neighbors0), -1, dtype=np.int32).tobytes())
+            f.truncate()
+        self._map_layer0(size + count)
+
+    def _map_layer0(self, rows: int):
+        """映射第 0 层文件；通过普通 ndarray 视图访问，避免 memmap 子类每次索引的开销"""
+        self._layer0_map = np.memmap(self.directory / LAYER0_FILE, dtype=np.int32, mode="r+", shape=(rows, self.max_neighbors0))
+        self.layer0 = np.asarray(self._layer0_map)
+
+    # ------------------------------------------------------------------
+    # 图操作
+    # ------------------------------------------------------------------
+
+    def _neighbors(self, node: int, layer: int) -> np.ndarray:
+        if layer == 0:
+            row = self.layer0[node]
+            return row[row >= 0]
+        return np.asarray(self.upper[layer].get(node, []), dtype=np.int64)
+
+    def _set_neighbors(self, node: int, layer: int, neighbors: List[int]):
+        if layer == 0:
+            row = np.full(self.max_neighbors0, -1, dtype=np.int32)
+            row[:len(neighbors)] = neighbors
+            self.layer0[node] = row
+        else:
+            self.upper[layer][node] = list(neighbors)
+
+    def _search_layer(
+        self,
+        query: np.ndarray,
+        entry_points: List[Tuple[float, int]],
+        ef: int,
+        layer: int,
+        visited: np.ndarray
+    ) -> List[Tuple[float, int]]:
+        """在一层上做束搜索，返回至多 ef 个 (相似度, 节点)，未排序"""
+        candidates = [(-similarity, node) for similarity, node in entry_points]
+        heapq.heapify(candidates)
+        results = list(entry_points)
+        heapq.heapify(results)
+        for _, node in entry_points:
+            visited[node] = True
+
+        while candidates:
+            negative, node = heapq.heappop(candidates)
+            if -negative < results[0][0] and len(results) >= ef:
+                break
+            neighbors = self._neighbors(node, layer)
+            neighbors = neighbors[~visited[neighbors]]
+            if len(neighbors) == 0:
+                continue
+            visited[neighbors] = True
+            similarities = self.vectors(neighbors) @ query
+            if len(results) >= ef:
+                # 结果集已满时先批量去掉不可能进入结果的邻居
+                better = similarities > results[0][0]
+                neighbors, similarities = neighbors[better], similarities[better]
+            for neighbor, similarity in zip(neighbors.tolist(), similarities.tolist()):
+                if len(results) < ef or similarity > results[0][0]:
+                    heapq.heappush(candidates, (-similarity, neighbor))
+                    heapq.heappush(results, (similarity, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return results
+
+    def _select_neighbors(self, candidates: List[Tuple[float, int]], limit: int) -> List[int]:
+        """启发式选邻居：候选离查询点比离已选邻居更近时才保留，不足时用剩余候选补齐"""
+        candidates = sorted(candidates, reverse=True)
+        if len(candidates) <= limit:
+            return [node for _, node in candidates]
+        nodes = np.asarray([node for _, node in candidates], dtype=np.int64)
+        vectors = self.vectors(nodes)
+        pairwise = vectors @ vectors.T
+
+        selected: List[int] = []
+        pruned: List[int] = []
+        closest = np.full(len(candidates), -np.inf, dtype=np.float32)  # 每个候选与已选邻居的最大相似度
+        for i, (similarity, _) in enumerate(candidates):
+            if len(selected) >= limit:
+                break
+            if closest[i] < similarity:
+                selected.append(i)
+                np.maximum(closest, pairwise[i], out=closest)
+            else:
+                pruned.append(i)
+        selected.extend(pruned[:limit - len(selected)])
+        return nodes[selected].tolist()
+
+    def _connect(self, node: int, neighbor: int, layer: int):
+        """把 node 加入 neighbor 的邻接表，超出上限时重新选择"""
+        limit = self.max_neighbors0 if layer == 0 else self.M
+        current = self._neighbors(neighbor, layer).tolist()
+        if len(current) < limit:
+            self._set_neighbors(neighbor, layer, current + [node])
+            return
+        nodes = np.asarray(current + [node], dtype=np.int64)
+        similarities = self.vectors(nodes) @ self.vectors(np.asarray([neighbor]))[0]
+        self._set_neighbors(neighbor, layer, self._select_neighbors(list(zip(similarities.tolist(), nodes.tolist())), limit))
+
+    def add(self, count: int):
+        """把行号 [size, size + count) 依次插入图中"""
+        if count <= 0:
+            return
+        start = self.size
+        self._grow_layer0(count)
+        levels = np.minimum(
+            (-np.log(1.0 - self.rng.random(count)) * self.level_mult).astype(np.int64), 16
+        ).astype(np.int8)
+        self.levels = np.concatenate([self.levels, levels])
+        visited = np.zeros(start + count, dtype=bool)
+
+        for node in range(start, start + count):
+            level = int(self.levels[node])
+            for layer in range(1, level + 1):
+                self.upper.setdefault(layer, {})[node] = []
+            if self.entry_point < 0:
+                self.entry_point, self.max_level = node, level
+                continue
+
+            query = self.vectors(np.asarray([node]))[0]
+            entry = self.entry_point
+            best = [(float(self.vectors(np.asarray([entry]))[0] @ query), entry)]
+            for layer in range(self.max_level, level, -1):
+                visited[:node + 1] = False
+                best = [max(self._search_layer(query, best, 1, layer, visited))]
+
+            for layer in range(min(level, self.max_level), -1, -1):
+                visited[:node + 1] = False
+                found = self._search_layer(query, best, self.ef_construction, layer, visited)
+                neighbors = self._select_neighbors(found, self.M)
+                self._set_neighbors(node, layer, neighbors)
+                for neighbor in neighbors:
+                    self._connect(node, neighbor, layer)
+                best = found
+
+            if level > self.max_level:
+                self.entry_point, self.max_level = node, level
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        ef_search: Optional[int] = None,
+        alive: Optional[np.ndarray] = None
+    ) -> List[Tuple[float, int]]:
+        """返回至多 k 个 (相似度, 行号)，按相似度降序；alive 为 False 的行被跳过"""
+        if self.entry_point < 0:
+            return []
+        ef = max(ef_search or self.ef_search, k)
+        visited = np.zeros(self.size, dtype=bool)
+        entry = self.entry_point
+        best = [(float(self.vectors(np.asarray([entry]))[0] @ query), entry)]
+        for layer in range(self.max_level, 0, -1):
+            visited[:] = False
+            best = [max(self._search_layer(query, best, 1, layer, visited))]
+        visited[:] = False
+        found = self._search_layer(query, best, ef, 0, visited)
+        if alive is not None:
+            found = [(similarity, node) for similarity, node in found if alive[node]]
+        return sorted(found, reverse=True)[:k]
@@ -0,0 +1,73 @@
+"""
+混合检索：BM25 关键词搜索和向量搜索并发执行，用倒数排名融合（RRF）合并
+关键词搜索弥补向量搜索对精确标识符、错误码、中文产品名等的漏召回
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+RRF_K = 60  # RRF 平滑常数，score = sum(1 / (RRF_K + rank))
+CANDIDATE_MULTIPLIER = 4  # 每一路取 limit * 4 个候选参与融合
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> Dict[str, float]:
+    """多路排名（ID 列表，按相关度降序）-> ID 的融合分数"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+async def hybrid_search(
+    vector_db,
+    collection_name: str,
+    query: str,
+    query_embedding,
+    n_results: int = 10,
+    filter: Optional[Dict[str, Any]] = None,
+    mode: str = "hybrid"
+) -> Dict[str, Any]:
+    """
+    mode: hybrid（两路融合）或 lexical（只用关键词）
+    返回与 vector_db.search 相同的结构，每个结果另有 rrf_score、dense_rank、lexical_rank
+    """
+    if mode not in ("hybrid", "lexical"):
+        raise ValueError(f"Unsupported search mode {mode}, expected hybrid or lexical")
+    loop = asyncio.get_running_loop()
+    depth = n_results * CANDIDATE_MULTIPLIER
+
+    lexical_task = loop.run_in_executor(None, vector_db.lexical_search, collection_name, query, depth)
+    if mode == "hybrid":
+        dense_task = loop.run_in_executor(
+            None, lambda: vector_db.search(collection_name, query_embedding, n_results=depth, filter=filter)
+        )
+        lexical_hits, dense = await asyncio.gather(lexical_task, dense_task)
+        dense_results = dense["results"]
+    else:
+        lexical_hits, dense_results = await lexical_task, []
+
+    # 关键词结果中向量搜索没有返回的文档，按 ID 读取（同时应用过滤条件）
+    known = {result["id"]: result for result in dense_results}
+    missing = [doc_id for doc_id, _ in lexical_hits if doc_id not in known]
+    fetched = await loop.run_in_executor(None, vector_db.get_documents_by_ids, collection_name, missing, filter)
+    for doc_id, record in fetched.items():
+        known[doc_id] = {"id": doc_id, "document": record["document"], "metadata": record["metadata"], "distance": None}
+
+    dense_ranking = [result["id"] for result in dense_results]
+    lexical_ranking = [doc_id for doc_id, _ in lexical_hits if doc_id in known]
+    fused = reciprocal_rank_fusion([dense_ranking, lexical_ranking] if dense_ranking else [lexical_ranking])
+    dense_ranks = {doc_id: rank for rank, doc_id in enumerate(dense_ranking, start=1)}
+    lexical_ranks = {doc_id: rank for rank, doc_id in enumerate(lexical_ranking, start=1)}
+
+    results = []
+    for doc_id in sorted(fused, key=fused.get, reverse=True)[:n_results]:
+        results.append({
+            **known[doc_id],
+            "rrf_score": fused[doc_id],
+            "dense_rank": dense_ranks.get(doc_id),
+            "lexical_rank": lexical_ranks.get(doc_id)
+        })
+    return {"results": results, "total": len(results)}
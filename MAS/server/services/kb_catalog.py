@@ -0,0 +1,194 @@
+"""
+知识库目录
+集合级元数据（显示名称、草稿/发布状态、设备、描述、文档数）保存在 SQLite 表中，
+发布和重命名只更新一行，不再读取和重写集合中的向量
+
+启动时整张表载入内存，读取（按 ID、按显示名称、列表）只访问内存；
+每次写入先落盘再更新内存并递增版本号，上层据版本号缓存列表和生成 ETag
+"""
+import json
+import sqlite3
+import threading
+import logging
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = "kb_catalog.db"
+
+
+def is_draft_metadata(metadata: Dict[str, Any]) -> bool:
+    """兼容 is_draft 被存成整数或字符串的旧元数据"""
+    value = metadata.get("is_draft", metadata.get("status", "draft") == "draft")
+    if isinstance(value, str):
+        return value.lower() in ("true", "1", "yes")
+    return bool(value)
+
+
+class KBCatalog:
+    """知识库目录（每个知识库一行，完整元数据以 JSON 保存，常用查询字段单独成列）"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._init_database()
+        
+        # 内存中的目录：ID -> 条目（保持创建顺序），显示名称 -> ID 集合
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._by_name: Dict[str, set] = {}
+        self.instance = uuid.uuid4().hex[:8]  # 进程内唯一，避免重启后版本号重复
+        self.version = 0
+        self._load()
+
+    def _init_database(self):
+        """初始化数据库"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS knowledge_bases (
+                    id TEXT PRIMARY KEY,
+                    display_name TEXT NOT NULL,
+                    is_draft INTEGER NOT NULL,
+                    device_id TEXT,
+                    document_count INTEGER NOT NULL DEFAULT 0,
+                    metadata TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_kb_display_name ON knowledge_bases(display_name, is_draft)")
+            conn.commit()
+
+        logger.info(f"Knowledge base catalog initialized at {self.db_path}")
+
+    @contextmanager
+    def _get_connection(self):
+        """获取数据库连接"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _load(self):
+        with self._get_connection() as conn:
+            rows = conn.execute("SELECT id, document_count, metadata FROM knowledge_bases ORDER BY rowid").fetchall()
+        for row in rows:
+            self._remember(row["id"], json.loads(row["metadata"]), row["document_count"])
+
+    def _remember(self, kb_id: str, metadata: Dict[str, Any], document_count: int):
+        """更新内存中的条目（调用方持有锁）"""
+        self._forget(kb_id)
+        self._entries[kb_id] = {"id": kb_id, "document_count": document_count, "metadata": metadata}
+        self._by_name.setdefault(metadata.get("display_name", kb_id), set()).add(kb_id)
+        self.version += 1
+
+    def _forget(self, kb_id: str):
+        entry = self._entries.pop(kb_id, None)
+        if entry is not None:
+            name = entry["metadata"].get("display_name", kb_id)
+            self._by_name[name].discard(kb_id)
+            if not self._by_name[name]:
+                del self._by_name[name]
+            self.version += 1
+
+    @staticmethod
+    def _copy(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {**entry, "metadata": dict(entry["metadata"])}
+
+    def put(self, kb_id: str, metadata: Dict[str, Any], document_count: int = 0):
+        """写入（或覆盖）一个知识库"""
+        metadata = dict(metadata)
+        with self._lock, self._get_connection() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO knowledge_bases
+                    (id, display_name, is_draft, device_id, document_count, metadata, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    kb_id,
+                    metadata.get("display_name", kb_id),
+                    int(is_draft_metadata(metadata)),
+                    metadata.get("device_id"),
+                    document_count,
+                    json.dumps(metadata, ensure_ascii=False),
+                    datetime.now().isoformat()
+                )
+            )
+            conn.commit()
+            self._remember(kb_id, metadata, document_count)
+
+    def get(self, kb_id: str) -> Optional[Dict[str, Any]]:
+        """按 ID 读取，不存在时返回 None"""
+        entry = self._entries.get(kb_id)
+        return self._copy(entry) if entry else None
+
+    def find_by_display_name(self, display_name: str) -> List[Dict[str, Any]]:
+        """按显示名称查找（草稿可能重名，返回所有匹配）"""
+        return [self._copy(self._entries[kb_id]) for kb_id in sorted(self._by_name.get(display_name, ()))]
+
+    def update(self, kb_id: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """合并更新元数据，返回更新后的元数据；知识库不存在时抛出 KeyError"""
+        with self._lock, self._get_connection() as conn:
+            entry = self._entries.get(kb_id)
+            if entry is None:
+                raise KeyError(kb_id)
+            metadata = {**entry["metadata"], **changes}
+            conn.execute(
+                """
+                UPDATE knowledge_bases
+                SET display_name = ?, is_draft = ?, device_id = ?, metadata = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (
+                    metadata.get("display_name", kb_id),
+                    int(is_draft_metadata(metadata)),
+                    metadata.get("device_id"),
+                    json.dumps(metadata, ensure_ascii=False),
+                    datetime.now().isoformat(),
+                    kb_id
+                )
+            )
+            conn.commit()
+            self._remember(kb_id, metadata, entry["document_count"])
+        return dict(metadata)
+
+    def set_document_count(self, kb_id: str, count: int):
+        """更新文档数"""
+        with self._lock, self._get_connection() as conn:
+            entry = self._entries.get(kb_id)
+            if entry is None or entry["document_count"] == count:
+                return
+            conn.execute("UPDATE knowledge_bases SET document_count = ? WHERE id = ?", (count, kb_id))
+            conn.commit()
+            entry["document_count"] = count
+            self.version += 1
+
+    def delete(self, kb_id: str):
+        """删除一个知识库"""
+        with self._lock, self._get_connection() as conn:
+            conn.execute("DELETE FROM knowledge_bases WHERE id = ?", (kb_id,))
+            conn.commit()
+            self._forget(kb_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """所有知识库，按创建顺序"""
+        return [self._copy(entry) for entry in list(self._entries.values())]
+
+    def ids(self) -> List[str]:
+        return list(self._entries)
+
+    @property
+    def etag(self) -> str:
+        """目录当前版本的标识，任何写入后都会变化"""
+        return f"{self.instance}-{self.version}"
+
+    def published_name_exists(self, display_name: str, exclude_id: Optional[str] = None) -> bool:
+        """是否已有同名的已发布知识库"""
+        return any(
+            kb_id != exclude_id and not is_draft_metadata(self._entries[kb_id]["metadata"])
+            for kb_id in list(self._by_name.get(display_name, ()))
+        )
@@ -0,0 +1,181 @@
+"""
+知识库路由画像（供跨知识库联合搜索选择要搜索的知识库）
+每个知识库维护归一化向量的累加和（质心）和一个蓄水池抽样，抽样上用 k-means 求出若干摘要向量；
+查询与质心、摘要向量的最大余弦相似度作为该知识库的路由分数，只搜索分数最高的 M 个知识库
+
+写入文档时增量更新；删除文档无法从累加和中减去（没有向量），删除比例超过阈值后标记为需要重建，
+由调用方重新读取全部向量重建
+"""
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from server.services.vector_codecs import kmeans
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_ROWS = 512  # 每个知识库保留的抽样向量数
+SUMMARY_VECTORS = 8  # 每个知识库的摘要向量数
+REBUILD_DELETED_FRACTION = 0.25  # 删除超过这个比例后重建画像
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32).reshape(len(matrix), -1)
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10)
+
+
+class RoutingProfile:
+    """单个知识库的路由画像"""
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.vector_sum = np.zeros(dimension, dtype=np.float64)
+        self.count = 0
+        self.deleted = 0
+        self.seen = 0  # 蓄水池抽样见过的向量数
+        self.sample = np.zeros((0, dimension), dtype=np.float32)
+        self.summaries: Optional[np.ndarray] = None  # 抽样变化后置空，下次路由时重新计算
+
+    @property
+    def stale(self) -> bool:
+        return self.deleted > REBUILD_DELETED_FRACTION * max(self.count + self.deleted, 1)
+
+    def add(self, vectors: np.ndarray, rng: np.random.Generator):
+        self.vector_sum += vectors.sum(axis=0, dtype=np.float64)
+        self.count += len(vectors)
+        # 蓄水池抽样：第 i 个向量以 SAMPLE_ROWS / i 的概率替换抽样中的随机一个
+        room = max(SAMPLE_ROWS - len(self.sample), 0)
+        if room:
+            self.sample = np.concatenate([self.sample, vectors[:room]])
+        rest = vectors[room:]
+        if len(rest):
+            slots = rng.integers(0, np.arange(self.seen + room + 1, self.seen + len(vectors) + 1))
+            kept = slots < SAMPLE_ROWS
+            self.sample[slots[kept]] = rest[kept]  # 同一位置被多次选中时后面的向量生效
+        self.seen += len(vectors)
+        self.summaries = None
+
+    def representatives(self) -> np.ndarray:
+        """质心和摘要向量（归一化）"""
+        if self.summaries is None:
+            if len(self.sample):
+                clusters = min(SUMMARY_VECTORS, len(self.sample))
+                self.summaries = _normalize(kmeans(self.sample, clusters, iterations=10))
+            else:
+                self.summaries = np.zeros((0, self.dimension), dtype=np.float32)
+        centroid = _normalize(self.vector_sum.reshape(1, -1))
+        return np.concatenate([centroid, self.summaries])
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {
+            "vector_sum": self.vector_sum,
+            "counters": np.array([self.count, self.deleted, self.seen], dtype=np.int64),
+            "sample": self.sample,
+            "summaries": self.summaries if self.summaries is not None else np.zeros((0, 0), dtype=np.float32)
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "RoutingProfile":
+        profile = cls(len(state["vector_sum"]))
+        profile.vector_sum = state["vector_sum"]
+        profile.count, profile.deleted, profile.seen = (int(value) for value in state["counters"])
+        profile.sample = state["sample"]
+        profile.summaries = state["summaries"] if state["summaries"].size else None
+        return profile
+
+
+class KBRoutingIndex:
+    """所有知识库的路由画像，每个知识库一个 .npz 文件"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._profiles: Dict[str, RoutingProfile] = {}
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng()
+        for path in self.directory.glob("*.npz"):
+            try:
+                with np.load(path) as state:
+                    self._profiles[path.stem] = RoutingProfile.from_state(dict(state))
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable routing profile {path.name}: {e}")
+
+    def _path(self, kb_id: str) -> Path:
+        return self.directory / f"{kb_id}.npz"
+
+    def _save(self, kb_id: str, profile: RoutingProfile):
+        temp_path = self.directory / f"{kb_id}.tmp.npz"
+        np.savez(temp_path, **profile.state())
+        os.replace(temp_path, self._path(kb_id))
+
+    def add(self, kb_id: str, embeddings) -> None:
+        """写入文档后更新画像；维度变化（换了嵌入模型）时重新开始"""
+        vectors = _normalize(embeddings)
+        if len(vectors) == 0:
+            return
+        with self._lock:
+            profile = self._profiles.get(kb_id)
+            if profile is None or profile.dimension != vectors.shape[1]:
+                profile = self._profiles[kb_id] = RoutingProfile(vectors.shape[1])
+            profile.add(vectors, self._rng)
+            self._save(kb_id, profile)
+
+    def remove(self, kb_id: str, count: int):
+        """删除文档后记录删除数"""
+        with self._lock:
+            profile = self._profiles.get(kb_id)
+            if profile is None:
+                return
+            removed = min(count, profile.count)
+            profile.count -= removed
+            profile.deleted += removed
+            self._save(kb_id, profile)
+
+    def drop(self, kb_id: str):
+        """删除知识库（或向量整体被替换）时丢弃画像"""
+        with self._lock:
+            self._profiles.pop(kb_id, None)
+            self._path(kb_id).unlink(missing_ok=True)
+
+    def rebuild(self, kb_id: str, batches: Iterable[np.ndarray]):
+        """用知识库中的全部向量重建画像"""
+        profile = None
+        for batch in batches:
+            vectors = _normalize(batch)
+            if len(vectors) == 0:
+                continue
+            if profile is None:
+                profile = RoutingProfile(vectors.shape[1])
+            profile.add(vectors, self._rng)
+        with self._lock:
+            if profile is None:
+                self._profiles.pop(kb_id, None)
+                self._path(kb_id).unlink(missing_ok=True)
+                return
+            profile.representatives()
+            self._profiles[kb_id] = profile
+            self._save(kb_id, profile)
+        logger.info(f"Rebuilt routing profile of {kb_id} from {profile.count} vectors")
+
+    def needs_rebuild(self, kb_id: str, document_count: int) -> bool:
+        """画像缺失、删除过多，或画像的向量数与文档数不一致（旧知识库在建立画像前已有文档）时需要重建"""
+        profile = self._profiles.get(kb_id)
+        if profile is None:
+            return document_count > 0
+        return profile.stale or profile.count != document_count
+
+    def scores(self, query: np.ndarray, kb_ids: List[str]) -> Dict[str, float]:
+        """查询与各知识库质心/摘要向量的最大余弦相似度；没有画像或维度不同的知识库不出现在结果中"""
+        query = _normalize(np.asarray(query).reshape(1, -1))[0]
+        scores = {}
+        with self._lock:
+            for kb_id in kb_ids:
+                profile = self._profiles.get(kb_id)
+                if profile is None or profile.count == 0 or profile.dimension != len(query):
+                    continue
+                scores[kb_id] = float((profile.representatives() @ query).max())
+        return scores
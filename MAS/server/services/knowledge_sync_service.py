@@ -399,7 +399,7 @@ class KnowledgeSyncService:
                         
                         # 生成嵌入并保存
                         texts = [doc['content'] for doc in documents]
-                        embeddings = embedding_manager.embed_texts(texts)
+                        embeddings = await embedding_manager.aembed_texts_array(texts)
                         metadatas = [doc['metadata'] for doc in documents]
                         
                         # 添加到本地数据库
@@ -0,0 +1,223 @@
+"""
+BM25 倒排索引（按集合，保存在 SQLite 中）
+文档加入集合时增量建立词项 -> (文档, 词频) 的倒排表，删除时移除；
+查询时只读取查询词项的倒排表，用 BM25 打分
+
+分词兼顾中日韩文本：连续的中日韩字符切成单字和相邻二字组合，
+字母数字按标识符整体保留（如 ERR-1024、v2.3.1），同时拆出其中的各段
+"""
+import logging
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_FILE = "lexical_index.db"
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_CJK_RANGES = (
+    "぀-ヿ"  # 平假名、片假名
+    "㐀-䶿一-鿿豈-﫿"  # 汉字
+    "가-힯"  # 韩文音节
+)
+_TOKEN_PATTERN = re.compile(rf"[{_CJK_RANGES}]+|[0-9a-z]+(?:[-_.:/][0-9a-z]+)*")
+_CJK_PATTERN = re.compile(rf"[{_CJK_RANGES}]")
+_PART_PATTERN = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """把文本切成 BM25 词项"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if _CJK_PATTERN.match(token):
+            tokens.extend(token)
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token)
+            parts = _PART_PATTERN.findall(token)
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return tokens
+
+
+class LexicalIndex:
+    """所有集合的 BM25 倒排索引"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._init_database()
+
+    def _init_database(self):
+        """初始化数据库"""
+        with self._get_connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS lexical_collections (
+                    collection TEXT PRIMARY KEY,
+                    doc_count INTEGER NOT NULL,
+                    total_length INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS lexical_docs (
+                    collection TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (collection, doc_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS lexical_postings (
+                    collection TEXT NOT NULL,
+                    term TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (collection, term, doc_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_lexical_postings_doc ON lexical_postings(collection, doc_id);
+            """)
+            conn.commit()
+
+        logger.info(f"Lexical index initialized at {self.db_path}")
+
+    @contextmanager
+    def _get_connection(self):
+        """获取数据库连接"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _remove(self, conn: sqlite3.Connection, collection: str, doc_ids: List[str]) -> Tuple[int, int]:
+        """删除文档的倒排项，返回 (删除的文档数, 删除的总词数)"""
+        removed, removed_length = 0, 0
+        for doc_id in doc_ids:
+            row = conn.execute(
+                "SELECT length FROM lexical_docs WHERE collection = ? AND doc_id = ?", (collection, doc_id)
+            ).fetchone()
+            if row is None:
+                continue
+            conn.execute("DELETE FROM lexical_postings WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+            conn.execute("DELETE FROM lexical_docs WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+            removed += 1
+            removed_length += row[0]
+        return removed, removed_length
+
+    def add(self, collection: str, doc_ids: List[str], documents: List[str]):
+        """索引文档（已存在的同 ID 文档先移除）"""
+        latest = dict(zip(doc_ids, documents))  # 同一批中重复的 ID 以最后一个为准
+        with self._lock, self._get_connection() as conn:
+            removed, removed_length = self._remove(conn, collection, list(latest))
+            added_length = 0
+            for doc_id, document in latest.items():
+                counts = Counter(tokenize(document or ""))
+                length = sum(counts.values())
+                added_length += length
+                conn.execute(
+                    "INSERT INTO lexical_docs (collection, doc_id, length) VALUES (?, ?, ?)", (collection, doc_id, length)
+                )
+                conn.executemany(
+                    "INSERT INTO lexical_postings (collection, term, doc_id, tf) VALUES (?, ?, ?, ?)",
+                    [(collection, term, doc_id, tf) for term, tf in counts.items()]
+                )
+            conn.execute(
+                """
+                INSERT INTO lexical_collections (collection, doc_count, total_length) VALUES (?, ?, ?)
+                ON CONFLICT(collection) DO UPDATE SET
+                    doc_count = doc_count + excluded.doc_count,
+                    total_length = total_length + excluded.total_length
+                """,
+                (collection, len(latest) - removed, added_length - removed_length)
+            )
+            conn.commit()
+
+    def delete(self, collection: str, doc_ids: List[str]):
+        """从索引中移除文档"""
+        with self._lock, self._get_connection() as conn:
+            removed, removed_length = self._remove(conn, collection, doc_ids)
+            conn.execute(
+                "UPDATE lexical_collections SET doc_count = doc_count - ?, total_length = total_length - ? WHERE collection = ?",
+                (removed, removed_length, collection)
+            )
+            conn.commit()
+
+    def create(self, collection: str):
+        """为新集合建立空索引（之后的写入增量更新）"""
+        with self._lock, self._get_connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO lexical_collections (collection, doc_count, total_length) VALUES (?, 0, 0)",
+                (collection,)
+            )
+            conn.commit()
+
+    def drop(self, collection: str):
+        """删除整个集合的索引"""
+        with self._lock, self._get_connection() as conn:
+            for table in ("lexical_postings", "lexical_docs", "lexical_collections"):
+                conn.execute(f"DELETE FROM {table} WHERE collection = ?", (collection,))
+            conn.commit()
+
+    def document_count(self, collection: str) -> int:
+        """已索引的文档数；集合从未建立索引时返回 -1"""
+        with self._get_connection() as conn:
+            row = conn.execute(
+                "SELECT doc_count FROM lexical_collections WHERE collection = ?", (collection,)
+            ).fetchone()
+        return row[0] if row else -1
+
+    def rebuild(self, collection: str, pages: Iterable[Tuple[List[str], List[str]]]):
+        """用集合中的全部文档重建索引"""
+        self.drop(collection)
+        total = 0
+        for doc_ids, documents in pages:
+            self.add(collection, doc_ids, documents)
+            total += len(doc_ids)
+        if total == 0:
+            # 空集合也记录一行，表示索引已建立
+            self.create(collection)
+        logger.info(f"Rebuilt lexical index of {collection} from {total} documents")
+
+    def search(self, collection: str, query: str, n_results: int = 10) -> List[Tuple[str, float]]:
+        """BM25 top-k，返回 [(文档ID, 分数)]，按分数降序"""
+        terms = Counter(tokenize(query))
+        if not terms:
+            return []
+        with self._get_connection() as conn:
+            row = conn.execute(
+                "SELECT doc_count, total_length FROM lexical_collections WHERE collection = ?", (collection,)
+            ).fetchone()
+            if row is None or row[0] <= 0:
+                return []
+            doc_count, total_length = row
+            average_length = total_length / doc_count if doc_count else 0.0
+
+            scores: Dict[str, float] = {}
+            postings_by_term = {
+                term: conn.execute(
+                    """
+                    SELECT p.doc_id, p.tf, d.length FROM lexical_postings p
+                    JOIN lexical_docs d ON d.collection = p.collection AND d.doc_id = p.doc_id
+                    WHERE p.collection = ? AND p.term = ?
+                    """,
+                    (collection, term)
+                ).fetchall()
+                for term in terms
+            }
+
+        for term, query_tf in terms.items():
+            postings = postings_by_term[term]
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf, length in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (average_length or 1))
+                scores[doc_id] = scores.get(doc_id, 0.0) + query_tf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return top[:n_results]
@@ -0,0 +1,142 @@
+"""
+元数据倒排索引（供 SimpleVectorDB 使用）
+每个元数据键维护 值 -> 行号列表（uint32，只追加），查询时展开为行号位图；
+数值和字符串（ISO 时间戳）另外维护有序的去重值列表，范围条件用二分查找定位
+
+删除的行不从列表中移除，求值结果总是和集合的有效行位图相与；
+元数据被更新时才把旧值列表中的行去掉
+"""
+import bisect
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+COMPARISON_OPERATORS = ("$gt", "$gte", "$lt", "$lte")
+
+
+class InvalidFilterError(ValueError):
+    """无法解析的过滤条件"""
+    pass
+
+
+def _value_key(value: Any) -> Optional[Tuple[str, Any]]:
+    """值 -> (类别, 值)；True 和 1 分属不同类别，不可索引的值返回 None"""
+    if isinstance(value, bool):
+        return ("bool", value)
+    if isinstance(value, (int, float)):
+        return ("number", value)
+    if isinstance(value, str):
+        return ("string", value)
+    return None
+
+
+class MetadataIndex:
+    """元数据倒排索引和有序索引"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[Tuple[str, Any], array]] = {}
+        self.key_rows: Dict[str, array] = {}  # 键 -> 含有该键的行
+        self.sorted_values: Dict[Tuple[str, str], List[Any]] = {}  # (键, 类别) -> 有序去重值
+
+    def add(self, row: int, metadata: Dict[str, Any]):
+        """索引一行的元数据"""
+        for key, value in metadata.items():
+            value_key = _value_key(value)
+            if value_key is None:
+                continue
+            self.key_rows.setdefault(key, array("I")).append(row)
+            values = self.postings.setdefault(key, {})
+            if value_key not in values:
+                values[value_key] = array("I")
+                if value_key[0] in ("number", "string"):
+                    bisect.insort(self.sorted_values.setdefault((key, value_key[0]), []), value)
+            values[value_key].append(row)
+
+    def remove(self, row: int, metadata: Dict[str, Any]):
+        """从旧值的行列表中去掉一行（元数据更新时使用）"""
+        for key, value in metadata.items():
+            value_key = _value_key(value)
+            if value_key is None or key not in self.postings:
+                continue
+            for lists, list_key in ((self.postings[key], value_key), (self.key_rows, key)):
+                if list_key in lists:
+                    rows = np.frombuffer(lists[list_key], dtype=np.uint32)
+                    lists[list_key] = array("I", rows[rows != row].tobytes())
+
+    # ------------------------------------------------------------------
+    # 求值
+    # ------------------------------------------------------------------
+
+    def _bitmap(self, row_lists: List[array], size: int) -> np.ndarray:
+        bitmap = np.zeros(size, dtype=bool)
+        for rows in row_lists:
+            if len(rows):
+                bitmap[np.frombuffer(rows, dtype=np.uint32)] = True
+        return bitmap
+
+    def _values_bitmap(self, key: str, values: List[Any], size: int) -> np.ndarray:
+        postings = self.postings.get(key, {})
+        keys = [_value_key(value) for value in values]
+        return self._bitmap([postings[k] for k in keys if k is not None and k in postings], size)
+
+    def _range_bitmap(self, key: str, operator: str, operand: Any, size: int) -> np.ndarray:
+        operand_key = _value_key(operand)
+        if operand_key is None or operand_key[0] == "bool":
+            raise InvalidFilterError(f"{operator} requires a number or string operand, got {operand!r}")
+        kind = operand_key[0]
+        values = self.sorted_values.get((key, kind), [])
+        if operator == "$gt":
+            selected = values[bisect.bisect_right(values, operand):]
+        elif operator == "$gte":
+            selected = values[bisect.bisect_left(values, operand):]
+        elif operator == "$lt":
+            selected = values[:bisect.bisect_left(values, operand)]
+        else:
+            selected = values[:bisect.bisect_right(values, operand)]
+        postings = self.postings.get(key, {})
+        return self._bitmap([postings[(kind, value)] for value in selected], size)
+
+    def _field_bitmap(self, key: str, condition: Any, size: int) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        result = np.ones(size, dtype=bool)
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                result &= self._values_bitmap(key, [operand], size)
+            elif operator == "$in":
+                result &= self._values_bitmap(key, list(operand), size)
+            elif operator in ("$ne", "$nin"):
+                excluded = [operand] if operator == "$ne" else list(operand)
+                result &= self._bitmap([self.key_rows.get(key, array("I"))], size)
+                result &= ~self._values_bitmap(key, excluded, size)
+            elif operator in COMPARISON_OPERATORS:
+                result &= self._range_bitmap(key, operator, operand, size)
+            else:
+                raise InvalidFilterError(f"Unsupported filter operator {operator}")
+        return result
+
+    def evaluate(self, where: Dict[str, Any], size: int) -> np.ndarray:
+        """求值 Chroma 风格的 where 条件，返回长度为 size 的行位图（未与有效行相与）"""
+        result = np.ones(size, dtype=bool)
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                if not isinstance(condition, list) or not condition:
+                    raise InvalidFilterError(f"{key} requires a non-empty list of conditions")
+                parts = [self.evaluate(part, size) for part in condition]
+                combined = np.logical_and.reduce(parts) if key == "$and" else np.logical_or.reduce(parts)
+                result &= combined
+            elif key.startswith("$"):
+                raise InvalidFilterError(f"Unsupported filter operator {key}")
+            else:
+                result &= self._field_bitmap(key, condition, size)
+        return result
+
+    def value_counts(self, key: str, alive: np.ndarray) -> Dict[Any, int]:
+        """某个键每个取值的有效行数"""
+        counts = {}
+        for (_, value), rows in self.postings.get(key, {}).items():
+            count = int(alive[np.frombuffer(rows, dtype=np.uint32)].sum()) if len(rows) else 0
+            if count:
+                counts[value] = count
+        return counts
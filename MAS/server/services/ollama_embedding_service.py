@@ -1,92 +1,325 @@
+import asyncio
 import logging
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
 import requests
+from requests.adapters import HTTPAdapter
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
 from server.services.embedding_manager import BaseEmbeddingService
 
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """当前线程正在运行的事件循环，没有则返回 None"""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+async def _aclose_quietly(client):
+    """关闭 httpx 客户端，失败只记录日志"""
+    try:
+        await client.aclose()
+    except Exception as e:
+        logger.debug(f"Failed to close async Ollama client: {e}")
+
+
+async def _close_on_loop_shutdown(client):
+    """
+    关闭钩子：启动后挂起的异步生成器，事件循环关闭前 shutdown_asyncgens 会结束它，
+    此时在仍然可用的循环上关闭客户端（asyncio.run 和 uvicorn 都会调用 shutdown_asyncgens）
+    """
+    try:
+        yield
+    finally:
+        await _aclose_quietly(client)
+
+
 class OllamaEmbeddingService(BaseEmbeddingService):
-    """使用 Ollama 的嵌入服务"""
-    
-    def __init__(self, base_url: str = "http://localhost:11434", model_name: str = "nomic-embed-text:latest"):
+    """使用 Ollama 的嵌入服务
+
+    - 使用保持连接的连接池，避免每个文本都新建 TCP 连接
+    - 优先使用批量接口 /api/embed（input 数组），旧版 Ollama 回退到逐条的 /api/embeddings
+    - 限制同时进行中的请求数
+    - 提供同步和异步两套接口
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:11434",
+        model_name: str = "nomic-embed-text:latest",
+        max_concurrency: int = 4,
+        request_batch_size: int = 64,
+        timeout: float = 30
+    ):
         """
         初始化 Ollama 嵌入服务
+        max_concurrency: 同时进行中的请求数上限（同时也是连接池大小）
+        request_batch_size: 批量接口单次请求包含的最大文本数
         """
-        self.base_url = base_url
+        self.base_url = base_url.rstrip("/")
         self.model_name = model_name
         self.embedding_dim = None
-        
+        self.max_concurrency = max(1, max_concurrency)
+        self.request_batch_size = max(1, request_batch_size)
+        self.timeout = timeout
+
+        # None 表示尚未探测批量接口是否可用
+        self._batch_endpoint_supported: Optional[bool] = None
+
+        # 同步接口：保持连接的会话 + 有界线程池
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="ollama-embed"
+        )
+
+        # 异步接口：按事件循环创建的 httpx 客户端
+        self._async_client = None
+        self._async_loop = None
+        self._async_semaphore: Optional[asyncio.Semaphore] = None
+        self._async_lock = threading.Lock()
+        self._shutdown_hook = None  # 当前客户端的关闭钩子（事件循环只保存弱引用）
+        self._closing_tasks = set()  # 正在关闭客户端的任务（保持引用，避免被回收）
+
         # 测试连接并获取嵌入维度
         self._test_embedding()
-    
+
     def _test_embedding(self):
         """测试嵌入功能并获取维度"""
         try:
             test_embedding = self.embed_text("test")
             self.embedding_dim = len(test_embedding)
-            logger.info(f"Ollama embedding service initialized with model: {self.model_name}")
+            logger.info(f"Ollama embedding service initialized with model: {self.model_id}")
             logger.info(f"Embedding dimension: {self.embedding_dim}")
+            logger.info(f"Batch /api/embed endpoint: {'available' if self._batch_endpoint_supported else 'unavailable'}")
         except Exception as e:
             logger.error(f"Failed to initialize Ollama embedding service: {e}")
             raise
-    
+
+    @property
+    def model_id(self) -> str:
+        """
+        向量的模型标识：批量接口返回 L2 归一化的向量，逐条接口返回原始向量，两者不可混用，
+        归一化的加上 @l2 后缀，使集合标记和嵌入缓存键不同（已有的原始向量集合会被迁移重新嵌入）
+        """
+        return f"{self.model_name}@l2" if self._batch_endpoint_supported else self.model_name
+
+    # ========== 同步接口 ==========
+
     def embed_text(self, text: str) -> List[float]:
         """使用 Ollama 生成文本嵌入"""
         try:
-            response = requests.post(
-                f"{self.base_url}/api/embeddings",
-                json={
-                    "model": self.model_name,
-                    "prompt": text
-                },
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Ollama embedding failed: {response.text}")
-            
-            data = response.json()
-            embedding = data.get("embedding", [])
-            
-            if not embedding:
-                raise Exception("No embedding returned from Ollama")
-            
-            return embedding
-            
+            return self._embed_request(self._session_post, [text])[0]
         except Exception as e:
             logger.error(f"Failed to generate embedding: {e}")
             raise
-    
+
     def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
-        """批量生成文本嵌入"""
-        embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            for text in batch:
-                embedding = self.embed_text(text)
-                embeddings.append(embedding)
+        """批量生成文本嵌入，多个请求并发执行（受 max_concurrency 限制）"""
+        if not texts:
+            return []
+
+        if self._batch_endpoint_supported is None:
+            # 先用第一批探测批量接口，避免并发请求同时探测
+            first = self._embed_request(self._session_post, texts[:self._group_size(batch_size)])
+            rest = texts[len(first):]
+            return first + (self.embed_texts(rest, batch_size) if rest else [])
+
+        groups = self._split_groups(texts, batch_size)
+        results = self._executor.map(lambda group: self._embed_request(self._session_post, group), groups)
+
+        embeddings: List[List[float]] = []
+        for group_embeddings in results:
+            embeddings.extend(group_embeddings)
+        return embeddings
+
+    def _session_post(self, path: str, payload: Dict[str, Any]):
+        """通过连接池发送请求，返回 (状态码, JSON 或文本)"""
+        response = self._session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        if response.status_code == 200:
+            return response.status_code, response.json()
+        return response.status_code, response.text
+
+    # ========== 异步接口 ==========
+
+    async def aembed_text(self, text: str) -> List[float]:
+        """异步生成单个文本嵌入"""
+        return (await self.aembed_texts([text]))[0]
+
+    async def aembed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """异步批量生成文本嵌入，并发请求数受 max_concurrency 限制"""
+        if not texts:
+            return []
+
+        client, semaphore = self._get_async_client()
+
+        async def post(path: str, payload: Dict[str, Any]):
+            async with semaphore:
+                response = await client.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+            if response.status_code == 200:
+                return response.status_code, response.json()
+            return response.status_code, response.text
+
+        if self._batch_endpoint_supported is None:
+            first = await self._aembed_request(post, texts[:self._group_size(batch_size)])
+            rest = texts[len(first):]
+            return first + (await self.aembed_texts(rest, batch_size) if rest else [])
+
+        groups = self._split_groups(texts, batch_size)
+        results = await asyncio.gather(*(self._aembed_request(post, group) for group in groups))
+
+        embeddings: List[List[float]] = []
+        for group_embeddings in results:
+            embeddings.extend(group_embeddings)
         return embeddings
-    
+
+    def _get_async_client(self):
+        """获取当前事件循环对应的 httpx 客户端和并发信号量"""
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            if self._async_client is None or self._async_loop is not loop:
+                if self._async_client is not None:
+                    # 事件循环变了，关闭上一个客户端，释放它保持的连接
+                    self._close_async_client(self._async_client, self._async_loop)
+                self._async_client = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency,
+                        max_keepalive_connections=self.max_concurrency
+                    )
+                )
+                self._async_loop = loop
+                self._async_semaphore = asyncio.Semaphore(self.max_concurrency)
+                # 连接绑定在这个事件循环上，循环关闭后就无法再关闭，因此在循环关闭前（shutdown_asyncgens）关闭客户端
+                self._shutdown_hook = _close_on_loop_shutdown(self._async_client)
+                loop.create_task(self._shutdown_hook.asend(None))
+            return self._async_client, self._async_semaphore
+
+    def _close_async_client(self, client, loop):
+        """在客户端所属的事件循环上关闭它；所属循环已经关闭时客户端已由关闭钩子关闭"""
+        if client.is_closed or loop is None or loop.is_closed():
+            return
+        try:
+            if not loop.is_running():
+                loop.run_until_complete(_aclose_quietly(client))
+            elif _running_loop() is loop:
+                task = loop.create_task(_aclose_quietly(client))
+                self._closing_tasks.add(task)
+                task.add_done_callback(self._closing_tasks.discard)
+            else:
+                asyncio.run_coroutine_threadsafe(_aclose_quietly(client), loop)
+        except Exception as e:
+            logger.debug(f"Failed to close async Ollama client: {e}")
+
+    # ========== 请求逻辑（同步/异步共用） ==========
+
+    def _group_size(self, batch_size: int) -> int:
+        """单个请求包含的文本数"""
+        return max(1, min(batch_size, self.request_batch_size))
+
+    def _split_groups(self, texts: List[str], batch_size: int) -> List[List[str]]:
+        """按请求拆分文本：批量接口每组多条，逐条接口每组一条"""
+        if self._batch_endpoint_supported:
+            size = self._group_size(batch_size)
+            return [texts[i:i + size] for i in range(0, len(texts), size)]
+        return [[text] for text in texts]
+
+    def _embed_request(self, post, texts: List[str]) -> List[List[float]]:
+        """同步执行一组文本的嵌入请求"""
+        if self._batch_endpoint_supported is not False:
+            status, data = post("/api/embed", {"model": self.model_name, "input": texts})
+            embeddings = self._handle_batch_response(status, data, len(texts))
+            if embeddings is not None:
+                return embeddings
+
+        results = []
+        for text in texts:
+            status, data = post("/api/embeddings", {"model": self.model_name, "prompt": text})
+            results.append(self._handle_single_response(status, data))
+        return results
+
+    async def _aembed_request(self, post, texts: List[str]) -> List[List[float]]:
+        """异步执行一组文本的嵌入请求"""
+        if self._batch_endpoint_supported is not False:
+            status, data = await post("/api/embed", {"model": self.model_name, "input": texts})
+            embeddings = self._handle_batch_response(status, data, len(texts))
+            if embeddings is not None:
+                return embeddings
+
+        results = await asyncio.gather(*(
+            post("/api/embeddings", {"model": self.model_name, "prompt": text}) for text in texts
+        ))
+        return [self._handle_single_response(status, data) for status, data in results]
+
+    def _handle_batch_response(self, status: int, data: Any, expected: int) -> Optional[List[List[float]]]:
+        """解析批量接口响应；接口不存在时返回 None 以回退到逐条接口"""
+        if status == 404 and self._batch_endpoint_supported is None and "model" not in str(data).lower():
+            # 旧版 Ollama 没有 /api/embed（模型不存在时同样返回 404，但响应中会提到 model）
+            logger.info("Ollama /api/embed not available, falling back to /api/embeddings")
+            self._batch_endpoint_supported = False
+            return None
+
+        if status != 200:
+            raise Exception(f"Ollama embedding failed: {data}")
+
+        embeddings = data.get("embeddings", [])
+        if len(embeddings) != expected or not all(embeddings):
+            raise Exception("No embedding returned from Ollama")
+
+        self._batch_endpoint_supported = True
+        return embeddings
+
+    def _handle_single_response(self, status: int, data: Any) -> List[float]:
+        """解析逐条接口响应（原样返回未归一化的向量，与已有集合中旧版 Ollama 写入的向量保持一致）"""
+        if status != 200:
+            raise Exception(f"Ollama embedding failed: {data}")
+
+        embedding = data.get("embedding", [])
+        if not embedding:
+            raise Exception("No embedding returned from Ollama")
+        return embedding
+
+    # ========== 其他 ==========
+
     def compute_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
         """计算余弦相似度"""
         vec1 = np.array(embedding1)
         vec2 = np.array(embedding2)
-        
+
         dot_product = np.dot(vec1, vec2)
         norm1 = np.linalg.norm(vec1)
         norm2 = np.linalg.norm(vec2)
-        
+
         if norm1 == 0 or norm2 == 0:
             return 0.0
-        
+
         return float(dot_product / (norm1 * norm2))
-    
+
     def get_model_info(self) -> Dict[str, Any]:
         """获取模型信息"""
         return {
-            "model_name": self.model_name,
+            "model_name": self.model_id,
             "embedding_dimension": self.embedding_dim,
-            "provider": "ollama"
-        }
\ No newline at end of file
+            "provider": "ollama",
+            "batch_endpoint": self._batch_endpoint_supported,
+            "max_concurrency": self.max_concurrency,
+            "normalized": self._batch_endpoint_supported is True  # 只有批量接口返回归一化的向量
+        }
+
+    def close(self):
+        """关闭连接池和线程池"""
+        self._executor.shutdown(wait=False)
+        self._session.close()
+        with self._async_lock:
+            if self._async_client is not None:
+                self._close_async_client(self._async_client, self._async_loop)
+            self._async_client = None
+            self._async_loop = None
@@ -0,0 +1,223 @@
+"""
+ONNX Runtime 嵌入服务
+导出（或加载已导出的）sentence-transformers 模型的 ONNX 版本，可选动态 int8 量化，
+推理时只依赖 onnxruntime、tokenizers 和 numpy，分词和池化在 NumPy 中批量完成
+"""
+import json
+import logging
+import os
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from server.services.embedding_manager import BaseEmbeddingService
+
+logger = logging.getLogger(__name__)
+
+# 导出的 ONNX 模型存放目录
+DEFAULT_ONNX_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "models", "onnx")
+
+
+def export_onnx_model(model_name: str, output_dir: str, opset: int = 14) -> Dict[str, Any]:
+    """
+    把 sentence-transformers 模型导出为 ONNX（需要 torch 和 sentence-transformers）
+
+    Returns:
+        池化配置（池化方式、是否归一化、最大序列长度、维度）
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Pooling, Normalize
+
+    cache_dir = os.path.join(os.path.dirname(__file__), "..", "..", "models", "embeddings")
+    st_model = SentenceTransformer(model_name, cache_folder=cache_dir, device='cpu')
+    transformer = st_model[0].auto_model
+    tokenizer = st_model.tokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 读取池化和归一化配置，保证与 PyTorch 模型输出一致
+    pooling_mode = "mean"
+    normalize = False
+    for module in st_model:
+        if isinstance(module, Pooling):
+            if module.pooling_mode_cls_token:
+                pooling_mode = "cls"
+            elif module.pooling_mode_max_tokens:
+                pooling_mode = "max"
+        elif isinstance(module, Normalize):
+            normalize = True
+
+    config = {
+        "model_name": model_name,
+        "pooling": pooling_mode,
+        "normalize": normalize,
+        "max_seq_length": int(st_model.max_seq_length),
+        "embedding_dimension": int(st_model.get_sentence_embedding_dimension())
+    }
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    transformer.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            os.path.join(output_dir, "model.onnx"),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True
+        )
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, "embedding_config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    logger.info(f"Exported {model_name} to ONNX at {output_dir}")
+    return config
+
+
+def quantize_onnx_model(model_path: str, output_path: str):
+    """对 ONNX 模型做动态 int8 量化"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8)
+    logger.info(f"Quantized ONNX model written to {output_path}")
+
+
+class OnnxEmbeddingService(BaseEmbeddingService):
+    """基于 ONNX Runtime 的嵌入服务"""
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        quantize: bool = True,
+        model_dir: Optional[str] = None,
+        intra_op_threads: Optional[int] = None
+    ):
+        """
+        model_name: sentence-transformers 模型名称
+        quantize: 是否使用动态 int8 量化后的模型
+        model_dir: ONNX 模型目录，默认 models/onnx/<model_name>
+        intra_op_threads: ONNX Runtime 算子内线程数，None 时使用默认值
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.quantized = quantize
+        # 量化模型的向量与 fp32 不同：报告的模型名带上量化方式，嵌入缓存和集合标记不会混用两者
+        self.model_id = f"{model_name}@int8" if quantize else model_name
+        self.model_dir = model_dir or os.path.join(DEFAULT_ONNX_DIR, model_name.replace("/", "__"))
+
+        fp32_path = os.path.join(self.model_dir, "model.onnx")
+        int8_path = os.path.join(self.model_dir, "model.int8.onnx")
+        config_path = os.path.join(self.model_dir, "embedding_config.json")
+
+        # 没有导出过时先导出（只在首次需要 torch）
+        if not os.path.exists(fp32_path) or not os.path.exists(config_path):
+            logger.info(f"No ONNX export found for {model_name}, exporting...")
+            export_onnx_model(model_name, self.model_dir)
+
+        if quantize and not os.path.exists(int8_path):
+            quantize_onnx_model(fp32_path, int8_path)
+
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        self.max_seq_length = self.config["max_seq_length"]
+        self.embedding_dim = self.config["embedding_dimension"]
+        self.pooling = self.config.get("pooling", "mean")
+        self.normalize = self.config.get("normalize", False)
+
+        # 分词器：截断到模型最大长度，批内按最长样本补齐
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        pad_id = self.tokenizer.token_to_id("[PAD]")
+        if pad_id is None:
+            pad_id = self.tokenizer.token_to_id("<pad>") or 0
+        pad_token = self.tokenizer.id_to_token(pad_id)
+        self.tokenizer.enable_padding(pad_id=pad_id, pad_token=pad_token)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+
+        model_path = int8_path if quantize else fp32_path
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+        logger.info(
+            f"ONNX embedding model loaded: {self.model_id}, "
+            f"dimension: {self.embedding_dim}"
+        )
+
+    def embed_text(self, text: str) -> List[float]:
+        """将单个文本转换为向量"""
+        return self.embed_texts_array([text])[0].tolist()
+
+    def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """批量将文本转换为向量"""
+        return self.embed_texts_array(texts, batch_size).tolist()
+
+    def embed_texts_array(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """批量编码并返回 float32 数组"""
+        if not texts:
+            return np.zeros((0, self.embedding_dim), dtype=np.float32)
+
+        try:
+            # 按长度排序后分批，减少补齐带来的浪费，最后恢复原顺序
+            order = np.argsort([len(text) for text in texts], kind="stable")
+            output = np.empty((len(texts), self.embedding_dim), dtype=np.float32)
+
+            for start in range(0, len(texts), batch_size):
+                indices = order[start:start + batch_size]
+                output[indices] = self._encode_batch([texts[i] for i in indices])
+
+            return output
+        except Exception as e:
+            logger.error(f"Failed to embed texts with ONNX: {e}")
+            raise
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """分词、推理并池化一个批次"""
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        feed = {name: value for name, value in feed.items() if name in self.input_names}
+
+        hidden = self.session.run(None, feed)[0]
+
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        elif self.pooling == "max":
+            masked = np.where(attention_mask[:, :, None] > 0, hidden, -1e9)
+            pooled = masked.max(axis=1)
+        else:
+            mask = attention_mask[:, :, None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+        return pooled.astype(np.float32, copy=False)
+
+    def get_model_info(self) -> Dict[str, Any]:
+        """获取模型信息"""
+        return {
+            "model_name": self.model_id,
+            "embedding_dimension": self.embedding_dim,
+            "max_sequence_length": self.max_seq_length,
+            "provider": "onnxruntime",
+            "quantization": "int8-dynamic" if self.quantized else None
+        }
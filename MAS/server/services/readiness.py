@@ -0,0 +1,153 @@
+"""
+服务就绪状态跟踪
+启动时各组件在后台并行加载，这里记录每个组件的状态和耗时，
+并按能力（chat、embeddings、knowledge）判断请求是否可以被处理
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class ServiceNotReadyError(Exception):
+    """请求的能力尚未就绪（仍在加载或加载失败）"""
+
+    def __init__(self, capability: str, state: str, components: Dict[str, Dict[str, Any]]):
+        self.capability = capability
+        self.state = state
+        self.components = components
+        super().__init__(f"Capability '{capability}' is {state}")
+
+
+class ComponentStatus:
+    """单个组件的加载状态"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state: str = PENDING
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.detail: Dict[str, Any] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        duration = None
+        if self.started_at is not None:
+            end = self.finished_at if self.finished_at is not None else time.perf_counter()
+            duration = round((end - self.started_at) * 1000, 1)
+        return {
+            "state": self.state,
+            "duration_ms": duration,
+            "error": self.error,
+            **self.detail
+        }
+
+
+class ReadinessTracker:
+    """组件就绪状态跟踪器（线程安全，加载函数在线程池中调用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components: Dict[str, ComponentStatus] = {}
+        self._capabilities: Dict[str, List[str]] = {}
+        self._created_at = time.perf_counter()
+        self.started_at = datetime.now()
+
+    def define_capability(self, capability: str, components: List[str]):
+        """定义能力依赖的组件，所有组件就绪后该能力才就绪"""
+        with self._lock:
+            self._capabilities[capability] = list(components)
+            for name in components:
+                self._components.setdefault(name, ComponentStatus(name))
+
+    def start(self, component: str):
+        """标记组件开始加载"""
+        with self._lock:
+            status = self._components.setdefault(component, ComponentStatus(component))
+            status.state = LOADING
+            status.started_at = time.perf_counter()
+            status.finished_at = None
+            status.error = None
+
+    def mark_ready(self, component: str, **detail):
+        """标记组件加载完成"""
+        with self._lock:
+            status = self._components.setdefault(component, ComponentStatus(component))
+            status.state = READY
+            status.finished_at = time.perf_counter()
+            status.detail.update(detail)
+        logger.info(f"Component ready: {component} ({status.to_dict()['duration_ms']} ms)")
+
+    def mark_failed(self, component: str, error: str):
+        """标记组件加载失败"""
+        with self._lock:
+            status = self._components.setdefault(component, ComponentStatus(component))
+            status.state = FAILED
+            status.finished_at = time.perf_counter()
+            status.error = error
+        logger.warning(f"Component failed: {component}: {error}")
+
+    @contextmanager
+    def track(self, component: str):
+        """在 with 块中加载组件：正常结束标记就绪，抛出异常标记失败（异常继续向上抛出）"""
+        self.start(component)
+        try:
+            yield
+        except Exception as e:
+            self.mark_failed(component, str(e))
+            raise
+        self.mark_ready(component)
+
+    def capability_state(self, capability: str) -> str:
+        """能力的整体状态：任一组件失败为 failed，全部就绪为 ready，否则为 loading/pending"""
+        with self._lock:
+            states = [self._components[name].state for name in self._capabilities.get(capability, [])]
+        if not states:
+            return READY
+        if FAILED in states:
+            return FAILED
+        if all(state == READY for state in states):
+            return READY
+        return LOADING if LOADING in states or READY in states else PENDING
+
+    def is_ready(self, capability: str) -> bool:
+        """能力是否就绪"""
+        return self.capability_state(capability) == READY
+
+    def require(self, capability: str):
+        """能力未就绪时抛出 ServiceNotReadyError"""
+        state = self.capability_state(capability)
+        if state != READY:
+            with self._lock:
+                components = {
+                    name: self._components[name].to_dict()
+                    for name in self._capabilities.get(capability, [])
+                }
+            raise ServiceNotReadyError(capability, state, components)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """所有组件和能力的状态，用于 /api/system/ready"""
+        capabilities = {capability: self.capability_state(capability) for capability in list(self._capabilities)}
+        with self._lock:
+            components = {name: status.to_dict() for name, status in self._components.items()}
+        return {
+            "ready": all(state == READY for state in capabilities.values()),
+            "loading": any(state in (PENDING, LOADING) for state in capabilities.values()),
+            "started_at": self.started_at.isoformat(),
+            "uptime_ms": round((time.perf_counter() - self._created_at) * 1000, 1),
+            "capabilities": capabilities,
+            "components": components
+        }
+
+
+# 全局实例
+readiness = ReadinessTracker()
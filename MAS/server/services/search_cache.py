@@ -0,0 +1,170 @@
+"""
+搜索结果缓存
+键为 (知识库ID, 写入代数, 查询, 结果数, 过滤条件, 检索模式)：查询为文本时取归一化文本的 sha256
+（连同嵌入服务名，命中时连嵌入也省掉），为向量时取 float32 字节的 sha256。
+知识库每次写入后代数加一，旧代数的条目不再可能被查到，无需显式失效，随 LRU 淘汰
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple, Union
+
+import numpy as np
+
+from server.services.embedding_cache import text_digest
+from server.services.embedding_dispatcher import embed_query
+from server.services.hybrid_search import hybrid_search
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 2048  # 缓存的最大条目数
+MAX_BYTES = 64 * 1024 * 1024  # 缓存结果估计占用内存的上限
+ENTRY_OVERHEAD = 512  # 每个条目（键、字典）的估计固定开销
+
+CacheKey = Tuple[Hashable, ...]
+
+
+def query_key(query: Union[str, np.ndarray, list], service_name: Optional[str] = None) -> str:
+    """查询文本（归一化后）或查询向量的摘要"""
+    if isinstance(query, str):
+        return f"text:{service_name or ''}:{text_digest(query)}"
+    vector = np.ascontiguousarray(query, dtype=np.float32)
+    return f"vector:{hashlib.sha256(vector.tobytes()).hexdigest()}"
+
+
+def estimate_bytes(results: Dict[str, Any]) -> int:
+    """结果的估计内存占用（文档文本和元数据按序列化长度计）"""
+    size = ENTRY_OVERHEAD
+    for result in results.get("results", []):
+        size += ENTRY_OVERHEAD + len(result.get("document") or "") * 2
+        size += len(json.dumps(result.get("metadata") or {}, ensure_ascii=False, default=str))
+    return size
+
+
+class SearchResultCache:
+    """按条目数和估计字节数限制大小的 LRU 结果缓存"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        """
+        max_entries: 最大条目数
+        max_bytes: 缓存结果估计占用内存的上限（单个结果超过它时不缓存）
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    @staticmethod
+    def key(
+        kb_id: str,
+        generation: int,
+        query: Union[str, np.ndarray, list],
+        limit: int,
+        filter: Optional[Dict[str, Any]] = None,
+        mode: str = "dense",
+        service_name: Optional[str] = None
+    ) -> CacheKey:
+        """缓存键；过滤条件按排序后的 JSON 比较"""
+        filter_key = json.dumps(filter, sort_keys=True, default=str) if filter else ""
+        return (kb_id, generation, query_key(query, service_name), limit, filter_key, mode)
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        """查找缓存，未命中返回 None；返回的结果与其他请求共享，调用方不能修改"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: CacheKey, results: Dict[str, Any]):
+        """写入结果，超出条目数或字节数上限时淘汰最久未使用的条目"""
+        size = estimate_bytes(results)
+        with self._lock:
+            if size > self.max_bytes:
+                self.rejected += 1
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (results, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存（统计保留）"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "rejected": self.rejected
+            }
+
+
+async def search_collection(
+    services,
+    kb_id: str,
+    query: str,
+    n_results: int,
+    filter: Optional[Dict[str, Any]] = None,
+    mode: str = "dense",
+    service_name: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    嵌入查询并在知识库中检索（dense / hybrid / lexical），结果经过 services.search_cache 缓存
+    写入代数在检索之前读取：检索期间发生的写入使代数增加，这次的结果只会存在旧代数下
+    """
+    cache: Optional[SearchResultCache] = getattr(services, "search_cache", None)
+    vector_db = services.vector_db_service
+    key = None
+    if cache is not None:
+        key = cache.key(kb_id, vector_db.write_generation(kb_id), query, n_results, filter, mode, service_name)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    query_embedding = None
+    if mode != "lexical":
+        query_embedding = await embed_query(services, query, service_name)
+    if mode == "dense":
+        results = vector_db.search(
+            collection_name=kb_id,
+            query_embedding=query_embedding,
+            n_results=n_results,
+            filter=filter
+        )
+    else:
+        results = await hybrid_search(
+            vector_db, kb_id, query, query_embedding, n_results=n_results, filter=filter, mode=mode
+        )
+
+    if key is not None:
+        cache.put(key, results)
+    return results
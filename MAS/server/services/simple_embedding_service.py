@@ -1,51 +1,266 @@
 """
 简单的嵌入服务实现
-用于测试和备用
+基于特征哈希（hashing trick）的词法嵌入，不依赖任何模型，用于离线/边缘节点的备用服务和测试。
+整批文本拼接为一个码点数组，词、词二元组和字符 n-gram 的哈希、分桶和累加全部用 NumPy 数组运算完成
 """
 import logging
-import hashlib
-from typing import List, Dict, Any
+import unicodedata
+import zlib
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
 from server.services.embedding_manager import BaseEmbeddingService
 
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = "hashing-ngram-v1"
+
+# 多项式滚动哈希的底数（奇数，模 2^64 可逆）
+_BASE = 0x100000001B3
+_BASE_INV = pow(_BASE, -1, 2 ** 64)
+
+# 各类特征的盐值，避免相同字符序列在不同特征类别中落入同一个桶
+_WORD_SALT = np.uint64(0x27D4EB2F165667C5)
+_BIGRAM_SALT = np.uint64(0xC2B2AE3D27D4EB4F)
+_CHAR_SALT = np.uint64(0x165667B19E3779F9)
+
+# 一次向量化处理的最大文本数，限制中间数组的内存
+_MAX_BLOCK_TEXTS = 2048
+
+# 常驻的幂表最多保留的项数（两张表共 1 MB）；更长的文本块每次临时计算
+_MAX_CACHED_POWERS = 1 << 16
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    """乘以 64 位黄金分割常数（Fibonacci 哈希），把多项式哈希的熵扩散到高位"""
+    return h * np.uint64(0x9E3779B97F4A7C15)
+
+
+def _cjk_mask(cp: np.ndarray) -> np.ndarray:
+    """中日韩表意文字、假名和谚文音节：每个字单独作为一个词"""
+    return (
+        ((cp >= 0x3400) & (cp <= 0x9FFF)) |
+        ((cp >= 0xF900) & (cp <= 0xFAFF)) |
+        ((cp >= 0x3040) & (cp <= 0x30FF)) |
+        ((cp >= 0xAC00) & (cp <= 0xD7AF))
+    )
+
+
+def _word_char_mask(cp: np.ndarray, cjk: np.ndarray) -> np.ndarray:
+    """组成（非 CJK）词的字符：ASCII 数字字母以及其他非标点的非 ASCII 字符"""
+    ascii_alnum = ((cp >= 48) & (cp <= 57)) | ((cp >= 97) & (cp <= 122))
+    punctuation = (
+        ((cp >= 0x2000) & (cp <= 0x206F)) |
+        ((cp >= 0x3000) & (cp <= 0x303F)) |
+        ((cp >= 0xFF5F) & (cp <= 0xFF65)) |
+        (cp == 0xD7) | (cp == 0xF7)
+    )
+    return ascii_alnum | ((cp >= 0xC0) & ~cjk & ~punctuation)
+
+
 class SimpleEmbeddingService(BaseEmbeddingService):
-    """简单的嵌入服务（用于测试）"""
-    
-    def __init__(self):
-        self.dimension = 384  # 模拟的嵌入维度
-        logger.info("Initialized SimpleEmbeddingService")
-    
+    """特征哈希嵌入服务：词/词二元组/字符 n-gram 带符号分桶，可选 IDF 加权，L2 归一化"""
+
+    def __init__(
+        self,
+        dimension: int = 384,
+        char_ngram_range: Tuple[int, int] = (3, 4),
+        char_weight: float = 0.5,
+        use_bigrams: bool = True,
+        idf_path: Optional[str] = None
+    ):
+        """
+        dimension: 向量维度（哈希桶数）
+        char_ngram_range: 字符 n-gram 的长度范围（闭区间），(0, 0) 表示不使用
+        char_weight: 字符 n-gram 特征相对词特征的权重
+        use_bigrams: 是否加入相邻词二元组特征
+        idf_path: fit_idf 后 save_idf 保存的 IDF 文件（.npy），存在时加载并启用 IDF 加权
+        """
+        self.dimension = dimension
+        self.char_ngram_range = char_ngram_range
+        self.char_weight = char_weight
+        self.use_bigrams = use_bigrams
+        self.idf: Optional[np.ndarray] = None
+        self._power_table: Tuple[np.ndarray, np.ndarray] = (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64))
+
+        if idf_path:
+            try:
+                self.set_idf(np.load(idf_path))
+                logger.info(f"Loaded IDF weights from {idf_path}")
+            except FileNotFoundError:
+                logger.warning(f"IDF file not found: {idf_path}, using raw term frequencies")
+
+        logger.info(f"Initialized SimpleEmbeddingService ({MODEL_NAME}, dimension: {dimension})")
+
     def embed_text(self, text: str) -> List[float]:
-        """生成文本的模拟嵌入向量"""
-        # 使用哈希生成伪随机但可重复的向量
-        hash_obj = hashlib.sha256(text.encode('utf-8'))
-        hash_hex = hash_obj.hexdigest()
-        
-        # 将哈希转换为浮点数向量
-        embedding = []
-        for i in range(0, len(hash_hex), 2):
-            # 取两个十六进制字符转换为0-1之间的浮点数
-            value = int(hash_hex[i:i+2], 16) / 255.0
-            embedding.append(value)
-            
-        # 确保向量长度为指定维度
-        while len(embedding) < self.dimension:
-            embedding.append(0.0)
-        
-        return embedding[:self.dimension]
-    
+        """生成文本的哈希嵌入向量"""
+        return self.embed_texts_array([text])[0].tolist()
+
     def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
-        """批量生成文本的模拟嵌入向量"""
-        embeddings = []
-        for text in texts:
-            embeddings.append(self.embed_text(text))
-        return embeddings
-    
+        """批量生成文本的哈希嵌入向量"""
+        return self.embed_texts_array(texts, batch_size).tolist()
+
+    def embed_texts_array(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """批量嵌入并返回 float32 数组（batch_size 不影响结果，整批向量化处理）"""
+        output = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), _MAX_BLOCK_TEXTS):
+            block = texts[start:start + _MAX_BLOCK_TEXTS]
+            matrix = self._accumulate(self._features(block), len(block))
+
+            if self.idf is not None:
+                matrix *= self.idf
+
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            output[start:start + len(block)] = matrix / np.maximum(norms, 1e-12)
+        return output
+
+    def fit_idf(self, texts: List[str]) -> np.ndarray:
+        """根据语料统计每个哈希桶的文档频率并启用 IDF 加权（与 sklearn 的平滑 IDF 公式一致）"""
+        document_frequency = np.zeros(self.dimension, dtype=np.int64)
+        for start in range(0, len(texts), _MAX_BLOCK_TEXTS):
+            block = texts[start:start + _MAX_BLOCK_TEXTS]
+            keys = [self._signed_keys(docs, mixed) >> 1 for docs, mixed, _ in self._features(block)]
+            if keys:
+                pairs = np.unique(np.concatenate(keys))
+                document_frequency += np.bincount(pairs % self.dimension, minlength=self.dimension)
+
+        idf = np.log((1 + len(texts)) / (1 + document_frequency)) + 1.0
+        self.set_idf(idf)
+        return self.idf
+
+    def set_idf(self, idf: np.ndarray):
+        """设置 IDF 权重"""
+        idf = np.asarray(idf, dtype=np.float64)
+        if idf.shape != (self.dimension,):
+            raise ValueError(f"IDF weights must have shape ({self.dimension},), got {idf.shape}")
+        self.idf = idf
+
+    def save_idf(self, path: str):
+        """保存 IDF 权重"""
+        if self.idf is None:
+            raise ValueError("IDF weights have not been fitted")
+        np.save(path, self.idf)
+
     def get_model_info(self) -> Dict[str, Any]:
         """获取模型信息"""
+        model_name = MODEL_NAME
+        if self.idf is not None:
+            # IDF 不同则向量不同，模型名中带上指纹，避免命中旧的缓存
+            model_name += f"+idf-{zlib.crc32(self.idf.astype(np.float32).tobytes()):08x}"
         return {
-            "model_name": "simple-embedding",
+            "model_name": model_name,
             "dimension": self.dimension,
-            "description": "Simple hash-based embedding for testing"
+            "embedding_dimension": self.dimension,
+            "provider": "hashing",
+            "char_ngram_range": list(self.char_ngram_range),
+            "idf": self.idf is not None,
+            "normalized": True,
+            "description": "Feature-hashing embedding over words, word bigrams and character n-grams"
         }
+
+    # ========== 特征提取 ==========
+
+    def _features(self, texts: List[str]) -> List[Tuple[np.ndarray, np.ndarray, float]]:
+        """
+        提取一批文本的哈希特征
+
+        Returns:
+            每类特征一组 (文本下标, 混合后的 64 位哈希, 权重)
+        """
+        # NFKC 对含全角标点的中文文本很慢，这里用 NFC 加上全角 ASCII 折叠代替，效果上覆盖常见情况
+        normalized = [unicodedata.normalize("NFC", text).lower() for text in texts]
+        lengths = np.fromiter((len(text) for text in normalized), dtype=np.int64, count=len(normalized))
+        cp = np.frombuffer("".join(normalized).encode("utf-32-le"), dtype=np.uint32).copy()
+        doc = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+        fullwidth = (cp >= 0xFF01) & (cp <= 0xFF5E)
+        cp[fullwidth] -= 0xFEE0
+
+        # 空白统一为空格，连续空白只保留一个
+        space = (cp == 32) | (cp == 9) | (cp == 10) | (cp == 13) | (cp == 0xA0) | (cp == 0x3000)
+        cp[space] = 32
+        keep = np.ones(len(cp), dtype=bool)
+        keep[1:] = ~(space[1:] & space[:-1] & (doc[1:] == doc[:-1]))
+        cp, doc = cp[keep], doc[keep]
+
+        n = len(cp)
+        if n == 0:
+            return []
+
+        # 前缀哈希：prefix[k] = sum(cp[j] * BASE^-j, j < k)，任意区间 [s, e) 的哈希为
+        # BASE^(e-1) * (prefix[e] - prefix[s])（模 2^64，uint64 溢出即取模）
+        powers, inverse_powers = self._powers(n)
+        prefix = np.zeros(n + 1, dtype=np.uint64)
+        np.cumsum(cp.astype(np.uint64) * inverse_powers, out=prefix[1:])
+
+        groups: List[Tuple[np.ndarray, np.ndarray, float]] = []
+
+        # 词：连续的词字符为一个词，CJK 字符各自为一个词
+        cjk = _cjk_mask(cp)
+        word = _word_char_mask(cp, cjk)
+        same_doc_prev = np.zeros(n, dtype=bool)
+        same_doc_prev[1:] = doc[1:] == doc[:-1]
+        prev_word = np.zeros(n, dtype=bool)
+        prev_word[1:] = word[:-1]
+        next_word = np.zeros(n, dtype=bool)
+        next_word[:-1] = word[1:]
+        same_doc_next = np.zeros(n, dtype=bool)
+        same_doc_next[:-1] = same_doc_prev[1:]
+
+        # 词字符与 CJK 字符互不相交，起止位置各自按顺序一一对应
+        token_starts = np.flatnonzero((word & ~(prev_word & same_doc_prev)) | cjk)
+        token_ends = np.flatnonzero((word & ~(next_word & same_doc_next)) | cjk) + 1
+        token_docs = doc[token_starts]
+
+        if len(token_starts):
+            token_hashes = powers[token_ends - 1] * (prefix[token_ends] - prefix[token_starts])
+            groups.append((token_docs, _mix(token_hashes ^ _WORD_SALT), 1.0))
+
+            if self.use_bigrams and len(token_starts) > 1:
+                valid = token_docs[1:] == token_docs[:-1]
+                bigrams = _mix(token_hashes[:-1]) * np.uint64(_BASE) + token_hashes[1:]
+                groups.append((token_docs[1:][valid], _mix(bigrams[valid] ^ _BIGRAM_SALT), 1.0))
+
+        # 字符 n-gram（跨越空格，捕捉短语和词形变化）；全部用切片计算，最后再去掉跨文本的 n-gram
+        low, high = self.char_ngram_range
+        for size in range(max(low, 1), min(high, n) + 1) if low > 0 else ():
+            count = n - size + 1
+            ngram_hashes = powers[size - 1:] * (prefix[size:] - prefix[:count])
+            valid = doc[:count] == doc[size - 1:]
+            groups.append((doc[:count][valid], _mix(ngram_hashes[valid] ^ (_CHAR_SALT + np.uint64(size))), self.char_weight))
+
+        return groups
+
+    def _powers(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """BASE 和 BASE^-1 的 0..n-1 次幂（模 2^64）；不超过 _MAX_CACHED_POWERS 项的表按需扩容并复用"""
+        powers, inverse_powers = self._power_table
+        if len(powers) < n:
+            size = max(n, min(2 * len(powers), _MAX_CACHED_POWERS))
+            powers = np.empty(size, dtype=np.uint64)
+            inverse_powers = np.empty(size, dtype=np.uint64)
+            powers[0] = inverse_powers[0] = 1
+            powers[1:] = np.cumprod(np.full(size - 1, _BASE, dtype=np.uint64))
+            inverse_powers[1:] = np.cumprod(np.full(size - 1, _BASE_INV, dtype=np.uint64))
+            if size <= _MAX_CACHED_POWERS:
+                self._power_table = (powers, inverse_powers)
+        return powers[:n], inverse_powers[:n]
+
+    def _accumulate(self, groups: List[Tuple[np.ndarray, np.ndarray, float]], text_count: int) -> np.ndarray:
+        """把各类特征按桶带符号累加为 (text_count, dimension) 的矩阵"""
+        matrix = np.zeros((text_count, self.dimension), dtype=np.float64)
+        for docs, mixed, weight in groups:
+            # 正负号分别计数（无权重的 bincount 更快），再相减
+            counts = np.bincount(self._signed_keys(docs, mixed), minlength=text_count * 2 * self.dimension)
+            counts = counts.reshape(text_count, self.dimension, 2)
+            signed = counts[:, :, 0] - counts[:, :, 1]
+            matrix += signed if weight == 1.0 else weight * signed
+        return matrix
+
+    def _signed_keys(self, docs: np.ndarray, mixed: np.ndarray) -> np.ndarray:
+        """
+        高 32 位通过乘移映射到 [0, 2 * dimension)（避免 64 位取模）：
+        商为桶下标，最低位为符号（带符号哈希使冲突在期望上相互抵消）
+        """
+        slots = ((mixed >> np.uint64(32)) * np.uint64(2 * self.dimension)) >> np.uint64(32)
+        return docs * (2 * self.dimension) + slots.astype(np.int64)
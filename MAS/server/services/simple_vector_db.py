@@ -1,119 +1,1550 @@
 """
 简单的向量数据库实现（ChromaDB替代方案）
 使用numpy和文件存储实现基本的向量搜索功能
+
+每个集合一个目录：
+    manifest.jsonl   追加写入的清单：集合元数据、向量维度、文档存储文件名、每个向量段的行数
+    seg-000001.f32   只追加的 float32 向量段（写入时已归一化，按行存放），用 np.memmap 打开
+    docs.sqlite      行号 -> 文档 ID、文本、元数据和原始向量范数（SQLite WAL 模式，提交不单独 fsync）；
+                     压缩后为 docs-000002.sqlite 等
+    wal.log          预写日志：上次检查点之后的 add / update / delete（见 vector_wal.py）
+    hnsw-*           可选的 HNSW 图索引（见 hnsw_index.py）
+    codes.bin        可选的压缩编码（float16 / int8 / pq，见 vector_codecs.py）和 codec.npz 训练结果；
+                     启用后先用编码近似打分，再从磁盘读取原始向量精排候选
+元数据倒排索引在加载时由文档存储重建（见 metadata_index.py），带 where 条件的搜索只对候选行打分
+添加文档只写入新增的行（O(新增行数) 的 I/O），搜索直接对已归一化的矩阵做矩阵向量乘法；
+建立了 HNSW 索引且文档数不少于 exact_threshold 时改用近似搜索
+
+写入先追加预写日志（组提交），向量段、HNSW 索引和清单中的段行数由后台检查点定期刷盘，
+检查点在清单中记录已折叠的日志序号后清空日志；加载时重放清单，再重放检查点之后的日志
+
+删除只从文档存储中移除并在有效行位图中置为 False（墓碑），向量行留在段中、搜索时跳过；
+更换向量的更新是删除 + 追加，已写入的行不再改变。墓碑比例超过阈值后由后台压缩：
+限速复制有效行到新的段和文档存储，再用新清单原子替换旧清单，之后删除旧文件
 """
 import json
+import logging
 import os
-import numpy as np
-from typing import List, Dict, Any, Optional
 import pickle
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+from server.services.hnsw_index import HNSWIndex
+from server.services.metadata_index import MetadataIndex
+from server.services.vector_codecs import CODECS, VectorCodec, create_codec
+from server.services.vector_wal import SYNC_INTERVAL_MS, SYNC_RECORDS, WAL_FILE, WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.jsonl"
+STORE_FILE = "docs.sqlite"
+SEGMENT_ROWS = 65536  # 单个向量段的最大行数，写满后开始新段
+EXACT_THRESHOLD = 10000  # 文档数少于此值时即使有索引也做精确搜索
+SQL_BATCH = 500  # 单条 SQL 中 IN (...) 的参数个数上限
+CODES_FILE = "codes.bin"
+CODEC_FILE = "codec.npz"
+RERANK_FACTOR = 10  # 压缩存储下精排 k * RERANK_FACTOR 个候选
+CHECKPOINT_BYTES = 64 * 1024 * 1024  # 日志超过此大小时做检查点
+CHECKPOINT_INTERVAL = 30.0  # 有未折叠的日志时最长间隔（秒）做一次检查点
+COMPACTION_THRESHOLD = 0.3  # 墓碑行占总行数的比例超过此值时压缩
+COMPACTION_MIN_ROWS = 1000  # 墓碑行少于此数时不压缩
+COMPACTION_RATE = 32 * 1024 * 1024  # 压缩复制向量的限速（字节/秒）
+COMPACTION_CHECK_INTERVAL = 60.0  # 后台检查是否需要压缩的间隔（秒）
+COMPACTION_DIRECTORY = "compaction.tmp"  # 压缩时生成新索引的临时目录
+MEMORY_BUDGET = 2 * 1024 * 1024 * 1024  # 已加载集合估计常驻内存的默认上限（字节）
+ROW_OVERHEAD = 64  # 每行的有效位、元数据倒排索引等常驻开销的估计（字节）
+ACCESS_STATS_FILE = "access_stats.json"
+ACCESS_HALF_LIFE = 24 * 3600.0  # 访问次数的衰减半衰期（秒）
+PREWARM_COLLECTIONS = 4  # 启动后预先加载的最常访问集合数
+STATS_SAVE_INTERVAL = 60.0  # 保存访问统计的间隔（秒）
+
+
+def _file_number(file: str) -> int:
+    """seg-000001.f32 -> 1，docs-000002.sqlite -> 2，docs.sqlite -> 0"""
+    stem = file.split(".")[0]
+    return int(stem.split("-")[1]) if "-" in stem else 0
+
+
+def _batches(values: List[Any], size: int = SQL_BATCH):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def as_vector_matrix(embeddings: Union[List[List[float]], np.ndarray]) -> np.ndarray:
+    """把向量转换为二维连续 float32 数组；已经是该格式时不复制"""
+    if len(embeddings) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2:
+        raise ValueError(f"Embeddings must be a 2-D matrix, got shape {matrix.shape}")
+    return matrix
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """分数最高的 k 个位置，按分数降序"""
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class VectorSegment:
+    """只追加的向量段文件，内容为 rows x dimension 的 float32 矩阵"""
+
+    def __init__(self, path: Path, dimension: int, rows: int = 0):
+        self.path = path
+        self.dimension = dimension
+        self.rows = rows
+        self.dirty = False  # 上次 sync 之后是否写入过
+        self._map()
+
+    def _map(self):
+        """按清单记录的行数映射文件（文件末尾未提交的数据被忽略）
+        读写通过普通 ndarray 视图进行，避免 memmap 子类每次索引的开销"""
+        if self.rows == 0:
+            self.mmap = None
+            self.vectors = np.zeros((0, self.dimension), dtype=np.float32)
+            return
+        self.mmap = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(self.rows, self.dimension))
+        self.vectors = np.asarray(self.mmap)
+
+    def append(self, matrix: np.ndarray):
+        """在已有的行之后写入新行（刷盘由检查点的 sync 完成）"""
+        mode = "r+b" if self.path.exists() else "w+b"
+        with open(self.path, mode) as f:
+            f.seek(self.rows * self.dimension * 4)
+            f.write(matrix.tobytes())
+            f.truncate()
+        self.rows += len(matrix)
+        self.dirty = True
+        self._map()
+
+    def sync(self):
+        """把追加和原地修改的内容刷到磁盘"""
+        if self.mmap is not None:
+            self.mmap.flush()
+        with open(self.path, "rb") as f:
+            os.fsync(f.fileno())
+        self.dirty = False
+
+    def close(self):
+        """释放内存映射"""
+        self.mmap = None
+        self.vectors = np.zeros((0, self.dimension), dtype=np.float32)
+
+
+class CompressedVectors:
+    """压缩编码文件：rows x code_width 的编码矩阵（只追加，内存映射）和编码器训练结果"""
+
+    def __init__(self, directory: Path, codec: VectorCodec, rerank_factor: int = RERANK_FACTOR):
+        self.directory = directory
+        self.codec = codec
+        self.rerank_factor = rerank_factor
+        self.rows = 0
+        self.mmap: Optional[np.memmap] = None
+        self.codes = np.zeros((0, codec.code_width), dtype=codec.dtype)
+
+    def load(self, max_rows: int):
+        """读取训练结果和已编码的行（超出集合行数的部分被丢弃）"""
+        codec_path = self.directory / CODEC_FILE
+        codes_path = self.directory / CODES_FILE
+        if not codec_path.exists():
+            return
+        with np.load(codec_path) as state:
+            state = {key: state[key] for key in state.files}
+        self.codec.trained_rows = int(state.pop("trained_rows", 0))
+        self.codec.load_state(state)
+        if codes_path.exists():
+            self._map(min(codes_path.stat().st_size // self.codec.bytes_per_vector, max_rows))
+
+    def _map(self, rows: int):
+        self.rows = rows
+        if rows == 0:
+            self.mmap = None
+            self.codes = np.zeros((0, self.codec.code_width), dtype=self.codec.dtype)
+            return
+        self.mmap = np.memmap(self.directory / CODES_FILE, dtype=self.codec.dtype, mode="r+", shape=(rows, self.codec.code_width))
+        self.codes = np.asarray(self.mmap)
+
+    def save_codec(self):
+        tmp_path = self.directory / (CODEC_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, trained_rows=np.array(self.codec.trained_rows), **self.codec.state())
+        os.replace(tmp_path, self.directory / CODEC_FILE)
+
+    def append(self, codes: np.ndarray):
+        path = self.directory / CODES_FILE
+        with open(path, "r+b" if path.exists() else "w+b") as f:
+            f.seek(self.rows * self.codec.bytes_per_vector)
+            f.write(codes.tobytes())
+            f.truncate()
+        self._map(self.rows + len(codes))
+
+    def replace(self, codes: np.ndarray):
+        """用新的编码矩阵替换全部编码（集合压缩后行号改变）"""
+        (self.directory / CODES_FILE).unlink(missing_ok=True)
+        self._map(0)
+        self.append(codes)
+
+    def remove_files(self):
+        self._map(0)
+        for name in (CODES_FILE, CODEC_FILE):
+            path = self.directory / name
+            if path.exists():
+                path.unlink()
+
+    def memory_bytes(self) -> int:
+        """编码常驻内存的字节数"""
+        return self.rows * self.codec.bytes_per_vector
+
+
+def read_manifest(directory: Path) -> Dict[str, Any]:
+    """重放集合的清单（不打开向量和文档存储）；document_count 为最近一次检查点时的文档数"""
+    manifest: Dict[str, Any] = {
+        "metadata": {},
+        "dimension": None,
+        "segments": {},
+        "index": None,
+        "storage": {"mode": "float32"},
+        "store": STORE_FILE,
+        "checkpoint_lsn": 0,
+        "document_count": None
+    }
+    with open(directory / MANIFEST_FILE, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    for number, line in enumerate(lines):
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            if number == len(lines) - 1:
+                break  # 最后一行写到一半时崩溃
+            raise
+        if entry["op"] in ("create", "metadata"):
+            manifest["metadata"] = entry["metadata"]
+        elif entry["op"] == "dimension":
+            manifest["dimension"] = entry["dimension"]
+        elif entry["op"] == "segment":
+            manifest["segments"][entry["file"]] = entry["rows"]
+        elif entry["op"] == "index":
+            manifest["index"] = entry["params"]
+        elif entry["op"] == "storage":
+            manifest["storage"] = entry["storage"]
+        elif entry["op"] == "store":
+            manifest["store"] = entry["file"]
+        elif entry["op"] == "checkpoint":
+            manifest["checkpoint_lsn"] = entry["lsn"]
+            manifest["document_count"] = entry.get("count")
+    return manifest
+
+
+class SegmentedCollection:
+    """一个集合：向量段 + SQLite 文档存储 + 追加写入的清单 + 预写日志"""
+
+    def __init__(
+        self,
+        directory: Path,
+        segment_rows: int = SEGMENT_ROWS,
+        exact_threshold: int = EXACT_THRESHOLD,
+        wal_sync_interval_ms: int = SYNC_INTERVAL_MS,
+        wal_sync_records: int = SYNC_RECORDS
+    ):
+        self.directory = directory
+        self.name = directory.name
+        self.segment_rows = segment_rows
+        self.exact_threshold = exact_threshold
+        self.metadata: Dict[str, Any] = {}
+        self.dimension: Optional[int] = None
+        self.segments: List[VectorSegment] = []
+        self.segment_ends = np.zeros(0, dtype=np.int64)
+        self.index: Optional[HNSWIndex] = None
+        self.metadata_index = MetadataIndex()
+        self.storage: Dict[str, Any] = {"mode": "float32"}
+        self.codes: Optional[CompressedVectors] = None
+        self.alive = np.zeros(0, dtype=bool)  # 行是否有效（被删除的行留在段中，搜索时跳过）
+        self.checkpoint_lsn = 0  # 已折叠进数据文件的最大日志序号
+        self.last_checkpoint = time.monotonic()
+        self._checkpointed_rows: Dict[str, int] = {}  # 清单中记录的各段行数
+        self._index_dirty = False
+        self._next_segment = 1
+        self.store_file = STORE_FILE
+        self._store: Optional[sqlite3.Connection] = None
+        self.last_compaction: Optional[Dict[str, Any]] = None
+        self._closed = False
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self.wal = WriteAheadLog(directory / WAL_FILE, wal_sync_interval_ms, wal_sync_records)
+        self._load()
+
+    @classmethod
+    def create(cls, directory: Path, metadata: Dict[str, Any], **options) -> "SegmentedCollection":
+        """创建新集合目录"""
+        directory.mkdir(parents=True, exist_ok=False)
+        with open(directory / MANIFEST_FILE, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "create", "metadata": metadata}, ensure_ascii=False) + "\n")
+        return cls(directory, **options)
+
+    # ------------------------------------------------------------------
+    # 清单
+    # ------------------------------------------------------------------
+
+    def _load(self):
+        """重放清单，恢复元数据和段（清单记录之后写入段的数据被丢弃），再重放检查点之后的预写日志"""
+        manifest = read_manifest(self.directory)
+        self.metadata = manifest["metadata"]
+        self.dimension = manifest["dimension"]
+        self.storage = manifest["storage"]
+        self.checkpoint_lsn = manifest["checkpoint_lsn"]
+        self.store_file = manifest["store"]
+        segment_rows = manifest["segments"]
+        index_params = manifest["index"]
+
+        self._checkpointed_rows = dict(segment_rows)
+        self.segments = [
+            VectorSegment(self.directory / file, self.dimension, rows)
+            for file, rows in sorted(segment_rows.items())
+        ]
+        self._next_segment = max(_file_number(file) for file in [*segment_rows, self.store_file]) + 1
+        self._update_segment_ends()
+        self._open_store()
+
+        replayed = 0
+        for header, vectors in self.wal.replay(self.checkpoint_lsn):
+            self._apply(header, vectors)
+            replayed += 1
+        if replayed:
+            logger.info(f"Replayed {replayed} write-ahead log records into collection {self.name}")
+        self._remove_orphans()
+        total = self.total_rows
+
+        if index_params is not None:
+            self.index = HNSWIndex.open(self.directory, self.vectors_at, **index_params)
+            if self.index.size > total:
+                self.index.remove_files()
+                self.index = HNSWIndex(self.directory, self.vectors_at, **index_params)
+            self._catch_up_index()
+
+        if self.storage["mode"] != "float32" and self.dimension is not None:
+            self._open_codes(load=True)
+
+    def _open_store(self):
+        """打开清单指定的文档存储（删除清单之后写入的行），重建有效行位图和元数据倒排索引"""
+        self._store = sqlite3.connect(str(self.directory / self.store_file), check_same_thread=False)
+        # 持久性由预写日志保证，文档存储的提交不需要单独 fsync
+        self._store.execute("PRAGMA journal_mode=WAL")
+        self._store.execute("PRAGMA synchronous=NORMAL")
+        self._store.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT, norm REAL)"
+        )
+        total = self.total_rows
+        self._store.execute("DELETE FROM docs WHERE row >= ?", (total,))
+        self._store.commit()
+        self.alive = np.zeros(total, dtype=bool)
+        self.metadata_index = MetadataIndex()
+        for row, metadata in self._store.execute("SELECT row, metadata FROM docs"):
+            self.alive[row] = True
+            self.metadata_index.add(row, json.loads(metadata))
+
+    def _remove_orphans(self):
+        """删除清单没有引用的段和文档存储（崩溃前未完成的压缩或未重放的写入留下的文件）"""
+        live = {segment.path.name for segment in self.segments}
+        for path in self.directory.glob("seg-*.f32"):
+            if path.name not in live:
+                path.unlink()
+        for path in self.directory.glob("docs*.sqlite*"):
+            if not path.name.startswith(self.store_file):
+                path.unlink()
+        shutil.rmtree(self.directory / COMPACTION_DIRECTORY, ignore_errors=True)
+
+    def _open_codes(self, load: bool = False):
+        """按存储模式创建编码器，补齐缺少的编码"""
+        params = {key: value for key, value in self.storage.items() if key not in ("mode", "rerank_factor")}
+        codec = create_codec(self.storage["mode"], self.dimension, **params)
+        self.codes = CompressedVectors(self.directory, codec, self.storage.get("rerank_factor", RERANK_FACTOR))
+        if load:
+            self.codes.load(self.total_rows)
+        self._catch_up_codes()
+
+    def _catch_up_codes(self):
+        """
+        行数达到训练要求时训练编码器，并把尚未编码的行编码追加；
+        编码器要求重新训练时（行数比训练时增长了若干倍）重新训练并重新编码全部行
+        """
+        codec = self.codes.codec
+        total = self.total_rows
+        retrain = codec.needs_retrain(total)
+        if not codec.trained or retrain:
+            if total < codec.min_train_rows:
+                return
+            sample_rows = np.arange(total)
+            if total > codec.train_sample_rows:
+                sample_rows = np.sort(np.random.default_rng(0).choice(total, codec.train_sample_rows, replace=False))
+            codec.train(self.vectors_at(sample_rows))
+            codec.trained_rows = total
+            if retrain:
+                self.codes.replace(self.codes.codes[:0])
+            self.codes.save_codec()
+        for start in range(self.codes.rows, total, SEGMENT_ROWS):
+            rows = np.arange(start, min(start + SEGMENT_ROWS, total))
+            self.codes.append(codec.encode(self.vectors_at(rows)))
+
+    def _compressed(self) -> bool:
+        """压缩编码是否可用于打分（编码器已训练且覆盖全部行）"""
+        return self.codes is not None and self.codes.codec.trained and self.codes.rows == self.total_rows
+
+    def set_storage_mode(self, mode: str, rerank_factor: int = RERANK_FACTOR, **params):
+        """切换存储模式（float32 / float16 / int8 / pq），已有的行重新编码"""
+        with self._lock:
+            storage = {"mode": mode, "rerank_factor": rerank_factor, **params}
+            if mode != "float32" and mode not in CODECS:
+                raise ValueError(f"Unknown storage mode {mode}, expected one of float32, {', '.join(CODECS)}")
+            if mode != "float32" and self.dimension is not None:
+                create_codec(mode, self.dimension, **params)  # 先校验参数
+            if self.codes is not None:
+                self.codes.remove_files()
+                self.codes = None
+            self._append_manifest({"op": "storage", "storage": storage})
+            self.storage = storage
+            if mode != "float32" and self.dimension is not None:
+                self._open_codes()
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """存储模式、向量常驻内存的字节数、墓碑行数和最近一次压缩的统计"""
+        float32_bytes = self.total_rows * (self.dimension or 0) * 4
+        stats = {"mode": self.storage["mode"], "rows": self.total_rows, "float32_bytes": float32_bytes}
+        stats["tombstones"] = self.total_rows - self.count()
+        stats["last_compaction"] = self.last_compaction
+        if self._compressed():
+            stats["resident_bytes"] = self.codes.memory_bytes()
+        else:
+            stats["resident_bytes"] = float32_bytes
+        stats["trained"] = self.codes.codec.trained if self.codes is not None else True
+        return stats
+
+    def memory_bytes(self) -> int:
+        """常驻内存的估计值：向量（压缩存储时为编码）、HNSW 第 0 层和每行的固定开销"""
+        vectors = self.codes.memory_bytes() if self._compressed() else self.total_rows * (self.dimension or 0) * 4
+        graph = self.index.size * self.index.max_neighbors0 * 4 if self.index is not None else 0
+        return vectors + graph + self.total_rows * ROW_OVERHEAD
+
+    def _catch_up_index(self, save: bool = True):
+        """把索引之后追加的行补进索引；save=False 时留给检查点保存"""
+        missing = self.total_rows - self.index.size
+        if missing > 0:
+            self.index.add(missing)
+            if save:
+                self.index.save()
+            else:
+                self._index_dirty = True
+
+    def _append_manifest(self, *entries: Dict[str, Any]):
+        """追加清单记录并刷到磁盘"""
+        with open(self.directory / MANIFEST_FILE, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    @property
+    def total_rows(self) -> int:
+        """段中的总行数（含已删除的行）"""
+        return sum(segment.rows for segment in self.segments)
+
+    def count(self) -> int:
+        """有效文档数"""
+        return int(self.alive.sum())
+
+    def _update_segment_ends(self):
+        self.segment_ends = np.cumsum([segment.rows for segment in self.segments], dtype=np.int64)
+
+    def vectors_at(self, rows: np.ndarray) -> np.ndarray:
+        """按全局行号读取归一化向量"""
+        if len(self.segments) == 1:
+            return self.segments[0].vectors[rows]
+        owners = np.searchsorted(self.segment_ends, rows, side="right")
+        result = np.empty((len(rows), self.dimension), dtype=np.float32)
+        for owner in np.unique(owners).tolist():
+            mask = owners == owner
+            start = self.segment_ends[owner] - self.segments[owner].rows
+            result[mask] = self.segments[owner].vectors[rows[mask] - start]
+        return result
+
+    def create_index(self, **params):
+        """建立（或按新参数重建）HNSW 索引，覆盖已有的全部行"""
+        with self._lock:
+            if self.index is not None:
+                self.index.remove_files()
+            self.index = HNSWIndex(self.directory, self.vectors_at, **params)
+            self._catch_up_index()
+            self._append_manifest({"op": "index", "params": self.index.params()})
+
+    def drop_index(self):
+        """删除 HNSW 索引，之后只做精确搜索"""
+        with self._lock:
+            if self.index is not None:
+                self._append_manifest({"op": "index", "params": None})
+                self.index.remove_files()
+                self.index = None
+
+    def set_metadata(self, metadata: Dict[str, Any]):
+        """替换集合元数据"""
+        with self._lock:
+            self._append_manifest({"op": "metadata", "metadata": metadata})
+            self.metadata = metadata
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def add(self, documents: List[str], embeddings: np.ndarray, metadatas: List[Dict[str, Any]], ids: List[str]) -> List[str]:
+        """追加文档：校验后先写预写日志，再写向量段和文档存储"""
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = embeddings.shape[1]
+                self._append_manifest({"op": "dimension", "dimension": self.dimension})
+            elif embeddings.shape[1] != self.dimension:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match collection dimension {self.dimension}")
+
+            existing = [doc_id for (doc_id,) in self._select_in("SELECT id FROM docs WHERE id IN", ids)]
+            if existing or len(set(ids)) != len(ids):
+                raise ValueError(f"Duplicate document ids: {existing or ids}")
+
+            self.wal.append({"op": "add", "ids": ids, "documents": documents, "metadatas": metadatas}, embeddings)
+            self._apply_add(documents, embeddings, metadatas, ids)
+            self._catch_up_appended()
+            return ids
+
+    def _catch_up_appended(self):
+        """把追加的行补进 HNSW 索引和压缩编码"""
+        if self.index is not None:
+            self._catch_up_index(save=False)
+        if self.storage["mode"] != "float32":
+            if self.codes is None:
+                self._open_codes()
+            else:
+                self._catch_up_codes()
+
+    def _apply(self, header: Dict[str, Any], vectors: Optional[np.ndarray]):
+        """重放一条日志记录"""
+        if header["op"] == "add":
+            self._apply_add(header["documents"], vectors, header["metadatas"], header["ids"])
+        elif header["op"] == "delete":
+            self._apply_delete(header["ids"])
+        elif header["op"] == "update":
+            embedding = vectors[0] if vectors is not None else None
+            self._apply_update(header["id"], header["document"], embedding, header["metadata"])
+
+    def _apply_add(self, documents: List[str], embeddings: np.ndarray, metadatas: List[Dict[str, Any]], ids: List[str]):
+        norms = np.linalg.norm(embeddings, axis=1)
+        normalized = embeddings / np.maximum(norms, 1e-10)[:, None]
+
+        start = self.total_rows
+        offset = 0
+        while offset < len(normalized):
+            segment = self._writable_segment()
+            take = min(self.segment_rows - segment.rows, len(normalized) - offset)
+            segment.append(normalized[offset:offset + take])
+            offset += take
+
+        self._store.executemany(
+            "INSERT INTO docs (row, id, document, metadata, norm) VALUES (?, ?, ?, ?, ?)",
+            [
+                (start + i, doc_id, document, json.dumps(metadata, ensure_ascii=False), float(norm))
+                for i, (doc_id, document, metadata, norm) in enumerate(zip(ids, documents, metadatas, norms))
+            ]
+        )
+        self._store.commit()
+        for i, metadata in enumerate(metadatas):
+            self.metadata_index.add(start + i, metadata)
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        self._update_segment_ends()
+
+    def _writable_segment(self) -> VectorSegment:
+        """最后一个未写满的段，没有则新建"""
+        if not self.segments or self.segments[-1].rows >= self.segment_rows:
+            self.segments.append(self._new_segment())
+        return self.segments[-1]
+
+    def _new_segment(self) -> VectorSegment:
+        """编号递增的新段文件（压缩生成的段与写入追加的段不会重名）"""
+        path = self.directory / f"seg-{self._next_segment:06d}.f32"
+        self._next_segment += 1
+        return VectorSegment(path, self.dimension)
+
+    def _locate(self, row: int):
+        """全局行号 -> (段, 段内行号)"""
+        for segment in self.segments:
+            if row < segment.rows:
+                return segment, row
+            row -= segment.rows
+        raise IndexError(row)
+
+    def delete(self, ids: List[str]) -> int:
+        """删除文档：从文档存储中移除，向量行标记为无效"""
+        with self._lock:
+            found = [doc_id for (doc_id,) in self._select_in("SELECT id FROM docs WHERE id IN", ids)]
+            if found:
+                self.wal.append({"op": "delete", "ids": found})
+                self._apply_delete(found)
+            return len(found)
+
+    def _apply_delete(self, ids: List[str]):
+        rows = [row for (row,) in self._select_in("SELECT row FROM docs WHERE id IN", ids)]
+        for batch in _batches(ids):
+            self._store.execute(f"DELETE FROM docs WHERE id IN ({','.join('?' * len(batch))})", batch)
+        self._store.commit()
+        self.alive[rows] = False
+
+    def update(
+        self,
+        document_id: str,
+        document: Optional[str] = None,
+        embedding: Optional[np.ndarray] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """
+        更新文档；只改文本或元数据时原地更新文档存储，更换向量时删除旧行并追加新行
+        更换向量的日志记录带完整的文本和元数据：新行在检查点之后写入，崩溃后重新打开时被丢弃，
+        重放时按记录重新追加
+        """
+        with self._lock:
+            found = self._store.execute("SELECT document, metadata FROM docs WHERE id = ?", (document_id,)).fetchone()
+            if found is None:
+                return False
+            vector = None
+            if embedding is not None:
+                vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+                if len(vector) != self.dimension:
+                    raise ValueError(f"Embedding dimension {len(vector)} does not match collection dimension {self.dimension}")
+                document = found[0] if document is None else document
+                metadata = json.loads(found[1]) if metadata is None else metadata
+            self.wal.append(
+                {"op": "update", "id": document_id, "document": document, "metadata": metadata},
+                vector[None, :] if vector is not None else None
+            )
+            self._apply_update(document_id, document, vector, metadata)
+            if vector is not None:
+                self._catch_up_appended()
+            return True
+
+    def _apply_update(
+        self,
+        document_id: str,
+        document: Optional[str],
+        vector: Optional[np.ndarray],
+        metadata: Optional[Dict[str, Any]]
+    ):
+        found = self._store.execute("SELECT row, document, metadata FROM docs WHERE id = ?", (document_id,)).fetchone()
+        if found is None:
+            # 重放时旧行的删除已提交而新行被丢弃：按记录中的完整文本和元数据重新追加
+            if vector is not None and metadata is not None:
+                self._apply_add([document], vector[None, :], [metadata], [document_id])
+            return
+        row, old_document, old_metadata = found
+        if vector is not None:
+            self._apply_delete([document_id])
+            self._apply_add(
+                [old_document if document is None else document],
+                vector[None, :],
+                [json.loads(old_metadata) if metadata is None else metadata],
+                [document_id]
+            )
+            return
+        if document is not None:
+            self._store.execute("UPDATE docs SET document = ? WHERE row = ?", (document, row))
+        if metadata is not None:
+            self._store.execute("UPDATE docs SET metadata = ? WHERE row = ?", (json.dumps(metadata, ensure_ascii=False), row))
+            self.metadata_index.remove(row, json.loads(old_metadata))
+            self.metadata_index.add(row, metadata)
+        self._store.commit()
+
+    # ------------------------------------------------------------------
+    # 检查点
+    # ------------------------------------------------------------------
+
+    def checkpoint_due(self, max_bytes: int = CHECKPOINT_BYTES, interval: float = CHECKPOINT_INTERVAL) -> bool:
+        """日志过大，或有未折叠的日志且距上次检查点超过 interval 秒"""
+        if self._closed or self.wal.last_lsn == self.checkpoint_lsn:
+            return False
+        return self.wal.size >= max_bytes or time.monotonic() - self.last_checkpoint >= interval
+
+    def checkpoint(self) -> bool:
+        """把日志折叠进数据文件：向量段、索引和文档存储刷盘，清单记录段行数和日志序号，然后清空日志"""
+        with self._lock:
+            self.last_checkpoint = time.monotonic()
+            lsn = self.wal.last_lsn
+            if self._closed or lsn == self.checkpoint_lsn:
+                return False
+            for segment in self.segments:
+                if segment.dirty:
+                    segment.sync()
+            if self.index is not None and self._index_dirty:
+                self.index.save()
+                self._index_dirty = False
+            self._store.execute("PRAGMA wal_checkpoint(FULL)")
+            entries = [
+                {"op": "segment", "file": segment.path.name, "rows": segment.rows}
+                for segment in self.segments
+                if self._checkpointed_rows.get(segment.path.name) != segment.rows
+            ]
+            self._append_manifest(*entries, {"op": "checkpoint", "lsn": lsn, "count": self.count()})
+            self._checkpointed_rows.update((entry["file"], entry["rows"]) for entry in entries)
+            self.checkpoint_lsn = lsn
+            self.wal.truncate()
+            return True
+
+    # ------------------------------------------------------------------
+    # 压缩
+    # ------------------------------------------------------------------
+
+    def compaction_due(self, threshold: float = COMPACTION_THRESHOLD, min_rows: int = COMPACTION_MIN_ROWS) -> bool:
+        """墓碑行不少于 min_rows 且占总行数的比例不低于 threshold"""
+        dead = self.total_rows - self.count()
+        return dead >= min_rows and dead >= threshold * self.total_rows
+
+    def _disk_bytes(self) -> int:
+        return sum(path.stat().st_size for path in self.directory.iterdir() if path.is_file())
+
+    def compact(self, rate: Optional[float] = COMPACTION_RATE, stop: Optional[threading.Event] = None) -> Optional[Dict[str, Any]]:
+        """
+        丢弃墓碑行，重写向量段和文档存储，返回压缩统计（没有墓碑、集合已关闭或被 stop 中止时返回 None）
+        已有的行不会被改写，有效行的复制在锁外按 rate（字节/秒）限速进行，不阻塞读写；
+        复制期间追加的行和删除在最后持锁时补齐，然后用新清单原子替换旧清单
+        """
+        with self._compaction_lock:
+            started = time.perf_counter()
+            with self._lock:
+                if self._closed or self.count() == self.total_rows:
+                    return None
+                self.checkpoint()
+                snapshot_total = self.total_rows
+                keep = np.flatnonzero(self.alive)
+                bytes_before = self._disk_bytes()
+
+            # 复制快照中的有效行（锁外，限速）
+            segments: List[VectorSegment] = []
+            copied = 0
+            for start in range(0, len(keep), self.segment_rows):
+                if stop is not None and stop.is_set():
+                    self._discard_segments(segments)
+                    return None
+                with self._lock:
+                    segment = self._new_segment()
+                segment.append(self.vectors_at(keep[start:start + self.segment_rows]))
+                segments.append(segment)
+                copied += segment.rows * self.dimension * 4
+                if rate:
+                    time.sleep(max(0.0, copied / rate - (time.perf_counter() - started)))
+
+            with self._lock:
+                if self._closed:
+                    self._discard_segments(segments)
+                    return None
+                self.checkpoint()
+                tail = snapshot_total + np.flatnonzero(self.alive[snapshot_total:])
+                for start in range(0, len(tail), self.segment_rows):
+                    rows = tail[start:start + self.segment_rows]
+                    while len(rows):
+                        if not segments or segments[-1].rows >= self.segment_rows:
+                            segments.append(self._new_segment())
+                        take = min(self.segment_rows - segments[-1].rows, len(rows))
+                        segments[-1].append(self.vectors_at(rows[:take]))
+                        rows = rows[take:]
+                keep = np.concatenate([keep, tail])
+                rows_before = self.total_rows
+                self._swap_compacted(segments, keep)
+
+            stats = {
+                "rows_before": rows_before,
+                "rows_after": len(keep),
+                "removed_rows": rows_before - len(keep),
+                "bytes_before": bytes_before,
+                "bytes_after": self._disk_bytes(),
+                "seconds": round(time.perf_counter() - started, 3)
+            }
+            stats["reclaimed_bytes"] = stats["bytes_before"] - stats["bytes_after"]
+            self.last_compaction = stats
+            logger.info(
+                f"Compacted collection {self.name}: removed {stats['removed_rows']} rows, "
+                f"reclaimed {stats['reclaimed_bytes']} bytes in {stats['seconds']}s"
+            )
+            return stats
+
+    def _discard_segments(self, segments: List[VectorSegment]):
+        for segment in segments:
+            segment.close()
+            segment.path.unlink(missing_ok=True)
+
+    def _swap_compacted(self, segments: List[VectorSegment], keep: np.ndarray):
+        """（持锁）写出新文档存储、索引和编码，原子替换清单后切换到新文件并删除旧文件"""
+        for segment in segments:
+            segment.sync()
+        store_file = f"docs-{self._next_segment:06d}.sqlite"  # 与段文件共用编号计数器，不会与旧文件重名
+        self._next_segment += 1
+        (self.directory / store_file).unlink(missing_ok=True)
+        self._store.execute("ATTACH DATABASE ? AS compacted", (str(self.directory / store_file),))
+        self._store.execute(
+            "CREATE TABLE compacted.docs ("
+            "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT, norm REAL)"
+        )
+        self._store.execute("CREATE TEMP TABLE row_map (old INTEGER PRIMARY KEY, new INTEGER NOT NULL)")
+        self._store.executemany("INSERT INTO row_map VALUES (?, ?)", zip(keep.tolist(), range(len(keep))))
+        self._store.execute(
+            "INSERT INTO compacted.docs SELECT m.new, d.id, d.document, d.metadata, d.norm "
+            "FROM docs d JOIN row_map m ON m.old = d.row"
+        )
+        self._store.commit()
+        self._store.execute("DROP TABLE row_map")
+        self._store.execute("DETACH DATABASE compacted")
+
+        # 索引和编码按新行号写到临时位置；旧文件先删除，崩溃后由加载流程按当时的清单重建
+        temp_directory = self.directory / COMPACTION_DIRECTORY
+        index_params = None
+        if self.index is not None:
+            temp_directory.mkdir(exist_ok=True)
+            self._catch_up_index(save=False)
+            index_params = self.index.params()
+            self.index.remapped(temp_directory, self.vectors_at, keep)
+            self.index.remove_files()
+        codes = None
+        if self.codes is not None:
+            codes = self.codes.codes[keep] if self._compressed() else self.codes.codes[:0]
+            (self.directory / CODES_FILE).unlink(missing_ok=True)
+
+        entries = [{"op": "create", "metadata": self.metadata}, {"op": "dimension", "dimension": self.dimension}]
+        entries.append({"op": "storage", "storage": self.storage})
+        if index_params is not None:
+            entries.append({"op": "index", "params": index_params})
+        entries.append({"op": "store", "file": store_file})
+        entries.extend({"op": "segment", "file": segment.path.name, "rows": segment.rows} for segment in segments)
+        entries.append({"op": "checkpoint", "lsn": self.checkpoint_lsn, "count": int(self.alive[keep].sum())})
+        temp_manifest = self.directory / (MANIFEST_FILE + ".tmp")
+        with open(temp_manifest, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_manifest, self.directory / MANIFEST_FILE)
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+        # 切换到新文件
+        old_segments, old_store = self.segments, self.store_file
+        self.segments = segments
+        self._checkpointed_rows = {segment.path.name: segment.rows for segment in segments}
+        self._update_segment_ends()
+        self._store.close()
+        self.store_file = store_file
+        self._open_store()
+        if index_params is not None:
+            for path in temp_directory.iterdir():
+                os.replace(path, self.directory / path.name)
+            self.index = HNSWIndex.open(self.directory, self.vectors_at, **index_params)
+            self._catch_up_index()
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        if codes is not None:
+            self.codes.replace(codes)
+            self._catch_up_codes()
+        for segment in old_segments:
+            segment.close()
+            segment.path.unlink(missing_ok=True)
+        for path in self.directory.glob(f"{old_store}*"):
+            path.unlink()
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def matching_rows(self, where: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """满足 where 条件的有效行位图"""
+        if not where:
+            return self.alive
+        return self.metadata_index.evaluate(where, self.total_rows) & self.alive
+
+    def _normalized_queries(self, queries: Union[List[List[float]], np.ndarray]) -> np.ndarray:
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.dimension:
+            raise ValueError(f"Query dimension {queries.shape[-1]} does not match collection dimension {self.dimension}")
+        return queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-10)
+
+    def _candidates(self, where: Optional[Dict[str, Any]]):
+        """满足条件的有效行位图和行数"""
+        candidates = self.matching_rows(where)
+        return candidates, self.count() if candidates is self.alive else int(candidates.sum())
+
+    def search(
+        self,
+        query_embedding: Union[List[float], np.ndarray],
+        n_results: int = 10,
+        ef_search: Optional[int] = None,
+        exact: bool = False,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """余弦相似度 top-k：有索引且候选足够多时走 HNSW，否则精确搜索；
+        where 条件先由元数据索引求出候选行"""
+        with self._lock:
+            candidates, count = self._candidates(where)
+            if count == 0:
+                return []
+            query = self._normalized_queries(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+            return self._search_one(query, min(n_results, count), ef_search, exact, candidates, count)
+
+    def _uses_scan_path(self, count: int, exact: bool) -> bool:
+        """是否对全部行做未压缩的精确扫描（批量查询时可合并为一次矩阵乘法）"""
+        if self.index is not None and not exact and count >= self.exact_threshold:
+            return False
+        return not self._compressed() and count * 2 >= self.total_rows
+
+    def _search_one(
+        self,
+        query: np.ndarray,
+        k: int,
+        ef_search: Optional[int],
+        exact: bool,
+        candidates: np.ndarray,
+        count: int
+    ) -> List[Dict[str, Any]]:
+        """单个已归一化查询的 top-k（调用方持有锁，k 不超过候选数）"""
+        if self.index is not None and not exact and count >= self.exact_threshold:
+            found = self.index.search(query, k, ef_search, candidates if count < self.total_rows else None)
+            if len(found) == k:
+                return self._results([node for _, node in found], [similarity for similarity, _ in found])
+
+        # 候选较少时只对候选行打分，否则全量扫描后屏蔽非候选行
+        rows = np.flatnonzero(candidates) if count * 2 < self.total_rows else None
+        scores = self._scan(query, rows)
+        if rows is None and count < self.total_rows:
+            scores[~candidates] = -np.inf
+
+        if self._compressed():
+            # 编码近似打分选出候选，再从磁盘读取原始向量精排
+            top = _top_k(scores, min(count, k * self.codes.rerank_factor))
+            shortlist = np.sort(top if rows is None else rows[top])
+            exact_scores = self.vectors_at(shortlist) @ query
+            best = _top_k(exact_scores, k)
+            return self._results(shortlist[best].tolist(), exact_scores[best].tolist())
+
+        top = _top_k(scores, k)
+        return self._results((top if rows is None else rows[top]).tolist(), scores[top].tolist())
+
+    def search_batch(
+        self,
+        query_embeddings: Union[List[List[float]], np.ndarray],
+        n_results: List[int],
+        ef_search: Optional[int] = None,
+        exact: bool = False,
+        wheres: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """多个查询一次完成：走精确扫描的查询合并为每段一次矩阵乘法（段 x 查询），
+        其余（HNSW、压缩存储、候选很少）逐个搜索；相同过滤条件只求值一次"""
+        with self._lock:
+            results: List[List[Dict[str, Any]]] = [[] for _ in range(len(query_embeddings))]
+            if self.count() == 0:
+                return results
+            queries = self._normalized_queries(query_embeddings)
+            wheres = wheres or [None] * len(queries)
+            groups: Dict[str, List[int]] = {}
+            for i, where in enumerate(wheres):
+                groups.setdefault(json.dumps(where, sort_keys=True), []).append(i)
+
+            scanned = []  # (查询序号, k, 候选位图, 候选数)
+            for members in groups.values():
+                candidates, count = self._candidates(wheres[members[0]])
+                if count == 0:
+                    continue
+                for i in members:
+                    k = min(n_results[i], count)
+                    if self._uses_scan_path(count, exact):
+                        scanned.append((i, k, candidates, count))
+                    else:
+                        results[i] = self._search_one(queries[i], k, ef_search, exact, candidates, count)
+
+            if scanned:
+                matrix = queries[[i for i, _, _, _ in scanned]].T
+                best: List[List[Tuple[np.ndarray, np.ndarray]]] = [[] for _ in scanned]
+                offset = 0
+                for segment in self.segments:
+                    if segment.rows == 0:
+                        continue
+                    block = segment.vectors @ matrix  # (段内行数, 查询数)
+                    for j, (_, k, candidates, count) in enumerate(scanned):
+                        column = block[:, j]
+                        if count < self.total_rows:
+                            column[~candidates[offset:offset + segment.rows]] = -np.inf
+                        top = _top_k(column, min(k, segment.rows))
+                        best[j].append((top + offset, column[top]))
+                    offset += segment.rows
+                for j, (i, k, _, _) in enumerate(scanned):
+                    rows = np.concatenate([part[0] for part in best[j]])
+                    scores = np.concatenate([part[1] for part in best[j]])
+                    top = _top_k(scores, k)
+                    results[i] = self._results(rows[top].tolist(), scores[top].tolist())
+            return results
+
+    def _scan(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """对全部行（rows 为 None）或指定行打分：压缩存储下用编码近似打分，否则每个段一次矩阵向量乘法"""
+        if self._compressed():
+            codes = self.codes.codes if rows is None else self.codes.codes[rows]
+            return self.codes.codec.scores(codes, query)
+        if rows is not None:
+            return self.vectors_at(rows) @ query
+        scores = np.empty(self.total_rows, dtype=np.float32)
+        offset = 0
+        for segment in self.segments:
+            np.dot(segment.vectors, query, out=scores[offset:offset + segment.rows])
+            offset += segment.rows
+        return scores
+
+    def query(self, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """满足 where 条件的文档 ID 和元数据（不读取向量和文本）"""
+        with self._lock:
+            rows = np.flatnonzero(self.matching_rows(where)).tolist()
+            return [
+                {"id": doc_id, "metadata": json.loads(metadata)}
+                for doc_id, metadata in self._select_in("SELECT id, metadata FROM docs WHERE row IN", rows)
+            ]
+
+    def count_matching(self, where: Optional[Dict[str, Any]] = None) -> int:
+        """满足 where 条件的文档数"""
+        with self._lock:
+            return int(self.matching_rows(where).sum())
+
+    def value_counts(self, key: str) -> Dict[Any, int]:
+        """元数据键每个取值的文档数（直接由倒排索引计算）"""
+        with self._lock:
+            return self.metadata_index.value_counts(key, self.alive)
+
+    def _select_in(self, sql: str, values: List[Any]):
+        """分批执行 "... IN (?, ...)" 查询，逐行产出结果"""
+        for batch in _batches(values):
+            yield from self._store.execute(f"{sql} ({','.join('?' * len(batch))})", batch)
+
+    def _results(self, rows: List[int], similarities: List[float]) -> List[Dict[str, Any]]:
+        """行号和相似度 -> 搜索结果"""
+        records = self._fetch_rows(rows)
+        return [
+            {
+                "id": records[row]["id"],
+                "document": records[row]["document"],
+                "metadata": records[row]["metadata"],
+                "distance": float(1 - similarity)  # 转换为距离
+            }
+            for row, similarity in zip(rows, similarities)
+        ]
+
+    def _fetch_rows(self, rows: List[int]) -> Dict[int, Dict[str, Any]]:
+        """按行号读取文档"""
+        return {
+            row: {"id": doc_id, "document": document, "metadata": json.loads(metadata), "norm": norm}
+            for row, doc_id, document, metadata, norm in self._select_in(
+                "SELECT row, id, document, metadata, norm FROM docs WHERE row IN", rows
+            )
+        }
+
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """按 ID 读取文档，向量按保存的范数还原"""
+        with self._lock:
+            found = self._store.execute(
+                "SELECT row, document, metadata, norm FROM docs WHERE id = ?", (document_id,)
+            ).fetchone()
+            if found is None:
+                return None
+            row, document, metadata, norm = found
+            segment, index = self._locate(row)
+            return {
+                "id": document_id,
+                "document": document,
+                "metadata": json.loads(metadata),
+                "embedding": (np.asarray(segment.vectors[index]) * norm).tolist()
+            }
+
+    def close(self):
+        """关闭预写日志、文档存储和内存映射（不做检查点）"""
+        with self._lock:
+            self._closed = True
+            self.wal.close()
+            for segment in self.segments:
+                segment.close()
+            self._store.close()
+
+
+class CollectionEntry:
+    """目录中的一个集合；未加载时只有清单中的信息，由 SimpleVectorDB 按需加载"""
+
+    def __init__(self, directory: Path, manifest: Dict[str, Any]):
+        self.directory = directory
+        self.metadata: Dict[str, Any] = manifest["metadata"]
+        # 日志非空时检查点记录的文档数已过期，需要加载集合才能计数
+        wal = directory / WAL_FILE
+        self.document_count: Optional[int] = None if wal.exists() and wal.stat().st_size else manifest["document_count"]
+        rows = sum(manifest["segments"].values())
+        self.estimated_bytes = rows * ((manifest["dimension"] or 0) * 4 + ROW_OVERHEAD)
+        self.load_lock = threading.Lock()  # 加载和淘汰互斥
+        self.pins = 0  # 正在使用集合的调用数，大于 0 时不会被淘汰
+        self.score = 0.0  # 按 ACCESS_HALF_LIFE 衰减的访问次数
+        self.last_access = 0.0
+
+    def record_access(self, now: float):
+        self.score = self.score * 0.5 ** ((now - self.last_access) / ACCESS_HALF_LIFE) + 1
+        self.last_access = now
+
+    def decayed_score(self, now: float) -> float:
+        return self.score * 0.5 ** ((now - self.last_access) / ACCESS_HALF_LIFE)
+
 
 class SimpleVectorDB:
-    """简单的向量数据库实现"""
-    
-    def __init__(self, persist_directory: str = "./simple_vector_db"):
+    """简单的向量数据库实现
+
+    启动时只读取各集合的清单（目录），集合在第一次访问时加载；加载的集合按最近使用排序，
+    估计的常驻内存超过 memory_budget 时关闭最久未使用且没有在使用的集合。
+    访问次数（按天衰减）保存在 access_stats.json 中，启动后在后台预先加载最常访问的集合
+    """
+
+    def __init__(
+        self,
+        persist_directory: str = "./simple_vector_db",
+        segment_rows: int = SEGMENT_ROWS,
+        exact_threshold: int = EXACT_THRESHOLD,
+        wal_sync_interval_ms: int = SYNC_INTERVAL_MS,
+        wal_sync_records: int = SYNC_RECORDS,
+        checkpoint_bytes: int = CHECKPOINT_BYTES,
+        checkpoint_interval: float = CHECKPOINT_INTERVAL,
+        compaction_threshold: float = COMPACTION_THRESHOLD,
+        compaction_min_rows: int = COMPACTION_MIN_ROWS,
+        compaction_rate: Optional[float] = COMPACTION_RATE,
+        compaction_check_interval: float = COMPACTION_CHECK_INTERVAL,
+        memory_budget: Optional[int] = MEMORY_BUDGET,
+        prewarm_collections: int = PREWARM_COLLECTIONS
+    ):
+        """
+        wal_sync_interval_ms / wal_sync_records: 预写日志的组提交条件（先满足的一个触发 fsync）
+        checkpoint_bytes / checkpoint_interval: 后台检查点的触发条件（日志大小 / 最长间隔秒数）
+        compaction_threshold / compaction_min_rows: 后台压缩的触发条件（墓碑比例 / 最少墓碑行数）
+        compaction_rate: 压缩复制向量的限速（字节/秒，None 不限速）
+        memory_budget: 加载的集合估计常驻内存的上限（字节，None 不限制）
+        prewarm_collections: 启动后在后台预先加载的最常访问集合数（0 不预热）
+        """
         self.persist_directory = Path(persist_directory)
         self.persist_directory.mkdir(parents=True, exist_ok=True)
-        self.collections = {}
+        self.collection_options = {
+            "segment_rows": segment_rows,
+            "exact_threshold": exact_threshold,
+            "wal_sync_interval_ms": wal_sync_interval_ms,
+            "wal_sync_records": wal_sync_records
+        }
+        self.wal_sync_interval = wal_sync_interval_ms / 1000
+        self.checkpoint_bytes = checkpoint_bytes
+        self.checkpoint_interval = checkpoint_interval
+        self.compaction_threshold = compaction_threshold
+        self.compaction_min_rows = compaction_min_rows
+        self.compaction_rate = compaction_rate
+        self.compaction_check_interval = compaction_check_interval
+        self.memory_budget = memory_budget
+        self.catalog: Dict[str, CollectionEntry] = {}
+        self.collections: "OrderedDict[str, SegmentedCollection]" = OrderedDict()  # 已加载的集合，最近使用的在后
+        self._catalog_lock = threading.RLock()
+        self._stats_dirty = False
         self._load_collections()
-    
-    def create_collection(self, name: str, metadata: Dict[str, Any] = None):
-        """创建集合"""
-        if name not in self.collections:
-            self.collections[name] = {
-                "vectors": [],
-                "documents": [],
-                "metadatas": [],
-                "ids": [],
-                "metadata": metadata or {}
+        self._stop = threading.Event()
+        self._background = threading.Thread(target=self._run_background, name="simple-vector-db-wal", daemon=True)
+        self._background.start()
+        self._compactor = threading.Thread(target=self._run_compaction, name="simple-vector-db-compaction", daemon=True)
+        self._compactor.start()
+        self._prewarmer = threading.Thread(
+            target=self.prewarm, args=(prewarm_collections,), name="simple-vector-db-prewarm", daemon=True
+        )
+        self._prewarmer.start()
+
+    # ------------------------------------------------------------------
+    # 加载与淘汰
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def _use(self, name: str, record: bool = True) -> Iterator[SegmentedCollection]:
+        """取得集合（未加载时先加载），使用期间不会被淘汰；record=False 时不计入访问统计"""
+        with self._catalog_lock:
+            entry = self.catalog.get(name)
+            if entry is None:
+                raise ValueError(f"Collection {name} not found")
+            entry.pins += 1
+            if record:
+                entry.record_access(time.time())
+                self._stats_dirty = True
+        try:
+            collection = self.collections.get(name)
+            if collection is None:
+                with entry.load_lock:
+                    collection = self.collections.get(name)
+                    if collection is None:
+                        started = time.perf_counter()
+                        collection = SegmentedCollection(entry.directory, **self.collection_options)
+                        with self._catalog_lock:
+                            self.collections[name] = collection
+                        logger.info(
+                            f"Loaded collection {name} ({collection.total_rows} rows) "
+                            f"in {time.perf_counter() - started:.3f}s"
+                        )
+            with self._catalog_lock:
+                if name in self.collections:
+                    self.collections.move_to_end(name)
+            yield collection
+        finally:
+            with self._catalog_lock:
+                entry.pins -= 1
+            self._evict()
+
+    def _evict(self):
+        """估计的常驻内存超过预算时，从最久未使用的开始关闭没有在使用的集合（最近使用的一个保留）"""
+        if self.memory_budget is None:
+            return
+        victims = []
+        with self._catalog_lock:
+            used = sum(collection.memory_bytes() for collection in self.collections.values())
+            loaded = list(self.collections.items())
+            for name, collection in loaded[:-1]:
+                if used <= self.memory_budget:
+                    break
+                entry = self.catalog[name]
+                if entry.pins or not entry.load_lock.acquire(blocking=False):
+                    continue
+                del self.collections[name]
+                used -= collection.memory_bytes()
+                victims.append((name, entry, collection))
+        for name, entry, collection in victims:
+            try:
+                collection.checkpoint()
+                entry.metadata = collection.metadata
+                entry.document_count = collection.count()
+                entry.estimated_bytes = collection.memory_bytes()
+                collection.close()
+                logger.info(f"Evicted collection {name} ({entry.estimated_bytes} bytes) to stay within the memory budget")
+            finally:
+                entry.load_lock.release()
+
+    def prewarm(self, limit: int = PREWARM_COLLECTIONS):
+        """按衰减后的访问次数预先加载最常访问的集合，不超出内存预算"""
+        now = time.time()
+        with self._catalog_lock:
+            ranked = sorted(
+                ((entry.decayed_score(now), name) for name, entry in self.catalog.items() if entry.score > 0),
+                reverse=True
+            )[:limit]
+        for _, name in ranked:
+            if self._stop.is_set():
+                return
+            with self._catalog_lock:
+                entry = self.catalog.get(name)
+                if entry is None or name in self.collections:
+                    continue
+                used = sum(collection.memory_bytes() for collection in self.collections.values())
+            if self.memory_budget is not None and used + entry.estimated_bytes > self.memory_budget:
+                continue
+            try:
+                with self._use(name, record=False):
+                    pass
+            except Exception as e:
+                logger.warning(f"Failed to prewarm collection {name}: {e}")
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """内存预算、已加载集合（按最近使用排序）的估计常驻内存和各集合的访问统计"""
+        now = time.time()
+        with self._catalog_lock:
+            loaded = {name: collection.memory_bytes() for name, collection in self.collections.items()}
+            return {
+                "memory_budget": self.memory_budget,
+                "resident_bytes": sum(loaded.values()),
+                "loaded": list(loaded),
+                "collections": {
+                    name: {
+                        "loaded": name in loaded,
+                        "memory_bytes": loaded.get(name, entry.estimated_bytes),
+                        "access_score": round(entry.decayed_score(now), 3),
+                        "last_access": entry.last_access or None
+                    }
+                    for name, entry in self.catalog.items()
+                }
             }
-            self._save_collection(name)
-        return self.collections[name]
-    
-    def add_documents(self, collection_name: str, documents: List[str], 
-                     embeddings: List[List[float]], metadatas: List[Dict[str, Any]] = None,
+
+    def _loaded(self) -> List[Tuple[str, SegmentedCollection]]:
+        with self._catalog_lock:
+            return list(self.collections.items())
+
+    def _load_access_stats(self):
+        path = self.persist_directory / ACCESS_STATS_FILE
+        if not path.exists():
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable access stats {path}: {e}")
+            return
+        for name, values in stats.items():
+            if name in self.catalog:
+                self.catalog[name].score = values["score"]
+                self.catalog[name].last_access = values["last_access"]
+
+    def _save_access_stats(self):
+        """访问统计有变化时写入 access_stats.json（先写临时文件再替换）"""
+        with self._catalog_lock:
+            if not self._stats_dirty:
+                return
+            self._stats_dirty = False
+            stats = {
+                name: {"score": entry.score, "last_access": entry.last_access}
+                for name, entry in self.catalog.items() if entry.score > 0
+            }
+        path = self.persist_directory / ACCESS_STATS_FILE
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f)
+        os.replace(temp_path, path)
+
+    # ------------------------------------------------------------------
+    # 后台维护
+    # ------------------------------------------------------------------
+
+    def _run_background(self):
+        """后台线程：到期的日志刷盘，满足条件的集合做检查点，定期保存访问统计"""
+        last_stats_save = time.monotonic()
+        while not self._stop.wait(self.wal_sync_interval):
+            for name, collection in self._loaded():
+                try:
+                    collection.wal.sync_if_due()
+                    if collection.checkpoint_due(self.checkpoint_bytes, self.checkpoint_interval):
+                        collection.checkpoint()
+                except Exception as e:
+                    if self.collections.get(name) is collection:
+                        logger.error(f"Background WAL maintenance failed for collection {name}: {e}")
+            if time.monotonic() - last_stats_save >= STATS_SAVE_INTERVAL:
+                last_stats_save = time.monotonic()
+                try:
+                    self._save_access_stats()
+                except OSError as e:
+                    logger.error(f"Failed to save collection access stats: {e}")
+
+    def _run_compaction(self):
+        """后台线程：依次压缩墓碑过多的已加载集合（一次一个，限速）"""
+        while not self._stop.wait(self.compaction_check_interval):
+            for name, collection in self._loaded():
+                if self._stop.is_set():
+                    return
+                try:
+                    if collection.compaction_due(self.compaction_threshold, self.compaction_min_rows):
+                        with self._use(name, record=False) as pinned:
+                            pinned.compact(self.compaction_rate, self._stop)
+                except Exception as e:
+                    logger.error(f"Background compaction failed for collection {name}: {e}")
+
+    def compact(self, name: str, rate: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """立即压缩集合（默认不限速），返回行数、磁盘字节数和耗时的统计；没有墓碑时返回 None"""
+        with self._use(name, record=False) as collection:
+            return collection.compact(rate)
+
+    def checkpoint(self, name: Optional[str] = None):
+        """立即对集合（默认全部已加载的集合）做检查点"""
+        if name:
+            with self._use(name, record=False) as collection:
+                collection.checkpoint()
+            return
+        for _, collection in self._loaded():
+            collection.checkpoint()
+
+    def close(self):
+        """停止后台线程，做检查点后关闭所有集合，保存访问统计"""
+        self._stop.set()
+        for thread in (self._background, self._compactor, self._prewarmer):
+            thread.join()
+        with self._catalog_lock:
+            loaded, self.collections = list(self.collections.values()), OrderedDict()
+        for collection in loaded:
+            collection.checkpoint()
+            collection.close()
+        self._save_access_stats()
+
+    # ------------------------------------------------------------------
+    # 集合
+    # ------------------------------------------------------------------
+
+    def create_collection(self, name: str, metadata: Dict[str, Any] = None) -> SegmentedCollection:
+        """创建集合"""
+        with self._catalog_lock:
+            if name not in self.catalog:
+                directory = self.persist_directory / name
+                collection = SegmentedCollection.create(directory, metadata or {}, **self.collection_options)
+                self.catalog[name] = CollectionEntry(directory, read_manifest(directory))
+                self.collections[name] = collection
+        with self._use(name) as collection:
+            return collection
+
+    def add_documents(self, collection_name: str, documents: List[str],
+                     embeddings: Union[List[List[float]], np.ndarray], metadatas: List[Dict[str, Any]] = None,
                      ids: List[str] = None):
-        """添加文档"""
-        if collection_name not in self.collections:
-            raise ValueError(f"Collection {collection_name} not found")
-        
-        collection = self.collections[collection_name]
-        n_docs = len(documents)
-        
-        if ids is None:
-            ids = [f"doc_{len(collection['ids']) + i}" for i in range(n_docs)]
-        
-        if metadatas is None:
-            metadatas = [{} for _ in range(n_docs)]
-        
-        collection["documents"].extend(documents)
-        collection["vectors"].extend(embeddings)
-        collection["metadatas"].extend(metadatas)
-        collection["ids"].extend(ids)
-        
-        self._save_collection(collection_name)
-        return ids
-    
-    def search(self, collection_name: str, query_embedding: List[float], 
-              n_results: int = 10) -> Dict[str, List[Any]]:
-        """搜索相似文档"""
-        if collection_name not in self.collections:
-            raise ValueError(f"Collection {collection_name} not found")
-        
-        collection = self.collections[collection_name]
-        if not collection["vectors"]:
-            return {"results": []}
-        
-        # 计算余弦相似度
-        query_vec = np.array(query_embedding)
-        vectors = np.array(collection["vectors"])
-        
-        # 归一化
-        query_norm = query_vec / (np.linalg.norm(query_vec) + 1e-10)
-        vectors_norm = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-10)
-        
-        # 计算相似度
-        similarities = np.dot(vectors_norm, query_norm)
-        
-        # 获取top-k结果
-        top_indices = np.argsort(similarities)[::-1][:n_results]
-        
-        results = []
-        for idx in top_indices:
-            results.append({
-                "id": collection["ids"][idx],
-                "document": collection["documents"][idx],
-                "metadata": collection["metadatas"][idx],
-                "distance": float(1 - similarities[idx])  # 转换为距离
-            })
-        
-        return {"results": results}
-    
+        """添加文档（embeddings 可以是 (n, dim) 的 float32 数组）"""
+        with self._use(collection_name) as collection:
+            n_docs = len(documents)
+
+            if ids is None:
+                ids = [f"doc_{collection.total_rows + i}" for i in range(n_docs)]
+
+            if metadatas is None:
+                metadatas = [{} for _ in range(n_docs)]
+
+            new_vectors = as_vector_matrix(embeddings)
+            if len(new_vectors) != n_docs:
+                raise ValueError(f"Got {len(new_vectors)} embeddings for {n_docs} documents")
+            if n_docs == 0:
+                return []
+
+            return collection.add(documents, new_vectors, metadatas, ids)
+
+    def search(self, collection_name: str, query_embedding: Union[List[float], np.ndarray],
+              n_results: int = 10, ef_search: Optional[int] = None, exact: bool = False,
+              where: Optional[Dict[str, Any]] = None) -> Dict[str, List[Any]]:
+        """搜索相似文档；ef_search 覆盖索引的默认搜索宽度，exact=True 时强制精确搜索，
+        where 为 Chroma 风格的元数据过滤条件（$and/$or/$eq/$ne/$in/$nin/$gt/$gte/$lt/$lte）"""
+        with self._use(collection_name) as collection:
+            return {"results": collection.search(query_embedding, n_results, ef_search, exact, where)}
+
+    def search_batch(self, collection_name: str, query_embeddings: Union[List[List[float]], np.ndarray],
+                     n_results: Union[int, List[int]] = 10, ef_search: Optional[int] = None, exact: bool = False,
+                     wheres: Optional[List[Optional[Dict[str, Any]]]] = None) -> List[Dict[str, List[Any]]]:
+        """批量搜索；n_results 和 wheres 可以按查询分别指定，返回与查询一一对应的结果"""
+        query_count = len(query_embeddings)
+        if isinstance(n_results, int):
+            n_results = [n_results] * query_count
+        if len(n_results) != query_count or (wheres is not None and len(wheres) != query_count):
+            raise ValueError("n_results and wheres must have one entry per query")
+        if query_count == 0:
+            return []
+        with self._use(collection_name) as collection:
+            batches = collection.search_batch(query_embeddings, n_results, ef_search, exact, wheres)
+        return [{"results": results} for results in batches]
+
+    def query(self, collection_name: str, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """按元数据条件列出文档 ID 和元数据"""
+        with self._use(collection_name) as collection:
+            return collection.query(where)
+
+    def value_counts(self, collection_name: str, key: str) -> Dict[Any, int]:
+        """元数据键每个取值的文档数"""
+        with self._use(collection_name) as collection:
+            return collection.value_counts(key)
+
+    def create_index(self, collection_name: str, M: int = 16, ef_construction: int = 200, ef_search: int = 64):
+        """为集合建立 HNSW 索引，之后的 add_documents 增量更新索引"""
+        with self._use(collection_name) as collection:
+            collection.create_index(M=M, ef_construction=ef_construction, ef_search=ef_search)
+
+    def drop_index(self, collection_name: str):
+        """删除集合的 HNSW 索引"""
+        with self._use(collection_name) as collection:
+            collection.drop_index()
+
+    def set_storage_mode(self, collection_name: str, mode: str, rerank_factor: int = RERANK_FACTOR, **params):
+        """设置集合的向量存储模式：float32（默认）、float16、int8 或 pq（可传 subspaces）"""
+        with self._use(collection_name) as collection:
+            collection.set_storage_mode(mode, rerank_factor, **params)
+
+    def storage_stats(self, collection_name: str) -> Dict[str, Any]:
+        """集合的存储模式和向量常驻内存大小"""
+        with self._use(collection_name, record=False) as collection:
+            return collection.storage_stats()
+
+    def get_document(self, collection_name: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """获取文档"""
+        with self._use(collection_name) as collection:
+            return collection.get(document_id)
+
+    def delete_documents(self, collection_name: str, document_ids: List[str]) -> int:
+        """删除文档，返回实际删除的数量"""
+        with self._use(collection_name) as collection:
+            return collection.delete(document_ids)
+
+    def update_document(
+        self,
+        collection_name: str,
+        document_id: str,
+        document: Optional[str] = None,
+        embedding: Optional[Union[List[float], np.ndarray]] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """更新文档，文档不存在时返回 False"""
+        with self._use(collection_name) as collection:
+            return collection.update(document_id, document, embedding, metadata)
+
+    def get_collection_metadata(self, name: str) -> Dict[str, Any]:
+        """集合元数据（未加载的集合从目录读取，不触发加载）"""
+        with self._catalog_lock:
+            if name in self.collections:
+                return self.collections[name].metadata
+            if name not in self.catalog:
+                raise ValueError(f"Collection {name} not found")
+            return self.catalog[name].metadata
+
+    def set_collection_metadata(self, name: str, metadata: Dict[str, Any]):
+        """替换集合元数据"""
+        with self._use(name, record=False) as collection:
+            collection.set_metadata(metadata)
+            self.catalog[name].metadata = metadata
+
+    def count(self, name: str, where: Optional[Dict[str, Any]] = None) -> int:
+        """集合中（满足 where 条件）的文档数；未加载的集合在检查点记录了文档数时不触发加载"""
+        with self._catalog_lock:
+            entry = self.catalog.get(name)
+            if not where and name not in self.collections and entry is not None and entry.document_count is not None:
+                return entry.document_count
+        with self._use(name, record=False) as collection:
+            return collection.count_matching(where)
+
     def delete_collection(self, name: str):
         """删除集合"""
-        if name in self.collections:
-            del self.collections[name]
-            collection_file = self.persist_directory / f"{name}.pkl"
-            if collection_file.exists():
-                collection_file.unlink()
-    
+        with self._catalog_lock:
+            entry = self.catalog.pop(name, None)
+        if entry is None:
+            return
+        with entry.load_lock:
+            with self._catalog_lock:
+                collection = self.collections.pop(name, None)
+            if collection is not None:
+                collection.close()
+            shutil.rmtree(entry.directory)
+        self._stats_dirty = True
+
     def list_collections(self) -> List[str]:
         """列出所有集合"""
-        return list(self.collections.keys())
-    
-    def _save_collection(self, name: str):
-        """保存集合到文件"""
-        collection_file = self.persist_directory / f"{name}.pkl"
-        with open(collection_file, "wb") as f:
-            pickle.dump(self.collections[name], f)
-    
+        with self._catalog_lock:
+            return list(self.catalog.keys())
+
     def _load_collections(self):
-        """从文件加载集合"""
+        """读取各集合的清单建立目录（不加载向量和文档存储）；旧版的 pickle 文件转换为分段格式"""
+        for directory in sorted(self.persist_directory.iterdir()):
+            if (directory / MANIFEST_FILE).exists():
+                self.catalog[directory.name] = CollectionEntry(directory, read_manifest(directory))
+        self._load_access_stats()
+
         for collection_file in self.persist_directory.glob("*.pkl"):
-            name = collection_file.stem
-            with open(collection_file, "rb") as f:
-                self.collections[name] = pickle.load(f)
+            self._convert_legacy(collection_file)
+
+    def _convert_legacy(self, collection_file: Path):
+        """把旧版 pickle 集合（向量为列表或矩阵）写入新格式，原文件改名保留"""
+        name = collection_file.stem
+        with open(collection_file, "rb") as f:
+            legacy = pickle.load(f)
+        if name not in self.catalog:
+            self.create_collection(name, legacy.get("metadata", {}))
+            if legacy["ids"]:
+                with self._use(name, record=False) as collection:
+                    collection.add(legacy["documents"], as_vector_matrix(legacy["vectors"]), legacy["metadatas"], legacy["ids"])
+        collection_file.rename(collection_file.with_suffix(".pkl.migrated"))
+        logger.info(f"Converted legacy collection {name} ({len(legacy['ids'])} documents)")
 
 # 全局实例
 _simple_db = None
@@ -0,0 +1,207 @@
+"""
+向量压缩编码（供 SimpleVectorDB 的存储模式使用）
+压缩后的编码常驻内存用于近似打分，原始 float32 向量仍保存在磁盘上的向量段中，只用于精排候选
+
+    float16   每维 2 字节，直接转换
+    int8      每维 1 字节，按维度的最小值/步长做标量量化
+    pq        乘积量化：向量切成 m 个子空间，每个子空间 256 个中心，每个向量 m 字节；
+              查询时先算每个子空间到各中心的内积表，再按编码查表求和（非对称距离计算）
+"""
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+SCORE_CHUNK_ROWS = 4096  # 分块解码打分，解码后的块留在 CPU 缓存中
+
+
+class VectorCodec:
+    """编码器基类"""
+
+    mode = ""
+    dtype = np.float32
+    min_train_rows = 0  # 至少有这么多行才训练，之前仍用 float32 精确搜索
+    train_sample_rows = 50000  # 训练时最多抽样的行数
+    retrain_growth = 0  # 行数增长到训练时的这么多倍后重新训练并重新编码全部行（0 不重新训练）
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.trained = self.min_train_rows == 0
+        self.trained_rows = 0  # 训练时集合的行数
+
+    def needs_retrain(self, rows: int) -> bool:
+        """训练后行数增长了 retrain_growth 倍，训练时的样本已不能代表整个集合"""
+        return self.trained and self.retrain_growth > 0 and rows >= self.trained_rows * self.retrain_growth
+
+    @property
+    def code_width(self) -> int:
+        """每个向量的编码元素个数"""
+        return self.dimension
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.code_width * np.dtype(self.dtype).itemsize
+
+    def train(self, sample: np.ndarray):
+        self.trained = True
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _score_chunk(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def prepare(self, query: np.ndarray) -> Any:
+        """每次查询只计算一次的数据（如 PQ 的内积表）"""
+        return query
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """近似内积"""
+        prepared = self.prepare(query)
+        result = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+            result[start:start + SCORE_CHUNK_ROWS] = self._score_chunk(codes[start:start + SCORE_CHUNK_ROWS], prepared)
+        return result
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """需要持久化的训练结果"""
+        return {}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        self.trained = True
+
+
+class Float16Codec(VectorCodec):
+    """半精度存储"""
+
+    mode = "float16"
+    dtype = np.float16
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.astype(np.float16)
+
+    def _score_chunk(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) @ query
+
+
+class ScalarInt8Codec(VectorCodec):
+    """
+    按维度的 8 位标量量化：x ≈ low + scale * code
+    范围取自训练样本，超出范围的值饱和到 0 或 255，因此样本太少时不训练，集合明显变大后重新训练
+    """
+
+    mode = "int8"
+    dtype = np.uint8
+    min_train_rows = 256
+    retrain_growth = 4
+
+    def __init__(self, dimension: int):
+        super().__init__(dimension)
+        self.low = np.zeros(dimension, dtype=np.float32)
+        self.scale = np.ones(dimension, dtype=np.float32)
+
+    def train(self, sample: np.ndarray):
+        self.low = sample.min(axis=0)
+        self.scale = np.maximum(sample.max(axis=0) - self.low, 1e-6) / 255
+        self.trained = True
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint((vectors - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def prepare(self, query: np.ndarray):
+        return float(query @ self.low), (query * self.scale).astype(np.float32)
+
+    def _score_chunk(self, codes: np.ndarray, prepared) -> np.ndarray:
+        offset, scaled = prepared
+        return codes.astype(np.float32) @ scaled + offset
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "scale": self.scale}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        self.low, self.scale = state["low"], state["scale"]
+        self.trained = True
+
+
+def kmeans(data: np.ndarray, clusters: int, iterations: int = 15, seed: int = 0) -> np.ndarray:
+    """Lloyd k-means，空簇用随机样本重新初始化"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), clusters, replace=len(data) < clusters)].copy()
+    data_norms = (data ** 2).sum(axis=1)
+    for _ in range(iterations):
+        distances = data_norms[:, None] - 2 * data @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+        labels = distances.argmin(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        counts = np.bincount(labels, minlength=clusters)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()))]
+    return centroids
+
+
+class ProductQuantizer(VectorCodec):
+    """乘积量化：m 个子空间 x 256 个中心，编码为 m 个 uint8"""
+
+    mode = "pq"
+    dtype = np.uint8
+    min_train_rows = 1024
+    train_sample_rows = 16384
+    clusters = 256
+
+    def __init__(self, dimension: int, subspaces: Optional[int] = None):
+        super().__init__(dimension)
+        if subspaces is None:
+            subspaces = next(m for m in (dimension // 8, dimension // 4, dimension // 2, dimension) if m and dimension % m == 0)
+        if dimension % subspaces:
+            raise ValueError(f"Dimension {dimension} is not divisible into {subspaces} subspaces")
+        self.subspaces = subspaces
+        self.sub_dimension = dimension // subspaces
+        self.centroids = np.zeros((subspaces, self.clusters, self.sub_dimension), dtype=np.float32)
+        self._offsets = np.arange(subspaces, dtype=np.uint16) * self.clusters
+
+    @property
+    def code_width(self) -> int:
+        return self.subspaces
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.reshape(len(vectors), self.subspaces, self.sub_dimension)
+
+    def train(self, sample: np.ndarray):
+        parts = self._split(sample)
+        for m in range(self.subspaces):
+            self.centroids[m] = kmeans(np.ascontiguousarray(parts[:, m]), self.clusters, seed=m)
+        self.trained = True
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self._split(vectors)
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for m in range(self.subspaces):
+            centroids = self.centroids[m]
+            distances = -2 * parts[:, m] @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+            codes[:, m] = distances.argmin(axis=1)
+        return codes
+
+    def prepare(self, query: np.ndarray) -> np.ndarray:
+        # 内积表：table[m, c] = <query 的第 m 段, 第 m 个子空间的第 c 个中心>，展平后按编码 + 偏移查表
+        return np.einsum("mcd,md->mc", self.centroids, query.reshape(self.subspaces, self.sub_dimension)).ravel()
+
+    def _score_chunk(self, codes: np.ndarray, table: np.ndarray) -> np.ndarray:
+        return np.take(table, codes + self._offsets).sum(axis=1, dtype=np.float32)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        self.centroids = state["centroids"]
+        self.trained = True
+
+
+CODECS = {codec.mode: codec for codec in (Float16Codec, ScalarInt8Codec, ProductQuantizer)}
+
+
+def create_codec(mode: str, dimension: int, **params) -> VectorCodec:
+    """按存储模式名创建编码器"""
+    if mode not in CODECS:
+        raise ValueError(f"Unknown storage mode {mode}, expected one of float32, {', '.join(CODECS)}")
+    return CODECS[mode](dimension, **params)
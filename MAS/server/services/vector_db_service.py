@@ -1,17 +1,77 @@
 import chromadb
 from chromadb.config import Settings
+import json
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Union
 import uuid
 from datetime import datetime
 import os
 
+import numpy as np
+
+from server.services.kb_catalog import KBCatalog, CATALOG_FILE
+from server.services.kb_routing import KBRoutingIndex
+from server.services.lexical_index import LexicalIndex, LEXICAL_INDEX_FILE
+
 logger = logging.getLogger(__name__)
 
+# 向量参数既可以是列表，也可以是 float32 numpy 数组（嵌入管理器的原生输出）
+Embeddings = Union[List[List[float]], np.ndarray]
+Embedding = Union[List[float], np.ndarray]
+
+
+# 集合元数据中记录生成向量的嵌入模型和维度
+EMBEDDING_MODEL_KEY = "embedding_model"
+EMBEDDING_DIMENSION_KEY = "embedding_dimension"
+
+# 重新嵌入迁移使用的影子集合名前缀；切换后通过别名映射到原知识库 ID
+SHADOW_PREFIX = "mig_"
+DEFAULT_PERSIST_DIRECTORY = "./chroma_db"  # 默认数据目录，知识库之外的持久化数据（如嵌入缓存）也放在这里
+ALIASES_FILE = "collection_aliases.json"
+ROUTING_DIRECTORY = "kb_routing"
+ROUTING_REBUILD_PAGE = 1000  # 重建路由画像和词法索引时每次读取的文档数
+
+
+def to_embedding_list(embeddings: Union[Embeddings, Embedding]) -> list:
+    """ChromaDB 只接受列表形式的向量，只在这一边界上把 numpy 数组转换为列表"""
+    if isinstance(embeddings, np.ndarray):
+        return embeddings.tolist()
+    return embeddings
+
+
+def format_query_results(results: Dict[str, Any], position: int) -> Dict[str, Any]:
+    """collection.query 返回的第 position 个查询的结果"""
+    formatted_results = []
+    if results['ids'] and results['ids'][position]:
+        for i in range(len(results['ids'][position])):
+            formatted_results.append({
+                "id": results['ids'][position][i],
+                "document": results['documents'][position][i] if results['documents'] else "",
+                "metadata": results['metadatas'][position][i] if results['metadatas'] else {},
+                "distance": results['distances'][position][i] if results['distances'] else 0
+            })
+    return {
+        "results": formatted_results,
+        "total": len(formatted_results)
+    }
+
+
+def embedding_stamp(model_name: str, dimension: int) -> Dict[str, Any]:
+    """集合的嵌入模型标记"""
+    return {EMBEDDING_MODEL_KEY: model_name, EMBEDDING_DIMENSION_KEY: int(dimension)}
+
+
+class EmbeddingModelMismatchError(ValueError):
+    """写入的向量与集合标记的嵌入模型不一致"""
+
+
 class VectorDBService:
     """向量数据库服务（使用 ChromaDB）"""
     
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    def __init__(self, persist_directory: str = DEFAULT_PERSIST_DIRECTORY):
         """初始化 ChromaDB"""
         try:
             # 确保目录存在
@@ -27,8 +87,30 @@ class VectorDBService:
             )
             logger.info(f"ChromaDB initialized with persist directory: {persist_directory}")
             
+            self.persist_directory = persist_directory
+            
+            # 知识库 ID -> 实际的 ChromaDB 集合名（迁移切换后不同）
+            self._aliases_path = os.path.join(persist_directory, ALIASES_FILE)
+            self._aliases: Dict[str, str] = self._load_aliases()
+            # 每个知识库一把写锁，迁移切换时与写入互斥
+            self._locks: Dict[str, threading.RLock] = defaultdict(threading.RLock)
+            self._locks_guard = threading.Lock()
+            # 知识库 ID -> 写入代数（进程内单调递增），搜索结果缓存以它为键的一部分
+            self._generations: Dict[str, int] = defaultdict(int)
+            self._generations_guard = threading.Lock()
+            
+            # 集合级元数据保存在知识库目录中
+            self.catalog = KBCatalog(os.path.join(persist_directory, CATALOG_FILE))
+            self.routing = KBRoutingIndex(os.path.join(persist_directory, ROUTING_DIRECTORY))
+            # 路由画像在后台单线程重建（需要读取知识库的全部向量，不放在查询路径上）
+            self._routing_rebuilder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-routing-rebuild")
+            self._routing_pending: set = set()
+            self._routing_pending_guard = threading.Lock()
+            self.lexical = LexicalIndex(os.path.join(persist_directory, LEXICAL_INDEX_FILE))
+            
             # 获取或创建默认集合
             self._ensure_default_collection()
+            self._sync_catalog()
             
         except Exception as e:
             logger.error(f"Failed to initialize ChromaDB: {e}")
@@ -55,6 +137,191 @@ class VectorDBService:
         except Exception as e:
             logger.error(f"Failed to create default collection: {e}")
     
+    def _sync_catalog(self):
+        """把目录中缺少的集合（旧版本创建的）从 ChromaDB 元数据补入，删除已不存在的集合"""
+        logical_names = self._logical_names()
+        existing = set()
+        catalog_ids = set(self.catalog.ids())
+        for collection in self.client.list_collections():
+            collection_id = logical_names.get(collection.name, collection.name)
+            if collection_id.startswith(SHADOW_PREFIX):
+                continue
+            existing.add(collection_id)
+            if collection_id not in catalog_ids:
+                metadata = dict(collection.metadata or {})
+                metadata.setdefault("display_name", collection_id)
+                self.catalog.put(collection_id, metadata, collection.count())
+                logger.info(f"Added collection {collection_id} to the knowledge base catalog")
+        for collection_id in catalog_ids - existing:
+            self.catalog.delete(collection_id)
+    
+    def get_kb_metadata(self, kb_id: str) -> Dict[str, Any]:
+        """知识库的集合级元数据（来自目录）；不存在时抛出 ValueError"""
+        entry = self.catalog.get(kb_id)
+        if entry is None:
+            raise ValueError(f"Collection {kb_id} does not exist.")
+        return entry["metadata"]
+    
+    def update_kb_metadata(self, kb_id: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """合并更新知识库元数据，返回更新后的元数据"""
+        try:
+            metadata = self.catalog.update(kb_id, changes)
+        except KeyError:
+            raise ValueError(f"Collection {kb_id} does not exist.")
+        # 同步写回集合元数据（只改一行，不触及向量），目录丢失时仍可据此重建
+        collection = self.get_collection(kb_id)
+        collection_metadata = dict(collection.metadata or {})
+        collection_metadata.update(changes)
+        collection.modify(metadata=collection_metadata)
+        self._bump_generation(kb_id)
+        logger.info(f"Updated catalog metadata of {kb_id}: {sorted(changes)}")
+        return metadata
+    
+    def _load_aliases(self) -> Dict[str, str]:
+        """读取集合别名映射"""
+        if not os.path.exists(self._aliases_path):
+            return {}
+        try:
+            with open(self._aliases_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load collection aliases: {e}")
+            return {}
+    
+    def _save_aliases(self):
+        """原子地写入别名映射（先写临时文件再替换）"""
+        tmp_path = self._aliases_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._aliases, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._aliases_path)
+    
+    def _physical_name(self, name: str) -> str:
+        """知识库 ID 对应的 ChromaDB 集合名"""
+        return self._aliases.get(name, name)
+    
+    def _logical_names(self) -> Dict[str, str]:
+        """ChromaDB 集合名 -> 知识库 ID"""
+        return {physical: logical for logical, physical in self._aliases.items()}
+    
+    def collection_lock(self, name: str) -> threading.RLock:
+        """知识库的写锁"""
+        with self._locks_guard:
+            return self._locks[name]
+    
+    def write_generation(self, name: str) -> int:
+        """知识库的写入代数：每次增删改文档、改元数据（如发布）、迁移切换或删除后加一"""
+        with self._generations_guard:
+            return self._generations[name]
+    
+    def _bump_generation(self, name: str):
+        """写入完成后调用，使按旧代数缓存的搜索结果不再被查到"""
+        with self._generations_guard:
+            self._generations[name] += 1
+    
+    def get_collection(self, name: str):
+        """按知识库 ID 获取 ChromaDB 集合（解析迁移后的别名）"""
+        return self.client.get_collection(name=self._physical_name(name))
+    
+    def get_embedding_stamp(self, name: str) -> Optional[Dict[str, Any]]:
+        """集合的嵌入模型标记，旧集合没有标记时返回 None"""
+        entry = self.catalog.get(name)
+        metadata = entry["metadata"] if entry else self.get_collection(name).metadata or {}
+        if EMBEDDING_MODEL_KEY not in metadata:
+            return None
+        return embedding_stamp(metadata[EMBEDDING_MODEL_KEY], metadata.get(EMBEDDING_DIMENSION_KEY, 0))
+    
+    def stamp_collection(self, name: str, stamp: Dict[str, Any]):
+        """给集合记录嵌入模型和维度"""
+        collection = self.get_collection(name)
+        metadata = dict(collection.metadata or {})
+        metadata.update(stamp)
+        collection.modify(metadata=metadata)
+        if self.catalog.get(name) is not None:
+            self.catalog.update(name, stamp)
+        logger.info(f"Stamped collection {name} with embedding model {stamp[EMBEDDING_MODEL_KEY]} ({stamp[EMBEDDING_DIMENSION_KEY]} dims)")
+    
+    def infer_embedding_dimension(self, name: str) -> Optional[int]:
+        """从已存储的向量推断维度，空集合返回 None"""
+        results = self.get_collection(name).get(limit=1, include=["embeddings"])
+        if not results["ids"]:
+            return None
+        return len(results["embeddings"][0])
+    
+    def create_shadow_collection(self, name: str, stamp: Dict[str, Any]) -> str:
+        """为迁移创建影子集合：复制原集合元数据并写入新的模型标记，返回影子集合名"""
+        metadata = dict(self.get_collection(name).metadata or {})
+        metadata.update(stamp)
+        metadata["shadow_of"] = name
+        shadow = f"{SHADOW_PREFIX}{uuid.uuid4().hex}"
+        self.client.create_collection(name=shadow, metadata=metadata)
+        logger.info(f"Created shadow collection {shadow} for {name}")
+        return shadow
+    
+    def has_physical_collection(self, physical_name: str) -> bool:
+        """ChromaDB 中是否存在该集合"""
+        return any(c.name == physical_name for c in self.client.list_collections())
+    
+    def read_documents(self, name: str, offset: int = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+        """按页读取集合中的文档和元数据（不含向量）"""
+        return self.get_collection(name).get(offset=offset, limit=limit, include=["documents", "metadatas"])
+    
+    def document_ids(self, name: str) -> List[str]:
+        """集合中所有文档的 ID"""
+        return self.get_collection(name).get(include=[])["ids"]
+    
+    def write_documents(
+        self,
+        name: str,
+        ids: List[str],
+        documents: List[str],
+        embeddings: Embeddings,
+        metadatas: List[Dict[str, Any]]
+    ):
+        """原样写入（upsert）文档，不修改元数据，用于迁移复制"""
+        self.get_collection(name).upsert(
+            ids=ids,
+            documents=documents,
+            embeddings=to_embedding_list(embeddings),
+            metadatas=metadatas
+        )
+    
+    def delete_physical_documents(self, name: str, ids: List[str]):
+        """从集合中删除文档（不更新计数等元数据），用于迁移复制"""
+        if ids:
+            self.get_collection(name).delete(ids=ids)
+    
+    def swap_collection(self, name: str, shadow: str):
+        """
+        把知识库切换到影子集合：别名映射原子地写入磁盘后删除旧集合
+        调用方应持有 collection_lock(name)，保证切换时没有写入
+        """
+        old_physical = self._physical_name(name)
+        self._aliases[name] = shadow
+        self._save_aliases()
+        shadow_metadata = self.client.get_collection(name=shadow).metadata or {}
+        self.catalog.update(name, {
+            key: shadow_metadata[key] for key in (EMBEDDING_MODEL_KEY, EMBEDDING_DIMENSION_KEY) if key in shadow_metadata
+        })
+        try:
+            self.client.delete_collection(name=old_physical)
+        except Exception as e:
+            logger.warning(f"Failed to delete old collection {old_physical} after swap: {e}")
+        # 向量换成了新模型，路由画像在下次联合搜索时重建
+        self.routing.drop(name)
+        self._bump_generation(name)
+        logger.info(f"Swapped collection {name}: {old_physical} -> {shadow}")
+    
+    def drop_shadow_collection(self, shadow: str):
+        """删除未切换的影子集合"""
+        if shadow in self._aliases.values():
+            raise ValueError(f"Collection {shadow} is in use")
+        try:
+            self.client.delete_collection(name=shadow)
+        except Exception as e:
+            logger.warning(f"Failed to drop shadow collection {shadow}: {e}")
+    
     def create_collection(self, name: str, description: str = "", metadata: Optional[Dict[str, Any]] = None, collection_id: Optional[str] = None) -> Dict[str, Any]:
         """创建新的知识库集合"""
         try:
@@ -63,7 +330,7 @@ class VectorDBService:
                 collection_id = str(uuid.uuid4())
             
             # 检查集合是否已存在
-            existing_collections = [c.name for c in self.client.list_collections()]
+            existing_collections = [c.name for c in self.client.list_collections()] + list(self._aliases)
             logger.info(f"Existing collections: {existing_collections}")
             logger.info(f"Trying to create collection with id: {collection_id}")
             logger.info(f"Collection display name: {name}")
@@ -109,6 +376,8 @@ class VectorDBService:
                 name=collection_id,  # 使用ID作为collection的名称
                 metadata=collection_metadata
             )
+            self.catalog.put(collection_id, collection_metadata)
+            self.lexical.create(collection_id)
             
             logger.info(f"Created collection: {name} with id: {collection_id}")
             return {
@@ -126,6 +395,27 @@ class VectorDBService:
             logger.error(f"Failed to create collection: {e}")
             raise
     
+    @staticmethod
+    def _collection_info(entry: Dict[str, Any]) -> Dict[str, Any]:
+        """目录条目 -> list_collections 返回的字典"""
+        metadata = entry["metadata"]
+        collection_id = entry["id"]
+        return {
+            "id": collection_id,  # 知识库ID（迁移后与实际的集合名不同）
+            "name": metadata.get("display_name", collection_id),  # 显示名称
+            "description": metadata.get("description", ""),
+            "created_at": metadata.get("created_at") or datetime.now().isoformat(),
+            "document_count": entry["document_count"],
+            "status": metadata.get("status", "draft"),
+            "device_id": metadata.get("device_id", ""),
+            "device_name": metadata.get("device_name", ""),
+            "published_at": metadata.get("published_at", ""),
+            "original_name": metadata.get("original_name", ""),
+            "embedding_model": metadata.get(EMBEDDING_MODEL_KEY),
+            "embedding_dimension": metadata.get(EMBEDDING_DIMENSION_KEY),
+            "metadata": metadata
+        }
+    
     def list_collections(self, device_id: Optional[str] = None, status: Optional[str] = None) -> List[Dict[str, Any]]:
         """列出知识库集合
         
@@ -135,8 +425,8 @@ class VectorDBService:
         """
         try:
             collections = []
-            for collection in self.client.list_collections():
-                metadata = collection.metadata or {}
+            for entry in self.catalog.list():
+                metadata = entry["metadata"]
                 
                 # 过滤条件
                 if device_id and metadata.get("device_id") != device_id:
@@ -144,33 +434,39 @@ class VectorDBService:
                 if status and metadata.get("status", "draft") != status:
                     continue
                 
-                # 如果没有 created_at，使用当前时间
-                created_at = metadata.get("created_at")
-                if not created_at:
-                    created_at = datetime.now().isoformat()
-                
-                collections.append({
-                    "id": collection.name,  # collection的实际ID
-                    "name": metadata.get("display_name", collection.name),  # 显示名称
-                    "description": metadata.get("description", ""),
-                    "created_at": created_at,
-                    "document_count": collection.count(),
-                    "status": metadata.get("status", "draft"),
-                    "device_id": metadata.get("device_id", ""),
-                    "device_name": metadata.get("device_name", ""),
-                    "published_at": metadata.get("published_at", ""),
-                    "original_name": metadata.get("original_name", "")
-                })
+                collections.append(self._collection_info(entry))
             return collections
             
         except Exception as e:
             logger.error(f"Failed to list collections: {e}")
             raise
     
+    def get_collection_info(self, collection_id: str) -> Optional[Dict[str, Any]]:
+        """按 ID 获取单个知识库的信息（与 list_collections 的条目相同），不存在时返回 None"""
+        entry = self.catalog.get(collection_id)
+        return self._collection_info(entry) if entry else None
+    
+    def find_collections_by_name(self, display_name: str) -> List[Dict[str, Any]]:
+        """按显示名称查找知识库"""
+        return [self._collection_info(entry) for entry in self.catalog.find_by_display_name(display_name)]
+    
+    @property
+    def catalog_etag(self) -> str:
+        """知识库列表的版本标识（创建、删除、增删文档、改元数据后变化）"""
+        return self.catalog.etag
+    
     def delete_collection(self, name: str):
         """删除知识库集合"""
         try:
-            self.client.delete_collection(name=name)
+            with self.collection_lock(name):
+                self.client.delete_collection(name=self._physical_name(name))
+                self.catalog.delete(name)
+                self.routing.drop(name)
+                self.lexical.drop(name)
+                if name in self._aliases:
+                    del self._aliases[name]
+                    self._save_aliases()
+                self._bump_generation(name)
             logger.info(f"Deleted collection: {name}")
             
         except Exception as e:
@@ -181,13 +477,40 @@ class VectorDBService:
         self,
         collection_name: str,
         documents: List[str],
-        embeddings: List[List[float]],
+        embeddings: Embeddings,
         metadatas: Optional[List[Dict[str, Any]]] = None,
-        ids: Optional[List[str]] = None
+        ids: Optional[List[str]] = None,
+        embedding_stamp: Optional[Dict[str, Any]] = None
+    ) -> List[str]:
+        """
+        向集合中添加文档（embeddings 可以是 (n, dim) 的 float32 数组）
+        embedding_stamp: 生成这些向量的模型标记；集合尚未标记时写入，已标记且不一致时拒绝写入
+        """
+        with self.collection_lock(collection_name):
+            return self._add_documents(collection_name, documents, embeddings, metadatas, ids, embedding_stamp)
+    
+    def _add_documents(
+        self,
+        collection_name: str,
+        documents: List[str],
+        embeddings: Embeddings,
+        metadatas: Optional[List[Dict[str, Any]]],
+        ids: Optional[List[str]],
+        stamp: Optional[Dict[str, Any]]
     ) -> List[str]:
-        """向集合中添加文档"""
         try:
-            collection = self.client.get_collection(name=collection_name)
+            collection = self.get_collection(collection_name)
+            
+            if stamp is not None:
+                current = self.get_embedding_stamp(collection_name)
+                if current is None:
+                    self.stamp_collection(collection_name, stamp)
+                    collection = self.get_collection(collection_name)
+                elif current != stamp:
+                    raise EmbeddingModelMismatchError(
+                        f"Collection {collection_name} holds {current[EMBEDDING_MODEL_KEY]} embeddings "
+                        f"({current[EMBEDDING_DIMENSION_KEY]} dims), got {stamp[EMBEDDING_MODEL_KEY]}"
+                    )
             
             # 生成 ID
             if ids is None:
@@ -203,15 +526,18 @@ class VectorDBService:
             
             # 添加到集合
             collection.add(
-                embeddings=embeddings,
+                embeddings=to_embedding_list(embeddings),
                 documents=documents,
                 metadatas=metadatas,
                 ids=ids
             )
             
-            # 更新集合元数据中的文档计数
-            collection_metadata = collection.metadata or {}
-            collection_metadata["document_count"] = collection.count()
+            # 更新目录中的文档计数和路由画像
+            self.catalog.set_document_count(collection_name, collection.count())
+            self.routing.add(collection_name, embeddings)
+            if self._lexical_indexed(collection_name):
+                self.lexical.add(collection_name, ids, documents)
+            self._bump_generation(collection_name)
             
             logger.info(f"Added {len(documents)} documents to collection: {collection_name}")
             return ids
@@ -223,45 +549,163 @@ class VectorDBService:
     def search(
         self,
         collection_name: str,
-        query_embedding: List[float],
+        query_embedding: Embedding,
         n_results: int = 10,
-        filter: Optional[Dict[str, Any]] = None
+        filter: Optional[Dict[str, Any]] = None,
+        with_similarity: bool = False
     ) -> Dict[str, Any]:
-        """在集合中搜索相似文档"""
+        """在集合中搜索相似文档
+        
+        with_similarity: 为每个结果附加与查询的余弦相似度（不依赖集合的距离类型，可跨集合比较）
+        """
         try:
-            collection = self.client.get_collection(name=collection_name)
+            collection = self.get_collection(collection_name)
             
             # 执行搜索
+            include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_similarity else [])
             results = collection.query(
-                query_embeddings=[query_embedding],
+                query_embeddings=[to_embedding_list(query_embedding)],
                 n_results=n_results,
-                where=filter
+                where=filter,
+                include=include
             )
             
-            # 格式化结果
-            formatted_results = []
-            if results['ids'] and results['ids'][0]:
-                for i in range(len(results['ids'][0])):
-                    formatted_results.append({
-                        "id": results['ids'][0][i],
-                        "document": results['documents'][0][i] if results['documents'] else "",
-                        "metadata": results['metadatas'][0][i] if results['metadatas'] else {},
-                        "distance": results['distances'][0][i] if results['distances'] else 0
-                    })
-            
-            return {
-                "results": formatted_results,
-                "total": len(formatted_results)
-            }
+            formatted = format_query_results(results, 0)
+            if with_similarity and formatted["results"]:
+                query = np.asarray(query_embedding, dtype=np.float32)
+                vectors = np.asarray(results["embeddings"][0], dtype=np.float32)
+                similarities = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-10)
+                for result, similarity in zip(formatted["results"], similarities):
+                    result["similarity"] = float(similarity)
+            return formatted
             
         except Exception as e:
             logger.error(f"Failed to search: {e}")
             raise
     
+    def search_batch(
+        self,
+        collection_name: str,
+        query_embeddings: Embeddings,
+        n_results: List[int],
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[Dict[str, Any]]:
+        """批量搜索：过滤条件相同的查询合并为一次 collection.query，返回与查询一一对应的结果"""
+        try:
+            collection = self.get_collection(collection_name)
+            embeddings = to_embedding_list(query_embeddings)
+            filters = filters or [None] * len(embeddings)
+            
+            groups: Dict[str, List[int]] = {}
+            for i, where in enumerate(filters):
+                groups.setdefault(json.dumps(where, sort_keys=True), []).append(i)
+            
+            batch_results: List[Dict[str, Any]] = [None] * len(embeddings)
+            for members in groups.values():
+                results = collection.query(
+                    query_embeddings=[embeddings[i] for i in members],
+                    n_results=max(n_results[i] for i in members),
+                    where=filters[members[0]]
+                )
+                for position, i in enumerate(members):
+                    formatted = format_query_results(results, position)
+                    formatted["results"] = formatted["results"][:n_results[i]]
+                    formatted["total"] = len(formatted["results"])
+                    batch_results[i] = formatted
+            return batch_results
+            
+        except Exception as e:
+            logger.error(f"Failed to search batch: {e}")
+            raise
+    
+    def routing_scores(self, query_embedding: Embedding, kb_ids: List[str]) -> Dict[str, float]:
+        """
+        查询与各知识库路由画像的相似度；缺失或过期的画像交给后台重建，不阻塞查询：
+        过期的画像在重建完成前照常参与打分，没有画像的知识库不出现在结果中（由调用方按分数未知处理）
+        """
+        for kb_id in kb_ids:
+            entry = self.catalog.get(kb_id)
+            if entry is not None and self.routing.needs_rebuild(kb_id, entry["document_count"]):
+                self._schedule_routing_rebuild(kb_id)
+        return self.routing.scores(np.asarray(query_embedding, dtype=np.float32), kb_ids)
+    
+    def _schedule_routing_rebuild(self, kb_id: str):
+        """提交后台重建路由画像，同一知识库同时只有一个重建任务"""
+        with self._routing_pending_guard:
+            if kb_id in self._routing_pending:
+                return
+            self._routing_pending.add(kb_id)
+        self._routing_rebuilder.submit(self._rebuild_routing, kb_id)
+    
+    def _rebuild_routing(self, kb_id: str):
+        """从集合中的全部向量重建路由画像（在后台线程中执行）"""
+        try:
+            self.routing.rebuild(kb_id, self._embedding_pages(kb_id))
+        except Exception as e:
+            logger.warning(f"Failed to rebuild routing profile of {kb_id}: {e}")
+        finally:
+            with self._routing_pending_guard:
+                self._routing_pending.discard(kb_id)
+    
+    def wait_for_routing_rebuilds(self):
+        """等待已提交的路由画像重建完成"""
+        self._routing_rebuilder.submit(lambda: None).result()
+    
+    def _lexical_indexed(self, collection_name: str) -> bool:
+        """词法索引是否已建立；旧集合在第一次关键词搜索时整体建立，之前的写入不做增量更新"""
+        return self.lexical.document_count(collection_name) >= 0
+    
+    def lexical_search(self, collection_name: str, query: str, n_results: int = 10) -> List[Tuple[str, float]]:
+        """BM25 关键词搜索，返回 [(文档ID, 分数)]；旧集合第一次搜索时先建立词法索引"""
+        entry = self.catalog.get(collection_name)
+        if entry is not None and self.lexical.document_count(collection_name) < 0:
+            with self.collection_lock(collection_name):
+                # 加锁后再检查一次：并发的第一次搜索只有一个重建
+                if self.lexical.document_count(collection_name) < 0:
+                    self.lexical.rebuild(collection_name, self._document_pages(collection_name))
+        return self.lexical.search(collection_name, query, n_results)
+    
+    def get_documents_by_ids(
+        self,
+        collection_name: str,
+        ids: List[str],
+        filter: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """按 ID 读取文档和元数据（满足 filter 的），返回 ID -> {"document", "metadata"}"""
+        if not ids:
+            return {}
+        page = self.get_collection(collection_name).get(ids=ids, where=filter, include=["documents", "metadatas"])
+        return {
+            doc_id: {"document": document, "metadata": metadata or {}}
+            for doc_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"])
+        }
+    
+    def _document_pages(self, name: str):
+        """分页读取集合中的全部文档文本"""
+        collection = self.get_collection(name)
+        offset = 0
+        while True:
+            page = collection.get(offset=offset, limit=ROUTING_REBUILD_PAGE, include=["documents"])
+            if not page["ids"]:
+                return
+            yield page["ids"], page["documents"]
+            offset += len(page["ids"])
+    
+    def _embedding_pages(self, name: str):
+        """分页读取集合中的全部向量"""
+        collection = self.get_collection(name)
+        offset = 0
+        while True:
+            page = collection.get(offset=offset, limit=ROUTING_REBUILD_PAGE, include=["embeddings"])
+            if not page["ids"]:
+                return
+            yield np.asarray(page["embeddings"], dtype=np.float32)
+            offset += len(page["ids"])
+    
     def get_document(self, collection_name: str, document_id: str) -> Optional[Dict[str, Any]]:
         """获取特定文档"""
         try:
-            collection = self.client.get_collection(name=collection_name)
+            collection = self.get_collection(collection_name)
             
             results = collection.get(
                 ids=[document_id],
@@ -285,12 +729,18 @@ class VectorDBService:
     def delete_documents(self, collection_name: str, document_ids: List[str]):
         """删除文档"""
         try:
-            collection = self.client.get_collection(name=collection_name)
-            collection.delete(ids=document_ids)
-            
-            # 更新文档计数
-            collection_metadata = collection.metadata or {}
-            collection_metadata["document_count"] = collection.count()
+            with self.collection_lock(collection_name):
+                collection = self.get_collection(collection_name)
+                before = collection.count()
+                collection.delete(ids=document_ids)
+                
+                # 更新目录中的文档计数和路由画像
+                after = collection.count()
+                self.catalog.set_document_count(collection_name, after)
+                self.routing.remove(collection_name, before - after)
+                if self._lexical_indexed(collection_name):
+                    self.lexical.delete(collection_name, document_ids)
+                self._bump_generation(collection_name)
             
             logger.info(f"Deleted {len(document_ids)} documents from collection: {collection_name}")
             
@@ -303,23 +753,29 @@ class VectorDBService:
         collection_name: str,
         document_id: str,
         document: Optional[str] = None,
-        embedding: Optional[List[float]] = None,
+        embedding: Optional[Embedding] = None,
         metadata: Optional[Dict[str, Any]] = None
     ):
         """更新文档"""
         try:
-            collection = self.client.get_collection(name=collection_name)
-            
             update_params = {"ids": [document_id]}
             if document is not None:
                 update_params["documents"] = [document]
             if embedding is not None:
-                update_params["embeddings"] = [embedding]
+                update_params["embeddings"] = [to_embedding_list(embedding)]
             if metadata is not None:
                 metadata["updated_at"] = datetime.now().isoformat()
                 update_params["metadatas"] = [metadata]
             
-            collection.update(**update_params)
+            with self.collection_lock(collection_name):
+                self.get_collection(collection_name).update(**update_params)
+                if embedding is not None:
+                    # 向量被替换：画像中记为删除一个、加入一个
+                    self.routing.remove(collection_name, 1)
+                    self.routing.add(collection_name, np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+                if document is not None and self._lexical_indexed(collection_name):
+                    self.lexical.add(collection_name, [document_id], [document])
+                self._bump_generation(collection_name)
             logger.info(f"Updated document {document_id} in collection: {collection_name}")
             
         except Exception as e:
@@ -337,42 +793,21 @@ class VectorDBService:
             更新后的集合信息
         """
         try:
-            # 获取集合
-            collection = self.client.get_collection(name=collection_id)
-            metadata = collection.metadata or {}
+            metadata = self.get_kb_metadata(collection_id)
             
             # 检查是否已经发布
             if metadata.get("status") == "published":
                 raise ValueError("Collection is already published")
             
-            # 获取所有文档和嵌入
-            all_docs = collection.get(include=["documents", "embeddings", "metadatas"])
-            
-            # 创建新的元数据
-            new_metadata = metadata.copy()
-            new_metadata["status"] = "published"
-            new_metadata["published_at"] = datetime.now().isoformat()
+            # 只更新目录中的一行，不读取和重写向量
+            changes = {
+                "status": "published",
+                "is_draft": False,
+                "published_at": datetime.now().isoformat()
+            }
             if new_name:
-                new_metadata["display_name"] = new_name
-            
-            # 由于ChromaDB不支持直接更新元数据，需要重新创建集合
-            # 首先删除旧集合
-            self.client.delete_collection(name=collection_id)
-            
-            # 创建新集合
-            new_collection = self.client.create_collection(
-                name=collection_id,
-                metadata=new_metadata
-            )
-            
-            # 重新添加所有文档
-            if all_docs['ids']:
-                new_collection.add(
-                    ids=all_docs['ids'],
-                    documents=all_docs['documents'],
-                    embeddings=all_docs['embeddings'],
-                    metadatas=all_docs['metadatas']
-                )
+                changes["display_name"] = new_name
+            new_metadata = self.update_kb_metadata(collection_id, changes)
             
             logger.info(f"Published collection: {collection_id}")
             
@@ -382,7 +817,7 @@ class VectorDBService:
                 "description": new_metadata.get("description", ""),
                 "status": "published",
                 "published_at": new_metadata["published_at"],
-                "document_count": new_collection.count()
+                "document_count": self.catalog.get(collection_id)["document_count"]
             }
             
         except Exception as e:
@@ -400,18 +835,8 @@ class VectorDBService:
             True 如果名称已存在，否则 False
         """
         try:
-            for collection in self.client.list_collections():
-                if collection.name == exclude_id:
-                    continue
-                    
-                metadata = collection.metadata or {}
-                display_name = metadata.get("display_name", collection.name)
-                
-                # 只检查公开的知识库
-                if metadata.get("status") == "published" and display_name == name:
-                    return True
-                    
-            return False
+            # 只检查公开的知识库
+            return self.catalog.published_name_exists(name, exclude_id)
             
         except Exception as e:
             logger.error(f"Failed to check name existence: {e}")
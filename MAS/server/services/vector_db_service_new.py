@@ -2,13 +2,27 @@
 向量数据库服务 - 支持ChromaDB和简单实现
 """
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 import uuid
 from datetime import datetime
 import os
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
+# 向量参数既可以是列表，也可以是 float32 numpy 数组（嵌入管理器的原生输出）
+Embeddings = Union[List[List[float]], np.ndarray]
+Embedding = Union[List[float], np.ndarray]
+
+
+def to_embedding_list(embeddings: Union[Embeddings, Embedding]) -> list:
+    """ChromaDB 只接受列表形式的向量，只在这一边界上把 numpy 数组转换为列表"""
+    if isinstance(embeddings, np.ndarray):
+        return embeddings.tolist()
+    return embeddings
+
+
 # 尝试导入ChromaDB
 CHROMADB_AVAILABLE = False
 try:
@@ -154,14 +168,13 @@ class VectorDBService:
             if self.use_simple_db:
                 # 简单DB实现
                 for coll_id in self.client.list_collections():
-                    collection = self.client.collections[coll_id]
-                    metadata = collection.get("metadata", {})
+                    metadata = self.client.get_collection_metadata(coll_id)
                     collections.append({
                         "id": coll_id,
                         "name": metadata.get("display_name", coll_id),
                         "description": metadata.get("description", ""),
                         "created_at": metadata.get("created_at", ""),
-                        "document_count": len(collection.get("documents", []))
+                        "document_count": self.client.count(coll_id)
                     })
             else:
                 # ChromaDB实现
@@ -201,7 +214,7 @@ class VectorDBService:
         self,
         collection_name: str,
         documents: List[str],
-        embeddings: List[List[float]],
+        embeddings: Embeddings,
         metadatas: Optional[List[Dict[str, Any]]] = None,
         ids: Optional[List[str]] = None
     ) -> List[str]:
@@ -232,7 +245,7 @@ class VectorDBService:
                 # ChromaDB实现
                 collection = self.client.get_collection(name=collection_name)
                 collection.add(
-                    embeddings=embeddings,
+                    embeddings=to_embedding_list(embeddings),
                     documents=documents,
                     metadatas=metadatas,
                     ids=ids
@@ -248,29 +261,36 @@ class VectorDBService:
     def search(
         self,
         collection_name: str,
-        query_embedding: List[float],
+        query_embedding: Embedding,
         n_results: int = 10,
-        filter: Optional[Dict[str, Any]] = None
+        filter: Optional[Dict[str, Any]] = None,
+        with_similarity: bool = False
     ) -> Dict[str, Any]:
-        """在集合中搜索相似文档"""
+        """在集合中搜索相似文档；with_similarity 为每个结果附加与查询的余弦相似度"""
         try:
             if self.use_simple_db:
-                # 简单DB实现（不支持filter）
-                if filter:
-                    logger.warning("Simple DB does not support filters, ignoring filter parameter")
-                return self.client.search(
+                # 简单DB实现（过滤条件由元数据索引求值，只对候选行打分）
+                results = self.client.search(
                     collection_name=collection_name,
                     query_embedding=query_embedding,
-                    n_results=n_results
+                    n_results=n_results,
+                    where=filter
                 )
+                if with_similarity:
+                    # 简单DB的距离就是 1 - 余弦相似度
+                    for result in results["results"]:
+                        result["similarity"] = 1.0 - result["distance"]
+                return results
             else:
                 # ChromaDB实现
                 collection = self.client.get_collection(name=collection_name)
                 
+                include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_similarity else [])
                 results = collection.query(
-                    query_embeddings=[query_embedding],
+                    query_embeddings=[to_embedding_list(query_embedding)],
                     n_results=n_results,
-                    where=filter
+                    where=filter,
+                    include=include
                 )
                 
                 # 格式化结果
@@ -284,6 +304,13 @@ class VectorDBService:
                             "distance": results['distances'][0][i] if results['distances'] else 0
                         })
                 
+                if with_similarity and formatted_results:
+                    query = np.asarray(query_embedding, dtype=np.float32)
+                    vectors = np.asarray(results['embeddings'][0], dtype=np.float32)
+                    similarities = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-10)
+                    for result, similarity in zip(formatted_results, similarities):
+                        result["similarity"] = float(similarity)
+                
                 return {
                     "results": formatted_results,
                     "total": len(formatted_results)
@@ -293,22 +320,58 @@ class VectorDBService:
             logger.error(f"Failed to search: {e}")
             raise
     
+    def search_batch(
+        self,
+        collection_name: str,
+        query_embeddings: Embeddings,
+        n_results: List[int],
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[Dict[str, Any]]:
+        """批量搜索，返回与查询一一对应的结果"""
+        try:
+            if self.use_simple_db:
+                # 简单DB实现（精确扫描的查询合并为矩阵乘法）
+                return self.client.search_batch(
+                    collection_name=collection_name,
+                    query_embeddings=query_embeddings,
+                    n_results=n_results,
+                    wheres=filters
+                )
+            else:
+                return [
+                    self.search(collection_name, query_embedding, k, where)
+                    for query_embedding, k, where in zip(
+                        query_embeddings, n_results, filters or [None] * len(query_embeddings)
+                    )
+                ]
+            
+        except Exception as e:
+            logger.error(f"Failed to search batch: {e}")
+            raise
+    
+    def get_documents(self, collection_name: str, filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """按元数据条件列出文档 ID 和元数据（不返回向量和文本）"""
+        try:
+            if self.use_simple_db:
+                return self.client.query(collection_name, where=filter)
+            else:
+                collection = self.client.get_collection(name=collection_name)
+                results = collection.get(where=filter, include=["metadatas"])
+                return [
+                    {"id": doc_id, "metadata": results["metadatas"][i] if results["metadatas"] else {}}
+                    for i, doc_id in enumerate(results["ids"])
+                ]
+
+        except Exception as e:
+            logger.error(f"Failed to get documents: {e}")
+            raise
+
     def get_document(self, collection_name: str, document_id: str) -> Optional[Dict[str, Any]]:
         """获取特定文档"""
         try:
             if self.use_simple_db:
                 # 简单DB实现
-                collection = self.client.collections.get(collection_name)
-                if collection:
-                    for i, doc_id in enumerate(collection["ids"]):
-                        if doc_id == document_id:
-                            return {
-                                "id": doc_id,
-                                "document": collection["documents"][i],
-                                "metadata": collection["metadatas"][i],
-                                "embedding": collection["vectors"][i]
-                            }
-                return None
+                return self.client.get_document(collection_name, document_id)
             else:
                 # ChromaDB实现
                 collection = self.client.get_collection(name=collection_name)
@@ -337,24 +400,7 @@ class VectorDBService:
         try:
             if self.use_simple_db:
                 # 简单DB实现
-                collection = self.client.collections.get(collection_name)
-                if collection:
-                    # 找到要删除的索引
-                    indices_to_remove = []
-                    for doc_id in document_ids:
-                        if doc_id in collection["ids"]:
-                            idx = collection["ids"].index(doc_id)
-                            indices_to_remove.append(idx)
-                    
-                    # 从高到低排序，避免索引错位
-                    for idx in sorted(indices_to_remove, reverse=True):
-                        collection["ids"].pop(idx)
-                        collection["documents"].pop(idx)
-                        collection["vectors"].pop(idx)
-                        collection["metadatas"].pop(idx)
-                    
-                    # 保存更改
-                    self.client._save_collection(collection_name)
+                self.client.delete_documents(collection_name, document_ids)
             else:
                 # ChromaDB实现
                 collection = self.client.get_collection(name=collection_name)
@@ -371,27 +417,16 @@ class VectorDBService:
         collection_name: str,
         document_id: str,
         document: Optional[str] = None,
-        embedding: Optional[List[float]] = None,
+        embedding: Optional[Embedding] = None,
         metadata: Optional[Dict[str, Any]] = None
     ):
         """更新文档"""
         try:
             if self.use_simple_db:
                 # 简单DB实现
-                collection = self.client.collections.get(collection_name)
-                if collection and document_id in collection["ids"]:
-                    idx = collection["ids"].index(document_id)
-                    
-                    if document is not None:
-                        collection["documents"][idx] = document
-                    if embedding is not None:
-                        collection["vectors"][idx] = embedding
-                    if metadata is not None:
-                        metadata["updated_at"] = datetime.now().isoformat()
-                        collection["metadatas"][idx] = metadata
-                    
-                    # 保存更改
-                    self.client._save_collection(collection_name)
+                if metadata is not None:
+                    metadata["updated_at"] = datetime.now().isoformat()
+                self.client.update_document(collection_name, document_id, document, embedding, metadata)
             else:
                 # ChromaDB实现
                 collection = self.client.get_collection(name=collection_name)
@@ -400,7 +435,7 @@ class VectorDBService:
                 if document is not None:
                     update_params["documents"] = [document]
                 if embedding is not None:
-                    update_params["embeddings"] = [embedding]
+                    update_params["embeddings"] = [to_embedding_list(embedding)]
                 if metadata is not None:
                     metadata["updated_at"] = datetime.now().isoformat()
                     update_params["metadatas"] = [metadata]
@@ -412,3 +447,21 @@ class VectorDBService:
         except Exception as e:
             logger.error(f"Failed to update document: {e}")
             raise
+
+    def compact_collection(self, collection_name: str) -> Optional[Dict[str, Any]]:
+        """压缩集合，回收已删除和被更新替换的向量占用的空间；返回压缩统计，
+        没有可回收的行或使用 ChromaDB（自行管理存储）时返回 None"""
+        try:
+            if not self.use_simple_db:
+                return None
+            return self.client.compact(collection_name)
+
+        except Exception as e:
+            logger.error(f"Failed to compact collection: {e}")
+            raise
+
+    def collection_storage_stats(self, collection_name: str) -> Optional[Dict[str, Any]]:
+        """集合的存储统计（墓碑行数、最近一次压缩等）；ChromaDB 返回 None"""
+        if not self.use_simple_db:
+            return None
+        return self.client.storage_stats(collection_name)
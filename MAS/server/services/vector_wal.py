@@ -0,0 +1,130 @@
+"""
+SimpleVectorDB 集合的预写日志（WAL）
+add / update / delete 先追加一条日志记录再修改内存和数据文件；向量段、HNSW 索引和清单只在检查点时刷盘，
+写入的 I/O 只有一次顺序追加，与集合大小无关
+
+组提交：记录写入操作系统缓冲后即返回，待刷盘的记录数达到 sync_records，
+或距第一条未刷盘记录超过 sync_interval_ms（由后台线程调用 sync_if_due）时统一 fsync 一次；
+进程崩溃不丢数据，断电最多丢失最近一个刷盘间隔内的写入
+
+记录格式：载荷长度(uint32) + CRC32(uint32) + 载荷，载荷为 JSON 头、换行和 float32 向量字节
+JSON 头中的 lsn 单调递增，检查点把已折叠进数据文件的最大 lsn 写入清单，之后日志被清空
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WAL_FILE = "wal.log"
+SYNC_INTERVAL_MS = 50  # 未刷盘记录最多等待的时间
+SYNC_RECORDS = 256  # 未刷盘记录数达到此值时立即刷盘
+
+_FRAME = struct.Struct("<II")
+
+
+class WriteAheadLog:
+    """单个集合的预写日志文件"""
+
+    def __init__(self, path: Path, sync_interval_ms: int = SYNC_INTERVAL_MS, sync_records: int = SYNC_RECORDS):
+        self.path = path
+        self.sync_interval = sync_interval_ms / 1000
+        self.sync_records = sync_records
+        self.last_lsn = 0
+        self.synced_lsn = 0
+        self.pending = 0
+        self._pending_since = 0.0
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+
+    @property
+    def size(self) -> int:
+        """日志字节数"""
+        return self._file.tell()
+
+    def replay(self, after_lsn: int) -> Iterator[Tuple[Dict[str, Any], Optional[np.ndarray]]]:
+        """读出 lsn 大于 after_lsn 的记录 (头, 向量)；末尾不完整或校验失败的记录被截掉"""
+        self.last_lsn = self.synced_lsn = max(self.last_lsn, after_lsn)
+        with open(self.path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + _FRAME.size <= len(data):
+            length, checksum = _FRAME.unpack_from(data, offset)
+            payload = data[offset + _FRAME.size:offset + _FRAME.size + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            offset += _FRAME.size + length
+            header_bytes, _, body = payload.partition(b"\n")
+            header = json.loads(header_bytes)
+            self.last_lsn = self.synced_lsn = max(self.last_lsn, header["lsn"])
+            if header["lsn"] <= after_lsn:
+                continue
+            vectors = None
+            if "shape" in header:
+                vectors = np.frombuffer(body, dtype=np.float32).reshape(header["shape"])
+            yield header, vectors
+        if offset < len(data):
+            logger.warning(f"Discarding {len(data) - offset} bytes of incomplete records at the end of {self.path}")
+            with self._lock:
+                self._file.truncate(offset)
+                self._file.seek(offset)
+
+    def append(self, header: Dict[str, Any], vectors: Optional[np.ndarray] = None) -> int:
+        """追加一条记录，返回其 lsn；达到 sync_records 时顺带刷盘"""
+        with self._lock:
+            lsn = self.last_lsn + 1
+            header = {**header, "lsn": lsn}
+            if vectors is not None:
+                vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+                header["shape"] = list(vectors.shape)
+            payload = json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n"
+            if vectors is not None:
+                payload += vectors.tobytes()
+            self._file.write(_FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._file.flush()
+            self.last_lsn = lsn
+            if self.pending == 0:
+                self._pending_since = time.monotonic()
+            self.pending += 1
+            if self.pending >= self.sync_records:
+                self._sync()
+            return lsn
+
+    def _sync(self):
+        if self.pending and not self._file.closed:
+            os.fsync(self._file.fileno())
+            self.pending = 0
+            self.synced_lsn = self.last_lsn
+
+    def sync(self):
+        """把已追加的记录刷到磁盘"""
+        with self._lock:
+            self._sync()
+
+    def sync_if_due(self):
+        """最早的未刷盘记录已等待超过 sync_interval_ms 时刷盘"""
+        with self._lock:
+            if self.pending and time.monotonic() - self._pending_since >= self.sync_interval:
+                self._sync()
+
+    def truncate(self):
+        """检查点之后清空日志（lsn 继续递增）"""
+        with self._lock:
+            self._file.truncate(0)
+            self._file.seek(0)
+            os.fsync(self._file.fileno())
+            self.pending = 0
+            self.synced_lsn = self.last_lsn
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
@@ -0,0 +1,117 @@
+"""
+测试熔断器以及 EmbeddingManager 的降级和对冲
+"""
+import asyncio
+import time
+from typing import List, Dict, Any
+
+import pytest
+
+from server.services.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from server.services.embedding_manager import BaseEmbeddingService, EmbeddingManager
+
+
+class FakeEmbeddingService(BaseEmbeddingService):
+    """可以设置延迟和失败的假嵌入服务"""
+
+    def __init__(self, value: float, model_name: str = "fake", delay: float = 0.0):
+        self.value = value
+        self.model_name = model_name
+        self.delay = delay
+        self.fail = False
+        self.calls = 0
+
+    def embed_text(self, text: str) -> List[float]:
+        return self.embed_texts([text])[0]
+
+    def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("backend down")
+        return [[self.value, 1.0] for _ in texts]
+
+    def get_model_info(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "embedding_dimension": 2}
+
+
+def test_breaker_opens_and_recovers_through_half_open():
+    """连续失败达到阈值后打开，冷却后只放行一个探测请求，探测成功后关闭"""
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.05)
+
+    breaker.record_failure("timeout")
+    assert breaker.state == CLOSED
+    breaker.record_failure("timeout")
+    assert breaker.state == OPEN and not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert [t["to"] for t in breaker.to_dict()["transitions"]] == [OPEN, HALF_OPEN, CLOSED]
+
+
+def test_failover_records_health_on_actual_service():
+    """主服务失败时立即降级，失败记在主服务上，成功记在实际提供结果的服务上"""
+    primary = FakeEmbeddingService(1.0, model_name="primary")
+    backup = FakeEmbeddingService(2.0, model_name="backup")
+    manager = EmbeddingManager()
+    manager.breaker_failure_threshold = 1
+    manager.register_service("primary", primary, set_as_default=True)
+    manager.register_service("backup", backup)
+    primary.fail = True
+
+    result = manager.embed_texts_array(["a", "b"])
+
+    assert result[:, 0].tolist() == [2.0, 2.0]
+    assert manager.service_health["primary"].failure_count == 1
+    assert manager.service_health["backup"].success_count == 1
+    assert manager.breakers["primary"].state == OPEN
+
+    # 主服务熔断后不再调用
+    calls = primary.calls
+    asyncio.run(manager.aembed_texts_array(["c", "d"]))
+    assert primary.calls == calls
+    assert manager.get_health_status()["resilience"]["failovers"] == 1
+
+
+def test_hedge_takes_faster_compatible_backend():
+    """主服务变慢时向同一模型的另一个服务发出对冲请求，取先返回的结果"""
+    slow = FakeEmbeddingService(1.0)
+    fast = FakeEmbeddingService(1.0)
+    other_model = FakeEmbeddingService(3.0, model_name="other")
+    manager = EmbeddingManager()
+    manager.register_service("slow", slow, set_as_default=True)
+    manager.register_service("other", other_model)
+    manager.register_service("fast", fast)
+    manager.hedge_delay = 0.02
+    slow.delay = 0.3
+
+    async def timed_query():
+        started = time.perf_counter()
+        vector = await manager.aembed_text("query")
+        return vector, time.perf_counter() - started
+
+    result, elapsed = asyncio.run(timed_query())
+
+    assert elapsed < 0.25
+    assert result.tolist() == [1.0, 1.0]
+    assert other_model.calls == 1  # 只有注册时的健康检查
+    assert manager.hedged_requests == 1 and manager.hedge_wins == 1
+
+
+def test_sync_embed_refused_in_event_loop_thread():
+    """同步接口的重试退避会阻塞事件循环，在事件循环线程中调用直接报错，在工作线程中正常"""
+    manager = EmbeddingManager()
+    manager.register_service("fake", FakeEmbeddingService(1.0), set_as_default=True)
+
+    async def call_sync():
+        with pytest.raises(RuntimeError, match="aembed_texts_array"):
+            manager.embed_texts_array(["a"])
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, manager.embed_texts_array, ["a"])
+
+    assert asyncio.run(call_sync()).tolist() == [[1.0, 1.0]]
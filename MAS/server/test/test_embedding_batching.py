@@ -0,0 +1,39 @@
+"""
+测试按长度分桶的批处理规划
+"""
+import numpy as np
+
+from server.services.embedding_batching import plan_length_buckets, padding_report
+
+
+def test_buckets_cover_every_text_once():
+    """每个文本恰好出现在一个批次中"""
+    lengths = [5, 300, 12, 40, 256, 7, 90, 3]
+    batches = plan_length_buckets(lengths, batch_size=2, max_seq_length=256)
+
+    covered = np.sort(np.concatenate(batches))
+    assert covered.tolist() == list(range(len(lengths)))
+
+
+def test_batch_size_fitted_to_length():
+    """批大小受 token 预算约束，短文本使用更大的批"""
+    lengths = [256] * 4 + [16] * 40
+    batches = plan_length_buckets(lengths, batch_size=2, max_seq_length=256)
+
+    assert [len(batch) for batch in batches] == [2, 2, 16, 16, 8]
+    for batch in batches:
+        assert max(lengths[i] for i in batch) * len(batch) <= 2 * 256
+
+
+def test_bucketing_reduces_padding():
+    """与原顺序固定分批相比补齐浪费更少"""
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(5, 400, size=500).tolist()
+    report = padding_report(lengths, batch_size=32, max_seq_length=256)
+
+    assert report["length_buckets"]["real_tokens"] == report["fixed_batches"]["real_tokens"]
+    assert report["length_buckets"]["padding_waste"] < report["fixed_batches"]["padding_waste"] / 3
+
+    # 补齐后的 token 数由批中最长的文本（截断到最大长度）决定
+    for batch in plan_length_buckets(lengths, batch_size=32, max_seq_length=256):
+        assert max(min(lengths[i], 256) for i in batch) * len(batch) <= 32 * 256
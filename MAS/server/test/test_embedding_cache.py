@@ -0,0 +1,98 @@
+"""
+测试嵌入缓存及其在 EmbeddingManager 中的使用
+"""
+from typing import List, Dict, Any
+
+import numpy as np
+
+from server.services.embedding_cache import EmbeddingCache
+from server.services.embedding_manager import BaseEmbeddingService, EmbeddingManager
+
+
+class CountingEmbeddingService(BaseEmbeddingService):
+    """记录调用次数的假嵌入服务"""
+
+    def __init__(self):
+        self.embedded: List[str] = []
+
+    def embed_text(self, text: str) -> List[float]:
+        self.embedded.append(text)
+        return [float(len(text)), 1.0, 0.5]
+
+    def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        return [self.embed_text(text) for text in texts]
+
+    def get_model_info(self) -> Dict[str, Any]:
+        return {"model_name": "counting"}
+
+
+def _make_manager(cache: EmbeddingCache):
+    service = CountingEmbeddingService()
+    manager = EmbeddingManager(cache=cache)
+    manager.register_service("counting", service)
+    service.embedded.clear()
+    return manager, service
+
+
+def test_batch_embeds_only_misses(tmp_path):
+    """批量嵌入只计算未命中的文本，并按原顺序合并结果"""
+    manager, service = _make_manager(EmbeddingCache(persist_directory=str(tmp_path)))
+
+    manager.embed_texts(["a", "bb"])
+    result = manager.embed_texts(["bb", "ccc", "a", "ccc"])
+
+    assert service.embedded == ["a", "bb", "ccc"]
+    assert [vector[0] for vector in result] == [2.0, 3.0, 1.0, 3.0]
+
+    stats = manager.get_health_status()["cache"]
+    assert stats["hits"] == 2
+    assert stats["misses"] == 4
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """磁盘缓存在重新创建缓存对象后仍然可用"""
+    manager, _ = _make_manager(EmbeddingCache(persist_directory=str(tmp_path)))
+    manager.embed_text("  hello world ")
+    manager.cache.close()
+
+    manager, service = _make_manager(EmbeddingCache(persist_directory=str(tmp_path)))
+    result = manager.embed_text("hello world")
+
+    assert service.embedded == []
+    assert result[0] == float(len("  hello world "))
+    assert manager.cache.get_stats()["disk_hits"] == 1
+
+
+def test_memory_lru_eviction():
+    """内存LRU超出上限时淘汰最久未使用的条目"""
+    cache = EmbeddingCache(max_memory_entries=2, persist_directory=None)
+    cache.put_many("s", "m", ["a", "b"], [[1.0], [2.0]])
+    cache.get("s", "m", "a")
+    cache.put("s", "m", "c", [3.0])
+
+    assert cache.get("s", "m", "b") is None
+    assert cache.get("s", "m", "a") is not None
+    assert cache.get_stats()["memory_evictions"] == 1
+
+
+def test_array_path_matches_list_path(tmp_path):
+    """数组接口与列表接口结果一致，缓存命中和未命中的行按原顺序合并"""
+    manager, service = _make_manager(EmbeddingCache(persist_directory=str(tmp_path)))
+
+    manager.embed_texts(["a"])
+    array = manager.embed_texts_array(["bb", "a", "bb"])
+
+    assert array.dtype == np.float32 and array.shape == (3, 3)
+    assert array.tolist() == manager.embed_texts(["bb", "a", "bb"])
+    assert service.embedded == ["a", "bb"]
+
+
+def test_misses_deduplicated_by_cache_key(tmp_path):
+    """归一化后相同的文本只嵌入一次，与缓存键一致"""
+    manager, service = _make_manager(EmbeddingCache(persist_directory=str(tmp_path)))
+
+    array = manager.embed_texts_array(["hello", " hello ", "hello\n", "world"])
+
+    assert service.embedded == ["hello", "world"]
+    assert array[:, 0].tolist() == [5.0, 5.0, 5.0, 5.0]
+    assert manager.cache.get_stats()["misses"] == 4
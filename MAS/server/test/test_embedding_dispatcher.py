@@ -0,0 +1,65 @@
+"""
+测试嵌入微批处理调度器
+"""
+import asyncio
+from typing import List, Dict, Any
+
+from server.services.embedding_dispatcher import EmbeddingDispatcher
+from server.services.embedding_manager import BaseEmbeddingService, EmbeddingManager
+
+
+class RecordingEmbeddingService(BaseEmbeddingService):
+    """记录每次批量调用大小的假嵌入服务"""
+
+    def __init__(self):
+        self.batches: List[int] = []
+
+    def embed_text(self, text: str) -> List[float]:
+        return [float(len(text))]
+
+    def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        self.batches.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+    def get_model_info(self) -> Dict[str, Any]:
+        return {"model_name": "recording"}
+
+
+def test_concurrent_requests_are_coalesced():
+    """窗口内的并发请求合并为一次批量调用，结果按调用方分发"""
+    service = RecordingEmbeddingService()
+    manager = EmbeddingManager()
+    manager.register_service("recording", service)
+    dispatcher = EmbeddingDispatcher(manager, max_wait_ms=50, max_batch_size=8)
+
+    async def run():
+        texts = ["x" * (i + 1) for i in range(5)]
+        results = await asyncio.gather(*(dispatcher.embed_text(text) for text in texts))
+        await dispatcher.stop()
+        return results
+
+    results = asyncio.run(run())
+
+    assert [result.tolist() for result in results] == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert service.batches == [5]
+
+    stats = dispatcher.get_stats()
+    assert stats["total_requests"] == 5
+    assert stats["total_batches"] == 1
+    assert stats["batch_size_histogram"]["<=8"] == 1
+
+
+def test_batch_is_split_at_max_batch_size():
+    """超过单批上限的请求拆分为多批"""
+    service = RecordingEmbeddingService()
+    manager = EmbeddingManager()
+    manager.register_service("recording", service)
+    dispatcher = EmbeddingDispatcher(manager, max_wait_ms=50, max_batch_size=4)
+
+    async def run():
+        await asyncio.gather(*(dispatcher.embed_text(f"text {i}") for i in range(10)))
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+    assert service.batches == [4, 4, 2]
@@ -0,0 +1,105 @@
+"""
+测试集合的嵌入模型标记和后台重新嵌入迁移
+"""
+import asyncio
+from typing import List, Dict, Any
+
+import pytest
+
+pytest.importorskip("chromadb")
+
+from server.services.embedding_manager import BaseEmbeddingService, EmbeddingManager
+from server.services.embedding_migration import EmbeddingMigrator, collection_embedding_service, DONE
+from server.services.vector_db_service import VectorDBService, embedding_stamp
+
+
+TEXTS = ["a", "b2", "three", "four", "5"]
+
+
+class FakeModel(BaseEmbeddingService):
+    """按文本长度生成向量的假模型，记录嵌入过的文本"""
+
+    def __init__(self, model_name: str, dimension: int):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.embedded: List[str] = []
+
+    def embed_text(self, text: str) -> List[float]:
+        return self.embed_texts([text])[0]
+
+    def embed_texts(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [[float(len(text))] + [1.0] * (self.dimension - 1) for text in texts]
+
+    def get_model_info(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "embedding_dimension": self.dimension}
+
+
+def _setup(tmp_path):
+    old, new = FakeModel("old-model", 3), FakeModel("new-model", 5)
+    manager = EmbeddingManager()
+    manager.register_service("old", old)
+    manager.register_service("new", new)
+    vector_db = VectorDBService(persist_directory=str(tmp_path / "chroma"))
+    vector_db.create_collection("kb", collection_id="kb1", metadata=embedding_stamp("old-model", 3))
+    vector_db.add_documents("kb1", TEXTS, manager.embed_texts_array(TEXTS, "old"), ids=[f"d{i}" for i in range(5)])
+    manager.default_service = "new"
+    old.embedded.clear()
+    new.embedded.clear()
+    return vector_db, manager, old, new
+
+
+def _migrator(vector_db, manager, tmp_path):
+    return EmbeddingMigrator(
+        vector_db, manager, str(tmp_path / "migrations.json"),
+        batch_size=2, max_texts_per_second=0, duty_cycle=1.0
+    )
+
+
+def test_migration_swaps_in_reembedded_collection(tmp_path):
+    """切换前查询使用集合标记的旧模型，迁移完成后知识库 ID 不变，指向新模型的向量"""
+    vector_db, manager, old, new = _setup(tmp_path)
+    assert collection_embedding_service(vector_db, manager, "kb1") == "old"
+
+    asyncio.run(_migrator(vector_db, manager, tmp_path).run())
+
+    assert vector_db.get_embedding_stamp("kb1") == embedding_stamp("new-model", 5)
+    assert collection_embedding_service(vector_db, manager, "kb1") == "new"
+    assert sorted(new.embedded) == sorted(TEXTS)
+    assert [c["id"] for c in vector_db.list_collections() if c["id"] != "default"] == ["kb1"]
+
+    results = vector_db.search("kb1", manager.embed_texts_array(["xxxxx"], "new")[0], n_results=1)
+    assert results["results"][0]["document"] == "three"
+
+    # 别名映射持久化，重新打开后仍然指向迁移后的集合
+    reopened = VectorDBService(persist_directory=str(tmp_path / "chroma"))
+    assert reopened.get_embedding_stamp("kb1") == embedding_stamp("new-model", 5)
+
+
+def test_migration_resumes_from_shadow(tmp_path):
+    """重启后跳过影子集合中已复制的文档，只重新嵌入剩余文档"""
+    vector_db, manager, old, new = _setup(tmp_path)
+    first = _migrator(vector_db, manager, tmp_path)
+    first.plan()
+
+    async def interrupted():
+        # 复制第一页后中断
+        original = first._throttle
+
+        async def stop_after_first_page(texts, elapsed):
+            await original(texts, elapsed)
+            raise asyncio.CancelledError()
+        first._throttle = stop_after_first_page
+        with pytest.raises(asyncio.CancelledError):
+            await first.migrate_collection("kb1")
+    asyncio.run(interrupted())
+    copied = list(new.embedded)
+    assert len(copied) == 2
+
+    new.embedded.clear()
+    resumed = _migrator(vector_db, manager, tmp_path)
+    asyncio.run(resumed.run())
+
+    assert sorted(copied + new.embedded) == sorted(TEXTS)
+    assert resumed.job_status("kb1")["status"] == DONE
+    assert len(vector_db.document_ids("kb1")) == 5
@@ -0,0 +1,55 @@
+"""
+测试嵌入基准测试套件的报告格式和基线比较
+"""
+import copy
+import json
+
+from server.benchmarks import embedding_suite
+from server.benchmarks.corpus import QUERIES, PASSAGES
+from server.benchmarks.embedding_suite import run_suite, compare_baselines
+
+
+def _missing_backend(options):
+    import not_installed_backend  # noqa: F401
+
+
+def _small_report():
+    return run_suite(
+        backends=["simple", "missing-dependency"],
+        batch_sizes=[1, 8],
+        texts_per_run=16,
+        isolate=False,
+        workloads={"queries": list(QUERIES), "passages": list(PASSAGES)}
+    )
+
+
+def test_report_is_json_serializable(monkeypatch):
+    """报告包含每个组合的吞吐量和延迟，不可用的后端标记为 skipped，可以直接写成 JSON"""
+    monkeypatch.setitem(embedding_suite.BACKENDS, "missing-dependency", _missing_backend)
+    report = _small_report()
+
+    simple = report["backends"]["simple"]
+    assert simple["status"] == "ok"
+    assert [(case["workload"], case["batch_size"]) for case in simple["results"]] == [
+        ("queries", 1), ("queries", 8), ("passages", 1), ("passages", 8)
+    ]
+    assert all(case["texts_per_sec"] > 0 and case["p99_ms"] >= case["p50_ms"] for case in simple["results"])
+    assert report["backends"]["missing-dependency"]["status"] == "skipped"
+    assert report["agreement"]["similarity_correlation"] == [[1.0]]
+    json.dumps(report)
+
+
+def test_compare_flags_throughput_regression():
+    """吞吐量下降超过容差时报告回归，容差以内不报告"""
+    baseline = {"backends": {"simple": {
+        "status": "ok",
+        "peak_rss_mb": 100.0,
+        "results": [{"workload": "queries", "batch_size": 8, "texts_per_sec": 1000.0, "p50_ms": 1.0, "p99_ms": 2.0}]
+    }}}
+    current = copy.deepcopy(baseline)
+    current["backends"]["simple"]["results"][0]["texts_per_sec"] = 950.0
+    assert compare_baselines(baseline, current, tolerance=0.1) == []
+
+    current["backends"]["simple"]["results"][0]["texts_per_sec"] = 700.0
+    regressions = compare_baselines(baseline, current, tolerance=0.1)
+    assert [(r["case"], r["metric"]) for r in regressions] == [("queries@8", "texts_per_sec")]
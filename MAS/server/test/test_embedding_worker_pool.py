@@ -0,0 +1,40 @@
+"""
+测试多进程嵌入服务的分片和结果重组（工作进程加载桩模型）
+"""
+import numpy as np
+import pytest
+
+from server.services.embedding_worker_pool import PooledEmbeddingService
+
+DIMENSION = 3
+
+
+class _StubModel:
+    """向量 = [文本长度, 首字符编码, 1]"""
+
+    max_seq_length = 64
+
+    def get_sentence_embedding_dimension(self):
+        return DIMENSION
+
+    def encode(self, texts, convert_to_numpy=True, batch_size=32):
+        return np.array([[len(text), ord(text[0]) if text else 0, 1] for text in texts], dtype=np.float32)
+
+
+def _load_stub_model(model_name, cache_dir, threads_per_worker):
+    return _StubModel()
+
+
+def test_shards_reassembled_in_input_order():
+    """大批量拆成两个分片并行编码，结果按输入顺序返回；空输入返回空数组；关闭后使用报错"""
+    pool = PooledEmbeddingService("stub", num_workers=2, min_shard_size=2, model_loader=_load_stub_model)
+    try:
+        texts = ["a", "bbbbbb", "cc", "", "ddddd", "eee", "f"]
+        output = pool.embed_texts_array(texts)
+        np.testing.assert_array_equal(output, _StubModel().encode(texts))
+        assert pool.embed_texts_array([]).shape == (0, DIMENSION)
+        assert pool.get_model_info()["embedding_dimension"] == DIMENSION
+    finally:
+        pool.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        pool.embed_texts(["a"])
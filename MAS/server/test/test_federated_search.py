@@ -0,0 +1,134 @@
+"""
+测试知识库路由画像和跨知识库联合搜索
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from server.services.federated_search import FederatedSearcher
+from server.services.kb_routing import KBRoutingIndex, SAMPLE_ROWS
+
+DIMENSION = 16
+
+
+def _kb_vectors(rng, center, count):
+    return center + 0.3 * rng.standard_normal((count, DIMENSION)).astype(np.float32)
+
+
+def test_routing_profiles_rank_matching_kb_first(tmp_path):
+    """查询离哪个知识库的向量近，哪个知识库的路由分数最高；画像持久化，删除过多后需要重建"""
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((4, DIMENSION)).astype(np.float32)
+    routing = KBRoutingIndex(str(tmp_path))
+    for k, center in enumerate(centers):
+        routing.add(f"kb{k}", _kb_vectors(rng, center, 300))
+        routing.add(f"kb{k}", _kb_vectors(rng, center, 400))
+
+    scores = routing.scores(centers[2], ["kb0", "kb1", "kb2", "kb3", "missing"])
+    assert max(scores, key=scores.get) == "kb2" and "missing" not in scores
+
+    reopened = KBRoutingIndex(str(tmp_path))
+    assert len(reopened._profiles["kb1"].sample) == SAMPLE_ROWS
+    assert max(reopened.scores(centers[1], ["kb0", "kb1"]).items(), key=lambda item: item[1])[0] == "kb1"
+
+    assert not reopened.needs_rebuild("kb3", 700)
+    reopened.remove("kb3", 300)
+    assert reopened.needs_rebuild("kb3", 400)
+    reopened.rebuild("kb3", [_kb_vectors(rng, centers[3], 400)])
+    assert not reopened.needs_rebuild("kb3", 400)
+    assert reopened.needs_rebuild("new", 10) and not reopened.needs_rebuild("empty", 0)
+    # 旧知识库建立画像前已有文档：画像只含新写入的向量，与文档数不一致
+    assert reopened.needs_rebuild("kb3", 401)
+
+
+def test_legacy_kb_profile_rebuilt_and_updates_recorded(tmp_path):
+    """没有画像的旧知识库写入后，路由时在后台按全部文档重建画像；更换向量记为删除一个、加入一个"""
+    pytest.importorskip("chromadb")
+    from server.services.vector_db_service import VectorDBService
+
+    rng = np.random.default_rng(2)
+    service = VectorDBService(str(tmp_path))
+    kb_id = service.create_collection("kb")["id"]
+    service.add_documents(kb_id, ["a", "b", "c"], rng.standard_normal((3, DIMENSION)), ids=["a", "b", "c"])
+    service.routing.drop(kb_id)
+
+    service.add_documents(kb_id, ["d"], rng.standard_normal((1, DIMENSION)), ids=["d"])
+    assert service.routing._profiles[kb_id].count == 1
+    service.routing_scores(rng.standard_normal(DIMENSION), [kb_id])
+    service.wait_for_routing_rebuilds()
+    assert service.routing._profiles[kb_id].count == 4
+
+    service.update_document(kb_id, "a", embedding=rng.standard_normal(DIMENSION))
+    profile = service.routing._profiles[kb_id]
+    assert profile.count == 4 and profile.deleted == 1 and profile.seen == 5
+
+
+class _FakeVectorDB:
+    """路由用质心相似度，kb-slow 的搜索超过超时时间"""
+
+    def __init__(self, routing, centers):
+        self.routing = routing
+        self.centers = centers
+
+    def get_embedding_stamp(self, name):
+        return None
+
+    def routing_scores(self, query, kb_ids):
+        return self.routing.scores(query, kb_ids)
+
+    def search(self, collection_name, query_embedding, n_results, filter=None, with_similarity=False):
+        if collection_name == "kb-slow":
+            time.sleep(0.5)
+        similarity = float(self.centers[collection_name] @ query_embedding)
+        return {"results": [
+            {"id": f"{collection_name}-{i}", "document": "", "metadata": {}, "distance": 0.0, "similarity": similarity - i}
+            for i in range(n_results)
+        ]}
+
+
+def test_federated_search_routes_merges_and_times_out(tmp_path):
+    """只搜索路由分数最高的 M 个知识库；超时的知识库不参与合并，其搜索仍在运行时下一次查询跳过它；
+    没有画像的知识库分数未知，排在有分数的之后"""
+    rng = np.random.default_rng(1)
+    names = ["kb-a", "kb-b", "kb-slow", "kb-far"]
+    centers = {name: vector / np.linalg.norm(vector) for name, vector in zip(names, rng.standard_normal((4, DIMENSION)))}
+    centers["kb-b"] = centers["kb-a"] + 0.05 * rng.standard_normal(DIMENSION)
+    centers["kb-slow"] = centers["kb-a"] + 0.05 * rng.standard_normal(DIMENSION)
+    routing = KBRoutingIndex(str(tmp_path))
+    for name in names:
+        routing.add(name, _kb_vectors(rng, centers[name], 50))
+
+    async def aembed_text(text, service_name=None, same_model=False):
+        return centers["kb-a"].astype(np.float32)
+
+    services = SimpleNamespace(
+        vector_db_service=_FakeVectorDB(routing, centers),
+        embedding_manager=SimpleNamespace(default_service="test", aembed_text=aembed_text),
+        embedding_dispatcher=None,
+        embedding_migrator=None
+    )
+    centers["kb-new"] = centers["kb-a"]
+    searcher = FederatedSearcher(max_workers=4, kb_timeout=0.2, top_m=3)
+
+    async def search_twice():
+        first = await searcher.search(services, "q", names + ["kb-new"], n_results=4)
+        second = await searcher.search(services, "q", names + ["kb-new"], n_results=4, top_m=5)
+        return first, second
+
+    try:
+        outcome, again = asyncio.run(search_twice())
+    finally:
+        searcher.shutdown()
+
+    assert {route["kb_id"] for route in outcome["routing"]} == {"kb-a", "kb-b", "kb-slow"}
+    assert outcome["timed_out"] == ["kb-slow"] and outcome["busy"] == []
+    similarities = [result["similarity"] for result in outcome["results"]]
+    assert len(similarities) == 4 and similarities == sorted(similarities, reverse=True)
+    assert {result["kb_id"] for result in outcome["results"]} == {"kb-a", "kb-b"}
+
+    assert again["routing"][-1] == {"kb_id": "kb-new", "score": None}
+    assert again["busy"] == ["kb-slow"] and again["timed_out"] == []
+    assert "kb-new" in {result["kb_id"] for result in again["results"]}
@@ -0,0 +1,62 @@
+"""
+测试 SimpleVectorDB 的 HNSW 索引
+"""
+import numpy as np
+
+from server.services.simple_vector_db import SimpleVectorDB
+
+
+def _vectors(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, 16), dtype=np.float32)
+
+
+def _exact_and_approximate(db, queries, k=10):
+    pairs = []
+    for query in queries:
+        exact = {r["id"] for r in db.search("kb", query, k, exact=True)["results"]}
+        approximate = {r["id"] for r in db.search("kb", query, k)["results"]}
+        pairs.append((exact, approximate))
+    return pairs
+
+
+def test_index_recall_and_incremental_persistence(tmp_path):
+    """索引建立后随 add_documents 增量更新，重新打开时从磁盘加载，召回率接近精确搜索"""
+    db = SimpleVectorDB(str(tmp_path), exact_threshold=0)
+    db.create_collection("kb")
+    vectors = _vectors(1200)
+    ids = [str(i) for i in range(1200)]
+    db.add_documents("kb", ids[:800], vectors[:800], ids=ids[:800])
+    db.create_index("kb", M=8, ef_construction=64, ef_search=32)
+    db.add_documents("kb", ids[800:], vectors[800:], ids=ids[800:])
+    assert db.collections["kb"].index.size == 1200
+
+    reopened = SimpleVectorDB(str(tmp_path), exact_threshold=0)
+    pairs = _exact_and_approximate(reopened, _vectors(30, seed=1))
+    index = reopened.collections["kb"].index
+    assert index.size == 1200 and index.params() == {"M": 8, "ef_construction": 64, "ef_search": 32}
+
+    recall = np.mean([len(exact & approximate) / 10 for exact, approximate in pairs])
+    assert recall >= 0.9
+
+    # 查询点本身在集合中时必须排在第一位
+    assert reopened.search("kb", vectors[1000], 1)["results"][0]["id"] == "1000"
+
+
+def test_small_collection_and_deleted_rows_use_exact_results(tmp_path):
+    """文档数低于阈值时走精确搜索；删除的行不会出现在索引结果中"""
+    db = SimpleVectorDB(str(tmp_path), exact_threshold=1000)
+    db.create_collection("kb")
+    vectors = _vectors(300)
+    ids = [str(i) for i in range(300)]
+    db.add_documents("kb", ids, vectors, ids=ids)
+    db.create_index("kb", M=8, ef_construction=32, ef_search=16)
+    assert all(exact == approximate for exact, approximate in _exact_and_approximate(db, _vectors(10, seed=2)))
+
+    db.collections["kb"].exact_threshold = 0
+    db.delete_documents("kb", ["5"])
+    assert "5" not in {r["id"] for r in db.search("kb", vectors[5], 5)["results"]}
+
+    db.drop_index("kb")
+    reopened = SimpleVectorDB(str(tmp_path))
+    reopened.get_document("kb", "0")
+    assert reopened.collections["kb"].index is None
@@ -0,0 +1,61 @@
+"""
+测试知识库目录：发布和重命名只更新一行元数据
+"""
+import pytest
+
+from server.services.kb_catalog import KBCatalog
+
+
+def test_publish_and_rename_update_one_row(tmp_path):
+    catalog = KBCatalog(str(tmp_path / "kb_catalog.db"))
+    catalog.put("kb1", {"display_name": "Notes (laptop)", "is_draft": True, "device_id": "d1"})
+    catalog.put("kb2", {"display_name": "Notes (laptop)", "is_draft": True, "device_id": "d2"})
+    catalog.set_document_count("kb1", 42)
+
+    assert not catalog.published_name_exists("Notes (laptop)")
+    metadata = catalog.update("kb1", {"is_draft": False, "published_at": "2024-01-01T00:00:00"})
+    assert metadata["device_id"] == "d1" and metadata["is_draft"] is False
+    assert catalog.published_name_exists("Notes (laptop)")
+    assert not catalog.published_name_exists("Notes (laptop)", exclude_id="kb1")
+
+    catalog.update("kb2", {"display_name": "Drafts (laptop)"})
+    assert [entry["metadata"]["display_name"] for entry in catalog.list()] == ["Notes (laptop)", "Drafts (laptop)"]
+    assert catalog.get("kb1")["document_count"] == 42
+
+    # 重新打开后内容不变；旧元数据中字符串形式的 is_draft 也能识别
+    reopened = KBCatalog(str(tmp_path / "kb_catalog.db"))
+    reopened.put("kb3", {"display_name": "Old (pc)", "is_draft": "false"})
+    assert reopened.published_name_exists("Old (pc)")
+    reopened.delete("kb2")
+    assert sorted(reopened.ids()) == ["kb1", "kb3"]
+    assert reopened.get("kb2") is None
+
+
+def test_update_missing_raises(tmp_path):
+    catalog = KBCatalog(str(tmp_path / "kb_catalog.db"))
+    with pytest.raises(KeyError):
+        catalog.update("missing", {"display_name": "x"})
+
+
+def test_version_changes_on_every_write(tmp_path):
+    """列表缓存和 ETag 依赖版本号：任何写入都要改变它，无变化的文档数更新不改变"""
+    catalog = KBCatalog(str(tmp_path / "kb_catalog.db"))
+    versions = [catalog.etag]
+    catalog.put("kb1", {"display_name": "A (pc)", "is_draft": True})
+    versions.append(catalog.etag)
+    catalog.set_document_count("kb1", 3)
+    versions.append(catalog.etag)
+    catalog.set_document_count("kb1", 3)
+    assert catalog.etag == versions[-1]
+    catalog.update("kb1", {"display_name": "B (pc)"})
+    versions.append(catalog.etag)
+    assert catalog.find_by_display_name("A (pc)") == []
+    assert [entry["id"] for entry in catalog.find_by_display_name("B (pc)")] == ["kb1"]
+    catalog.delete("kb1")
+    versions.append(catalog.etag)
+    assert len(set(versions)) == len(versions)
+
+    # 返回的是副本，调用方修改不影响目录
+    catalog.put("kb2", {"display_name": "C (pc)"})
+    catalog.get("kb2")["metadata"]["display_name"] = "changed"
+    assert catalog.get("kb2")["metadata"]["display_name"] == "C (pc)"
@@ -0,0 +1,128 @@
+"""
+测试 BM25 词法索引和倒数排名融合
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from server.services.hybrid_search import hybrid_search, reciprocal_rank_fusion
+from server.services.lexical_index import LexicalIndex, tokenize
+
+
+def test_tokenize_keeps_identifiers_and_cjk_bigrams():
+    tokens = tokenize("错误码 ERR-1024 在 MAS服务器")
+    assert "err-1024" in tokens and "err" in tokens and "1024" in tokens
+    assert "错误" in tokens and "误码" in tokens and "服务" in tokens and "mas" in tokens
+
+
+def test_bm25_incremental_add_update_delete(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.db"))
+    index.add("kb", ["a", "b", "c"], [
+        "服务器返回错误码 ERR-1024 时请重启",
+        "重启服务器之前先备份数据",
+        "向量数据库的安装说明"
+    ])
+    assert [doc_id for doc_id, _ in index.search("kb", "ERR-1024")] == ["a"]
+    assert [doc_id for doc_id, _ in index.search("kb", "服务器 重启")][:2] in (["a", "b"], ["b", "a"])
+    assert index.search("other", "服务器") == []
+
+    index.add("kb", ["c"], ["错误码 ERR-1024 的排查步骤：ERR-1024"])
+    assert [doc_id for doc_id, _ in index.search("kb", "ERR-1024")] == ["c", "a"]
+    index.delete("kb", ["c", "missing"])
+    assert index.document_count("kb") == 2
+    assert [doc_id for doc_id, _ in index.search("kb", "ERR-1024")] == ["a"]
+
+    reopened = LexicalIndex(str(tmp_path / "lexical.db"))
+    reopened.rebuild("kb", [(["x"], ["向量数据库"])])
+    assert reopened.document_count("kb") == 1 and reopened.search("kb", "重启") == []
+    assert reopened.document_count("never") == -1
+
+
+class _FakeVectorDB:
+    """向量搜索漏掉了含有错误码的文档 a，关键词搜索能找回"""
+
+    def __init__(self, tmp_path):
+        self.lexical = LexicalIndex(str(tmp_path / "lexical.db"))
+        self.documents = {"a": "错误码 ERR-1024", "b": "重启服务器", "c": "备份数据"}
+        self.lexical.add("kb", list(self.documents), list(self.documents.values()))
+
+    def lexical_search(self, collection_name, query, n_results):
+        return self.lexical.search(collection_name, query, n_results)
+
+    def search(self, collection_name, query_embedding, n_results, filter=None):
+        return {"results": [
+            {"id": doc_id, "document": self.documents[doc_id], "metadata": {}, "distance": 0.1 * rank}
+            for rank, doc_id in enumerate(["b", "c"])
+        ]}
+
+    def get_documents_by_ids(self, collection_name, ids, filter=None):
+        return {doc_id: {"document": self.documents[doc_id], "metadata": {}} for doc_id in ids}
+
+
+def test_hybrid_search_fuses_lexical_and_dense(tmp_path):
+    assert reciprocal_rank_fusion([["x", "y"], ["y"]], k=1) == {"x": 0.5, "y": 1 / 3 + 1 / 2}
+
+    vector_db = _FakeVectorDB(tmp_path)
+    results = asyncio.run(hybrid_search(vector_db, "kb", "ERR-1024 重启", [0.0], n_results=3))["results"]
+    assert {result["id"] for result in results} == {"a", "b", "c"}
+    assert results[0]["id"] == "b" and results[0]["dense_rank"] == 1 and results[0]["lexical_rank"] is not None
+    assert next(r for r in results if r["id"] == "a")["dense_rank"] is None
+
+    lexical_only = asyncio.run(hybrid_search(vector_db, "kb", "ERR-1024", None, n_results=2, mode="lexical"))
+    assert [result["id"] for result in lexical_only["results"]] == ["a"]
+
+
+def test_legacy_collection_indexed_in_full_after_upload(tmp_path):
+    """旧知识库（没有词法索引）先上传文档再搜索：第一次搜索时整体建立索引，旧文档也能搜到"""
+    pytest.importorskip("chromadb")
+    from server.services.vector_db_service import VectorDBService
+
+    service = VectorDBService(str(tmp_path))
+    kb_id = service.create_collection("kb")["id"]
+    service.add_documents(kb_id, ["错误码 ERR-1024 时请重启"], [[1.0, 0.0]], ids=["old"])
+    service.lexical.drop(kb_id)
+
+    service.add_documents(kb_id, ["重启服务器之前先备份数据"], [[0.0, 1.0]], ids=["new"])
+    service.delete_documents(kb_id, ["missing"])
+    assert [doc_id for doc_id, _ in service.lexical_search(kb_id, "ERR-1024")] == ["old"]
+    assert service.lexical.document_count(kb_id) == 2
+
+    service.add_documents(kb_id, ["ERR-1024 排查步骤"], [[0.5, 0.5]], ids=["later"])
+    assert {doc_id for doc_id, _ in service.lexical_search(kb_id, "ERR-1024")} == {"old", "later"}
+
+
+def test_concurrent_first_searches_build_index_once(tmp_path):
+    """两个并发的第一次搜索都发现没有索引时，只有拿到锁的一个重建"""
+    pytest.importorskip("chromadb")
+    from server.services.vector_db_service import VectorDBService
+
+    service = VectorDBService(str(tmp_path))
+    kb_id = service.create_collection("kb")["id"]
+    service.add_documents(kb_id, ["错误码 ERR-1024 时请重启"], [[1.0, 0.0]], ids=["old"])
+    service.lexical.drop(kb_id)
+
+    rebuilds = []
+    rebuild = service.lexical.rebuild
+
+    def slow_rebuild(collection, pages):
+        rebuilds.append(collection)
+        time.sleep(0.2)
+        rebuild(collection, pages)
+
+    service.lexical.rebuild = slow_rebuild
+    barrier = threading.Barrier(2)
+    results = []
+
+    def search():
+        barrier.wait()
+        results.append(service.lexical_search(kb_id, "ERR-1024"))
+
+    threads = [threading.Thread(target=search) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert rebuilds == [kb_id]
+    assert [[doc_id for doc_id, _ in result] for result in results] == [["old"], ["old"]]
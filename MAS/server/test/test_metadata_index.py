@@ -0,0 +1,59 @@
+"""
+测试元数据倒排索引和 SimpleVectorDB 的过滤搜索
+"""
+import numpy as np
+import pytest
+
+from server.services.metadata_index import MetadataIndex, InvalidFilterError
+from server.services.simple_vector_db import SimpleVectorDB
+
+METADATAS = [
+    {"source": "upload", "topic": "go", "added_at": "2024-01-01T10:00:00", "chunk_index": 0},
+    {"source": "upload", "topic": "rust", "added_at": "2024-02-01T10:00:00", "chunk_index": 1},
+    {"source": "sync", "topic": "go", "added_at": "2024-03-01T10:00:00", "chunk_index": 2},
+    {"source": "sync", "added_at": "2024-04-01T10:00:00", "chunk_index": 3, "pinned": True},
+]
+
+
+def _rows(index, where):
+    return np.flatnonzero(index.evaluate(where, len(METADATAS))).tolist()
+
+
+def test_filter_operators():
+    """相等、集合、范围（数值和 ISO 时间戳）条件以及 $and/$or 组合"""
+    index = MetadataIndex()
+    for row, metadata in enumerate(METADATAS):
+        index.add(row, metadata)
+
+    assert _rows(index, {"source": "sync"}) == [2, 3]
+    assert _rows(index, {"topic": {"$in": ["go", "python"]}}) == [0, 2]
+    assert _rows(index, {"topic": {"$ne": "go"}}) == [1]
+    assert _rows(index, {"chunk_index": {"$gte": 1, "$lt": 3}}) == [1, 2]
+    assert _rows(index, {"added_at": {"$lt": "2024-02-15"}}) == [0, 1]
+    assert _rows(index, {"$or": [{"topic": "rust"}, {"pinned": True}]}) == [1, 3]
+    assert _rows(index, {"$and": [{"source": "upload"}, {"topic": "go"}]}) == [0]
+    assert _rows(index, {"chunk_index": True}) == []  # True 和 1 不相等
+
+    index.remove(0, METADATAS[0])
+    index.add(0, {**METADATAS[0], "topic": "rust"})
+    assert _rows(index, {"topic": "rust"}) == [0, 1]
+
+    with pytest.raises(InvalidFilterError):
+        index.evaluate({"topic": {"$regex": "g.*"}}, 4)
+
+
+def test_filtered_search_only_returns_matching_rows(tmp_path):
+    """过滤搜索只在候选行中取最近的结果，删除的行不参与"""
+    db = SimpleVectorDB(str(tmp_path))
+    db.create_collection("kb")
+    vectors = np.eye(4, dtype=np.float32)
+    db.add_documents("kb", ["a", "b", "c", "d"], vectors, METADATAS, ids=["a", "b", "c", "d"])
+
+    results = db.search("kb", vectors[0], n_results=2, where={"source": "sync"})["results"]
+    assert sorted(result["id"] for result in results) == ["c", "d"]
+
+    db.delete_documents("kb", ["c"])
+    assert [r["id"] for r in db.search("kb", vectors[2], n_results=5, where={"topic": "go"})["results"]] == ["a"]
+    assert db.count("kb", where={"source": "sync"}) == 1
+    assert db.value_counts("kb", "source") == {"upload": 2, "sync": 1}
+    assert [doc["id"] for doc in SimpleVectorDB(str(tmp_path)).query("kb", {"added_at": {"$gt": "2024-01-15"}})] == ["b", "d"]
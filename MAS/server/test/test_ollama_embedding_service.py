@@ -0,0 +1,85 @@
+"""
+测试 Ollama 嵌入服务的批量接口、旧版逐条接口回退和并发上限（使用本地桩服务）
+"""
+import asyncio
+
+import numpy as np
+
+from server.benchmarks.ollama_stub import OllamaStubServer, stub_embedding
+from server.services.ollama_embedding_service import OllamaEmbeddingService
+
+DIMENSION = 8
+TEXTS = [f"text {i}" for i in range(10)]
+
+
+def _normalized(text):
+    vector = np.asarray(stub_embedding(text, DIMENSION))
+    return vector / np.linalg.norm(vector)
+
+
+def test_batch_endpoint_groups_texts():
+    """批量接口每个请求包含 request_batch_size 条文本，结果按输入顺序返回"""
+    with OllamaStubServer(dimension=DIMENSION, request_latency_ms=0, per_text_latency_ms=0) as stub:
+        service = OllamaEmbeddingService(base_url=stub.base_url, model_name="stub", request_batch_size=4)
+        try:
+            stub.reset_counters()
+            embeddings = service.embed_texts(TEXTS, batch_size=32)
+            assert stub.request_count == 3
+            np.testing.assert_allclose(embeddings, [_normalized(text) for text in TEXTS], rtol=1e-6)
+            np.testing.assert_allclose(asyncio.run(service.aembed_texts(TEXTS[:3])), embeddings[:3], rtol=1e-6)
+            info = service.get_model_info()
+            assert info["batch_endpoint"] is True and info["model_name"] == "stub@l2"
+        finally:
+            service.close()
+
+
+def test_legacy_endpoint_fallback_returns_raw_vectors():
+    """没有 /api/embed 时回退到逐条接口，向量原样返回（不归一化）"""
+    with OllamaStubServer(dimension=DIMENSION, request_latency_ms=0, per_text_latency_ms=0, batch_endpoint=False) as stub:
+        service = OllamaEmbeddingService(base_url=stub.base_url, model_name="stub")
+        try:
+            stub.reset_counters()
+            embeddings = service.embed_texts(TEXTS[:4])
+            assert stub.request_count == 4
+            np.testing.assert_allclose(embeddings, [stub_embedding(text, DIMENSION) for text in TEXTS[:4]])
+            np.testing.assert_allclose(asyncio.run(service.aembed_texts(TEXTS[:4])), embeddings)
+            info = service.get_model_info()
+            assert info["batch_endpoint"] is False and info["normalized"] is False
+            assert info["model_name"] == "stub"  # 与旧版写入的集合标记一致
+        finally:
+            service.close()
+
+
+def test_concurrent_requests_bounded_by_max_concurrency():
+    """同步和异步接口同时进行中的请求数都不超过 max_concurrency"""
+    with OllamaStubServer(dimension=DIMENSION, request_latency_ms=20, batch_endpoint=False, parallel=16) as stub:
+        service = OllamaEmbeddingService(base_url=stub.base_url, model_name="stub", max_concurrency=2)
+        try:
+            stub.reset_counters()
+            service.embed_texts(TEXTS)
+            assert stub.max_in_flight == 2
+
+            stub.reset_counters()
+            asyncio.run(service.aembed_texts(TEXTS))
+            assert stub.max_in_flight == 2
+        finally:
+            service.close()
+
+
+def test_async_clients_closed_with_their_event_loop():
+    """httpx 客户端在所属事件循环关闭前被关闭；换了事件循环后使用新客户端；在事件循环中关闭服务也会关闭客户端"""
+    with OllamaStubServer(dimension=DIMENSION, request_latency_ms=0, per_text_latency_ms=0) as stub:
+        service = OllamaEmbeddingService(base_url=stub.base_url, model_name="stub")
+        asyncio.run(service.aembed_texts(TEXTS[:2]))
+        first = service._async_client
+        assert first.is_closed
+
+        async def embed_then_close():
+            await service.aembed_texts(TEXTS[:2])
+            client = service._async_client
+            service.close()
+            await asyncio.sleep(0)
+            return client
+
+        second = asyncio.run(embed_then_close())
+        assert second is not first and second.is_closed
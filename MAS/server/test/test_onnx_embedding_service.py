@@ -0,0 +1,78 @@
+"""
+测试 ONNX 嵌入服务的分词、池化和归一化（推理会话用桩代替，不需要导出模型）
+"""
+import json
+
+import numpy as np
+import pytest
+
+ort = pytest.importorskip("onnxruntime")
+tokenizers = pytest.importorskip("tokenizers")
+
+from server.services.onnx_embedding_service import OnnxEmbeddingService
+
+VOCAB = {"[PAD]": 0, "[UNK]": 1, "alpha": 2, "beta": 3, "gamma": 4}
+DIMENSION = 4
+
+
+class _StubSession:
+    """隐藏状态 = [词 ID, 1, 位置, 0]，补齐位置的值很大，池化时没有被掩掉就会改变结果"""
+
+    def __init__(self, path, options, providers):
+        self.path = path
+
+    def get_inputs(self):
+        return [type("Input", (), {"name": name})() for name in ("input_ids", "attention_mask")]
+
+    def run(self, outputs, feed):
+        ids = feed["input_ids"].astype(np.float32)
+        positions = np.broadcast_to(np.arange(ids.shape[1], dtype=np.float32), ids.shape)
+        hidden = np.stack([ids, np.ones_like(ids), positions, np.zeros_like(ids)], axis=-1)
+        hidden[feed["attention_mask"] == 0] = 1000.0
+        return [hidden]
+
+
+def _model_dir(tmp_path, pooling="mean", normalize=True):
+    from tokenizers import Tokenizer
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+
+    tokenizer = Tokenizer(WordLevel(VOCAB, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+    (tmp_path / "model.onnx").write_bytes(b"")
+    (tmp_path / "model.int8.onnx").write_bytes(b"")
+    (tmp_path / "embedding_config.json").write_text(json.dumps({
+        "pooling": pooling, "normalize": normalize, "max_seq_length": 3, "embedding_dimension": DIMENSION
+    }))
+    return str(tmp_path)
+
+
+def test_mean_pooling_masks_padding_and_normalizes(tmp_path, monkeypatch):
+    """补齐的位置不参与平均，截断到最大长度，结果按输入顺序返回并归一化"""
+    monkeypatch.setattr(ort, "InferenceSession", _StubSession)
+    service = OnnxEmbeddingService("stub-model", quantize=False, model_dir=_model_dir(tmp_path))
+    texts = ["alpha beta gamma beta", "gamma", "beta alpha"]
+
+    output = service.embed_texts_array(texts, batch_size=2)
+    expected = np.array([
+        [(2 + 3 + 4) / 3, 1, 1, 0],  # 截断为 3 个词
+        [4, 1, 0, 0],
+        [2.5, 1, 0.5, 0]
+    ], dtype=np.float32)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    np.testing.assert_allclose(output, expected, rtol=1e-5)
+    np.testing.assert_allclose(service.embed_text("gamma"), expected[1], rtol=1e-5)
+    assert service.embed_texts_array([]).shape == (0, DIMENSION)
+
+
+def test_cls_pooling_and_quantized_model_identity(tmp_path, monkeypatch):
+    """int8 模型报告的模型名带量化后缀，与 fp32 的缓存键和集合标记区分开"""
+    monkeypatch.setattr(ort, "InferenceSession", _StubSession)
+    model_dir = _model_dir(tmp_path, pooling="cls", normalize=False)
+
+    quantized = OnnxEmbeddingService("stub-model", quantize=True, model_dir=model_dir)
+    assert quantized.session.path.endswith("model.int8.onnx")
+    np.testing.assert_allclose(quantized.embed_texts_array(["beta alpha"]), [[3, 1, 0, 0]])
+    assert quantized.get_model_info()["model_name"] == "stub-model@int8"
+    assert OnnxEmbeddingService("stub-model", quantize=False, model_dir=model_dir).get_model_info()["model_name"] == "stub-model"
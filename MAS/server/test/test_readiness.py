@@ -0,0 +1,44 @@
+"""
+测试服务就绪状态跟踪
+"""
+import pytest
+
+from server.services.readiness import ReadinessTracker, ServiceNotReadyError
+
+
+def test_capability_ready_only_when_all_components_ready():
+    """能力依赖的组件全部就绪后才就绪，加载中时 require 抛出异常"""
+    tracker = ReadinessTracker()
+    tracker.define_capability("knowledge", ["vector_db", "embeddings"])
+
+    assert tracker.capability_state("knowledge") == "pending"
+
+    tracker.start("vector_db")
+    tracker.start("embeddings")
+    tracker.mark_ready("vector_db")
+    assert tracker.capability_state("knowledge") == "loading"
+    with pytest.raises(ServiceNotReadyError) as excinfo:
+        tracker.require("knowledge")
+    assert excinfo.value.components["vector_db"]["state"] == "ready"
+
+    tracker.mark_ready("embeddings", default_service="simple")
+    tracker.require("knowledge")
+
+    snapshot = tracker.snapshot()
+    assert snapshot["ready"] and not snapshot["loading"]
+    assert snapshot["components"]["embeddings"]["default_service"] == "simple"
+    assert snapshot["components"]["embeddings"]["duration_ms"] >= 0
+
+
+def test_track_marks_failure_and_reraises():
+    """track 块中抛出异常时组件标记为失败，能力状态为 failed"""
+    tracker = ReadinessTracker()
+    tracker.define_capability("chat", ["ollama"])
+
+    with pytest.raises(RuntimeError):
+        with tracker.track("ollama"):
+            raise RuntimeError("connection refused")
+
+    assert tracker.capability_state("chat") == "failed"
+    assert tracker.snapshot()["components"]["ollama"]["error"] == "connection refused"
+    assert not tracker.snapshot()["loading"]
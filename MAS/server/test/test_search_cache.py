@@ -0,0 +1,99 @@
+"""
+测试按写入代数失效的搜索结果缓存
+"""
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from server.services.search_cache import SearchResultCache, search_collection
+
+
+class _FakeVectorDB:
+    """记录搜索次数；写入只增加代数"""
+
+    def __init__(self):
+        self.generation = 0
+        self.searches = 0
+
+    def write_generation(self, name):
+        return self.generation
+
+    def search(self, collection_name, query_embedding, n_results, filter=None):
+        self.searches += 1
+        return {"results": [
+            {"id": f"{self.generation}-{i}", "document": "text", "metadata": {}, "distance": 0.1 * i}
+            for i in range(n_results)
+        ]}
+
+
+def test_results_cached_until_collection_written():
+    """相同的查询（归一化后）命中缓存，连嵌入也跳过；写入后代数变化，重新搜索"""
+    embedded = []
+
+    async def aembed_text(text, service_name=None, same_model=False):
+        embedded.append(text)
+        return np.ones(4, dtype=np.float32)
+
+    vector_db = _FakeVectorDB()
+    services = SimpleNamespace(
+        vector_db_service=vector_db,
+        embedding_manager=SimpleNamespace(aembed_text=aembed_text),
+        search_cache=SearchResultCache()
+    )
+
+    async def run(query, limit=3, filter=None):
+        return await search_collection(services, "kb", query, limit, filter=filter)
+
+    first = asyncio.run(run("重启 服务器"))
+    assert asyncio.run(run("  重启 服务器 ")) is first
+    assert vector_db.searches == 1 and len(embedded) == 1
+
+    asyncio.run(run("重启 服务器", limit=5))
+    asyncio.run(run("重启 服务器", filter={"b": 1, "a": 2}))
+    asyncio.run(run("重启 服务器", filter={"a": 2, "b": 1}))
+    assert vector_db.searches == 3
+
+    vector_db.generation += 1
+    fresh = asyncio.run(run("重启 服务器"))
+    assert fresh["results"][0]["id"] == "1-0" and vector_db.searches == 4
+
+    stats = services.search_cache.get_stats()
+    assert stats["hits"] == 2 and stats["misses"] == 4 and stats["hit_rate"] == pytest.approx(2 / 6)
+
+
+def test_cache_bounded_by_entries_and_bytes():
+    cache = SearchResultCache(max_entries=2, max_bytes=20000)
+    small = {"results": [{"id": "a", "document": "x" * 100, "metadata": {}}]}
+    keys = [cache.key("kb", 0, f"q{i}", 5) for i in range(3)]
+    for key in keys:
+        cache.put(key, small)
+    assert cache.get(keys[0]) is None and cache.get(keys[2]) is small
+    assert cache.key("kb", 0, np.ones(3), 5) == cache.key("kb", 0, [1.0, 1.0, 1.0], 5)
+
+    cache.put(keys[0], {"results": [{"id": "b", "document": "x" * 20000, "metadata": {}}]})
+    stats = cache.get_stats()
+    assert stats["rejected"] == 1 and stats["evictions"] == 1 and stats["entries"] == 2
+    cache.put(cache.key("kb", 1, "big", 5), {"results": [{"id": "c", "document": "x" * 9000, "metadata": {}}]})
+    assert cache.get_stats()["bytes"] <= 20000 and cache.get(keys[1]) is None
+
+
+def test_write_generation_bumped_by_writes_and_publish(tmp_path):
+    pytest.importorskip("chromadb")
+    from server.services.vector_db_service import VectorDBService
+
+    service = VectorDBService(str(tmp_path))
+    kb_id = service.create_collection("kb", metadata={"is_draft": True, "status": "draft"})["id"]
+    generations = [service.write_generation(kb_id)]
+    service.add_documents(kb_id, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]], ids=["a", "b"])
+    generations.append(service.write_generation(kb_id))
+    service.update_document(kb_id, "a", document="a2", embedding=[1.0, 0.1])
+    generations.append(service.write_generation(kb_id))
+    service.delete_documents(kb_id, ["b"])
+    generations.append(service.write_generation(kb_id))
+    service.publish_collection(kb_id)
+    generations.append(service.write_generation(kb_id))
+    service.search(kb_id, [1.0, 0.0], n_results=1)
+    assert service.write_generation(kb_id) == generations[-1]
+    assert generations == sorted(set(generations))
@@ -0,0 +1,60 @@
+"""
+测试特征哈希嵌入服务
+"""
+import numpy as np
+
+from server.services.simple_embedding_service import SimpleEmbeddingService
+
+
+def test_batch_matches_single_and_is_normalized():
+    """批量与逐条结果一致，非空文本向量为单位长度，空文本为零向量"""
+    service = SimpleEmbeddingService()
+    texts = ["How do I reset my password?", "知识库同步", "", "E1024 sync error"]
+
+    batch = service.embed_texts_array(texts)
+    single = np.array([service.embed_text(text) for text in texts], dtype=np.float32)
+
+    assert batch.shape == (4, 384)
+    np.testing.assert_allclose(batch, single, atol=1e-6)
+    np.testing.assert_allclose(np.linalg.norm(batch[[0, 1, 3]], axis=1), 1.0, atol=1e-5)
+    assert not batch[2].any()
+
+
+def test_lexical_overlap_ranks_higher():
+    """词法重叠多的文本相似度更高，全角字符与半角等价"""
+    service = SimpleEmbeddingService()
+    query, related, unrelated, fullwidth = service.embed_texts_array([
+        "reset the account password",
+        "To reset your password open the account settings",
+        "设备发现服务通过 UDP 广播寻找服务器",
+        "ＲＥＳＥＴ ｔｈｅ ａｃｃｏｕｎｔ ｐａｓｓｗｏｒｄ"
+    ])
+
+    assert query @ related > query @ unrelated + 0.2
+    assert query @ fullwidth > 0.999
+
+
+def test_idf_changes_model_name(tmp_path):
+    """启用 IDF 后模型名带上指纹，保存后可以重新加载"""
+    service = SimpleEmbeddingService()
+    plain_name = service.get_model_info()["model_name"]
+
+    service.fit_idf(["the cat sat", "the dog ran", "a bird flew"])
+    fitted_name = service.get_model_info()["model_name"]
+    path = str(tmp_path / "idf.npy")
+    service.save_idf(path)
+
+    assert plain_name == "hashing-ngram-v1"
+    assert fitted_name.startswith("hashing-ngram-v1+idf-")
+    assert SimpleEmbeddingService(idf_path=path).get_model_info()["model_name"] == fitted_name
+
+
+def test_large_block_does_not_grow_retained_power_table():
+    """超长文本块的幂表临时计算，常驻的表不超过上限，结果与逐条编码一致"""
+    from server.services.simple_embedding_service import _MAX_CACHED_POWERS
+
+    service = SimpleEmbeddingService()
+    texts = ["reset the account password " * 3000, "知识库同步" * 3000]
+    batch = service.embed_texts_array(texts)
+    assert len(service._power_table[0]) <= _MAX_CACHED_POWERS
+    np.testing.assert_allclose(batch, [service.embed_text(text) for text in texts], atol=1e-6)
@@ -0,0 +1,224 @@
+"""
+测试简单向量数据库
+"""
+import pickle
+import time
+
+import numpy as np
+
+from server.services.simple_vector_db import SegmentedCollection, SimpleVectorDB
+
+
+def test_vectors_stored_in_memory_mapped_segments(tmp_path):
+    """向量追加写入归一化的 float32 段，跨段搜索结果按相似度排序，重新打开后不变"""
+    db = SimpleVectorDB(str(tmp_path), segment_rows=2)
+    db.create_collection("kb", {"description": "test"})
+    db.add_documents("kb", ["x", "y"], [[1.0, 0.0], [0.0, 1.0]], ids=["x", "y"])
+    db.add_documents("kb", ["z"], np.array([[0.6, 0.8]], dtype=np.float32), ids=["z"])
+
+    segments = db.collections["kb"].segments
+    assert [segment.rows for segment in segments] == [2, 1]
+    assert isinstance(segments[0].mmap, np.memmap) and segments[0].vectors.dtype == np.float32
+    assert (tmp_path / "kb" / "seg-000002.f32").stat().st_size == 2 * 4
+
+    results = db.search("kb", np.array([0.0, 1.0], dtype=np.float32), n_results=2)["results"]
+    assert [result["id"] for result in results] == ["y", "z"]
+
+    db.add_documents("kb", ["w"], [[3.0, 4.0]], ids=["w"])
+    reopened = SimpleVectorDB(str(tmp_path), segment_rows=2)
+    assert reopened.count("kb") == 4
+    assert reopened.get_collection_metadata("kb") == {"description": "test"}
+    assert np.allclose(reopened.get_document("kb", "w")["embedding"], [3.0, 4.0])
+
+
+def test_delete_and_update_documents(tmp_path):
+    """删除的文档不再出现在搜索结果中，更新向量后按新向量排序"""
+    db = SimpleVectorDB(str(tmp_path))
+    db.create_collection("kb")
+    db.add_documents("kb", ["x", "y", "z"], [[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]], ids=["x", "y", "z"])
+
+    assert db.delete_documents("kb", ["y", "missing"]) == 1
+    assert db.update_document("kb", "x", document="x2", embedding=[0.0, 2.0])
+    assert not db.update_document("kb", "missing", document="?")
+
+    results = db.search("kb", [0.0, 1.0], n_results=3)["results"]
+    assert [(result["id"], result["document"]) for result in results] == [("x", "x2"), ("z", "z")]
+    assert SimpleVectorDB(str(tmp_path)).get_document("kb", "y") is None
+
+
+def test_legacy_pickle_collection_is_converted_on_load(tmp_path):
+    """旧版 pickle 集合在加载时转换为分段格式，原文件改名保留"""
+    legacy = {
+        "vectors": [[1.0, 0.0], [0.0, 1.0]],
+        "documents": ["x", "y"],
+        "metadatas": [{}, {}],
+        "ids": ["x", "y"],
+        "metadata": {}
+    }
+    with open(tmp_path / "kb.pkl", "wb") as f:
+        pickle.dump(legacy, f)
+
+    db = SimpleVectorDB(str(tmp_path))
+
+    assert db.count("kb") == 2
+    assert db.search("kb", [1.0, 0.0], n_results=1)["results"][0]["id"] == "x"
+    assert (tmp_path / "kb.pkl.migrated").exists() and not (tmp_path / "kb.pkl").exists()
+
+
+def test_search_batch_matches_single_searches(tmp_path):
+    """批量搜索（跨段矩阵乘法、按查询的 k 和过滤条件）与逐个搜索结果一致"""
+    rng = np.random.default_rng(0)
+    db = SimpleVectorDB(str(tmp_path), segment_rows=64)
+    db.create_collection("kb")
+    vectors = rng.standard_normal((300, 8)).astype(np.float32)
+    ids = [str(i) for i in range(300)]
+    db.add_documents("kb", ids, vectors, metadatas=[{"group": i % 3} for i in range(300)], ids=ids)
+    db.delete_documents("kb", ["0", "1", "2"])
+
+    queries = rng.standard_normal((5, 8)).astype(np.float32)
+    limits = [5, 3, 1, 8, 2]
+    wheres = [None, {"group": 1}, None, {"group": {"$in": [0, 2]}}, {"group": 7}]
+    batch = db.search_batch("kb", queries, limits, wheres=wheres)
+    for query, limit, where, results in zip(queries, limits, wheres, batch):
+        expected = db.search("kb", query, n_results=limit, where=where)["results"]
+        assert [r["id"] for r in results["results"]] == [r["id"] for r in expected]
+    assert batch[4]["results"] == []
+
+
+def test_write_ahead_log_replayed_and_checkpointed(tmp_path):
+    """未做检查点的写入在重新打开时从日志重放（末尾写到一半的记录被丢弃），检查点把日志折叠进段文件"""
+    db = SimpleVectorDB(str(tmp_path), segment_rows=2, checkpoint_interval=3600)
+    db.create_collection("kb")
+    db.add_documents("kb", ["x", "y", "z"], [[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]], ids=["x", "y", "z"])
+    db.delete_documents("kb", ["y"])
+    db.update_document("kb", "x", document="x2", embedding=[0.0, 2.0], metadata={"v": 2})
+    manifest = (tmp_path / "kb" / "manifest.jsonl").read_text()
+    assert '"segment"' not in manifest
+    with open(tmp_path / "kb" / "wal.log", "ab") as f:
+        f.write(b"\x10\x00\x00\x00partial")
+
+    def check(reopened):
+        assert reopened.count("kb") == 2 and reopened.get_document("kb", "y") is None
+        assert reopened.get_document("kb", "x")["metadata"] == {"v": 2}
+        results = reopened.search("kb", [0.0, 1.0], n_results=2)["results"]
+        assert [(result["id"], result["document"]) for result in results] == [("x", "x2"), ("z", "z")]
+
+    reopened = SimpleVectorDB(str(tmp_path), segment_rows=2)
+    check(reopened)
+    reopened.close()
+
+    reopened = SimpleVectorDB(str(tmp_path), segment_rows=2)
+    assert (tmp_path / "kb" / "wal.log").stat().st_size == 0
+    check(reopened)
+    assert reopened.collections["kb"].checkpoint_lsn == 3
+    reopened.add_documents("kb", ["w"], [[1.0, 1.0]], ids=["w"])
+    assert reopened.collections["kb"].wal.last_lsn == 4
+
+
+def test_vector_update_after_checkpoint_survives_crash(tmp_path):
+    """检查点之后更换向量再崩溃：新行被丢弃，重放日志时按记录重新追加"""
+    db = SimpleVectorDB(str(tmp_path), checkpoint_interval=3600)
+    db.create_collection("kb")
+    db.add_documents("kb", ["a", "b", "c"], [[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]], metadatas=[{"k": 1}] * 3, ids=["a", "b", "c"])
+    collection = db.collections["kb"]
+    collection.checkpoint()
+    collection.update("b", embedding=np.array([1.0, 1.0], dtype=np.float32))
+    collection.update("c", document="c2", embedding=np.array([0.0, 1.0], dtype=np.float32), metadata={"k": 2})
+    collection.wal.sync()
+
+    reopened = SegmentedCollection(tmp_path / "kb")
+    assert reopened.count() == 3
+    assert reopened.get("b")["document"] == "b" and reopened.get("b")["metadata"] == {"k": 1}
+    assert reopened.get("c")["document"] == "c2" and np.allclose(reopened.get("c")["embedding"], [0.0, 1.0])
+
+
+def test_write_ahead_log_group_commit(tmp_path):
+    """日志按记录数或等待时间批量刷盘"""
+    db = SimpleVectorDB(str(tmp_path), wal_sync_records=3, wal_sync_interval_ms=20)
+    db.create_collection("kb")
+    wal = db.collections["kb"].wal
+    db.add_documents("kb", ["a"], [[1.0, 0.0]], ids=["a"])
+    db.add_documents("kb", ["b"], [[0.0, 1.0]], ids=["b"])
+    assert wal.pending == 2 and wal.synced_lsn == 0
+    db.add_documents("kb", ["c"], [[1.0, 1.0]], ids=["c"])
+    assert wal.pending == 0 and wal.synced_lsn == 3
+
+    db.delete_documents("kb", ["a"])
+    deadline = time.monotonic() + 2
+    while wal.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert wal.synced_lsn == 4
+    db.close()
+
+
+def test_compaction_drops_tombstones_and_keeps_results(tmp_path):
+    """删除只留下墓碑，更换向量是删除 + 追加；压缩后行号重排、旧文件删除，搜索结果（HNSW 和压缩编码）不变"""
+    rng = np.random.default_rng(2)
+    db = SimpleVectorDB(str(tmp_path), segment_rows=16, exact_threshold=0)
+    db.create_collection("kb")
+    vectors = rng.standard_normal((100, 8)).astype(np.float32)
+    ids = [str(i) for i in range(100)]
+    db.add_documents("kb", ids, vectors, metadatas=[{"group": i % 4} for i in range(100)], ids=ids)
+    db.create_index("kb", M=8, ef_construction=64, ef_search=100)
+    db.set_storage_mode("kb", "float16", rerank_factor=50)
+    db.delete_documents("kb", ids[:60])
+    db.update_document("kb", "70", embedding=[1.0] * 8)
+    assert db.storage_stats("kb")["tombstones"] == 61 and db.count("kb") == 40
+
+    queries = rng.standard_normal((5, 8)).astype(np.float32)
+    before = [[r["id"] for r in db.search("kb", query, n_results=5)["results"]] for query in queries]
+    filtered = [r["id"] for r in db.search("kb", queries[0], n_results=5, where={"group": 2})["results"]]
+    old_segments = {path.name for path in (tmp_path / "kb").glob("seg-*.f32")}
+
+    stats = db.compact("kb")
+    assert stats["rows_before"] == 101 and stats["rows_after"] == 40 and stats["removed_rows"] == 61
+    assert stats["reclaimed_bytes"] > 0 and stats["seconds"] >= 0
+    assert db.compact("kb") is None
+    collection = db.collections["kb"]
+    assert collection.total_rows == 40 and collection.index.size == 40 and collection.codes.rows == 40
+    assert not old_segments & {path.name for path in (tmp_path / "kb").glob("seg-*.f32")}
+    assert not (tmp_path / "kb" / "docs.sqlite").exists()
+
+    def check(reopened):
+        assert [[r["id"] for r in reopened.search("kb", query, n_results=5)["results"]] for query in queries] == before
+        assert [r["id"] for r in reopened.search("kb", queries[0], n_results=5, where={"group": 2})["results"]] == filtered
+        assert np.allclose(reopened.get_document("kb", "70")["embedding"], [1.0] * 8)
+        assert reopened.get_document("kb", "10") is None and reopened.count("kb") == 40
+
+    check(db)
+    db.add_documents("kb", ["new"], [[0.5] * 8], ids=["new"])
+    db.close()
+    reopened = SimpleVectorDB(str(tmp_path), segment_rows=16, exact_threshold=0, prewarm_collections=0)
+    assert reopened.count("kb") == 41 and "kb" not in reopened.collections
+    reopened.delete_documents("kb", ["new"])
+    assert reopened.collections["kb"].index.size == 41
+    check(reopened)
+
+
+def test_collections_load_lazily_and_are_evicted_within_budget(tmp_path):
+    """启动只读清单；超出内存预算时淘汰最久未使用的集合；访问统计持久化，重启后预热最常访问的集合"""
+    db = SimpleVectorDB(str(tmp_path), prewarm_collections=0)
+    for name in ("a", "b", "c"):
+        db.create_collection(name, {"name": name})
+        db.add_documents(name, ["x", "y"], [[1.0, 0.0], [0.0, 1.0]], ids=["x", "y"])
+    for _ in range(3):
+        db.search("b", [1.0, 0.0], n_results=1)
+    db.close()
+
+    reopened = SimpleVectorDB(str(tmp_path), memory_budget=1, prewarm_collections=0)
+    assert not reopened.collections and sorted(reopened.list_collections()) == ["a", "b", "c"]
+    assert reopened.count("a") == 2 and reopened.get_collection_metadata("c") == {"name": "c"}
+    assert not reopened.collections
+
+    reopened.search("a", [1.0, 0.0], n_results=1)
+    reopened.search("c", [1.0, 0.0], n_results=1)
+    assert list(reopened.collections) == ["c"]
+    assert reopened.get_document("a", "y")["document"] == "y" and list(reopened.collections) == ["a"]
+    stats = reopened.memory_stats()
+    assert stats["loaded"] == ["a"] and stats["collections"]["b"]["access_score"] > stats["collections"]["a"]["access_score"]
+    reopened.close()
+
+    warmed = SimpleVectorDB(str(tmp_path), prewarm_collections=1)
+    warmed._prewarmer.join()
+    assert list(warmed.collections) == ["b"]
+    warmed.close()
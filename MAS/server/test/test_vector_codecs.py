@@ -0,0 +1,74 @@
+"""
+测试压缩存储模式：编码精度、近似打分 + 精排，以及重新打开后的编码恢复
+"""
+import numpy as np
+import pytest
+
+from server.services.simple_vector_db import SimpleVectorDB
+from server.services.vector_codecs import create_codec
+
+
+def _normalized(count, dimension=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("mode, tolerance", [("float16", 1e-3), ("int8", 0.05), ("pq", 0.35)])
+def test_codec_scores_approximate_inner_product(mode, tolerance):
+    """近似内积与精确内积的平均误差在各模式的预期范围内"""
+    vectors = _normalized(2000)
+    query = vectors[0]
+    codec = create_codec(mode, 32)
+    codec.train(vectors)
+    scores = codec.scores(codec.encode(vectors), query)
+    assert np.abs(scores - vectors @ query).mean() < tolerance
+
+
+def test_storage_mode_reranks_and_persists(tmp_path):
+    """PQ 模式下近似打分后用原始向量精排，距离与 float32 一致；重新打开和增量添加后编码覆盖全部行"""
+    db = SimpleVectorDB(str(tmp_path))
+    db.create_collection("kb")
+    vectors = _normalized(1500)
+    ids = [str(i) for i in range(1500)]
+    db.add_documents("kb", ids[:1100], vectors[:1100], ids=ids[:1100])
+    exact = db.search("kb", vectors[7], 5)["results"]
+
+    db.set_storage_mode("kb", "pq", subspaces=8)
+    approximate = db.search("kb", vectors[7], 5)["results"]
+    assert approximate[0]["id"] == "7"
+    assert approximate[0]["distance"] == pytest.approx(exact[0]["distance"], abs=1e-6)
+
+    db.add_documents("kb", ids[1100:], vectors[1100:], ids=ids[1100:])
+    reopened = SimpleVectorDB(str(tmp_path))
+    stats = reopened.storage_stats("kb")
+    assert stats["mode"] == "pq" and stats["resident_bytes"] == 1500 * 8
+    assert reopened.search("kb", vectors[1200], 1)["results"][0]["id"] == "1200"
+
+    with pytest.raises(ValueError):
+        reopened.set_storage_mode("kb", "int4")
+
+
+def test_int8_trains_on_enough_rows_and_retrains_as_collection_grows(tmp_path):
+    """int8 模式从空集合开始逐步添加：行数不够时精确搜索，之后按增长重新训练，召回与一次性添加相同"""
+    vectors = _normalized(3000, dimension=64, seed=1)
+    ids = [str(i) for i in range(3000)]
+    queries = vectors[:50] + 0.1 * _normalized(50, dimension=64, seed=2)
+    exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :10]
+
+    db = SimpleVectorDB(str(tmp_path))
+    db.create_collection("kb")
+    db.set_storage_mode("kb", "int8")
+    db.add_documents("kb", ids[:1], vectors[:1], ids=ids[:1])
+    assert db.storage_stats("kb")["trained"] is False
+    for start, end in ((1, 300), (300, 1000), (1000, 3000)):
+        db.add_documents("kb", ids[start:end], vectors[start:end], ids=ids[start:end])
+    collection = db.collections["kb"]
+    assert collection.codes.codec.trained_rows == 3000 and collection.codes.rows == 3000
+
+    found = [[int(r["id"]) for r in db.search("kb", query, 10)["results"]] for query in queries]
+    recall = np.mean([len(set(row) & set(truth)) / 10 for row, truth in zip(found, exact)])
+    assert recall > 0.95
+
+    reopened = SimpleVectorDB(str(tmp_path))
+    assert reopened.search("kb", queries[3], 1)["results"][0]["id"] == "3"
+    assert reopened.collections["kb"].codes.codec.trained_rows == 3000
@@ -8,6 +8,9 @@ from fastapi.exceptions import RequestValidationError
 from pydantic import ValidationError
 import logging
 
+from server.services.readiness import ServiceNotReadyError, FAILED
+from server.services.embedding_migration import CollectionModelUnavailableError, PENDING, RUNNING
+
 logger = logging.getLogger(__name__)
 
 
@@ -87,3 +90,48 @@ async def general_exception_handler(request: Request, exc: Exception):
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={"detail": error_detail}
     )
+
+
+async def service_not_ready_handler(request: Request, exc: ServiceNotReadyError):
+    """
+    处理能力未就绪的请求：加载中返回 503 并带 Retry-After，加载失败返回 503 不带重试提示
+    """
+    loading = exc.state != FAILED
+    error_detail = {
+        "error": "Service not ready",
+        "message": f"The '{exc.capability}' capability is {exc.state}.",
+        "capability": exc.capability,
+        "state": exc.state,
+        "components": exc.components,
+        "suggestion": "The server is still starting up, please retry shortly." if loading
+        else "Please check the server logs; see /api/system/ready for details."
+    }
+
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": error_detail},
+        headers={"Retry-After": "2"} if loading else None
+    )
+
+
+async def collection_model_unavailable_handler(request: Request, exc: CollectionModelUnavailableError):
+    """
+    处理集合标记的嵌入模型未加载的请求：迁移进行中返回 503 并带 Retry-After，否则返回 409
+    """
+    migrating = exc.migration is not None and exc.migration.get("status") in (PENDING, RUNNING)
+    error_detail = {
+        "error": "Embedding model unavailable",
+        "message": str(exc),
+        "collection": exc.collection,
+        "embedding_model": exc.stamp,
+        "migration": exc.migration,
+        "suggestion": "The collection is being re-embedded with the current model, please retry later." if migrating
+        else "Enable the embedding migration (MAS_EMBEDDING_MIGRATION) or load the original embedding model; "
+             "see /api/system/embeddings/migrations for details."
+    }
+
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE if migrating else status.HTTP_409_CONFLICT,
+        content={"detail": error_detail},
+        headers={"Retry-After": "30"} if migrating else None
+    )
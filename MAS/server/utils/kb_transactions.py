@@ -44,7 +44,7 @@ class TransactionalKBOperations:
         """
         try:
             # 获取集合信息
-            collection = self.vector_db.client.get_collection(name=kb_id)
+            collection = self.vector_db.get_collection(kb_id)
             
             # 获取所有文档数据
             results = collection.get(
@@ -57,7 +57,7 @@ class TransactionalKBOperations:
             # 创建备份
             backup = KnowledgeBaseBackup(
                 kb_id=kb_id,
-                name=collection.name,
+                name=metadata.get("display_name", kb_id),
                 description=metadata.get("description", ""),
                 metadata=metadata,
                 documents=results.get("documents", []),